@@ -14,7 +14,8 @@ from app.schemas.budget import (
     BudgetAllocationRequest, BudgetAllocationResponse,
     BudgetSummaryResponse
 )
-from app.services.budget_service import BudgetService
+from app.services.budget_service import BudgetService, budget_summary_cache, format_category_budget
+from app.services.dashboard_cache import dashboard_cache
 from app.db.supabase_client import get_authenticated_supabase_client
 from supabase import Client
 
@@ -69,6 +70,8 @@ async def create_user_budget(
             }
             
             result = supabase.table("user_budgets").update(update_data).eq("id", existing_budget["id"]).execute()
+            budget_summary_cache.invalidate(current_user["id"])
+            dashboard_cache.bump(current_user["id"])
             
             if not result.data:
                 raise HTTPException(status_code=400, detail="Failed to update budget")
@@ -92,6 +95,8 @@ async def create_user_budget(
             }
             
             result = supabase.table("user_budgets").insert(budget_record).execute()
+            budget_summary_cache.invalidate(current_user["id"])
+            dashboard_cache.bump(current_user["id"])
             
             if not result.data:
                 raise HTTPException(status_code=400, detail="Failed to create budget")
@@ -169,6 +174,8 @@ async def update_user_budget(
         update_data["updated_at"] = datetime.now().isoformat()
         
         result = supabase.table("user_budgets").update(update_data).eq("id", budget["id"]).execute()
+        budget_summary_cache.invalidate(current_user["id"])
+        dashboard_cache.bump(current_user["id"])
         
         if not result.data:
             raise HTTPException(status_code=400, detail="Failed to update budget")
@@ -272,6 +279,9 @@ async def create_category_budget(
             result = supabase.table("budget_categories").insert(budget_record).execute()
             message = f"Category budget created successfully for {month:02d}/{year}"
         
+        budget_summary_cache.invalidate(current_user["id"])
+        dashboard_cache.bump(current_user["id"])
+        
         if not result.data:
             raise HTTPException(status_code=400, detail="Failed to save category budget")
         
@@ -300,8 +310,8 @@ async def get_category_budgets(
     try:
         year, month = get_current_year_month(year, month)
         
-        # Get user's budget for this month first
-        user_budget = await get_user_budget_for_month(supabase, current_user["id"], year, month)
+        # Budget and its category budgets (with names) in one cached query
+        user_budget = BudgetService(supabase).get_budget_with_categories(current_user["id"], year, month)
         
         if not user_budget:
             return {
@@ -310,30 +320,16 @@ async def get_category_budgets(
                 "message": f"No budget found for {month:02d}/{year}"
             }
         
-        # Get category budgets with category names using proper join
-        budget_result = supabase.table("budget_categories").select(
-            "*, categories(name)"
-        ).eq("user_budget_id", user_budget["id"]).eq("is_active", True).execute()
+        category_budgets = [
+            format_category_budget(item) for item in user_budget["budget_categories"] if item.get("is_active")
+        ]
         
-        if not budget_result.data:
+        if not category_budgets:
             return {
                 "status": "success",
                 "category_budgets": []
             }
         
-        category_budgets = []
-        for item in budget_result.data:
-            category_budgets.append({
-                "id": item["id"],
-                "user_budget_id": item["user_budget_id"],
-                "category_id": item["category_id"],
-                "category_name": item.get("categories", {}).get("name", "Unknown") if item.get("categories") else "Unknown",
-                "monthly_limit": item["monthly_limit"],
-                "is_active": item["is_active"],
-                "created_at": item["created_at"],
-                "updated_at": item["updated_at"]
-            })
-        
         return {
             "status": "success",
             "category_budgets": category_budgets,
@@ -362,8 +358,8 @@ async def get_budget_summary(
     try:
         year, month = get_current_year_month(year, month)
         
-        # Get user's budget for this month
-        user_budget = await get_user_budget_for_month(supabase, current_user["id"], year, month)
+        # Budget and its category budgets (with names) in one cached query
+        user_budget = BudgetService(supabase).get_budget_with_categories(current_user["id"], year, month)
         
         if not user_budget:
             raise HTTPException(
@@ -371,20 +367,17 @@ async def get_budget_summary(
                 detail=f"No budget found for {month:02d}/{year}"
             )
         
-        # Get category budgets with category names
-        category_result = supabase.table("budget_categories").select(
-            "*, categories(name)"
-        ).eq("user_budget_id", user_budget["id"]).eq("is_active", True).execute()
+        active_categories = [cb for cb in user_budget["budget_categories"] if cb.get("is_active")]
         
         # Calculate totals
-        total_allocated = sum(float(cb["monthly_limit"]) for cb in category_result.data or [])
+        total_allocated = sum(float(cb["monthly_limit"]) for cb in active_categories)
         total_budget = float(user_budget["total_monthly_budget"])
         remaining_budget = total_budget - total_allocated
         allocation_percentage = (total_allocated / total_budget * 100) if total_budget > 0 else 0
         
         # Format category budgets
         category_budgets = []
-        for cb in category_result.data or []:
+        for cb in active_categories:
             category_budgets.append({
                 "id": cb["id"],
                 "category_id": cb["category_id"],
@@ -435,6 +428,11 @@ async def apply_budget_allocation(
     - Only applies to predefined system categories, custom categories are not affected
     - Total allocation will be exactly 100% of the specified budget
     - Existing system category budgets will be updated, custom category budgets remain unchanged
+    
+    **method=history:** amounts come from the user's last months of spending per category
+    (median, trend, volatility) with an equal overrun risk for every category; each
+    allocation includes its projected overrun probability. Users without enough
+    history get the research based percentages.
     """
     try:
         year, month = get_current_year_month(allocation_request.year, allocation_request.month)
@@ -474,45 +472,43 @@ async def apply_budget_allocation(
         categories_result = supabase.table("categories").select("id, name").eq("is_system", True).execute()
         available_categories = {cat["name"]: cat["id"] for cat in categories_result.data or []}
         
-        # Apply allocation to category budgets
-        applied_count = 0
         total_budget = allocation_request.total_budget
+        allocation_method = "optimal_research_based"
+        allocations = None
+        amounts = {
+            available_categories[category_name]: round(total_budget * percentage, 2)
+            for category_name, percentage in optimal_allocations.items()
+            if category_name in available_categories
+        }
         
-        for category_name, percentage in optimal_allocations.items():
-            if category_name in available_categories:
-                category_id = available_categories[category_name]
-                amount = round(total_budget * percentage, 2)
-                
-                # Check if category budget already exists for this month
-                existing = supabase.table("budget_categories").select("*").eq("user_budget_id", user_budget_id).eq("category_id", category_id).execute()
-                
-                if existing.data:
-                    # Update existing
-                    update_data = {
-                        "monthly_limit": amount,
-                        "is_active": True,
-                        "updated_at": datetime.now().isoformat()
-                    }
-                    result = supabase.table("budget_categories").update(update_data).eq("id", existing.data[0]["id"]).execute()
-                else:
-                    # Create new
-                    budget_record = {
-                        "user_budget_id": user_budget_id,
-                        "category_id": category_id,
-                        "monthly_limit": amount,
-                        "is_active": True,
-                        "created_at": datetime.now().isoformat(),
-                        "updated_at": datetime.now().isoformat()
-                    }
-                    result = supabase.table("budget_categories").insert(budget_record).execute()
-                
-                if result.data:
-                    applied_count += 1
+        if allocation_request.method == "history":
+            history_result = BudgetService(supabase).allocate_from_history(
+                current_user["id"],
+                total_budget,
+                [{"id": category_id, "name": name} for name, category_id in available_categories.items()],
+                allocation_request.categories
+            )
+            if history_result:
+                allocation_method = history_result["allocation_method"]
+                allocations = history_result["allocations"]
+                amounts = {allocation["category_id"]: allocation["allocated_amount"] for allocation in allocations}
+        
+        # Apply allocation to category budgets; system categories outside it are deactivated.
+        # A failure part way through still leaves written rows, so invalidate either way.
+        try:
+            applied_count = BudgetService(supabase).apply_category_limits(
+                user_budget_id, amounts, list(available_categories.values())
+            )
+        finally:
+            budget_summary_cache.invalidate(current_user["id"])
+            dashboard_cache.bump(current_user["id"])
         
         return {
             "status": "success",
             "message": f"Applied budget allocation to {applied_count} categories for {month:02d}/{year}",
             "total_budget": total_budget,
+            "allocation_method": allocation_method,
+            "allocations": allocations,
             "year": year,
             "month": month,
             "applied_at": datetime.now().isoformat()
@@ -558,6 +554,8 @@ async def delete_category_budget(
         }
         
         result = supabase.table("budget_categories").update(update_data).eq("id", existing.data[0]["id"]).execute()
+        budget_summary_cache.invalidate(current_user["id"])
+        dashboard_cache.bump(current_user["id"])
         
         if not result.data:
             raise HTTPException(status_code=400, detail="Failed to deactivate category budget")
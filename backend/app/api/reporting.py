@@ -3,18 +3,22 @@ Financial Reporting API Endpoints
 Provides chart-ready data according to specified response formats
 """
 
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import Response
 from typing import List, Optional, Dict, Any
 from datetime import date, datetime, timedelta
 from collections import defaultdict
+import calendar
 
 from app.core.auth import get_current_user
 from app.schemas.reporting import (
     MonthlyReportRequest, TrendReportRequest,
-    ChartType, PeriodType
+    ChartType, PeriodType, KDVSummaryResponse
 )
 from app.services.reporting_service import ReportingService
+from app.services.dashboard_cache import dashboard_cache
 from app.db.supabase_client import get_authenticated_supabase_client, get_supabase_client
+from app.utils.date_parser import parse_date
 from supabase import Client
 
 router = APIRouter()
@@ -28,23 +32,10 @@ CHART_COLORS = _reporting_service.category_colors
 
 def parse_date_safely(date_str: str) -> date:
     """Safely parse date string from Supabase"""
-    try:
-        # Handle different date formats from Supabase
-        if date_str.endswith('Z'):
-            date_str = date_str.replace('Z', '+00:00')
-        elif '+' not in date_str and 'T' in date_str:
-            date_str = date_str + '+00:00'
-        elif 'T' not in date_str:
-            # Simple date format like "2024-12-25"
-            return datetime.strptime(date_str, '%Y-%m-%d').date()
-        
-        return datetime.fromisoformat(date_str).date()
-    except Exception as e:
-        # Fallback: try to parse as simple date
-        try:
-            return datetime.strptime(date_str[:10], '%Y-%m-%d').date()
-        except:
-            raise ValueError(f"Cannot parse date: {date_str}")
+    parsed = parse_date(date_str)
+    if parsed is None:
+        raise ValueError(f"Cannot parse date: {date_str}")
+    return parsed
 
 
 @router.get("/health", summary="Reporting Service Health Check")
@@ -452,6 +443,79 @@ async def get_spending_trends(
         raise HTTPException(status_code=500, detail=f"Failed to generate spending trends: {str(e)}")
 
 
+@router.get("/kdv-summary", response_model=KDVSummaryResponse, summary="KDV Breakdown by Rate")
+async def get_kdv_summary(
+    start_date: date = Query(..., description="Range start (YYYY-MM-DD, inclusive)"),
+    end_date: date = Query(..., description="Range end (YYYY-MM-DD, inclusive)"),
+    current_user: dict = Depends(get_current_user),
+    supabase: Client = Depends(get_authenticated_supabase_client)
+):
+    """
+    **D. KDV Summary**
+    
+    Returns the gross / KDV / net totals of all expense items in the range, grouped by KDV rate:
+    ```json
+    {
+      "reportTitle": "KDV Summary 2025-01-01 - 2025-01-31",
+      "totalAmount": 1250.00, "totalKdv": 137.79, "totalWithoutKdv": 1112.21, "averageKdvRate": 12.39,
+      "data": [
+        { "kdvRate": 1.0, "totalAmount": 450.00, "kdvAmount": 4.46, "amountWithoutKdv": 445.54, "itemCount": 12 },
+        { "kdvRate": 20.0, "totalAmount": 800.00, "kdvAmount": 133.33, "amountWithoutKdv": 666.67, "itemCount": 5 }
+      ]
+    }
+    ```
+    
+    KDV is computed once per rate group on the summed gross amount, in integer kuruş.
+    """
+    if end_date < start_date:
+        raise HTTPException(status_code=400, detail="end_date must not be before start_date")
+    
+    try:
+        return await _reporting_service.get_kdv_summary(
+            current_user["id"], start_date, end_date, supabase=supabase
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to generate KDV summary: {str(e)}")
+
+
+@router.get("/dashboard", summary="Home Screen Dashboard Summary")
+async def get_dashboard(
+    request: Request,
+    current_user: dict = Depends(get_current_user),
+    supabase: Client = Depends(get_authenticated_supabase_client)
+):
+    """
+    **E. Dashboard Summary**
+    
+    Current and previous month totals, top category, recent transactions and
+    the category distribution for the home screen.
+    
+    Responses carry an ETag and `Cache-Control: private, no-cache`; send it back
+    in If-None-Match to get 304 Not Modified while nothing has changed. The
+    response is cached per user and dropped on every expense, budget or
+    category write.
+    """
+    user_id = current_user["id"]
+    
+    page = dashboard_cache.get(user_id)
+    if page is None:
+        version = dashboard_cache.version(user_id)
+        try:
+            result = await _reporting_service.get_dashboard_summary(user_id, supabase=supabase)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Failed to generate dashboard: {str(e)}")
+        if "error" in result:
+            raise HTTPException(status_code=500, detail=f"Failed to generate dashboard: {result['error']}")
+        
+        page = dashboard_cache.build_page(result, version)
+        dashboard_cache.put(user_id, page)
+    
+    if page.is_not_modified(request.headers):
+        return Response(status_code=304, headers=page.cache_headers())
+    
+    return Response(content=page.body, media_type="application/json", headers=page.cache_headers())
+
+
 # Convenience endpoints with POST method for complex requests
 @router.post("/category-distribution", summary="Monthly Category Distribution (POST)")
 async def post_category_distribution(
@@ -500,7 +564,7 @@ async def post_spending_trends(
 
 @router.get("/export", summary="Export Report Data")
 async def export_report(
-    report_type: str = Query(..., description="Report type (category-distribution, budget-vs-actual, spending-trends)"),
+    report_type: str = Query(..., description="Report type (category-distribution, budget-vs-actual, spending-trends, kdv-summary)"),
     format: str = Query("json", description="Export format (json, csv)"),
     year: Optional[int] = Query(None, description="Year for monthly reports"),
     month: Optional[int] = Query(None, description="Month for monthly reports"),
@@ -515,6 +579,7 @@ async def export_report(
     - `category-distribution`: Monthly category breakdown
     - `budget-vs-actual`: Budget comparison
     - `spending-trends`: Spending trends over time
+    - `kdv-summary`: Monthly KDV breakdown by rate
     
     **Supported Formats:**
     - `json`: JSON format (default)
@@ -543,6 +608,15 @@ async def export_report(
                 period=period,
                 current_user=current_user, supabase=supabase
             )
+        elif report_type == "kdv-summary":
+            if not year or not month:
+                raise HTTPException(status_code=400, detail="Year and month required for KDV summary")
+            start_date = date(year, month, 1)
+            end_date = date(year, month, calendar.monthrange(year, month)[1])
+            result = await get_kdv_summary(
+                start_date=start_date, end_date=end_date,
+                current_user=current_user, supabase=supabase
+            )
         else:
             raise HTTPException(status_code=400, detail="Invalid report type")
         
@@ -9,6 +9,8 @@ from app.schemas.data_processing import (
     CategoryUpdateRequest
 )
 from app.db.supabase_client import get_authenticated_supabase_client
+from app.services.budget_service import budget_summary_cache
+from app.services.dashboard_cache import dashboard_cache
 from supabase import Client
 
 router = APIRouter()
@@ -92,6 +94,7 @@ async def create_category(
         if not response.data:
             raise HTTPException(status_code=500, detail="Failed to create category")
         
+        dashboard_cache.bump(current_user["id"])
         category = response.data[0]
         
         return CategoryResponse(
@@ -150,6 +153,9 @@ async def update_category(
         if not response.data:
             raise HTTPException(status_code=500, detail="Failed to update category")
         
+        # Category names appear in budget summaries and the dashboard
+        budget_summary_cache.invalidate(current_user["id"])
+        dashboard_cache.bump(current_user["id"])
         category = response.data[0]
         
         return CategoryResponse(
@@ -211,6 +217,9 @@ async def delete_category(
         if not response.data:
             raise HTTPException(status_code=500, detail="Failed to delete category")
         
+        budget_summary_cache.invalidate(current_user["id"])
+        dashboard_cache.bump(current_user["id"])
+        
         if reassigned_count > 0:
             return {
                 "message": f"Category deleted successfully. {reassigned_count} expense items reassigned to 'Other' category."
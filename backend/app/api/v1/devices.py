@@ -3,6 +3,7 @@ from typing import List, Optional
 from pydantic import BaseModel
 from app.db.supabase_client import get_authenticated_supabase_client
 from app.core.logging_config import get_logger
+from app.core.notifications import device_token_cache
 from supabase import Client
 
 router = APIRouter()
@@ -58,6 +59,7 @@ async def register_device(
             result = supabase.table("user_devices").update(update_data).eq("id", existing_device.data[0]["id"]).execute()
             
             if result.data:
+                device_token_cache.invalidate(user_id)
                 logger.info(f"Device updated for user {user_id}: {device_data.device_id}")
                 return {"message": "Device updated successfully", "device_id": device_data.device_id}
             else:
@@ -78,6 +80,7 @@ async def register_device(
             result = supabase.table("user_devices").insert(insert_data).execute()
             
             if result.data:
+                device_token_cache.invalidate(user_id)
                 logger.info(f"New device registered for user {user_id}: {device_data.device_id}")
                 return {"message": "Device registered successfully", "device_id": device_data.device_id}
             else:
@@ -131,6 +134,7 @@ async def deactivate_device(
         result = supabase.table("user_devices").update({"is_active": False}).eq("user_id", user_id).eq("device_id", device_id).execute()
         
         if result.data:
+            device_token_cache.invalidate(user_id)
             logger.info(f"Device deactivated for user {user_id}: {device_id}")
             return {"message": "Device deactivated successfully"}
         else:
@@ -160,6 +164,7 @@ async def delete_device(
         result = supabase.table("user_devices").delete().eq("user_id", user_id).eq("device_id", device_id).execute()
         
         if result.data:
+            device_token_cache.invalidate(user_id)
             logger.info(f"Device deleted for user {user_id}: {device_id}")
             return {"message": "Device deleted successfully"}
         else:
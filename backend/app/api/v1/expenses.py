@@ -16,6 +16,8 @@ from app.schemas.data_processing import (
 from app.services.data_processor import DataProcessor
 from app.services.qr_generator import QRGenerator
 from app.services.loyalty_service import LoyaltyService
+from app.services.budget_threshold_service import budget_threshold_service
+from app.services.dashboard_cache import dashboard_cache
 from app.db.supabase_client import get_authenticated_supabase_client
 from app.utils.kdv_calculator import KDVCalculator
 from supabase import Client
@@ -28,6 +30,7 @@ loyalty_service = LoyaltyService()
 @router.post("", response_model=ExpenseResponse)
 async def create_manual_expense(
     request: ManualExpenseRequest,
+    include_qr: bool = Query(True, description="Render the QR image inline; otherwise fetch it lazily from qr_code_url"),
     current_user: dict = Depends(get_current_user),
     supabase: Client = Depends(get_authenticated_supabase_client)
 ):
@@ -154,15 +157,14 @@ async def create_manual_expense(
                 updated_at=item["updated_at"]
             ))
         
-        # Generate QR code for the receipt
-        receipt = receipt_response.data[0]
-        qr_code = qr_generator.generate_receipt_qr(
-            receipt_id=str(receipt_id),
-            merchant_name=receipt["merchant_name"],
-            total_amount=receipt["total_amount"],
-            currency=receipt["currency"],
-            transaction_date=datetime.fromisoformat(receipt["transaction_date"].replace('Z', '+00:00'))
-        )
+        # Eşik olayları trigger'larda yazıldı; bildirim worker'ını uyandır
+        budget_threshold_service.notify()
+        dashboard_cache.bump(current_user["id"])
+        
+        # Generate QR code for the receipt (off the event loop), or leave it to the client
+        qr_code = None
+        if include_qr:
+            qr_code = await qr_generator.generate_receipt_qr_async(str(receipt_id))
         
         # Award loyalty points for the expense
         try:
@@ -200,6 +202,7 @@ async def create_manual_expense(
             merchant_name=request.merchant_name,
             items=expense_items,
             qr_code=qr_code,
+            qr_code_url=qr_generator.get_receipt_qr_image_url(str(receipt_id)),
             created_at=expense["created_at"],
             updated_at=expense["updated_at"]
         )
@@ -316,13 +319,16 @@ async def get_expense(
             categories(id, name)
         """).eq("expense_id", str(expense_id)).execute()
         
+        # Calculate KDV breakdowns for all items in one pass
+        kdv_breakdowns = KDVCalculator.get_kdv_breakdown_batch(
+            [item["amount"] for item in items_response.data],
+            [item.get("kdv_rate", 20.0) for item in items_response.data]
+        )
+        
         expense_items = []
-        for item in items_response.data:
+        for item, kdv_breakdown in zip(items_response.data, kdv_breakdowns):
             category_name = item.get("categories", {}).get("name") if item.get("categories") else None
-            
-            # Calculate KDV breakdown
-            kdv_rate = item.get("kdv_rate", 20.0)
-            kdv_breakdown = KDVCalculator.get_kdv_breakdown(item["amount"], kdv_rate)
+            kdv_rate = kdv_breakdown["kdv_rate"]
             
             expense_items.append(ExpenseItemResponse(
                 id=item["id"],
@@ -409,6 +415,7 @@ async def update_expense(
                 raise HTTPException(status_code=500, detail="Failed to update expense")
             
             expense = response.data[0]
+            budget_threshold_service.notify()
         else:
             expense = existing_response.data[0]
         
@@ -420,6 +427,8 @@ async def update_expense(
             if not receipt_response.data:
                 raise HTTPException(status_code=500, detail="Failed to update merchant name")
         
+        dashboard_cache.bump(current_user["id"])
+        
         # Get current merchant name from receipt
         receipt_response = supabase.table("receipts").select("merchant_name").eq("id", expense["receipt_id"]).execute()
         merchant_name = receipt_response.data[0]["merchant_name"] if receipt_response.data else None
@@ -430,13 +439,16 @@ async def update_expense(
             categories(id, name)
         """).eq("expense_id", str(expense_id)).execute()
         
+        # Calculate KDV breakdowns for all items in one pass
+        kdv_breakdowns = KDVCalculator.get_kdv_breakdown_batch(
+            [item["amount"] for item in items_response.data],
+            [item.get("kdv_rate", 20.0) for item in items_response.data]
+        )
+        
         expense_items = []
-        for item in items_response.data:
+        for item, kdv_breakdown in zip(items_response.data, kdv_breakdowns):
             category_name = item.get("categories", {}).get("name") if item.get("categories") else None
-            
-            # Calculate KDV breakdown
-            kdv_rate = item.get("kdv_rate", 20.0)
-            kdv_breakdown = KDVCalculator.get_kdv_breakdown(item["amount"], kdv_rate)
+            kdv_rate = kdv_breakdown["kdv_rate"]
             
             expense_items.append(ExpenseItemResponse(
                 id=item["id"],
@@ -507,6 +519,8 @@ async def delete_expense(
         if not response.data:
             raise HTTPException(status_code=500, detail="Failed to delete expense")
         
+        dashboard_cache.bump(current_user["id"])
+        
         return {"message": "Expense and all items deleted successfully"}
         
     except HTTPException:
@@ -594,6 +608,8 @@ async def create_expense_item(
         total_amount = sum(item["amount"] for item in items_total_response.data)
         
         supabase.table("expenses").update({"total_amount": total_amount}).eq("id", str(expense_id)).execute()
+        budget_threshold_service.notify()
+        dashboard_cache.bump(current_user["id"])
         
         # Get category name
         category_name = None
@@ -707,6 +723,8 @@ async def update_expense_item(
         total_amount = sum(item["amount"] for item in items_total_response.data)
         
         supabase.table("expenses").update({"total_amount": total_amount}).eq("id", str(expense_id)).execute()
+        budget_threshold_service.notify()
+        dashboard_cache.bump(current_user["id"])
         
         # Get category name
         category_name = None
@@ -779,6 +797,7 @@ async def delete_expense_item(
         total_amount = sum(item["amount"] for item in items_total_response.data) if items_total_response.data else 0
         
         supabase.table("expenses").update({"total_amount": total_amount}).eq("id", str(expense_id)).execute()
+        dashboard_cache.bump(current_user["id"])
         
         return {"message": "Expense item deleted successfully"}
         
@@ -807,13 +826,16 @@ async def list_expense_items(
             categories(id, name)
         """).eq("expense_id", str(expense_id)).execute()
         
+        # Calculate KDV breakdowns for all items in one pass
+        kdv_breakdowns = KDVCalculator.get_kdv_breakdown_batch(
+            [item["amount"] for item in items_response.data],
+            [item.get("kdv_rate", 20.0) for item in items_response.data]
+        )
+        
         expense_items = []
-        for item in items_response.data:
+        for item, kdv_breakdown in zip(items_response.data, kdv_breakdowns):
             category_name = item.get("categories", {}).get("name") if item.get("categories") else None
-            
-            # Calculate KDV breakdown
-            kdv_rate = item.get("kdv_rate", 20.0)
-            kdv_breakdown = KDVCalculator.get_kdv_breakdown(item["amount"], kdv_rate)
+            kdv_rate = kdv_breakdown["kdv_rate"]
             
             expense_items.append(ExpenseItemResponse(
                 id=item["id"],
@@ -1,9 +1,11 @@
 from fastapi import APIRouter, HTTPException, status, Depends
 from typing import Dict, Any
 import time
-from datetime import datetime, timedelta
+from datetime import datetime
 from app.core.config import settings
 from app.core.auth import get_current_user
+from app.core.log_sink import log_sink
+from app.services.system_metrics_service import system_metrics_service
 
 router = APIRouter()
 
@@ -107,39 +109,17 @@ async def database_health_check() -> Dict[str, Any]:
 async def system_metrics(current_user = Depends(get_current_user)) -> Dict[str, Any]:
     """
     System metrics (for authorized users)
+
+    Served from a snapshot refreshed by the scheduler; totals are planner
+    estimates, 24h windows are exact counts.
     """
     try:
-        supabase = settings.supabase_admin
-        
-        # Kullanıcı istatistikleri
-        users_count = supabase.table("users").select("id", count="exact").execute()  # type: ignore
-        
-        # Harcama istatistikleri
-        expenses_count = supabase.table("expenses").select("id", count="exact").execute()  # type: ignore
-        
-        # Fiş istatistikleri
-        receipts_count = supabase.table("receipts").select("id", count="exact").execute()  # type: ignore
-        
-        # Merchant istatistikleri
-        merchants_count = supabase.table("merchants").select("id", count="exact").execute()  # type: ignore
-        
-        # Son 24 saat içindeki aktivite
-        yesterday = datetime.utcnow() - timedelta(days=1)
-        recent_expenses = supabase.table("expenses").select("id", count="exact").gte("created_at", yesterday.isoformat()).execute()  # type: ignore
-        recent_receipts = supabase.table("receipts").select("id", count="exact").gte("created_at", yesterday.isoformat()).execute()  # type: ignore
+        snapshot = await system_metrics_service.get_snapshot()
         
         return {
             "timestamp": datetime.utcnow().isoformat(),
-            "totals": {
-                "users": users_count.count if hasattr(users_count, 'count') else 0,
-                "expenses": expenses_count.count if hasattr(expenses_count, 'count') else 0,
-                "receipts": receipts_count.count if hasattr(receipts_count, 'count') else 0,
-                "merchants": merchants_count.count if hasattr(merchants_count, 'count') else 0
-            },
-            "last_24h": {
-                "new_expenses": recent_expenses.count if hasattr(recent_expenses, 'count') else 0,
-                "new_receipts": recent_receipts.count if hasattr(recent_receipts, 'count') else 0
-            },
+            **snapshot,
+            "log_sink": log_sink.get_metrics(),
             "system": {
                 "environment": settings.ENVIRONMENT,
                 "version": settings.VERSION
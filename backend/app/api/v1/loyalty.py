@@ -3,10 +3,14 @@ Loyalty Program API Endpoints
 Handles loyalty points, levels, and rewards
 """
 
-from fastapi import APIRouter, Depends, HTTPException, Query
+import hashlib
+import json
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from typing import List, Optional
 
 from app.auth.dependencies import get_current_user
+from app.core.config import settings
 from app.schemas.loyalty import LoyaltyStatusResponse
 from app.services.loyalty_service import LoyaltyService
 
@@ -51,49 +55,63 @@ async def get_loyalty_history(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get loyalty history: {str(e)}")
 
+# Static: built and hashed once per process
+LOYALTY_LEVELS_INFO = {
+    "success": True,
+    "levels": {
+        "bronze": {
+            "name": "Bronze",
+            "points_required": 0,
+            "multiplier": 1.0,
+            "benefits": ["Base points earning", "Standard support"]
+        },
+        "silver": {
+            "name": "Silver", 
+            "points_required": 1000,
+            "multiplier": 1.2,
+            "benefits": ["20% bonus points", "Priority support", "Monthly reports"]
+        },
+        "gold": {
+            "name": "Gold",
+            "points_required": 5000, 
+            "multiplier": 1.5,
+            "benefits": ["50% bonus points", "Premium support", "Advanced analytics", "Category bonuses"]
+        },
+        "platinum": {
+            "name": "Platinum",
+            "points_required": 15000,
+            "multiplier": 2.0,
+            "benefits": ["100% bonus points", "VIP support", "Custom reports", "Maximum category bonuses", "Early feature access"]
+        }
+    },
+    "category_bonuses": {
+        "food": "50% bonus",
+        "grocery": "30% bonus", 
+        "fuel": "20% bonus",
+        "restaurant": "40% bonus"
+    }
+}
+LOYALTY_LEVELS_BODY = json.dumps(LOYALTY_LEVELS_INFO, separators=(",", ":")).encode()
+LOYALTY_LEVELS_ETAG = f'"{hashlib.sha256(LOYALTY_LEVELS_BODY).hexdigest()[:32]}"'
+
+
 @router.get("/levels")
-async def get_loyalty_levels():
+async def get_loyalty_levels(request: Request):
     """
     Get information about all loyalty levels and their requirements
+    
+    The payload is static, so it is served with a long max-age and an ETag;
+    revalidation with If-None-Match gets a 304.
     """
-    try:
-        levels_info = {
-            "bronze": {
-                "name": "Bronze",
-                "points_required": 0,
-                "multiplier": 1.0,
-                "benefits": ["Base points earning", "Standard support"]
-            },
-            "silver": {
-                "name": "Silver", 
-                "points_required": 1000,
-                "multiplier": 1.2,
-                "benefits": ["20% bonus points", "Priority support", "Monthly reports"]
-            },
-            "gold": {
-                "name": "Gold",
-                "points_required": 5000, 
-                "multiplier": 1.5,
-                "benefits": ["50% bonus points", "Premium support", "Advanced analytics", "Category bonuses"]
-            },
-            "platinum": {
-                "name": "Platinum",
-                "points_required": 15000,
-                "multiplier": 2.0,
-                "benefits": ["100% bonus points", "VIP support", "Custom reports", "Maximum category bonuses", "Early feature access"]
-            }
-        }
-        
-        return {
-            "success": True,
-            "levels": levels_info,
-            "category_bonuses": {
-                "food": "50% bonus",
-                "grocery": "30% bonus", 
-                "fuel": "20% bonus",
-                "restaurant": "40% bonus"
-            }
-        }
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to get levels info: {str(e)}") 
\ No newline at end of file
+    headers = {
+        "ETag": LOYALTY_LEVELS_ETAG,
+        "Cache-Control": f"public, max-age={settings.LOYALTY_LEVELS_MAX_AGE}"
+    }
+    
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        candidates = [tag.strip() for tag in if_none_match.split(",")]
+        if "*" in candidates or LOYALTY_LEVELS_ETAG in candidates or f"W/{LOYALTY_LEVELS_ETAG}" in candidates:
+            return Response(status_code=304, headers=headers)
+    
+    return Response(content=LOYALTY_LEVELS_BODY, media_type="application/json", headers=headers)
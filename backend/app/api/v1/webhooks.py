@@ -1,18 +1,35 @@
+import logging
+import time
 from fastapi import APIRouter, Depends, HTTPException, status, Query, Header
+from fastapi.responses import JSONResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from typing import Optional, List
+from datetime import datetime, timedelta, timezone
+from typing import Optional, List, Dict, Any
 from uuid import UUID
 
+from app.core.config import settings
 from app.db.supabase_client import get_supabase_client, get_supabase_admin_client
 from app.schemas.merchant import (
     WebhookTransactionData,
     WebhookProcessingResult,
+    WebhookQueueStatusResponse,
+    WebhookBatchRequest,
+    WebhookBatchItemResult,
+    WebhookBatchResponse,
+    WebhookDeadLetterResponse,
+    WebhookDeadLetterListResponse,
+    WebhookStatsResponse,
     WebhookLogResponse,
     WebhookLogListResponse,
     WebhookStatus
 )
 from app.services.merchant_service import MerchantService
 from app.services.webhook_service import WebhookService
+from app.services.webhook_queue_service import (
+    WebhookQueueStatus,
+    webhook_queue_service,
+    stored_result
+)
 from app.auth.dependencies import require_admin
 
 try:
@@ -20,6 +37,8 @@ try:
 except ImportError:
     cleanup_service = None
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter()
 security = HTTPBearer()
 
@@ -29,25 +48,29 @@ async def validate_merchant_api_key(
     x_api_key: str = Header(..., description="Merchant API key"),
     supabase=Depends(get_supabase_admin_client)
 ) -> UUID:
-    """Validate merchant API key and return merchant ID"""
+    """
+    Validate merchant API key and return merchant ID
+    
+    Uses the cached credential (key hash + active flag); the merchants row is
+    only read on a cache miss.
+    """
     try:
         merchant_service = MerchantService(supabase)
         
-        # Get merchant by ID and validate API key
-        merchant = await merchant_service.get_merchant_by_id(merchant_id)
-        if not merchant:
+        credential = await merchant_service.get_merchant_credential(merchant_id)
+        if not credential:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Merchant not found"
             )
         
-        if not merchant.is_active:
+        if not credential.is_active:
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail="Merchant account is inactive"
             )
         
-        if merchant.api_key != x_api_key:
+        if not credential.matches(x_api_key):
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Invalid API key"
@@ -64,10 +87,37 @@ async def validate_merchant_api_key(
         )
 
 
-@router.post("/merchant/{merchant_id}/transaction", response_model=WebhookProcessingResult)
+def _queue_status_response(merchant_id: UUID, entry: Dict[str, Any], duplicate: bool) -> WebhookQueueStatusResponse:
+    return WebhookQueueStatusResponse(
+        queue_id=entry["id"],
+        transaction_id=entry["transaction_id"],
+        status=entry["status"],
+        duplicate=duplicate,
+        attempts=entry.get("attempts") or 0,
+        status_url=f"{settings.API_V1_STR}/webhooks/merchant/{merchant_id}/transaction/{entry['transaction_id']}",
+        result=stored_result(entry),
+        created_at=entry.get("created_at")
+    )
+
+
+def _accepted(merchant_id: UUID, entry: Dict[str, Any], duplicate: bool) -> JSONResponse:
+    return JSONResponse(
+        status_code=status.HTTP_202_ACCEPTED,
+        content=_queue_status_response(merchant_id, entry, duplicate).model_dump(mode="json")
+    )
+
+
+@router.post(
+    "/merchant/{merchant_id}/transaction",
+    response_model=WebhookProcessingResult,
+    responses={202: {"model": WebhookQueueStatusResponse, "description": "Accepted for asynchronous processing"}}
+)
 async def receive_merchant_transaction(
     merchant_id: UUID,
     transaction_data: WebhookTransactionData,
+    async_processing: Optional[bool] = Query(
+        None, description="Queue the transaction and return 202 (defaults to WEBHOOK_ASYNC_INGEST)"
+    ),
     validated_merchant_id: UUID = Depends(validate_merchant_api_key),
     supabase=Depends(get_supabase_admin_client)
 ):
@@ -77,8 +127,44 @@ async def receive_merchant_transaction(
     This endpoint processes incoming transaction data from merchant partners,
     matches customers, and automatically creates receipts and expenses.
     
+    **Async mode** (`async_processing=true` or WEBHOOK_ASYNC_INGEST): the payload is
+    written to the webhook queue and 202 is returned immediately with a `status_url`.
+    
+    **Idempotency:** `transaction_id` is unique per merchant. Re-sending a transaction
+    returns the stored result (or its queue status) instead of creating a duplicate receipt.
+    
+    A failed transaction that will be retried (WEBHOOK_RETRY_ATTEMPTS) is answered with
+    202 and its queue status; the result is only returned once it is final.
+    
     Requires valid merchant API key in X-API-Key header.
     """
+    if async_processing is None:
+        async_processing = settings.WEBHOOK_ASYNC_INGEST
+    
+    if async_processing:
+        try:
+            entry, duplicate = webhook_queue_service.enqueue(merchant_id, transaction_data, supabase=supabase)
+        except Exception as e:
+            logger.error(f"Failed to enqueue webhook transaction {transaction_data.transaction_id}: {e}")
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Webhook queue unavailable, retry later"
+            )
+        return _accepted(merchant_id, entry, duplicate)
+    
+    # Sync mode still records the transaction in the queue for idempotency
+    entry = None
+    try:
+        entry, duplicate = webhook_queue_service.enqueue(
+            merchant_id, transaction_data, status=WebhookQueueStatus.PROCESSING, supabase=supabase
+        )
+        if duplicate:
+            result = stored_result(entry)
+            return result if result is not None else _accepted(merchant_id, entry, duplicate)
+    except Exception as e:
+        logger.warning(f"Webhook queue unavailable, processing {transaction_data.transaction_id} without idempotency: {e}")
+    
+    error = None
     try:
         webhook_service = WebhookService(supabase)
         result = await webhook_service.process_merchant_transaction(
@@ -87,13 +173,176 @@ async def receive_merchant_transaction(
             test_mode=False
         )
         
-        return result
-        
     except Exception as e:
+        error = f"Failed to process transaction: {str(e)}"
+        result = WebhookProcessingResult(
+            success=False,
+            message=error,
+            transaction_id=transaction_data.transaction_id,
+            processing_time_ms=0,
+            errors=[str(e)]
+        )
+    
+    # Close the queue row on every path, so it is not left 'processing' until its lease expires
+    completion = None
+    if entry is not None:
+        try:
+            completion = webhook_queue_service.complete(entry, result, supabase=supabase)
+        except Exception as e:
+            logger.error(f"Failed to record webhook result for {transaction_data.transaction_id}: {e}")
+    
+    if completion is not None and completion["status"] == WebhookQueueStatus.QUEUED.value:
+        # Failed, but a retry is scheduled: the result is not final yet
+        return _accepted(merchant_id, {**entry, **completion}, False)
+    
+    if error is not None:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Failed to process transaction: {str(e)}"
+            detail=error
+        )
+    
+    return result
+
+
+@router.post(
+    "/merchant/{merchant_id}/transactions/batch",
+    response_model=WebhookBatchResponse,
+    responses={413: {"description": "Too many transactions in one batch"}}
+)
+async def receive_merchant_transactions_batch(
+    merchant_id: UUID,
+    batch: WebhookBatchRequest,
+    validated_merchant_id: UUID = Depends(validate_merchant_api_key),
+    supabase=Depends(get_supabase_admin_client)
+):
+    """
+    Receive a batch of transactions from merchant POS systems
+    
+    The API key is validated once for the whole batch, customers are matched
+    with one query per identifier type and receipts, expenses and items are
+    written with multi-row inserts. Each transaction gets its own result;
+    a failed transaction does not fail the batch.
+    
+    **Idempotency:** transactions already received (in an earlier request or
+    earlier in the same batch) are not processed again and are returned with
+    `duplicate=true` and their stored result.
+    
+    Requires valid merchant API key in X-API-Key header.
+    """
+    start_time = time.time()
+    transactions = batch.transactions
+    
+    if len(transactions) > settings.WEBHOOK_BATCH_MAX_TRANSACTIONS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Batch contains {len(transactions)} transactions, maximum is {settings.WEBHOOK_BATCH_MAX_TRANSACTIONS}"
+        )
+    
+    created: Dict[str, Dict[str, Any]] = {}
+    existing: Dict[str, Dict[str, Any]] = {}
+    try:
+        created, existing = webhook_queue_service.enqueue_many(
+            merchant_id, transactions, status=WebhookQueueStatus.PROCESSING, supabase=supabase
+        )
+    except Exception as e:
+        logger.warning(f"Webhook queue unavailable, processing batch for merchant {merchant_id} without idempotency: {e}")
+    
+    # First occurrence of each new transaction_id is processed
+    first_index: Dict[str, int] = {}
+    for index, transaction_data in enumerate(transactions):
+        if transaction_data.transaction_id not in existing:
+            first_index.setdefault(transaction_data.transaction_id, index)
+    to_process = [transactions[index] for index in first_index.values()]
+    
+    error = None
+    try:
+        webhook_service = WebhookService(supabase)
+        processed = await webhook_service.process_merchant_transactions_batch(
+            merchant_id,
+            to_process,
+            test_mode=False,
+            write_batch_size=settings.WEBHOOK_BATCH_WRITE_SIZE
+        )
+    except Exception as e:
+        error = f"Failed to process transaction batch: {str(e)}"
+        processed = [
+            WebhookProcessingResult(
+                success=False,
+                message=error,
+                transaction_id=transaction_data.transaction_id,
+                processing_time_ms=0,
+                errors=[str(e)]
+            )
+            for transaction_data in to_process
+        ]
+    results_by_id = {transaction_data.transaction_id: result for transaction_data, result in zip(to_process, processed)}
+    
+    # Close the queue rows on every path, so they are not left 'processing' until their lease expires
+    if created:
+        try:
+            webhook_queue_service.complete_many(
+                [(created[transaction_id], result) for transaction_id, result in results_by_id.items() if transaction_id in created],
+                supabase=supabase
+            )
+        except Exception as e:
+            logger.error(f"Failed to record webhook batch results for merchant {merchant_id}: {e}")
+    
+    if error is not None:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=error
+        )
+    
+    items = []
+    for index, transaction_data in enumerate(transactions):
+        transaction_id = transaction_data.transaction_id
+        if transaction_id in existing:
+            entry = existing[transaction_id]
+            result = stored_result(entry)
+            items.append(WebhookBatchItemResult(
+                index=index,
+                transaction_id=transaction_id,
+                duplicate=True,
+                queue_status=None if result is not None else entry["status"],
+                result=result
+            ))
+        else:
+            items.append(WebhookBatchItemResult(
+                index=index,
+                transaction_id=transaction_id,
+                duplicate=first_index[transaction_id] != index,
+                result=results_by_id[transaction_id]
+            ))
+    
+    return WebhookBatchResponse(
+        total=len(items),
+        succeeded=sum(1 for item in items if not item.duplicate and item.result.success),
+        failed=sum(1 for item in items if not item.duplicate and not item.result.success),
+        duplicates=sum(1 for item in items if item.duplicate),
+        processing_time_ms=int((time.time() - start_time) * 1000),
+        results=items
+    )
+
+
+@router.get("/merchant/{merchant_id}/transaction/{transaction_id}", response_model=WebhookQueueStatusResponse)
+async def get_merchant_transaction_status(
+    merchant_id: UUID,
+    transaction_id: str,
+    validated_merchant_id: UUID = Depends(validate_merchant_api_key),
+    supabase=Depends(get_supabase_admin_client)
+):
+    """
+    Get the queue status and processing result of a submitted transaction
+    
+    Requires valid merchant API key in X-API-Key header.
+    """
+    entry = webhook_queue_service.get_entry(merchant_id, transaction_id, supabase=supabase)
+    if entry is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Transaction not found"
         )
+    return _queue_status_response(merchant_id, entry, duplicate=False)
 
 
 
@@ -172,60 +421,128 @@ async def retry_webhook(
         )
 
 
-@router.get("/merchant/{merchant_id}/stats")
+@router.get("/dead-letters", response_model=WebhookDeadLetterListResponse)
+async def get_webhook_dead_letters(
+    merchant_id: Optional[UUID] = Query(None, description="Filter by merchant"),
+    page: int = Query(1, ge=1, description="Page number"),
+    size: int = Query(20, ge=1, le=100, description="Page size"),
+    current_user=Depends(require_admin),
+    supabase=Depends(get_supabase_admin_client)
+):
+    """
+    Get webhook transactions that failed on every retry attempt (Admin only)
+    
+    Failed transactions are retried automatically with exponential backoff
+    (WEBHOOK_RETRY_ATTEMPTS, WEBHOOK_RETRY_DELAY); the ones still failing end up here.
+    """
+    try:
+        entries, total = webhook_queue_service.list_dead_letters(merchant_id, page, size, supabase=supabase)
+        
+        return WebhookDeadLetterListResponse(
+            items=[
+                WebhookDeadLetterResponse(
+                    queue_id=entry["id"],
+                    merchant_id=entry["merchant_id"],
+                    transaction_id=entry["transaction_id"],
+                    attempts=entry.get("attempts") or 0,
+                    error_message=entry.get("error_message"),
+                    created_at=entry["created_at"],
+                    failed_at=entry.get("failed_at")
+                )
+                for entry in entries
+            ],
+            total=total,
+            page=page,
+            size=size,
+            has_next=(page * size) < total
+        )
+        
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to fetch webhook dead letters: {str(e)}"
+        )
+
+
+@router.post("/dead-letters/{queue_id}/requeue")
+async def requeue_webhook_dead_letter(
+    queue_id: UUID,
+    current_user=Depends(require_admin),
+    supabase=Depends(get_supabase_admin_client)
+):
+    """
+    Put a dead-lettered webhook transaction back on the queue (Admin only)
+    
+    The transaction gets a fresh set of retry attempts.
+    """
+    try:
+        if not webhook_queue_service.requeue(queue_id, supabase=supabase):
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Dead-lettered transaction not found"
+            )
+        
+        return {"message": "Webhook transaction requeued successfully"}
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to requeue webhook transaction: {str(e)}"
+        )
+
+
+@router.get("/merchant/{merchant_id}/stats", response_model=WebhookStatsResponse)
 async def get_webhook_stats(
     merchant_id: UUID,
+    start_time: Optional[datetime] = Query(
+        None,
+        description=(
+            f"Window start. Defaults to {settings.WEBHOOK_STATS_DEFAULT_HOURS} hours before end_time "
+            "(WEBHOOK_STATS_DEFAULT_HOURS), not all time; pass it explicitly for a longer window "
+            f"of up to {settings.WEBHOOK_STATS_MAX_DAYS} days"
+        )
+    ),
+    end_time: Optional[datetime] = Query(None, description="Window end (defaults to now)"),
     current_user=Depends(require_admin),
     supabase=Depends(get_supabase_admin_client)
 ):
     """
     Get webhook statistics for a merchant (Admin only)
     
-    Returns summary statistics including success rate, total transactions, etc.
+    Returns counts by status, success rate, min/avg/max and p50/p95/p99
+    processing time and an hourly series for the requested window.
+    Aggregation runs in the database on an hourly rollup of webhook_logs.
+    
+    Without start_time only the last WEBHOOK_STATS_DEFAULT_HOURS hours are
+    counted (earlier versions counted all logs); the window actually used
+    is returned in start_time / end_time.
     """
+    if end_time is None:
+        end_time = datetime.now(timezone.utc)
+    if start_time is None:
+        start_time = end_time - timedelta(hours=settings.WEBHOOK_STATS_DEFAULT_HOURS)
+    
+    if start_time.tzinfo is None:
+        start_time = start_time.replace(tzinfo=timezone.utc)
+    if end_time.tzinfo is None:
+        end_time = end_time.replace(tzinfo=timezone.utc)
+    
+    if start_time >= end_time:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="start_time must be before end_time"
+        )
+    if end_time - start_time > timedelta(days=settings.WEBHOOK_STATS_MAX_DAYS):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Statistics window cannot exceed {settings.WEBHOOK_STATS_MAX_DAYS} days"
+        )
+    
     try:
-        # Get webhook statistics from database using simple table query
-        result = supabase.table("webhook_logs").select("*").eq("merchant_id", str(merchant_id)).execute()
-        
-        logs = result.data if result.data else []
-        total = len(logs)
-        
-        if total > 0:
-            successful = len([log for log in logs if log.get('status') == 'success'])
-            failed = len([log for log in logs if log.get('status') == 'failed'])
-            retry = len([log for log in logs if log.get('status') == 'retry'])
-            
-            success_rate = (successful / total * 100) if total > 0 else 0
-            
-            # Calculate processing time stats
-            processing_times = [log.get('processing_time_ms') for log in logs if log.get('processing_time_ms') is not None]
-            avg_time = sum(processing_times) / len(processing_times) if processing_times else None
-            max_time = max(processing_times) if processing_times else None
-            min_time = min(processing_times) if processing_times else None
-            
-            return {
-                "merchant_id": merchant_id,
-                "total_webhooks": total,
-                "successful_webhooks": successful,
-                "failed_webhooks": failed,
-                "retry_webhooks": retry,
-                "success_rate_percentage": round(success_rate, 2),
-                "avg_processing_time_ms": avg_time,
-                "max_processing_time_ms": max_time,
-                "min_processing_time_ms": min_time
-            }
-        else:
-            return {
-                "merchant_id": merchant_id,
-                "total_webhooks": 0,
-                "successful_webhooks": 0,
-                "failed_webhooks": 0,
-                "retry_webhooks": 0,
-                "success_rate_percentage": 0,
-                "avg_processing_time_ms": None,
-                "max_processing_time_ms": None,
-                "min_processing_time_ms": None
-            }
+        webhook_service = WebhookService(supabase)
+        return await webhook_service.get_webhook_stats(merchant_id, start_time, end_time)
         
     except Exception as e:
         raise HTTPException(
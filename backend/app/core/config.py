@@ -47,9 +47,63 @@ class Settings(BaseSettings):
     # Merchant Integration settings
     MERCHANT_API_KEY_LENGTH: int = 32
     MERCHANT_API_KEY_PREFIX: str = "mk_"
+    MERCHANT_CREDENTIAL_CACHE_TTL: int = int(os.getenv("MERCHANT_CREDENTIAL_CACHE_TTL", "300"))  # seconds
+    MERCHANT_CREDENTIAL_CACHE_SIZE: int = int(os.getenv("MERCHANT_CREDENTIAL_CACHE_SIZE", "4096"))
+    CUSTOMER_MATCH_CACHE_TTL: int = int(os.getenv("CUSTOMER_MATCH_CACHE_TTL", "300"))  # seconds
+    CUSTOMER_MATCH_NEGATIVE_TTL: int = int(os.getenv("CUSTOMER_MATCH_NEGATIVE_TTL", "60"))  # seconds
+    CUSTOMER_MATCH_CACHE_SIZE: int = int(os.getenv("CUSTOMER_MATCH_CACHE_SIZE", "10000"))
     WEBHOOK_TIMEOUT: int = int(os.getenv("WEBHOOK_TIMEOUT", "30"))
     WEBHOOK_RETRY_ATTEMPTS: int = int(os.getenv("WEBHOOK_RETRY_ATTEMPTS", "3"))
     WEBHOOK_RETRY_DELAY: int = int(os.getenv("WEBHOOK_RETRY_DELAY", "60"))  # seconds
+    WEBHOOK_RETRY_MAX_DELAY: int = int(os.getenv("WEBHOOK_RETRY_MAX_DELAY", "3600"))  # seconds
+    WEBHOOK_RETRY_RATE_LIMIT: int = int(os.getenv("WEBHOOK_RETRY_RATE_LIMIT", "60"))  # retries per period
+    WEBHOOK_RETRY_RATE_PERIOD: int = int(os.getenv("WEBHOOK_RETRY_RATE_PERIOD", "60"))  # seconds
+    
+    # Webhook ingestion queue settings
+    WEBHOOK_ASYNC_INGEST: bool = os.getenv("WEBHOOK_ASYNC_INGEST", "False").lower() == "true"
+    WEBHOOK_INGEST_WORKERS: int = int(os.getenv("WEBHOOK_INGEST_WORKERS", "4"))
+    WEBHOOK_INGEST_BATCH_SIZE: int = int(os.getenv("WEBHOOK_INGEST_BATCH_SIZE", "10"))
+    WEBHOOK_INGEST_POLL_INTERVAL: int = int(os.getenv("WEBHOOK_INGEST_POLL_INTERVAL", "5"))  # seconds
+    WEBHOOK_INGEST_LEASE_SECONDS: int = int(os.getenv("WEBHOOK_INGEST_LEASE_SECONDS", "300"))
+    
+    # Webhook batch endpoint settings
+    WEBHOOK_BATCH_MAX_TRANSACTIONS: int = int(os.getenv("WEBHOOK_BATCH_MAX_TRANSACTIONS", "500"))
+    WEBHOOK_BATCH_WRITE_SIZE: int = int(os.getenv("WEBHOOK_BATCH_WRITE_SIZE", "100"))
+    
+    # Webhook statistics settings
+    WEBHOOK_STATS_DEFAULT_HOURS: int = int(os.getenv("WEBHOOK_STATS_DEFAULT_HOURS", "24"))
+    WEBHOOK_STATS_MAX_DAYS: int = int(os.getenv("WEBHOOK_STATS_MAX_DAYS", "90"))
+    
+    # QR rendering settings
+    QR_RENDER_WORKERS: int = int(os.getenv("QR_RENDER_WORKERS", "2"))
+    QR_RENDER_CACHE_SIZE: int = int(os.getenv("QR_RENDER_CACHE_SIZE", "512"))
+    
+    # Public receipt page settings
+    PUBLIC_RECEIPT_CACHE_TTL: int = int(os.getenv("PUBLIC_RECEIPT_CACHE_TTL", "30"))  # seconds
+    PUBLIC_RECEIPT_CACHE_SIZE: int = int(os.getenv("PUBLIC_RECEIPT_CACHE_SIZE", "1024"))
+    PUBLIC_RECEIPT_MAX_AGE: int = int(os.getenv("PUBLIC_RECEIPT_MAX_AGE", "60"))  # seconds
+    
+    # Loyalty settings
+    LOYALTY_STATUS_CACHE_TTL: int = int(os.getenv("LOYALTY_STATUS_CACHE_TTL", "300"))  # seconds
+    LOYALTY_STATUS_CACHE_SIZE: int = int(os.getenv("LOYALTY_STATUS_CACHE_SIZE", "10000"))
+    LOYALTY_LEVELS_MAX_AGE: int = int(os.getenv("LOYALTY_LEVELS_MAX_AGE", "86400"))  # seconds
+    
+    # Budget settings
+    BUDGET_HISTORY_MONTHS: int = int(os.getenv("BUDGET_HISTORY_MONTHS", "12"))
+    BUDGET_HISTORY_MIN_MONTHS: int = int(os.getenv("BUDGET_HISTORY_MIN_MONTHS", "6"))
+    BUDGET_ALLOCATION_MIN_FLOOR: float = float(os.getenv("BUDGET_ALLOCATION_MIN_FLOOR", "0.02"))  # share of total per category
+    BUDGET_SUMMARY_CACHE_TTL: int = int(os.getenv("BUDGET_SUMMARY_CACHE_TTL", "30"))  # seconds
+    BUDGET_SUMMARY_CACHE_SIZE: int = int(os.getenv("BUDGET_SUMMARY_CACHE_SIZE", "10000"))
+
+    # Dashboard settings
+    DASHBOARD_CACHE_TTL: int = int(os.getenv("DASHBOARD_CACHE_TTL", "60"))  # seconds
+    DASHBOARD_CACHE_SIZE: int = int(os.getenv("DASHBOARD_CACHE_SIZE", "10000"))
+    
+    # Bulk receipt ingestion settings
+    BULK_INGEST_MAX_RECEIPTS: int = int(os.getenv("BULK_INGEST_MAX_RECEIPTS", "500"))
+    BULK_INGEST_QUEUE_SIZE: int = int(os.getenv("BULK_INGEST_QUEUE_SIZE", "64"))
+    BULK_INGEST_CATEGORIZE_WORKERS: int = int(os.getenv("BULK_INGEST_CATEGORIZE_WORKERS", "4"))
+    BULK_INGEST_WRITE_BATCH_SIZE: int = int(os.getenv("BULK_INGEST_WRITE_BATCH_SIZE", "50"))
     
     # Security settings
     JWT_SECRET_KEY: str = os.getenv("JWT_SECRET_KEY", "")
@@ -58,13 +112,33 @@ class Settings(BaseSettings):
     
     # Push Notification settings
     FCM_SERVER_KEY: str = os.getenv("FCM_SERVER_KEY", "")
+    FCM_URL: str = os.getenv("FCM_URL", "https://fcm.googleapis.com/fcm/send")
+    FCM_TIMEOUT: float = float(os.getenv("FCM_TIMEOUT", "30"))  # seconds
+    FCM_MAX_CONNECTIONS: int = int(os.getenv("FCM_MAX_CONNECTIONS", "100"))
+    FCM_MAX_CONCURRENCY: int = int(os.getenv("FCM_MAX_CONCURRENCY", "50"))  # multicast requests in flight
+    FCM_MULTICAST_SIZE: int = int(os.getenv("FCM_MULTICAST_SIZE", "500"))  # tokens per request, FCM max 1000
+    DEVICE_TOKEN_CACHE_TTL: int = int(os.getenv("DEVICE_TOKEN_CACHE_TTL", "600"))  # seconds
+    DEVICE_TOKEN_CACHE_SIZE: int = int(os.getenv("DEVICE_TOKEN_CACHE_SIZE", "50000"))
+    NOTIFICATION_DIGEST_BATCH_SIZE: int = int(os.getenv("NOTIFICATION_DIGEST_BATCH_SIZE", "500"))  # users per page / checkpoint
+    NOTIFICATION_DIGEST_INTERVAL_MINUTES: int = int(os.getenv("NOTIFICATION_DIGEST_INTERVAL_MINUTES", "60"))
+    NOTIFICATION_DIGEST_LEASE_SECONDS: int = int(os.getenv("NOTIFICATION_DIGEST_LEASE_SECONDS", "600"))  # extended after every page
+    BUDGET_THRESHOLD_BATCH_SIZE: int = int(os.getenv("BUDGET_THRESHOLD_BATCH_SIZE", "100"))
+    BUDGET_THRESHOLD_POLL_INTERVAL: int = int(os.getenv("BUDGET_THRESHOLD_POLL_INTERVAL", "10"))  # seconds
+    BUDGET_THRESHOLD_LEASE_SECONDS: int = int(os.getenv("BUDGET_THRESHOLD_LEASE_SECONDS", "300"))
+    BUDGET_THRESHOLD_MAX_ATTEMPTS: int = int(os.getenv("BUDGET_THRESHOLD_MAX_ATTEMPTS", "5"))  # failed sends are retried after the lease
     
     # Logging settings
     LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO")
     LOG_FILE: str = os.getenv("LOG_FILE", "logs/app.log")
     
+    # Audit log buffer settings (webhook_logs, notification_logs)
+    LOG_SINK_BATCH_SIZE: int = int(os.getenv("LOG_SINK_BATCH_SIZE", "100"))
+    LOG_SINK_FLUSH_INTERVAL: float = float(os.getenv("LOG_SINK_FLUSH_INTERVAL", "1.0"))  # seconds
+    LOG_SINK_MAX_BUFFER: int = int(os.getenv("LOG_SINK_MAX_BUFFER", "10000"))
+    
     # Scheduler settings
     SCHEDULER_ENABLED: bool = os.getenv("SCHEDULER_ENABLED", "True").lower() == "true"
+    METRICS_REFRESH_INTERVAL_MINUTES: int = int(os.getenv("METRICS_REFRESH_INTERVAL_MINUTES", "5"))
     
     # Initialize Supabase client
     @property
@@ -0,0 +1,268 @@
+"""
+Buffered audit log writer
+webhook_logs / notification_logs kayıtlarını tamponlayıp çok satırlı upsert ile yazar
+"""
+
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from uuid import UUID, uuid4
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# A record or update whose flush failed this many times is dropped
+MAX_FLUSH_ATTEMPTS = 3
+
+
+class BufferedLogSink:
+    """
+    Audit log kayıtları için tamponlu yazıcı
+
+    Kayıtlar id'leri istemcide üretilerek bellekte tutulur ve max_batch kayda
+    ulaşınca ya da flush_interval dolunca tablo başına çok satırlı upsert
+    (on_conflict=id) ile yazılır. Henüz yazılmamış bir kaydın güncellemesi
+    tampondaki kayda birleştirilir, yani deneme + sonuç tek satır olarak
+    yazılır; kayıt çoktan yazıldıysa güncelleme bir sonraki flush'ta ayrı bir
+    update olarak uygulanır. Yazılamayan kayıt ve güncellemeler sonraki
+    flush'ta MAX_FLUSH_ATTEMPTS kez yeniden denenir.
+
+    start() çağrılmadıysa (script, test) her kayıt hemen yazılır.
+    Tampon max_buffer'ı aşarsa yeni kayıtlar düşürülür ve metriklerde sayılır.
+    """
+
+    def __init__(
+        self,
+        max_batch: int = 100,
+        flush_interval: float = 1.0,
+        max_buffer: int = 10000,
+        supabase_factory: Optional[Callable[[], Any]] = None
+    ):
+        self.max_batch = max(1, max_batch)
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self._supabase_factory = supabase_factory or (lambda: settings.supabase_admin)
+        self._supabase = None
+        self._buffers: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self._late_updates: List[Tuple[str, str, Dict[str, Any]]] = []
+        # (table, id) for records, (table, id, "update") for late updates -> failed flushes
+        self._flush_failures: Dict[Tuple[str, ...], int] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._metrics = {
+            "records_buffered": 0,
+            "records_written": 0,
+            "records_dropped": 0,
+            "flushes": 0,
+            "failed_flushes": 0,
+            "last_flush_ms": None,
+            "max_flush_ms": None,
+            "total_flush_ms": 0.0,
+        }
+
+    @property
+    def supabase(self):
+        if self._supabase is None:
+            self._supabase = self._supabase_factory()
+        return self._supabase
+
+    @property
+    def depth(self) -> int:
+        """Tamponda bekleyen kayıt + güncelleme sayısı"""
+        return sum(len(records) for records in self._buffers.values()) + len(self._late_updates)
+
+    def add(self, table: str, record: Dict[str, Any]) -> UUID:
+        """
+        Kaydı tampona ekle
+
+        Returns:
+            Kaydın id'si (kayıtta yoksa burada üretilir)
+        """
+        record = dict(record)
+        record_id = str(record.get("id") or uuid4())
+        record["id"] = record_id
+
+        if self.depth >= self.max_buffer:
+            self._metrics["records_dropped"] += 1
+            logger.warning(f"Log buffer full ({self.max_buffer}), dropped {table} record {record_id}")
+            return UUID(record_id)
+
+        self._buffers.setdefault(table, {})[record_id] = record
+        self._metrics["records_buffered"] += 1
+        self._after_write()
+        return UUID(record_id)
+
+    def update(self, table: str, record_id: Any, changes: Dict[str, Any]):
+        """Kaydı güncelle; tampondaysa yerinde birleştirilir"""
+        record_id = str(record_id)
+        pending = self._buffers.get(table, {}).get(record_id)
+        if pending is not None:
+            pending.update(changes)
+            return
+
+        if self.depth >= self.max_buffer:
+            self._metrics["records_dropped"] += 1
+            logger.warning(f"Log buffer full ({self.max_buffer}), dropped {table} update for {record_id}")
+            return
+
+        self._late_updates.append((table, record_id, dict(changes)))
+        self._after_write()
+
+    async def flush(self) -> int:
+        """Tampondaki her şeyi yaz"""
+        return self.flush_now()
+
+    def flush_now(self) -> int:
+        """
+        Tampondaki her şeyi senkron yaz
+
+        Returns:
+            Yazılan kayıt ve güncelleme sayısı
+        """
+        buffers, self._buffers = self._buffers, {}
+        late_updates, self._late_updates = self._late_updates, []
+        if not buffers and not late_updates:
+            return 0
+
+        started = time.perf_counter()
+        written = 0
+        failed = False
+        for table, records in buffers.items():
+            # PostgREST bulk upsert needs the same keys in every row of a request
+            groups: Dict[Tuple[str, ...], List[Dict[str, Any]]] = {}
+            for record in records.values():
+                groups.setdefault(tuple(sorted(record)), []).append(record)
+
+            for rows in groups.values():
+                for start in range(0, len(rows), self.max_batch):
+                    chunk = rows[start:start + self.max_batch]
+                    try:
+                        self.supabase.table(table).upsert(chunk, on_conflict="id").execute()
+                    except Exception as e:
+                        failed = True
+                        logger.error(f"Failed to flush {len(chunk)} {table} records: {e}")
+                        self._requeue(table, chunk)
+                        continue
+                    written += len(chunk)
+                    for record in chunk:
+                        self._flush_failures.pop((table, record["id"]), None)
+
+        failed_updates = []
+        for table, record_id, changes in late_updates:
+            try:
+                self.supabase.table(table).update(changes).eq("id", record_id).execute()
+            except Exception as e:
+                failed = True
+                logger.error(f"Failed to apply {table} update for {record_id}: {e}")
+                failed_updates.append((table, record_id, changes))
+                continue
+            written += 1
+            self._flush_failures.pop((table, record_id, "update"), None)
+        self._requeue_updates(failed_updates)
+
+        elapsed_ms = round((time.perf_counter() - started) * 1000, 2)
+        self._metrics["records_written"] += written
+        self._metrics["flushes"] += 1
+        self._metrics["failed_flushes"] += int(failed)
+        self._metrics["last_flush_ms"] = elapsed_ms
+        self._metrics["max_flush_ms"] = max(self._metrics["max_flush_ms"] or 0, elapsed_ms)
+        self._metrics["total_flush_ms"] += elapsed_ms
+        return written
+
+    async def start(self):
+        """Zaman eşiği için flush döngüsünü başlat"""
+        if self._task is not None:
+            return
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run(), name="log-sink-flush")
+        logger.info(f"Log sink started (batch {self.max_batch}, interval {self.flush_interval}s)")
+
+    async def stop(self):
+        """Flush döngüsünü durdur ve kalan kayıtları yaz"""
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        self._wake = None
+        self.flush_now()
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Tampon derinliği, flush süreleri ve düşürülen kayıtlar"""
+        flushes = self._metrics["flushes"]
+        return {
+            "buffer_depth": self.depth,
+            "running": self._task is not None,
+            "records_buffered": self._metrics["records_buffered"],
+            "records_written": self._metrics["records_written"],
+            "records_dropped": self._metrics["records_dropped"],
+            "flushes": flushes,
+            "failed_flushes": self._metrics["failed_flushes"],
+            "last_flush_ms": self._metrics["last_flush_ms"],
+            "max_flush_ms": self._metrics["max_flush_ms"],
+            "avg_flush_ms": round(self._metrics["total_flush_ms"] / flushes, 2) if flushes else None,
+        }
+
+    def _after_write(self):
+        if self._task is None:
+            # Not started: write-through
+            self.flush_now()
+        elif self.depth >= self.max_batch:
+            self._wake.set()
+
+    def _requeue(self, table: str, rows: List[Dict[str, Any]]):
+        """Yazılamayan kayıtları bir sonraki flush için geri koy, deneme hakkı bitenleri düşür"""
+        buffer = self._buffers.setdefault(table, {})
+        for record in rows:
+            key = (table, record["id"])
+            attempts = self._flush_failures.get(key, 0) + 1
+            if attempts >= MAX_FLUSH_ATTEMPTS or self.depth >= self.max_buffer:
+                self._flush_failures.pop(key, None)
+                self._metrics["records_dropped"] += 1
+                logger.error(f"Dropped {table} record {record['id']} after {attempts} failed flushes")
+                continue
+            self._flush_failures[key] = attempts
+            # A newer version buffered meanwhile wins
+            buffer[record["id"]] = {**record, **buffer.get(record["id"], {})}
+
+    def _requeue_updates(self, updates: List[Tuple[str, str, Dict[str, Any]]]):
+        """Yazılamayan güncellemeleri, sonradan gelenlerden önce uygulanacak şekilde geri koy"""
+        requeued = []
+        for table, record_id, changes in updates:
+            key = (table, record_id, "update")
+            attempts = self._flush_failures.get(key, 0) + 1
+            if attempts >= MAX_FLUSH_ATTEMPTS or self.depth + len(requeued) >= self.max_buffer:
+                self._flush_failures.pop(key, None)
+                self._metrics["records_dropped"] += 1
+                logger.error(f"Dropped {table} update for {record_id} after {attempts} failed flushes")
+                continue
+            self._flush_failures[key] = attempts
+            requeued.append((table, record_id, changes))
+        self._late_updates[:0] = requeued
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                self.flush_now()
+            except Exception as e:
+                logger.error(f"Log sink flush failed: {e}")
+
+
+def utc_now_iso() -> str:
+    """Kaydın oluşma zamanı; flush anı değil olay anı yazılsın diye istemcide verilir"""
+    return datetime.now(timezone.utc).isoformat()
+
+
+# Global log sink instance
+log_sink = BufferedLogSink(
+    max_batch=settings.LOG_SINK_BATCH_SIZE,
+    flush_interval=settings.LOG_SINK_FLUSH_INTERVAL,
+    max_buffer=settings.LOG_SINK_MAX_BUFFER
+)
@@ -1,11 +1,23 @@
+import asyncio
 import logging
-from typing import Dict, List, Optional
+from typing import Any, Callable, Dict, List, Optional, Tuple
 from enum import Enum
 import httpx
 from app.core.config import settings
+from app.core.log_sink import log_sink, utc_now_iso
+from app.utils.ttl_cache import TTLCache
 
 logger = logging.getLogger(__name__)
 
+# Legacy FCM HTTP API accepts at most 1000 registration_ids per request
+FCM_MAX_MULTICAST = 1000
+# Per-token FCM errors after which the token will never work again
+FCM_INVALID_TOKEN_ERRORS = {"NotRegistered", "InvalidRegistration", "MismatchSenderId"}
+# Values per in_() filter on user_devices
+TOKEN_QUERY_CHUNK_SIZE = 200
+# Lookup result for a user the cache has never seen (None is a cached "no active device")
+TOKEN_MISS = object()
+
 class NotificationType(Enum):
     """
     Bildirim türleri
@@ -17,13 +29,91 @@ class NotificationType(Enum):
     WEEKLY_SUMMARY = "weekly_summary"
     MONTHLY_SUMMARY = "monthly_summary"
 
+class DeviceTokenCache:
+    """
+    user_id -> en son kullanılan aktif FCM token'ı
+
+    Cihazı olmayan kullanıcılar da None olarak önbelleğe alınır. api/v1/devices.py
+    cihaz değişikliklerinde kullanıcının kaydını siler; TTL diğer process'lerdeki
+    değişiklikler için güvenlik ağıdır.
+    """
+
+    def __init__(self, ttl_seconds: int = 600, max_entries: int = 50000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        # Kayıtlar token ile etiketlenir, budanan token'ların sahiplerini bulmak için
+        self._cache = TTLCache(ttl_seconds, max_entries, index=lambda _, token: token or None)
+
+    def get(self, user_id: Any) -> Any:
+        """Önbellekteki token, cihaz yoksa None, bilinmiyorsa TOKEN_MISS"""
+        return self._cache.get(str(user_id), TOKEN_MISS)
+
+    def put(self, user_id: Any, token: Optional[str]):
+        self._cache.put(str(user_id), token)
+
+    def invalidate(self, user_id: Any):
+        """Kullanıcının cihazları değişti (kayıt, güncelleme, devre dışı bırakma, silme)"""
+        self._cache.pop(str(user_id))
+
+    def invalidate_tokens(self, tokens: List[str]):
+        """Geçersiz token'ların sahiplerini önbellekten çıkar"""
+        for token in tokens:
+            self._cache.pop_tag(token)
+
+    def clear(self):
+        self._cache.clear()
+
+
+# Shared by NotificationService and api/v1/devices.py
+device_token_cache = DeviceTokenCache(
+    ttl_seconds=settings.DEVICE_TOKEN_CACHE_TTL,
+    max_entries=settings.DEVICE_TOKEN_CACHE_SIZE
+)
+
+
 class NotificationService:
     """
     Push notification servisi
+
+    FCM istekleri uzun ömürlü, bağlantı havuzlu tek bir httpx client ile
+    gönderilir. Toplu bildirimler registration_ids ile multicast paketlerine
+    bölünür ve en fazla max_concurrency paket aynı anda gönderilir. FCM'in
+    geçersiz dediği token'lar user_devices'ta pasif yapılır.
     """
-    def __init__(self):
+    def __init__(
+        self,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+        supabase_factory: Optional[Callable[[], Any]] = None,
+        token_cache: Optional[DeviceTokenCache] = None
+    ):
         self.fcm_server_key = settings.FCM_SERVER_KEY if hasattr(settings, 'FCM_SERVER_KEY') else None
-        self.fcm_url = "https://fcm.googleapis.com/fcm/send"
+        self.fcm_url = settings.FCM_URL
+        self.max_concurrency = max(1, settings.FCM_MAX_CONCURRENCY)
+        self.multicast_size = max(1, min(settings.FCM_MULTICAST_SIZE, FCM_MAX_MULTICAST))
+        self.token_cache = token_cache or device_token_cache
+        self._transport = transport
+        self._supabase_factory = supabase_factory or (lambda: settings.supabase_admin)
+        self._client: Optional[httpx.AsyncClient] = None
+    
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Havuzlu FCM client'ı; TLS bağlantıları istekler arasında yeniden kullanılır"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                transport=self._transport,
+                timeout=settings.FCM_TIMEOUT,
+                limits=httpx.Limits(
+                    max_connections=settings.FCM_MAX_CONNECTIONS,
+                    max_keepalive_connections=settings.FCM_MAX_CONNECTIONS
+                )
+            )
+        return self._client
+    
+    async def aclose(self):
+        """Havuzdaki bağlantıları kapat (uygulama kapanırken)"""
+        client, self._client = self._client, None
+        if client is not None:
+            await client.aclose()
     
     async def send_notification(
         self,
@@ -44,20 +134,7 @@ class NotificationService:
                 return False
             
             # Bildirim payload'ını hazırla
-            payload = {
-                "to": fcm_token,
-                "notification": {
-                    "title": title,
-                    "body": body,
-                    "sound": "default",
-                    "badge": 1
-                },
-                "data": {
-                    "type": notification_type.value,
-                    "user_id": user_id,
-                    **(data or {})
-                }
-            }
+            payload = self._build_payload(fcm_token, user_id, title, body, notification_type, data)
             
             # FCM'e gönder
             if self.fcm_server_key:
@@ -89,15 +166,96 @@ class NotificationService:
     ) -> Dict[str, bool]:
         """
         Birden fazla kullanıcıya notification gönder
+
+        Token'lar toplu sorgulanır ve aynı mesaj multicast paketleriyle
+        gönderilir; paket tüm alıcılar için aynı olduğundan data'ya user_id
+        eklenmez (token zaten kullanıcının cihazına ait).
         """
-        results = {}
+        results = {user_id: False for user_id in user_ids}
+        if not results:
+            return results
+        if not self.fcm_server_key:
+            logger.warning("FCM server key not configured")
+            return results
+        
+        tokens = await self._get_user_fcm_tokens(list(results))
+        recipients = [(user_id, token) for user_id, token in tokens.items() if token]
+        if len(recipients) < len(results):
+            logger.warning(f"No FCM token found for {len(results) - len(recipients)} of {len(results)} users")
+        
+        message = {
+            "notification": {
+                "title": title,
+                "body": body,
+                "sound": "default",
+                "badge": 1
+            },
+            "data": {
+                "type": notification_type.value,
+                **(data or {})
+            }
+        }
+        
+        semaphore = asyncio.Semaphore(self.max_concurrency)
         
-        for user_id in user_ids:
-            success = await self.send_notification(user_id, title, body, notification_type, data)
-            results[user_id] = success
+        async def dispatch(batch: List[Tuple[str, str]]):
+            async with semaphore:
+                return batch, await self._send_multicast([token for _, token in batch], message)
+        
+        batches = [
+            recipients[start:start + self.multicast_size]
+            for start in range(0, len(recipients), self.multicast_size)
+        ]
+        for batch, token_results in await asyncio.gather(*(dispatch(batch) for batch in batches)):
+            for (user_id, _), token_result in zip(batch, token_results):
+                success = "message_id" in token_result
+                results[user_id] = success
+                await self._save_notification_log(
+                    user_id, title, body, notification_type, success,
+                    error_message=token_result.get("error"), fcm_response=token_result
+                )
         
         return results
     
+    async def send_notifications(self, messages: List[Dict]) -> List[bool]:
+        """
+        Kişiye özel bildirimleri toplu gönder
+
+        Her mesaj send_notification argümanlarıdır (user_id, title, body,
+        notification_type, data). Token'lar toplu alınır ve istekler en fazla
+        max_concurrency eşzamanlı olarak havuzlu client ile gönderilir.
+
+        Returns:
+            Mesaj sırasıyla gönderim sonuçları
+        """
+        if not messages:
+            return []
+        if not self.fcm_server_key:
+            logger.warning("FCM server key not configured")
+            return [False for _ in messages]
+        
+        tokens = await self._get_user_fcm_tokens([message["user_id"] for message in messages])
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        
+        async def dispatch(message: Dict) -> bool:
+            fcm_token = tokens.get(message["user_id"])
+            if not fcm_token:
+                return False
+            
+            payload = self._build_payload(
+                fcm_token, message["user_id"], message["title"], message["body"],
+                message["notification_type"], message.get("data")
+            )
+            async with semaphore:
+                success, fcm_response = await self._send_to_fcm(payload)
+            await self._save_notification_log(
+                message["user_id"], message["title"], message["body"], message["notification_type"],
+                success, fcm_response=fcm_response
+            )
+            return success
+        
+        return list(await asyncio.gather(*(dispatch(message) for message in messages)))
+    
     async def send_receipt_notification(self, user_id: str, merchant_name: str, amount: float):
         """
         Fiş alındı bildirimi gönder
@@ -132,16 +290,19 @@ class NotificationService:
         """
         Bütçe uyarısı bildirimi gönder
         """
-        title = "Bütçe Uyarısı ⚠️"
-        body = f"{category} kategorisinde bütçenizin %{percentage:.0f}'ini harcadınız"
-        
-        await self.send_notification(
-            user_id=user_id,
-            title=title,
-            body=body,
-            notification_type=NotificationType.BUDGET_ALERT,
-            data={"category": category, "percentage": str(percentage)}
-        )
+        await self.send_notification(**self.budget_alert_message(user_id, category, percentage))
+    
+    def budget_alert_message(self, user_id: str, category: str, percentage: float) -> Dict:
+        """
+        Bütçe uyarısı mesajı (send_notification / send_notifications argümanları)
+        """
+        return {
+            "user_id": user_id,
+            "title": "Bütçe Uyarısı ⚠️",
+            "body": f"{category} kategorisinde bütçenizin %{percentage:.0f}'ini harcadınız",
+            "notification_type": NotificationType.BUDGET_ALERT,
+            "data": {"category": category, "percentage": str(percentage)}
+        }
     
     async def send_savings_tip_notification(self, user_id: str, tip: str):
         """
@@ -162,35 +323,112 @@ class NotificationService:
         """
         Haftalık özet bildirimi gönder
         """
-        title = "Haftalık Harcama Özeti 📊"
-        body = f"Bu hafta {total_spent:.2f} TL harcadınız. En çok: {top_category}"
-        
-        await self.send_notification(
-            user_id=user_id,
-            title=title,
-            body=body,
-            notification_type=NotificationType.WEEKLY_SUMMARY,
-            data={"total_spent": str(total_spent), "top_category": top_category}
-        )
+        await self.send_notification(**self.weekly_summary_message(user_id, total_spent, top_category))
+    
+    def weekly_summary_message(self, user_id: str, total_spent: float, top_category: str) -> Dict:
+        """
+        Haftalık özet mesajı (send_notification / send_notifications argümanları)
+        """
+        return {
+            "user_id": user_id,
+            "title": "Haftalık Harcama Özeti 📊",
+            "body": f"Bu hafta {total_spent:.2f} TL harcadınız. En çok: {top_category}",
+            "notification_type": NotificationType.WEEKLY_SUMMARY,
+            "data": {"total_spent": str(total_spent), "top_category": top_category}
+        }
+    
+    @staticmethod
+    def _build_payload(
+        fcm_token: str,
+        user_id: str,
+        title: str,
+        body: str,
+        notification_type: NotificationType,
+        data: Optional[Dict] = None
+    ) -> Dict:
+        """
+        Tek cihaz için FCM payload'ı
+        """
+        return {
+            "to": fcm_token,
+            "notification": {
+                "title": title,
+                "body": body,
+                "sound": "default",
+                "badge": 1
+            },
+            "data": {
+                "type": notification_type.value,
+                "user_id": user_id,
+                **(data or {})
+            }
+        }
+    
+    async def get_user_fcm_tokens(self, user_ids: List[str]) -> Dict[str, Optional[str]]:
+        """
+        Kullanıcıların FCM token'ları; cihazı olmayanlar None, sorgusu
+        başarısız olanlar sonuçta yer almaz
+        """
+        return await self._get_user_fcm_tokens(user_ids)
     
     async def _get_user_fcm_token(self, user_id: str) -> Optional[str]:
         """
         Kullanıcının FCM token'ını al
         """
+        return (await self._get_user_fcm_tokens([user_id])).get(user_id)
+    
+    async def _get_user_fcm_tokens(self, user_ids: List[str]) -> Dict[str, Optional[str]]:
+        """
+        Kullanıcıların en son kullanılan aktif FCM token'ları (yoksa None)
+        
+        Önbellekte olmayanlar user_devices'tan in_() ile toplu sorgulanır.
+        """
+        tokens: Dict[str, Optional[str]] = {}
+        missing = []
+        for user_id in dict.fromkeys(user_ids):
+            token = self.token_cache.get(user_id)
+            if token is TOKEN_MISS:
+                missing.append(user_id)
+            else:
+                tokens[user_id] = token
+        
+        if not missing:
+            return tokens
+        
         try:
-            supabase = settings.supabase_admin  # Admin client kullan
-            
-            # user_devices tablosundan aktif token al
-            result = supabase.table("user_devices").select("fcm_token").eq("user_id", user_id).eq("is_active", True).order("last_used_at", desc=True).limit(1).execute()
-            
-            if result.data:
-                return result.data[0]["fcm_token"]
+            supabase = self._supabase_factory()  # Admin client kullan
             
-            return None
+            for start in range(0, len(missing), TOKEN_QUERY_CHUNK_SIZE):
+                chunk = missing[start:start + TOKEN_QUERY_CHUNK_SIZE]
+                # user_devices tablosundan aktif token'ları al, kullanıcı başına en yenisi
+                result = supabase.table("user_devices").select("user_id, fcm_token").in_("user_id", chunk).eq("is_active", True).order("last_used_at", desc=True).execute()
+                
+                latest: Dict[str, str] = {}
+                for row in result.data or []:
+                    latest.setdefault(str(row["user_id"]), row["fcm_token"])
+                for user_id in chunk:
+                    tokens[user_id] = latest.get(str(user_id))
+                    self.token_cache.put(user_id, tokens[user_id])
             
         except Exception as e:
-            logger.error(f"Error getting FCM token for user {user_id}: {e}")
-            return None
+            logger.error(f"Error getting FCM tokens for {len(missing)} users: {e}")
+        
+        return tokens
+    
+    async def _send_multicast(self, tokens: List[str], message: Dict) -> List[Dict]:
+        """
+        Aynı mesajı birden fazla token'a tek istekle gönder
+        
+        Returns:
+            Token başına FCM sonucu ({"message_id": ...} ya da {"error": ...})
+        """
+        success, fcm_response = await self._send_to_fcm({"registration_ids": tokens, **message})
+        token_results = (fcm_response or {}).get("results")
+        if isinstance(token_results, list) and len(token_results) == len(tokens):
+            return token_results
+        
+        error = (fcm_response or {}).get("error") or "FCM multicast request failed"
+        return [{"error": error} for _ in tokens]
     
     async def _send_to_fcm(self, payload: Dict) -> tuple[bool, Optional[Dict]]:
         """
@@ -202,31 +440,52 @@ class NotificationService:
                 "Content-Type": "application/json"
             }
             
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    self.fcm_url,
-                    json=payload,
-                    headers=headers,
-                    timeout=30
-                )
-                
-                fcm_response = None
-                if response.status_code == 200:
-                    fcm_response = response.json()
-                    success = fcm_response.get("success", 0) > 0
-                    return success, fcm_response
-                else:
-                    logger.error(f"FCM request failed: {response.status_code} - {response.text}")
-                    fcm_response = {
-                        "status_code": response.status_code,
-                        "error": response.text
-                    }
-                    return False, fcm_response
+            response = await self.client.post(
+                self.fcm_url,
+                json=payload,
+                headers=headers
+            )
+            
+            fcm_response = None
+            if response.status_code == 200:
+                fcm_response = response.json()
+                success = fcm_response.get("success", 0) > 0
+                await self._prune_invalid_tokens(payload, fcm_response)
+                return success, fcm_response
+            else:
+                logger.error(f"FCM request failed: {response.status_code} - {response.text}")
+                fcm_response = {
+                    "status_code": response.status_code,
+                    "error": response.text
+                }
+                return False, fcm_response
                     
         except Exception as e:
             logger.error(f"Error sending to FCM: {e}")
             return False, {"error": str(e)}
     
+    async def _prune_invalid_tokens(self, payload: Dict, fcm_response: Dict):
+        """
+        FCM'in kalıcı olarak geçersiz dediği token'ları pasif yap
+        """
+        tokens = payload.get("registration_ids") or [payload.get("to")]
+        invalid = [
+            token for token, token_result in zip(tokens, fcm_response.get("results") or [])
+            if token and isinstance(token_result, dict) and token_result.get("error") in FCM_INVALID_TOKEN_ERRORS
+        ]
+        if not invalid:
+            return
+        
+        self.token_cache.invalidate_tokens(invalid)
+        try:
+            supabase = self._supabase_factory()
+            for start in range(0, len(invalid), TOKEN_QUERY_CHUNK_SIZE):
+                chunk = invalid[start:start + TOKEN_QUERY_CHUNK_SIZE]
+                supabase.table("user_devices").update({"is_active": False}).in_("fcm_token", chunk).execute()
+            logger.info(f"Deactivated {len(invalid)} invalid FCM tokens")
+        except Exception as e:
+            logger.error(f"Error deactivating {len(invalid)} invalid FCM tokens: {e}")
+    
     async def _save_notification_log(
         self,
         user_id: str,
@@ -241,9 +500,7 @@ class NotificationService:
         Notification logunu veritabanına kaydet
         """
         try:
-            supabase = settings.supabase_admin
-            
-            # notification_logs tablosuna kaydet
+            # notification_logs tablosuna tamponlu yaz (toplu upsert)
             log_data = {
                 "user_id": user_id,
                 "title": title,
@@ -251,15 +508,11 @@ class NotificationService:
                 "notification_type": notification_type.value,
                 "success": success,
                 "error_message": error_message,
-                "fcm_response": fcm_response
+                "fcm_response": fcm_response,
+                "sent_at": utc_now_iso()
             }
             
-            result = supabase.table("notification_logs").insert(log_data).execute()
-            
-            if result.data:
-                logger.info(f"Notification log saved for user {user_id}")
-            else:
-                logger.warning(f"Failed to save notification log for user {user_id}")
+            log_sink.add("notification_logs", log_data)
             
         except Exception as e:
             logger.error(f"Error saving notification log: {e}")
@@ -18,6 +18,16 @@ try:
 except ImportError:
     GlobalInflationService = None
 
+try:
+    from app.services.system_metrics_service import system_metrics_service
+except ImportError:
+    system_metrics_service = None
+
+try:
+    from app.services.notification_digest_service import notification_digest_service
+except ImportError:
+    notification_digest_service = None
+
 logger = logging.getLogger(__name__)
 
 class TaskScheduler:
@@ -95,7 +105,8 @@ class TaskScheduler:
         self.add_task(
             "update_loyalty_levels",
             self._update_loyalty_levels,
-            interval_minutes=24 * 60  # 24 saat
+            interval_minutes=24 * 60,  # 24 saat
+            run_immediately=True  # Eşikler deploy ile değiştiyse hemen uygula
         )
         
         # Eski webhook loglarını temizle (haftalık)
@@ -119,6 +130,24 @@ class TaskScheduler:
             interval_minutes=60  # 1 saat
         )
         
+        # /health/metrics snapshot'ını yenile
+        self.add_task(
+            "refresh_system_metrics",
+            self._refresh_system_metrics,
+            interval_minutes=settings.METRICS_REFRESH_INTERVAL_MINUTES,
+            run_immediately=True
+        )
+        
+        # Haftalık özet bildirimleri; hafta tamamlandıysa no-op, yarıda kaldıysa
+        # checkpoint'ten devam eder. Bütçe uyarıları harcama yazıldığında
+        # BudgetThresholdService tarafından gönderilir.
+        self.add_task(
+            "send_weekly_summaries",
+            self._send_weekly_summaries,
+            interval_minutes=settings.NOTIFICATION_DIGEST_INTERVAL_MINUTES,
+            run_immediately=True
+        )
+        
         # Aylık enflasyon hesaplama (haftalık - Pazar gecesi 3:00)
         self.add_task(
             "calculate_monthly_inflation",
@@ -130,15 +159,17 @@ class TaskScheduler:
     async def _update_loyalty_levels(self):
         """
         Tüm kullanıcıların loyalty seviyelerini güncelle
+        
+        Tek bir set-based UPDATE; seviye eşikleri son çalışmadan beri
+        değişmediyse veritabanında no-op'tur.
         """
         try:
-            logger.info("Loyalty levels update task started")
-            
-            # TODO: Implement loyalty level update logic if needed
-            # Currently loyalty levels are automatically calculated 
-            # when points are awarded, so this may not be necessary
+            if not self.loyalty_service:
+                logger.warning("LoyaltyService not available, skipping loyalty levels update")
+                return
             
-            logger.info("Loyalty levels update completed")
+            updated = await self.loyalty_service.recompute_levels()
+            logger.info(f"Loyalty levels update completed: {updated} users changed level")
         except Exception as e:
             logger.error(f"Error updating loyalty levels: {e}")
     
@@ -202,6 +233,31 @@ class TaskScheduler:
         except Exception as e:
             logger.error(f"System health check failed: {e}")
 
+    async def _refresh_system_metrics(self):
+        """
+        /health/metrics için metrik snapshot'ını yenile
+        """
+        try:
+            if system_metrics_service:
+                await system_metrics_service.refresh()
+            else:
+                logger.warning("SystemMetricsService not available, skipping metrics refresh")
+        except Exception as e:
+            logger.error(f"Error refreshing system metrics: {e}")
+
+    async def _send_weekly_summaries(self):
+        """
+        Geçen haftanın harcama özetini tüm aktif kullanıcılara gönder
+        """
+        try:
+            if notification_digest_service:
+                result = await notification_digest_service.send_weekly_summaries()
+                logger.info(f"Weekly summaries: {result}")
+            else:
+                logger.warning("NotificationDigestService not available, skipping weekly summaries")
+        except Exception as e:
+            logger.error(f"Error sending weekly summaries: {e}")
+
     async def _calculate_monthly_inflation(self):
         """
         Aylık ürün enflasyonunu hesapla ve veritabanına kaydet (aydan aya değişim)
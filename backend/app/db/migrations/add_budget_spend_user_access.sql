@@ -0,0 +1,11 @@
+-- History-based budget allocation
+-- BudgetService.allocate_from_history reads a user's monthly per-category totals from
+-- budget_category_spend with the user's own client, so users may read their rows.
+-- The primary key (user_id, category_id, year, month) serves the per-user range query.
+-- Requires add_budget_threshold_engine.sql.
+
+DROP POLICY IF EXISTS "Users can view their own budget category spend" ON budget_category_spend;
+
+CREATE POLICY "Users can view their own budget category spend"
+    ON budget_category_spend FOR SELECT
+    USING (auth.uid() = user_id);
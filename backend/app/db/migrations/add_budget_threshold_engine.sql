@@ -0,0 +1,229 @@
+-- Real-time budget threshold engine
+-- Month-to-date spending per user, category and month is kept in budget_category_spend
+-- by triggers on expense_items and expenses, so every write only adds its delta to one
+-- row. When the new total crosses 50, 80 or 100 percent of the category's monthly_limit
+-- a row is written to budget_threshold_events; the unique key makes each threshold fire
+-- once per month. BudgetThresholdService claims pending events in the background and
+-- sends the notifications, so nothing is sent on the request path.
+-- Requires restructure_expenses.sql and add_monthly_budget_support.sql.
+
+CREATE TABLE IF NOT EXISTS budget_category_spend (
+    user_id UUID NOT NULL,
+    category_id UUID NOT NULL,
+    year SMALLINT NOT NULL,
+    month SMALLINT NOT NULL,
+    spent NUMERIC NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+    PRIMARY KEY (user_id, category_id, year, month)
+);
+
+CREATE TABLE IF NOT EXISTS budget_threshold_events (
+    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    user_id UUID NOT NULL,
+    category_id UUID NOT NULL,
+    year SMALLINT NOT NULL,
+    month SMALLINT NOT NULL,
+    threshold SMALLINT NOT NULL,
+    percentage NUMERIC NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending'
+        CHECK (status IN ('pending', 'processing', 'sent')),
+    delivered BOOLEAN,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    locked_at TIMESTAMP WITH TIME ZONE,
+    sent_at TIMESTAMP WITH TIME ZONE,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+    CONSTRAINT budget_threshold_events_once_key UNIQUE (user_id, category_id, year, month, threshold)
+);
+
+ALTER TABLE budget_category_spend ENABLE ROW LEVEL SECURITY;
+ALTER TABLE budget_threshold_events ENABLE ROW LEVEL SECURITY;
+
+DROP POLICY IF EXISTS "Service role can manage budget category spend" ON budget_category_spend;
+CREATE POLICY "Service role can manage budget category spend"
+    ON budget_category_spend FOR ALL
+    USING (auth.role() = 'service_role')
+    WITH CHECK (auth.role() = 'service_role');
+
+DROP POLICY IF EXISTS "Service role can manage budget threshold events" ON budget_threshold_events;
+CREATE POLICY "Service role can manage budget threshold events"
+    ON budget_threshold_events FOR ALL
+    USING (auth.role() = 'service_role')
+    WITH CHECK (auth.role() = 'service_role');
+
+-- The worker only looks at unsent events, oldest first
+CREATE INDEX IF NOT EXISTS idx_budget_threshold_events_pending
+    ON budget_threshold_events(created_at)
+    WHERE status IN ('pending', 'processing');
+
+-- Limit lookup for one user, month and category
+CREATE INDEX IF NOT EXISTS idx_user_budgets_user_year_month
+    ON user_budgets(user_id, year, month);
+
+-- Add p_delta to one month's category total and record the thresholds it crossed upwards
+CREATE OR REPLACE FUNCTION public.apply_budget_spend_delta(
+    p_user_id UUID,
+    p_category_id UUID,
+    p_expense_date TIMESTAMP WITH TIME ZONE,
+    p_delta NUMERIC
+)
+RETURNS VOID AS $$
+DECLARE
+    v_year SMALLINT;
+    v_month SMALLINT;
+    v_new NUMERIC;
+    v_old NUMERIC;
+    v_limit NUMERIC;
+    v_threshold SMALLINT;
+BEGIN
+    IF p_user_id IS NULL OR p_category_id IS NULL OR p_expense_date IS NULL
+       OR COALESCE(p_delta, 0) = 0 THEN
+        RETURN;
+    END IF;
+
+    v_year := EXTRACT(YEAR FROM p_expense_date);
+    v_month := EXTRACT(MONTH FROM p_expense_date);
+
+    INSERT INTO budget_category_spend AS s (user_id, category_id, year, month, spent, updated_at)
+    VALUES (p_user_id, p_category_id, v_year, v_month, p_delta, now())
+    ON CONFLICT (user_id, category_id, year, month)
+    DO UPDATE SET spent = s.spent + EXCLUDED.spent, updated_at = now()
+    RETURNING spent INTO v_new;
+
+    IF p_delta < 0 THEN
+        RETURN;
+    END IF;
+    v_old := v_new - p_delta;
+
+    SELECT bc.monthly_limit INTO v_limit
+    FROM user_budgets ub
+    JOIN budget_categories bc ON bc.user_budget_id = ub.id AND bc.category_id = p_category_id
+    WHERE ub.user_id = p_user_id AND ub.year = v_year AND ub.month = v_month
+      AND bc.is_active = true;
+
+    IF v_limit IS NULL OR v_limit <= 0 THEN
+        RETURN;
+    END IF;
+
+    FOREACH v_threshold IN ARRAY ARRAY[50, 80, 100]::SMALLINT[] LOOP
+        IF v_old * 100 < v_limit * v_threshold AND v_new * 100 >= v_limit * v_threshold THEN
+            INSERT INTO budget_threshold_events (user_id, category_id, year, month, threshold, percentage)
+            VALUES (p_user_id, p_category_id, v_year, v_month, v_threshold, round(v_new * 100 / v_limit, 1))
+            ON CONFLICT ON CONSTRAINT budget_threshold_events_once_key DO NOTHING;
+        END IF;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+-- Item writes: the parent expense gives the month. When the expense itself is being
+-- deleted (cascade) it is already gone here and track_budget_spend_expense has
+-- subtracted its items.
+CREATE OR REPLACE FUNCTION public.track_budget_spend_item()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_date TIMESTAMP WITH TIME ZONE;
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        SELECT expense_date INTO v_date FROM expenses WHERE id = OLD.expense_id;
+        PERFORM apply_budget_spend_delta(OLD.user_id, OLD.category_id, v_date, -OLD.amount);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        IF TG_OP = 'INSERT' OR NEW.expense_id IS DISTINCT FROM OLD.expense_id THEN
+            SELECT expense_date INTO v_date FROM expenses WHERE id = NEW.expense_id;
+        END IF;
+        PERFORM apply_budget_spend_delta(NEW.user_id, NEW.category_id, v_date, NEW.amount);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+-- Expense writes: a deleted expense takes its items' amounts with it, a changed
+-- expense_date moves them to the new month
+CREATE OR REPLACE FUNCTION public.track_budget_spend_expense()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_item RECORD;
+BEGIN
+    FOR v_item IN
+        SELECT user_id, category_id, sum(amount) AS amount
+        FROM expense_items
+        WHERE expense_id = OLD.id AND category_id IS NOT NULL
+        GROUP BY user_id, category_id
+    LOOP
+        PERFORM apply_budget_spend_delta(v_item.user_id, v_item.category_id, OLD.expense_date, -v_item.amount);
+        IF TG_OP = 'UPDATE' THEN
+            PERFORM apply_budget_spend_delta(v_item.user_id, v_item.category_id, NEW.expense_date, v_item.amount);
+        END IF;
+    END LOOP;
+    IF TG_OP = 'DELETE' THEN
+        RETURN OLD;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+DROP TRIGGER IF EXISTS track_budget_spend_item ON expense_items;
+CREATE TRIGGER track_budget_spend_item
+    AFTER INSERT OR DELETE OR UPDATE OF amount, category_id, expense_id, user_id ON expense_items
+    FOR EACH ROW EXECUTE FUNCTION public.track_budget_spend_item();
+
+DROP TRIGGER IF EXISTS track_budget_spend_expense_delete ON expenses;
+CREATE TRIGGER track_budget_spend_expense_delete
+    BEFORE DELETE ON expenses
+    FOR EACH ROW EXECUTE FUNCTION public.track_budget_spend_expense();
+
+DROP TRIGGER IF EXISTS track_budget_spend_expense_date ON expenses;
+CREATE TRIGGER track_budget_spend_expense_date
+    AFTER UPDATE OF expense_date ON expenses
+    FOR EACH ROW
+    WHEN (OLD.expense_date IS DISTINCT FROM NEW.expense_date)
+    EXECUTE FUNCTION public.track_budget_spend_expense();
+
+-- Seed the running totals from existing expenses; no events are raised for the past
+INSERT INTO budget_category_spend (user_id, category_id, year, month, spent)
+SELECT ei.user_id, ei.category_id,
+       EXTRACT(YEAR FROM e.expense_date), EXTRACT(MONTH FROM e.expense_date),
+       sum(ei.amount)
+FROM expense_items ei
+JOIN expenses e ON e.id = ei.expense_id
+WHERE ei.category_id IS NOT NULL AND e.expense_date IS NOT NULL
+GROUP BY 1, 2, 3, 4
+ON CONFLICT (user_id, category_id, year, month) DO UPDATE SET spent = EXCLUDED.spent, updated_at = now();
+
+-- Claim up to p_limit events for the notification worker, with the category name.
+-- Events left in 'processing' longer than p_lease_seconds (crashed worker or failed send) are claimed again.
+DROP FUNCTION IF EXISTS public.claim_budget_threshold_events(INTEGER, INTEGER);
+CREATE OR REPLACE FUNCTION public.claim_budget_threshold_events(p_limit INTEGER, p_lease_seconds INTEGER)
+RETURNS TABLE (id UUID, user_id UUID, category_id UUID, category_name TEXT, threshold SMALLINT, percentage NUMERIC, attempts INTEGER) AS $$
+BEGIN
+    RETURN QUERY
+    WITH claimed AS (
+        UPDATE budget_threshold_events ev
+        SET status = 'processing',
+            attempts = ev.attempts + 1,
+            locked_at = now()
+        WHERE ev.id IN (
+            SELECT pe.id FROM budget_threshold_events pe
+            WHERE pe.status = 'pending'
+               OR (pe.status = 'processing' AND pe.locked_at < now() - make_interval(secs => p_lease_seconds))
+            ORDER BY pe.created_at
+            LIMIT p_limit
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING ev.id, ev.user_id, ev.category_id, ev.threshold, ev.percentage, ev.attempts, ev.created_at
+    )
+    SELECT c.id, c.user_id, c.category_id, cat.name, c.threshold, c.percentage, c.attempts
+    FROM claimed c
+    LEFT JOIN categories cat ON cat.id = c.category_id
+    ORDER BY c.created_at;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+-- Threshold events replace the weekly budget alert scan
+DROP FUNCTION IF EXISTS public.get_budget_alert_candidates(INTEGER, INTEGER, NUMERIC, UUID, INTEGER);
+
+REVOKE ALL ON FUNCTION public.apply_budget_spend_delta(UUID, UUID, TIMESTAMP WITH TIME ZONE, NUMERIC) FROM PUBLIC;
+REVOKE ALL ON FUNCTION public.claim_budget_threshold_events(INTEGER, INTEGER) FROM PUBLIC;
+GRANT EXECUTE ON FUNCTION public.claim_budget_threshold_events(INTEGER, INTEGER) TO service_role;
+
+COMMENT ON TABLE budget_category_spend IS 'Running month-to-date spending per user and category, maintained by expense triggers';
+COMMENT ON TABLE budget_threshold_events IS 'Budget threshold crossings (50/80/100%), at most one per user, category, month and threshold';
@@ -0,0 +1,84 @@
+-- Atomic claim of a public receipt in a single round trip
+-- Replaces the select/update/update/select/update sequence in POST /receipts/scan.
+-- The receipt row is locked with FOR UPDATE, so when two users scan the same QR
+-- concurrently only the first transaction claims it; the second sees user_id set.
+
+CREATE OR REPLACE FUNCTION public.claim_public_receipt(p_receipt_id UUID)
+RETURNS JSONB AS $$
+DECLARE
+    v_user_id UUID := auth.uid();
+    v_receipt receipts%ROWTYPE;
+    v_expense_ids UUID[];
+    v_uncategorized_items INTEGER := 0;
+BEGIN
+    IF v_user_id IS NULL THEN
+        RAISE EXCEPTION 'claim_public_receipt requires an authenticated user'
+            USING ERRCODE = '28000';
+    END IF;
+
+    SELECT * INTO v_receipt FROM receipts WHERE id = p_receipt_id FOR UPDATE;
+
+    IF NOT FOUND THEN
+        RETURN jsonb_build_object('status', 'not_found');
+    END IF;
+
+    -- Scanning your own receipt again: report it, change nothing
+    IF v_receipt.user_id = v_user_id THEN
+        SELECT array_agg(id) INTO v_expense_ids FROM expenses WHERE receipt_id = p_receipt_id;
+
+        RETURN jsonb_build_object(
+            'status', 'owned',
+            'receipt_id', v_receipt.id,
+            'merchant_name', v_receipt.merchant_name,
+            'total_amount', v_receipt.total_amount,
+            'currency', v_receipt.currency,
+            'expense_ids', to_jsonb(COALESCE(v_expense_ids, '{}'::UUID[]))
+        );
+    END IF;
+
+    IF v_receipt.user_id IS NOT NULL OR NOT COALESCE(v_receipt.is_public, FALSE) THEN
+        RETURN jsonb_build_object('status', 'claimed_by_other');
+    END IF;
+
+    IF v_receipt.expires_at IS NOT NULL AND v_receipt.expires_at < now() THEN
+        RETURN jsonb_build_object('status', 'expired');
+    END IF;
+
+    -- Transfer ownership of receipt, expenses and items
+    UPDATE receipts
+    SET user_id = v_user_id, is_public = FALSE, expires_at = NULL
+    WHERE id = p_receipt_id;
+
+    WITH claimed_expenses AS (
+        UPDATE expenses SET user_id = v_user_id
+        WHERE receipt_id = p_receipt_id
+        RETURNING id
+    )
+    SELECT array_agg(id) INTO v_expense_ids FROM claimed_expenses;
+
+    IF v_expense_ids IS NOT NULL THEN
+        UPDATE expense_items SET user_id = v_user_id
+        WHERE expense_id = ANY(v_expense_ids);
+
+        SELECT count(*) INTO v_uncategorized_items
+        FROM expense_items
+        WHERE expense_id = ANY(v_expense_ids) AND category_id IS NULL;
+    END IF;
+
+    RETURN jsonb_build_object(
+        'status', 'claimed',
+        'receipt_id', v_receipt.id,
+        'merchant_name', v_receipt.merchant_name,
+        'total_amount', v_receipt.total_amount,
+        'currency', v_receipt.currency,
+        'expense_ids', to_jsonb(COALESCE(v_expense_ids, '{}'::UUID[])),
+        'uncategorized_items', v_uncategorized_items
+    );
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+REVOKE ALL ON FUNCTION public.claim_public_receipt(UUID) FROM PUBLIC;
+GRANT EXECUTE ON FUNCTION public.claim_public_receipt(UUID) TO authenticated;
+
+COMMENT ON FUNCTION public.claim_public_receipt(UUID) IS
+    'Atomically claims an unclaimed, unexpired public receipt (and its expenses/items) for auth.uid(). Returns status: claimed, owned, claimed_by_other, expired or not_found';
@@ -0,0 +1,4 @@
+-- Index created_at on expenses and receipts so the last-24h activity counts
+-- used by /health/metrics are range scans instead of full table scans
+CREATE INDEX IF NOT EXISTS idx_expenses_created_at ON expenses(created_at);
+CREATE INDEX IF NOT EXISTS idx_receipts_created_at ON receipts(created_at);
@@ -0,0 +1,117 @@
+-- Atomic loyalty point accrual
+-- award_points_for_expense used to read loyalty_status twice, update it and insert into
+-- loyalty_transactions in separate requests, so two expenses landing at once could lose
+-- points. accrue_loyalty_points does the whole accrual for any number of expenses in one
+-- transaction: the status row is created if missing and locked, the level bonus is taken
+-- from the level at that moment, points and level are updated and the transaction row is
+-- written.
+--
+-- p_accruals: [{idx, user_id, expense_id, amount, base_points, category_bonus, category,
+--               merchant_name, calculation_details}, ...]
+-- p_levels:   [{level, min_points, multiplier}, ...] (LoyaltyService rules)
+-- Returns one object per accrual, ordered by idx.
+
+CREATE OR REPLACE FUNCTION public.accrue_loyalty_points(p_accruals JSONB, p_levels JSONB)
+RETURNS JSONB AS $$
+DECLARE
+    v_accrual JSONB;
+    v_user_id UUID;
+    v_previous INTEGER;
+    v_previous_level TEXT;
+    v_multiplier NUMERIC;
+    v_base INTEGER;
+    v_level_bonus INTEGER;
+    v_category_bonus INTEGER;
+    v_points INTEGER;
+    v_new INTEGER;
+    v_new_level TEXT;
+    v_details JSONB;
+    v_transaction_id UUID;
+    v_results JSONB := '[]'::JSONB;
+BEGIN
+    -- Lock rows in user_id order so concurrent batches cannot deadlock
+    FOR v_accrual IN
+        SELECT a.value
+        FROM jsonb_array_elements(p_accruals) AS a(value)
+        ORDER BY a.value->>'user_id', (a.value->>'idx')::INTEGER
+    LOOP
+        v_user_id := (v_accrual->>'user_id')::UUID;
+
+        INSERT INTO loyalty_status (user_id, points, level, last_updated)
+        VALUES (v_user_id, 0, (SELECT l->>'level' FROM jsonb_array_elements(p_levels) l ORDER BY (l->>'min_points')::INTEGER LIMIT 1), now())
+        ON CONFLICT (user_id) DO NOTHING;
+
+        SELECT points INTO v_previous FROM loyalty_status WHERE user_id = v_user_id FOR UPDATE;
+
+        SELECT l->>'level', (l->>'multiplier')::NUMERIC
+        INTO v_previous_level, v_multiplier
+        FROM jsonb_array_elements(p_levels) l
+        WHERE (l->>'min_points')::INTEGER <= v_previous
+        ORDER BY (l->>'min_points')::INTEGER DESC
+        LIMIT 1;
+
+        v_base := COALESCE((v_accrual->>'base_points')::INTEGER, 0);
+        v_category_bonus := COALESCE((v_accrual->>'category_bonus')::INTEGER, 0);
+        v_level_bonus := trunc(v_base * (COALESCE(v_multiplier, 1) - 1));
+        v_points := v_base + v_level_bonus + v_category_bonus;
+        v_new := v_previous + v_points;
+
+        SELECT l->>'level' INTO v_new_level
+        FROM jsonb_array_elements(p_levels) l
+        WHERE (l->>'min_points')::INTEGER <= v_new
+        ORDER BY (l->>'min_points')::INTEGER DESC
+        LIMIT 1;
+
+        UPDATE loyalty_status
+        SET points = v_new, level = v_new_level, last_updated = now()
+        WHERE user_id = v_user_id;
+
+        v_details := COALESCE(v_accrual->'calculation_details', '{}'::JSONB) || jsonb_build_object(
+            'current_level', v_previous_level,
+            'level_multiplier', v_multiplier,
+            'level_bonus', v_level_bonus
+        );
+
+        INSERT INTO loyalty_transactions (
+            user_id, expense_id, points_earned, transaction_amount, merchant_name, category,
+            calculation_details, transaction_type, created_at
+        )
+        VALUES (
+            v_user_id,
+            (v_accrual->>'expense_id')::UUID,
+            v_points,
+            (v_accrual->>'amount')::NUMERIC,
+            v_accrual->>'merchant_name',
+            v_accrual->>'category',
+            v_details,
+            'expense',
+            now()
+        )
+        RETURNING id INTO v_transaction_id;
+
+        v_results := v_results || jsonb_build_object(
+            'idx', (v_accrual->>'idx')::INTEGER,
+            'user_id', v_user_id,
+            'points_awarded', v_points,
+            'previous_total', v_previous,
+            'new_total', v_new,
+            'previous_level', v_previous_level,
+            'new_level', v_new_level,
+            'calculation_details', v_details,
+            'transaction_id', v_transaction_id
+        );
+    END LOOP;
+
+    RETURN COALESCE((
+        SELECT jsonb_agg(r.value ORDER BY (r.value->>'idx')::INTEGER)
+        FROM jsonb_array_elements(v_results) AS r(value)
+    ), '[]'::JSONB);
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+REVOKE ALL ON FUNCTION public.accrue_loyalty_points(JSONB, JSONB) FROM PUBLIC;
+GRANT EXECUTE ON FUNCTION public.accrue_loyalty_points(JSONB, JSONB) TO service_role;
+
+-- Loyalty history is read per user, newest first
+CREATE INDEX IF NOT EXISTS idx_loyalty_transactions_user_created
+    ON loyalty_transactions(user_id, created_at DESC);
@@ -0,0 +1,61 @@
+-- Set-based loyalty level recomputation
+-- TaskScheduler._update_loyalty_levels calls recompute_loyalty_levels with LoyaltyService's
+-- level rules. The last applied rules are kept in loyalty_level_rules; when they are
+-- unchanged the call is a no-op, otherwise every loyalty_status row whose level differs
+-- from the one its points now map to is fixed in a single UPDATE.
+-- Requires init.sql (loyalty_status).
+
+CREATE TABLE IF NOT EXISTS loyalty_level_rules (
+    id BOOLEAN PRIMARY KEY DEFAULT true CHECK (id),
+    rules JSONB NOT NULL,
+    applied_at TIMESTAMP WITH TIME ZONE DEFAULT now()
+);
+
+ALTER TABLE loyalty_level_rules ENABLE ROW LEVEL SECURITY;
+
+DROP POLICY IF EXISTS "Service role can manage loyalty level rules" ON loyalty_level_rules;
+CREATE POLICY "Service role can manage loyalty level rules"
+    ON loyalty_level_rules FOR ALL
+    USING (auth.role() = 'service_role')
+    WITH CHECK (auth.role() = 'service_role');
+
+-- p_levels: [{level, min_points, multiplier}, ...]
+-- Returns the number of rows whose level changed (0 if the rules are unchanged and not p_force)
+CREATE OR REPLACE FUNCTION public.recompute_loyalty_levels(p_levels JSONB, p_force BOOLEAN DEFAULT false)
+RETURNS INTEGER AS $$
+DECLARE
+    v_updated INTEGER;
+BEGIN
+    IF NOT p_force AND EXISTS (SELECT 1 FROM loyalty_level_rules WHERE rules = p_levels) THEN
+        RETURN 0;
+    END IF;
+
+    WITH levels AS (
+        SELECT l->>'level' AS level, (l->>'min_points')::INTEGER AS min_points
+        FROM jsonb_array_elements(p_levels) l
+    ),
+    target AS (
+        SELECT s.user_id,
+               (SELECT lv.level FROM levels lv WHERE lv.min_points <= s.points
+                ORDER BY lv.min_points DESC LIMIT 1) AS level
+        FROM loyalty_status s
+    )
+    UPDATE loyalty_status s
+    SET level = t.level, last_updated = now()
+    FROM target t
+    WHERE s.user_id = t.user_id AND s.level IS DISTINCT FROM t.level;
+
+    GET DIAGNOSTICS v_updated = ROW_COUNT;
+
+    INSERT INTO loyalty_level_rules (id, rules, applied_at)
+    VALUES (true, p_levels, now())
+    ON CONFLICT (id) DO UPDATE SET rules = EXCLUDED.rules, applied_at = EXCLUDED.applied_at;
+
+    RETURN v_updated;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+REVOKE ALL ON FUNCTION public.recompute_loyalty_levels(JSONB, BOOLEAN) FROM PUBLIC;
+GRANT EXECUTE ON FUNCTION public.recompute_loyalty_levels(JSONB, BOOLEAN) TO service_role;
+
+COMMENT ON TABLE loyalty_level_rules IS 'Level thresholds last applied by recompute_loyalty_levels';
@@ -0,0 +1,114 @@
+-- Weekly summary notification fan-out
+-- NotificationDigestService walks users with an active device in user_id order, one page
+-- at a time; each page's totals are computed here with set-based aggregates instead of
+-- one expenses query per user. Progress is checkpointed in notification_job_runs after
+-- every page, so an interrupted run resumes after the last processed user. A run holds
+-- a lease on its job period (acquire_notification_job_lease) that it extends with every
+-- checkpoint, so several app processes never send the same period at the same time.
+-- Requires add_user_devices.sql.
+
+CREATE TABLE IF NOT EXISTS notification_job_runs (
+    job_name TEXT NOT NULL,
+    period_key TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'running'
+        CHECK (status IN ('running', 'completed')),
+    last_user_id UUID,
+    users_processed INTEGER NOT NULL DEFAULT 0,
+    notifications_sent INTEGER NOT NULL DEFAULT 0,
+    notifications_failed INTEGER NOT NULL DEFAULT 0,
+    started_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+    completed_at TIMESTAMP WITH TIME ZONE,
+    PRIMARY KEY (job_name, period_key)
+);
+
+-- Run lease: only locked_by writes checkpoints until locked_until
+ALTER TABLE notification_job_runs
+    ADD COLUMN IF NOT EXISTS locked_by TEXT,
+    ADD COLUMN IF NOT EXISTS locked_until TIMESTAMP WITH TIME ZONE;
+
+ALTER TABLE notification_job_runs ENABLE ROW LEVEL SECURITY;
+
+DROP POLICY IF EXISTS "Service role can manage notification job runs" ON notification_job_runs;
+CREATE POLICY "Service role can manage notification job runs"
+    ON notification_job_runs FOR ALL
+    USING (auth.role() = 'service_role')
+    WITH CHECK (auth.role() = 'service_role');
+
+-- Keyset pages over users with an active device
+CREATE INDEX IF NOT EXISTS idx_user_devices_active_user
+    ON user_devices(user_id)
+    WHERE is_active = true;
+
+-- Per-user expense windows
+CREATE INDEX IF NOT EXISTS idx_expenses_user_expense_date
+    ON expenses(user_id, expense_date);
+
+-- Last week's spending for the next p_limit users after p_after (NULL: from the start).
+-- Every user of the page is returned, with total_spent = 0 if nothing was spent, so the
+-- caller can advance its cursor past them.
+CREATE OR REPLACE FUNCTION public.get_weekly_spending_summaries(
+    p_start TIMESTAMP WITH TIME ZONE,
+    p_end TIMESTAMP WITH TIME ZONE,
+    p_after UUID,
+    p_limit INTEGER
+)
+RETURNS TABLE (user_id UUID, total_spent NUMERIC, top_category TEXT) AS $$
+    WITH page AS (
+        SELECT DISTINCT d.user_id
+        FROM user_devices d
+        WHERE d.is_active = true
+          AND (p_after IS NULL OR d.user_id > p_after)
+        ORDER BY d.user_id
+        LIMIT p_limit
+    ),
+    totals AS (
+        SELECT e.user_id, sum(e.total_amount) AS total_spent
+        FROM expenses e
+        JOIN page p ON p.user_id = e.user_id
+        WHERE e.expense_date >= p_start AND e.expense_date < p_end
+        GROUP BY e.user_id
+    ),
+    top_categories AS (
+        SELECT DISTINCT ON (ei.user_id) ei.user_id, c.name
+        FROM expense_items ei
+        JOIN expenses e ON e.id = ei.expense_id
+        JOIN page p ON p.user_id = ei.user_id
+        LEFT JOIN categories c ON c.id = ei.category_id
+        WHERE e.expense_date >= p_start AND e.expense_date < p_end
+        GROUP BY ei.user_id, c.name
+        ORDER BY ei.user_id, sum(ei.amount) DESC
+    )
+    SELECT p.user_id, COALESCE(t.total_spent, 0), tc.name
+    FROM page p
+    LEFT JOIN totals t ON t.user_id = p.user_id
+    LEFT JOIN top_categories tc ON tc.user_id = p.user_id
+    ORDER BY p.user_id
+$$ LANGUAGE sql STABLE SECURITY DEFINER SET search_path = public;
+
+-- Take the lease of one job period for p_owner and return its checkpoint row. Nothing is
+-- returned if the period is completed or another run holds an unexpired lease.
+CREATE OR REPLACE FUNCTION public.acquire_notification_job_lease(
+    p_job_name TEXT,
+    p_period_key TEXT,
+    p_owner TEXT,
+    p_lease_seconds INTEGER
+)
+RETURNS SETOF notification_job_runs AS $$
+    INSERT INTO notification_job_runs AS r (job_name, period_key, locked_by, locked_until)
+    VALUES (p_job_name, p_period_key, p_owner, now() + make_interval(secs => p_lease_seconds))
+    ON CONFLICT (job_name, period_key) DO UPDATE
+    SET locked_by = EXCLUDED.locked_by,
+        locked_until = EXCLUDED.locked_until,
+        updated_at = now()
+    WHERE r.status <> 'completed'
+      AND (r.locked_until IS NULL OR r.locked_until < now() OR r.locked_by = p_owner)
+    RETURNING r.*
+$$ LANGUAGE sql VOLATILE SECURITY DEFINER SET search_path = public;
+
+REVOKE ALL ON FUNCTION public.get_weekly_spending_summaries(TIMESTAMP WITH TIME ZONE, TIMESTAMP WITH TIME ZONE, UUID, INTEGER) FROM PUBLIC;
+GRANT EXECUTE ON FUNCTION public.get_weekly_spending_summaries(TIMESTAMP WITH TIME ZONE, TIMESTAMP WITH TIME ZONE, UUID, INTEGER) TO service_role;
+REVOKE ALL ON FUNCTION public.acquire_notification_job_lease(TEXT, TEXT, TEXT, INTEGER) FROM PUBLIC;
+GRANT EXECUTE ON FUNCTION public.acquire_notification_job_lease(TEXT, TEXT, TEXT, INTEGER) TO service_role;
+
+COMMENT ON TABLE notification_job_runs IS 'Checkpoint of notification fan-out runs: one row per job and period, last_user_id is the resume cursor';
@@ -0,0 +1,11 @@
+-- Indexes for batched customer matching
+-- CustomerMatchingService looks up active payment methods with card_hash IN (...) and
+-- stores them with one upsert ON CONFLICT (user_id, card_hash) DO NOTHING, which needs
+-- a unique index on that pair (the PRD's UNIQUE constraint; created here if missing).
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_user_payment_methods_user_card
+    ON user_payment_methods(user_id, card_hash);
+
+CREATE INDEX IF NOT EXISTS idx_user_payment_methods_active_card_hash
+    ON user_payment_methods(card_hash)
+    WHERE is_active = true;
@@ -0,0 +1,65 @@
+-- Durable queue for accept-fast merchant webhooks
+-- POST /webhooks/merchant/{id}/transaction persists the payload here and returns 202;
+-- worker coroutines claim rows in batches and run the normal processing pipeline.
+-- (merchant_id, transaction_id) is unique, so POS retries of the same transaction
+-- are answered from the existing row instead of creating duplicate receipts.
+
+CREATE TABLE IF NOT EXISTS webhook_queue (
+    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    merchant_id UUID NOT NULL REFERENCES merchants(id) ON DELETE CASCADE,
+    transaction_id TEXT NOT NULL,
+    payload JSONB NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued'
+        CHECK (status IN ('queued', 'processing', 'done', 'failed')),
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result JSONB,
+    error_message TEXT,
+    locked_at TIMESTAMP WITH TIME ZONE,
+    processed_at TIMESTAMP WITH TIME ZONE,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+    CONSTRAINT webhook_queue_merchant_transaction_key UNIQUE (merchant_id, transaction_id)
+);
+
+ALTER TABLE webhook_queue ENABLE ROW LEVEL SECURITY;
+
+DROP POLICY IF EXISTS "Service role can manage webhook queue" ON webhook_queue;
+CREATE POLICY "Service role can manage webhook queue"
+    ON webhook_queue FOR ALL
+    USING (auth.role() = 'service_role')
+    WITH CHECK (auth.role() = 'service_role');
+
+-- Workers only look at unfinished rows, oldest first
+CREATE INDEX IF NOT EXISTS idx_webhook_queue_pending
+    ON webhook_queue(created_at)
+    WHERE status IN ('queued', 'processing');
+
+-- Claim up to p_limit rows for one worker.
+-- Rows left in 'processing' longer than p_lease_seconds (crashed worker) are claimed again.
+-- SKIP LOCKED lets concurrent workers claim disjoint batches without waiting on each other.
+CREATE OR REPLACE FUNCTION public.claim_webhook_queue_batch(p_limit INTEGER, p_lease_seconds INTEGER)
+RETURNS SETOF webhook_queue AS $$
+BEGIN
+    RETURN QUERY
+    UPDATE webhook_queue q
+    SET status = 'processing',
+        attempts = q.attempts + 1,
+        locked_at = now(),
+        updated_at = now()
+    WHERE q.id IN (
+        SELECT id FROM webhook_queue
+        WHERE status = 'queued'
+           OR (status = 'processing' AND locked_at < now() - make_interval(secs => p_lease_seconds))
+        ORDER BY created_at
+        LIMIT p_limit
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING q.*;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+REVOKE ALL ON FUNCTION public.claim_webhook_queue_batch(INTEGER, INTEGER) FROM PUBLIC;
+GRANT EXECUTE ON FUNCTION public.claim_webhook_queue_batch(INTEGER, INTEGER) TO service_role;
+
+COMMENT ON TABLE webhook_queue IS 'Accepted merchant webhook transactions waiting for or finished with processing';
+COMMENT ON COLUMN webhook_queue.result IS 'WebhookProcessingResult of the last processing attempt';
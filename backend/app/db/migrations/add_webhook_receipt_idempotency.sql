@@ -0,0 +1,18 @@
+-- Idempotent webhook receipts
+-- Webhook receipts carry the merchant's transaction_id and are upserted on
+-- (merchant_id, webhook_transaction_id), so a retried transaction reuses the receipt of
+-- its failed attempt instead of inserting another one. Receipts without a webhook
+-- transaction (QR scans, manual entries) keep NULL and are not constrained.
+-- Requires add_merchant_id_to_receipts.sql.
+
+ALTER TABLE receipts
+    ADD COLUMN IF NOT EXISTS webhook_transaction_id TEXT;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM information_schema.table_constraints WHERE constraint_name = 'receipts_merchant_webhook_transaction_key' AND table_name = 'receipts') THEN
+        ALTER TABLE receipts ADD CONSTRAINT receipts_merchant_webhook_transaction_key UNIQUE (merchant_id, webhook_transaction_id);
+    END IF;
+END $$;
+
+COMMENT ON COLUMN receipts.webhook_transaction_id IS 'Merchant webhook transaction_id; unique per merchant so webhook retries reuse the receipt';
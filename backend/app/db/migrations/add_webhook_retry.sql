@@ -0,0 +1,86 @@
+-- Automatic retries for webhook_queue
+-- A failed transaction goes back to 'queued' with next_attempt_at set by exponential
+-- backoff with jitter (WEBHOOK_RETRY_DELAY, WEBHOOK_RETRY_ATTEMPTS). Once the attempts
+-- are used up the row stays 'failed' and shows up in webhook_dead_letters.
+-- Requires add_webhook_queue.sql.
+
+ALTER TABLE webhook_queue
+    ADD COLUMN IF NOT EXISTS next_attempt_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now();
+
+-- Due-time index: retries are claimed in next_attempt_at order
+CREATE INDEX IF NOT EXISTS idx_webhook_queue_due_retries
+    ON webhook_queue(next_attempt_at)
+    WHERE status = 'queued' AND attempts > 0;
+
+-- Claim up to p_limit rows for one worker.
+-- New transactions (attempts = 0) and expired leases come first; due retries fill the
+-- rest of the batch, at most p_retry_limit of them, so retry load cannot starve live traffic.
+DROP FUNCTION IF EXISTS public.claim_webhook_queue_batch(INTEGER, INTEGER);
+
+CREATE OR REPLACE FUNCTION public.claim_webhook_queue_batch(
+    p_limit INTEGER,
+    p_lease_seconds INTEGER,
+    p_retry_limit INTEGER DEFAULT NULL
+)
+RETURNS SETOF webhook_queue AS $$
+DECLARE
+    v_ids UUID[];
+    v_retry_limit INTEGER;
+BEGIN
+    SELECT COALESCE(array_agg(live.id), '{}') INTO v_ids
+    FROM (
+        SELECT id FROM webhook_queue
+        WHERE (status = 'queued' AND attempts = 0)
+           OR (status = 'processing' AND locked_at < now() - make_interval(secs => p_lease_seconds))
+        ORDER BY created_at
+        LIMIT p_limit
+        FOR UPDATE SKIP LOCKED
+    ) live;
+
+    v_retry_limit := LEAST(COALESCE(p_retry_limit, p_limit), p_limit - COALESCE(array_length(v_ids, 1), 0));
+
+    IF v_retry_limit > 0 THEN
+        v_ids := v_ids || ARRAY(
+            SELECT id FROM webhook_queue
+            WHERE status = 'queued' AND attempts > 0 AND next_attempt_at <= now()
+            ORDER BY next_attempt_at
+            LIMIT v_retry_limit
+            FOR UPDATE SKIP LOCKED
+        );
+    END IF;
+
+    RETURN QUERY
+    UPDATE webhook_queue q
+    SET status = 'processing',
+        attempts = q.attempts + 1,
+        locked_at = now(),
+        updated_at = now()
+    WHERE q.id = ANY(v_ids)
+    RETURNING q.*;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+REVOKE ALL ON FUNCTION public.claim_webhook_queue_batch(INTEGER, INTEGER, INTEGER) FROM PUBLIC;
+GRANT EXECUTE ON FUNCTION public.claim_webhook_queue_batch(INTEGER, INTEGER, INTEGER) TO service_role;
+
+-- Dead-letter view: transactions that failed on every attempt
+CREATE OR REPLACE VIEW webhook_dead_letters
+WITH (security_invoker = true) AS
+SELECT
+    id,
+    merchant_id,
+    transaction_id,
+    payload,
+    attempts,
+    error_message,
+    result,
+    created_at,
+    updated_at AS failed_at
+FROM webhook_queue
+WHERE status = 'failed';
+
+REVOKE ALL ON webhook_dead_letters FROM anon, authenticated;
+GRANT SELECT ON webhook_dead_letters TO service_role;
+
+COMMENT ON COLUMN webhook_queue.next_attempt_at IS 'Earliest time a queued retry may be claimed';
+COMMENT ON VIEW webhook_dead_letters IS 'Webhook transactions that exhausted WEBHOOK_RETRY_ATTEMPTS';
@@ -0,0 +1,291 @@
+-- Hourly webhook statistics rollup
+-- GET /webhooks/merchant/{id}/stats used to download every webhook_logs row of a merchant
+-- and aggregate in Python. webhook_stats_hourly is kept up to date by a trigger on
+-- webhook_logs, so stats for any window read a few rows per merchant-hour.
+-- Each merchant-hour is split over webhook_stats_shards() rows (picked by log id) so
+-- concurrent webhooks of one merchant do not all wait on the same row lock.
+-- processing_time_ms is kept as a fixed-bucket histogram; p50/p95/p99 are the upper
+-- bound of the bucket the percentile falls in (capped at the observed maximum).
+-- Requires add_webhook_logs.sql.
+
+-- Rollup rows per merchant-hour
+CREATE OR REPLACE FUNCTION public.webhook_stats_shards()
+RETURNS INTEGER AS $$
+    SELECT 8
+$$ LANGUAGE sql IMMUTABLE;
+
+-- Histogram bucket upper bounds (ms); the last bucket (index n + 1) is everything above
+CREATE OR REPLACE FUNCTION public.webhook_latency_bounds()
+RETURNS INTEGER[] AS $$
+    SELECT ARRAY[5, 10, 20, 30, 50, 75, 100, 150, 200, 300, 500, 750,
+                 1000, 1500, 2000, 3000, 5000, 7500, 10000, 15000, 30000, 60000]
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION public.webhook_latency_bucket(p_ms INTEGER)
+RETURNS INTEGER AS $$
+    SELECT COALESCE(
+        (SELECT min(b.i)::INTEGER FROM unnest(webhook_latency_bounds()) WITH ORDINALITY AS b(bound, i) WHERE p_ms <= b.bound),
+        array_length(webhook_latency_bounds(), 1) + 1
+    )
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE TABLE IF NOT EXISTS webhook_stats_hourly (
+    merchant_id UUID NOT NULL REFERENCES merchants(id) ON DELETE CASCADE,
+    bucket_start TIMESTAMP WITH TIME ZONE NOT NULL,
+    shard SMALLINT NOT NULL DEFAULT 0,
+    total_count INTEGER NOT NULL DEFAULT 0,
+    success_count INTEGER NOT NULL DEFAULT 0,
+    failed_count INTEGER NOT NULL DEFAULT 0,
+    retry_count INTEGER NOT NULL DEFAULT 0,
+    pending_count INTEGER NOT NULL DEFAULT 0,
+    timed_count INTEGER NOT NULL DEFAULT 0,
+    time_sum_ms BIGINT NOT NULL DEFAULT 0,
+    time_min_ms INTEGER,
+    time_max_ms INTEGER,
+    latency_histogram INTEGER[] NOT NULL,
+    PRIMARY KEY (merchant_id, bucket_start, shard)
+);
+
+-- Tables created before sharding: add the shard to the primary key
+ALTER TABLE webhook_stats_hourly ADD COLUMN IF NOT EXISTS shard SMALLINT NOT NULL DEFAULT 0;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM information_schema.key_column_usage WHERE constraint_name = 'webhook_stats_hourly_pkey' AND table_name = 'webhook_stats_hourly' AND column_name = 'shard') THEN
+        ALTER TABLE webhook_stats_hourly DROP CONSTRAINT webhook_stats_hourly_pkey;
+        ALTER TABLE webhook_stats_hourly ADD CONSTRAINT webhook_stats_hourly_pkey PRIMARY KEY (merchant_id, bucket_start, shard);
+    END IF;
+END $$;
+
+ALTER TABLE webhook_stats_hourly ENABLE ROW LEVEL SECURITY;
+
+DROP POLICY IF EXISTS "Service role can manage webhook stats" ON webhook_stats_hourly;
+CREATE POLICY "Service role can manage webhook stats"
+    ON webhook_stats_hourly FOR ALL
+    USING (auth.role() = 'service_role')
+    WITH CHECK (auth.role() = 'service_role');
+
+-- Add (p_sign = 1) or remove (p_sign = -1) one log row's contribution.
+-- time_min_ms / time_max_ms only ever widen; they are not recomputed on removal.
+CREATE OR REPLACE FUNCTION public.apply_webhook_log_stats(p_log webhook_logs, p_sign INTEGER)
+RETURNS VOID AS $$
+DECLARE
+    v_buckets INTEGER := array_length(webhook_latency_bounds(), 1) + 1;
+    v_bucket INTEGER;
+    v_histogram INTEGER[];
+BEGIN
+    v_bucket := CASE WHEN p_log.processing_time_ms IS NULL THEN 0
+                     ELSE webhook_latency_bucket(p_log.processing_time_ms) END;
+    SELECT array_agg(CASE WHEN i = v_bucket THEN p_sign ELSE 0 END ORDER BY i)
+    INTO v_histogram
+    FROM generate_series(1, v_buckets) AS i;
+
+    INSERT INTO webhook_stats_hourly AS s (
+        merchant_id, bucket_start, shard, total_count, success_count, failed_count, retry_count,
+        pending_count, timed_count, time_sum_ms, time_min_ms, time_max_ms, latency_histogram
+    )
+    VALUES (
+        p_log.merchant_id,
+        date_trunc('hour', COALESCE(p_log.created_at, now())),
+        abs(mod(hashtext(p_log.id::TEXT), webhook_stats_shards())),
+        p_sign,
+        CASE WHEN p_log.status = 'success' THEN p_sign ELSE 0 END,
+        CASE WHEN p_log.status = 'failed' THEN p_sign ELSE 0 END,
+        CASE WHEN p_log.status = 'retry' THEN p_sign ELSE 0 END,
+        CASE WHEN p_log.status = 'pending' THEN p_sign ELSE 0 END,
+        CASE WHEN p_log.processing_time_ms IS NULL THEN 0 ELSE p_sign END,
+        COALESCE(p_log.processing_time_ms, 0) * p_sign,
+        CASE WHEN p_sign > 0 THEN p_log.processing_time_ms END,
+        CASE WHEN p_sign > 0 THEN p_log.processing_time_ms END,
+        v_histogram
+    )
+    ON CONFLICT (merchant_id, bucket_start, shard) DO UPDATE SET
+        total_count = s.total_count + EXCLUDED.total_count,
+        success_count = s.success_count + EXCLUDED.success_count,
+        failed_count = s.failed_count + EXCLUDED.failed_count,
+        retry_count = s.retry_count + EXCLUDED.retry_count,
+        pending_count = s.pending_count + EXCLUDED.pending_count,
+        timed_count = s.timed_count + EXCLUDED.timed_count,
+        time_sum_ms = s.time_sum_ms + EXCLUDED.time_sum_ms,
+        time_min_ms = LEAST(s.time_min_ms, EXCLUDED.time_min_ms),
+        time_max_ms = GREATEST(s.time_max_ms, EXCLUDED.time_max_ms),
+        latency_histogram = (
+            SELECT array_agg(h.a + h.b ORDER BY h.i)
+            FROM unnest(s.latency_histogram, EXCLUDED.latency_histogram) WITH ORDINALITY AS h(a, b, i)
+        );
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+CREATE OR REPLACE FUNCTION public.webhook_logs_stats_trigger()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'UPDATE'
+       AND OLD.status IS NOT DISTINCT FROM NEW.status
+       AND OLD.processing_time_ms IS NOT DISTINCT FROM NEW.processing_time_ms
+       AND OLD.merchant_id = NEW.merchant_id
+       AND OLD.created_at IS NOT DISTINCT FROM NEW.created_at THEN
+        RETURN NULL;
+    END IF;
+
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM apply_webhook_log_stats(OLD, -1);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM apply_webhook_log_stats(NEW, 1);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+DROP TRIGGER IF EXISTS webhook_logs_stats ON webhook_logs;
+CREATE TRIGGER webhook_logs_stats
+    AFTER INSERT OR UPDATE OR DELETE ON webhook_logs
+    FOR EACH ROW EXECUTE FUNCTION webhook_logs_stats_trigger();
+
+-- Backfill from existing logs (safe to re-run)
+TRUNCATE webhook_stats_hourly;
+SELECT apply_webhook_log_stats(l, 1) FROM webhook_logs l;
+
+-- Raw reads for the partial hours at the edges of a stats window
+CREATE INDEX IF NOT EXISTS idx_webhook_logs_merchant_created_at ON webhook_logs(merchant_id, created_at);
+
+-- Stats for one merchant over [p_start, p_end). Whole hours come from the rollup; the
+-- partial hours at either edge of the window are counted from webhook_logs directly so
+-- rows before p_start or after p_end are never included.
+CREATE OR REPLACE FUNCTION public.get_webhook_stats(
+    p_merchant_id UUID,
+    p_start TIMESTAMP WITH TIME ZONE,
+    p_end TIMESTAMP WITH TIME ZONE
+)
+RETURNS JSONB AS $$
+DECLARE
+    v_bounds INTEGER[] := webhook_latency_bounds();
+    -- [v_full_start, v_full_end) is the run of whole hours inside the window
+    v_full_start TIMESTAMP WITH TIME ZONE := CASE WHEN p_start = date_trunc('hour', p_start) THEN p_start
+                                                  ELSE date_trunc('hour', p_start) + INTERVAL '1 hour' END;
+    v_full_end TIMESTAMP WITH TIME ZONE := GREATEST(date_trunc('hour', p_end), v_full_start);
+    v_result JSONB;
+BEGIN
+    WITH rollup AS (
+        SELECT * FROM webhook_stats_hourly
+        WHERE merchant_id = p_merchant_id
+          AND bucket_start >= v_full_start
+          AND bucket_start < v_full_end
+    ),
+    edges AS (
+        SELECT status, processing_time_ms, created_at FROM webhook_logs
+        WHERE merchant_id = p_merchant_id AND created_at >= p_start AND created_at < LEAST(v_full_start, p_end)
+        UNION ALL
+        SELECT status, processing_time_ms, created_at FROM webhook_logs
+        WHERE merchant_id = p_merchant_id AND created_at >= v_full_end AND created_at < p_end
+    ),
+    hours AS (
+        SELECT bucket_start, total_count, success_count, failed_count, retry_count, pending_count,
+               timed_count, time_sum_ms, time_min_ms, time_max_ms
+        FROM rollup
+        UNION ALL
+        SELECT
+            date_trunc('hour', created_at),
+            count(*),
+            count(*) FILTER (WHERE status = 'success'),
+            count(*) FILTER (WHERE status = 'failed'),
+            count(*) FILTER (WHERE status = 'retry'),
+            count(*) FILTER (WHERE status = 'pending'),
+            count(processing_time_ms),
+            COALESCE(sum(processing_time_ms), 0),
+            min(processing_time_ms),
+            max(processing_time_ms)
+        FROM edges
+        GROUP BY 1
+    ),
+    -- Shards and edge rows of the same hour merged into one row per hour
+    buckets AS (
+        SELECT
+            bucket_start,
+            sum(total_count) AS total_count,
+            sum(success_count) AS success_count,
+            sum(failed_count) AS failed_count,
+            sum(retry_count) AS retry_count,
+            sum(pending_count) AS pending_count,
+            sum(timed_count) AS timed_count,
+            sum(time_sum_ms) AS time_sum_ms,
+            min(time_min_ms) AS time_min_ms,
+            max(time_max_ms) AS time_max_ms
+        FROM hours
+        GROUP BY bucket_start
+        HAVING sum(total_count) > 0
+    ),
+    totals AS (
+        SELECT
+            COALESCE(sum(total_count), 0) AS total,
+            COALESCE(sum(success_count), 0) AS success,
+            COALESCE(sum(failed_count), 0) AS failed,
+            COALESCE(sum(retry_count), 0) AS retry,
+            COALESCE(sum(pending_count), 0) AS pending,
+            COALESCE(sum(timed_count), 0) AS timed,
+            COALESCE(sum(time_sum_ms), 0) AS time_sum,
+            min(time_min_ms) AS time_min,
+            max(time_max_ms) AS time_max
+        FROM buckets
+    ),
+    histogram AS (
+        SELECT h.i, h.c
+        FROM rollup, unnest(rollup.latency_histogram) WITH ORDINALITY AS h(c, i)
+        UNION ALL
+        SELECT webhook_latency_bucket(processing_time_ms), count(*)
+        FROM edges
+        WHERE processing_time_ms IS NOT NULL
+        GROUP BY 1
+    ),
+    cumulative AS (
+        SELECT i, sum(sum(c)) OVER (ORDER BY i) AS running
+        FROM histogram
+        GROUP BY i
+    ),
+    percentiles AS (
+        SELECT
+            q.p,
+            (SELECT LEAST(COALESCE(v_bounds[c.i], t.time_max), t.time_max)
+             FROM cumulative c
+             WHERE c.running >= q.p * t.timed AND c.running > 0
+             ORDER BY c.i LIMIT 1) AS value
+        FROM totals t, (VALUES (0.50), (0.95), (0.99)) AS q(p)
+    )
+    SELECT jsonb_build_object(
+        'total', t.total,
+        'success', t.success,
+        'failed', t.failed,
+        'retry', t.retry,
+        'pending', t.pending,
+        'avg_processing_time_ms', CASE WHEN t.timed > 0 THEN round(t.time_sum::NUMERIC / t.timed, 2) END,
+        'min_processing_time_ms', t.time_min,
+        'max_processing_time_ms', t.time_max,
+        'p50_processing_time_ms', (SELECT value FROM percentiles WHERE p = 0.50),
+        'p95_processing_time_ms', (SELECT value FROM percentiles WHERE p = 0.95),
+        'p99_processing_time_ms', (SELECT value FROM percentiles WHERE p = 0.99),
+        'hourly', COALESCE((
+            SELECT jsonb_agg(jsonb_build_object(
+                'bucket_start', b.bucket_start,
+                'total', b.total_count,
+                'success', b.success_count,
+                'failed', b.failed_count,
+                'retry', b.retry_count,
+                'pending', b.pending_count,
+                'avg_processing_time_ms', CASE WHEN b.timed_count > 0 THEN round(b.time_sum_ms::NUMERIC / b.timed_count, 2) END
+            ) ORDER BY b.bucket_start)
+            FROM buckets b
+        ), '[]'::JSONB)
+    )
+    INTO v_result
+    FROM totals t;
+
+    RETURN v_result;
+END;
+$$ LANGUAGE plpgsql STABLE SECURITY DEFINER SET search_path = public;
+
+REVOKE ALL ON FUNCTION public.apply_webhook_log_stats(webhook_logs, INTEGER) FROM PUBLIC;
+REVOKE ALL ON FUNCTION public.get_webhook_stats(UUID, TIMESTAMP WITH TIME ZONE, TIMESTAMP WITH TIME ZONE) FROM PUBLIC;
+GRANT EXECUTE ON FUNCTION public.get_webhook_stats(UUID, TIMESTAMP WITH TIME ZONE, TIMESTAMP WITH TIME ZONE) TO service_role;
+
+COMMENT ON TABLE webhook_stats_hourly IS 'Per merchant-hour-shard webhook_logs counts and processing time histogram, maintained by trigger';
+COMMENT ON COLUMN webhook_stats_hourly.latency_histogram IS 'processing_time_ms counts per webhook_latency_bounds() bucket, last element is overflow';
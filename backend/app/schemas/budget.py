@@ -4,7 +4,7 @@ Pydantic models for budget management system
 """
 
 from pydantic import BaseModel, Field, validator
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Literal, Optional
 from datetime import datetime, date
 from enum import Enum
 from decimal import Decimal
@@ -226,6 +226,9 @@ class BudgetAllocationRequest(BaseModel):
     """Schema for budget allocation request"""
     total_budget: float = Field(gt=0, description="Total budget to allocate")
     categories: Optional[List[str]] = Field(None, description="Specific categories to allocate to")
+    method: Literal["research", "history"] = Field(
+        "research", description="research: fixed optimal percentages, history: based on the user's past spending"
+    )
     year: Optional[int] = Field(None, ge=2020, le=2100, description="Budget year (defaults to current year)")
     month: Optional[int] = Field(None, ge=1, le=12, description="Budget month (defaults to current month)")
 
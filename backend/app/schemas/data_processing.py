@@ -2,9 +2,9 @@
 Pydantic schemas for data processing services
 """
 
-from typing import Optional, List, Dict, Any, Union
+from typing import Optional, List, Dict, Any, Union, Literal
 from datetime import datetime
-from pydantic import BaseModel, Field, field_validator
+from pydantic import BaseModel, Field, field_validator, model_validator
 from uuid import UUID
 
 class QRScanRequest(BaseModel):
@@ -160,6 +160,67 @@ class QRReceiptResponse(BaseModel):
     expenses_count: int = Field(..., description="Number of expenses created")
     processing_confidence: float = Field(..., description="Processing confidence")
     public_url: Optional[str] = Field(None, description="Public URL for viewing receipt")
+    categorization_job_id: Optional[str] = Field(None, description="Background categorization job to poll after a claim")
+
+class CategorizationJobResponse(BaseModel):
+    """Response schema for a background receipt categorization job"""
+    job_id: str = Field(..., description="Job ID")
+    receipt_id: str = Field(..., description="Claimed receipt ID")
+    status: str = Field(..., description="pending, running, completed or failed")
+    items_total: int = Field(0, description="Uncategorized items picked up by the job")
+    items_categorized: int = Field(0, description="Items that received a category")
+    loyalty_points_awarded: Optional[int] = Field(None, description="Loyalty points awarded for the claim")
+    error: Optional[str] = Field(None, description="Error message if the job failed")
+    created_at: datetime = Field(..., description="Job creation time")
+    finished_at: Optional[datetime] = Field(None, description="Job completion time")
+
+class BulkReceiptItem(BaseModel):
+    """Item of a structured receipt in a bulk ingestion request"""
+    item_name: str = Field(..., min_length=1, max_length=200, description="Item name")
+    amount: float = Field(..., gt=0, description="Item amount")
+    quantity: int = Field(1, gt=0, description="Item quantity")
+    kdv_rate: Optional[float] = Field(None, description="KDV (VAT) rate; suggested from the description if omitted")
+
+class BulkReceiptEntry(BaseModel):
+    """One receipt in a bulk ingestion request: a raw QR payload or structured fields"""
+    qr_data: Optional[str] = Field(None, description="Raw QR code data")
+    merchant_name: Optional[str] = Field(None, max_length=100, description="Merchant name")
+    transaction_date: Optional[datetime] = Field(None, description="Transaction date")
+    total_amount: Optional[float] = Field(None, gt=0, description="Receipt total; summed from items if omitted")
+    currency: Optional[str] = Field("TRY", description="Currency code")
+    items: List[BulkReceiptItem] = Field(default_factory=list, description="Receipt items")
+    
+    @model_validator(mode='after')
+    def validate_payload(self):
+        if not (self.qr_data and self.qr_data.strip()) and not self.items and self.total_amount is None:
+            raise ValueError('Either qr_data or structured receipt fields (items or total_amount) are required')
+        return self
+
+class BulkReceiptRequest(BaseModel):
+    """Request schema for bulk receipt ingestion"""
+    receipts: List[BulkReceiptEntry] = Field(..., min_length=1, description="Receipts to ingest")
+
+class BulkReceiptResult(BaseModel):
+    """Streamed per-receipt result of a bulk ingestion (one NDJSON line)"""
+    type: Literal["result"] = "result"
+    index: int = Field(..., description="Position of the receipt in the request")
+    success: bool = Field(..., description="Whether the receipt was stored")
+    receipt_id: Optional[str] = Field(None, description="Created receipt ID")
+    expense_id: Optional[str] = Field(None, description="Created expense ID")
+    merchant_name: Optional[str] = Field(None, description="Merchant name")
+    total_amount: Optional[float] = Field(None, description="Total amount")
+    items_count: int = Field(0, description="Number of expense items")
+    processing_confidence: float = Field(0.0, description="Processing confidence")
+    warnings: List[str] = Field(default_factory=list, description="Warning messages")
+    errors: List[str] = Field(default_factory=list, description="Error messages")
+
+class BulkReceiptSummary(BaseModel):
+    """Final NDJSON line of a bulk ingestion"""
+    type: Literal["summary"] = "summary"
+    total: int = Field(..., description="Receipts in the request")
+    succeeded: int = Field(..., description="Receipts stored")
+    failed: int = Field(..., description="Receipts rejected")
+    duration_ms: float = Field(..., description="Total processing time")
 
 class ReceiptListResponse(BaseModel):
     """Response schema for receipt list"""
@@ -235,6 +296,7 @@ class ExpenseResponse(BaseModel):
     merchant_name: Optional[str] = Field(None, description="Merchant name")
     items: List[ExpenseItemResponse] = Field(default_factory=list, description="Expense items")
     qr_code: Optional[str] = Field(None, description="Base64 encoded QR code for receipt")
+    qr_code_url: Optional[str] = Field(None, description="URL that renders the receipt QR code on demand")
     created_at: datetime = Field(..., description="Creation date")
     updated_at: datetime = Field(..., description="Update date")
 
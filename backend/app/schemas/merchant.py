@@ -170,6 +170,86 @@ class WebhookProcessingResult(BaseModel):
     loyalty_transaction_id: Optional[UUID] = Field(None, description="ID of the loyalty transaction record")
 
 
+class WebhookQueueStatusResponse(BaseModel):
+    queue_id: UUID
+    transaction_id: str
+    status: str = Field(..., description="Queue status: queued (new or waiting for retry), processing, done, failed")
+    duplicate: bool = Field(default=False, description="True if this transaction_id was already received")
+    attempts: int = 0
+    status_url: str = Field(..., description="URL to poll for the processing result")
+    result: Optional[WebhookProcessingResult] = Field(None, description="Processing result once finished")
+    created_at: Optional[datetime] = None
+
+
+class WebhookDeadLetterResponse(BaseModel):
+    queue_id: UUID
+    merchant_id: UUID
+    transaction_id: str
+    attempts: int
+    error_message: Optional[str] = None
+    created_at: datetime
+    failed_at: Optional[datetime] = None
+
+
+class WebhookDeadLetterListResponse(BaseModel):
+    items: List[WebhookDeadLetterResponse]
+    total: int
+    page: int
+    size: int
+    has_next: bool
+
+
+class WebhookBatchRequest(BaseModel):
+    transactions: List[WebhookTransactionData] = Field(..., min_length=1, description="Transactions to process")
+
+
+class WebhookBatchItemResult(BaseModel):
+    index: int = Field(..., description="Position of the transaction in the request")
+    transaction_id: str
+    duplicate: bool = Field(default=False, description="True if this transaction_id was already received")
+    queue_status: Optional[str] = Field(None, description="Queue status of a duplicate that has no result yet")
+    result: Optional[WebhookProcessingResult] = None
+
+
+class WebhookBatchResponse(BaseModel):
+    total: int
+    succeeded: int
+    failed: int
+    duplicates: int
+    processing_time_ms: int
+    results: List[WebhookBatchItemResult]
+
+
+class WebhookStatsBucket(BaseModel):
+    bucket_start: datetime
+    total: int = 0
+    success: int = 0
+    failed: int = 0
+    retry: int = 0
+    pending: int = 0
+    avg_processing_time_ms: Optional[float] = None
+
+
+class WebhookStatsResponse(BaseModel):
+    merchant_id: UUID
+    start_time: datetime = Field(..., description="Window start; the last WEBHOOK_STATS_DEFAULT_HOURS hours when not requested, not all time")
+    end_time: datetime = Field(..., description="Window end (exclusive)")
+    total_webhooks: int
+    successful_webhooks: int
+    failed_webhooks: int
+    retry_webhooks: int
+    pending_webhooks: int
+    success_rate_percentage: float
+    avg_processing_time_ms: Optional[float] = None
+    max_processing_time_ms: Optional[int] = None
+    min_processing_time_ms: Optional[int] = None
+    # Histogram estimates: upper bound of the bucket the percentile falls in
+    p50_processing_time_ms: Optional[int] = None
+    p95_processing_time_ms: Optional[int] = None
+    p99_processing_time_ms: Optional[int] = None
+    hourly: List[WebhookStatsBucket] = Field(default_factory=list, description="Per-hour series, hours without webhooks are omitted")
+
+
 class CustomerMatchResult(BaseModel):
     matched: bool
     user_id: Optional[UUID] = None
@@ -82,6 +82,28 @@ class LineChartResponse(BaseModel):
     datasets: List[LineChartDataset] = Field(description="Chart datasets")
 
 
+# D. KDV Özeti Schemas
+class KDVRateSummaryItem(BaseModel):
+    """KDV totals of one rate group"""
+    kdvRate: float = Field(description="KDV rate (1, 10, 20)")
+    totalAmount: float = Field(description="Gross amount (KDV included)")
+    kdvAmount: float = Field(description="KDV amount")
+    amountWithoutKdv: float = Field(description="Net amount (KDV excluded)")
+    itemCount: int = Field(description="Number of expense items")
+
+
+class KDVSummaryResponse(BaseModel):
+    """KDV-by-rate summary for a date range"""
+    reportTitle: str = Field(description="Report title")
+    startDate: date = Field(description="Range start (inclusive)")
+    endDate: date = Field(description="Range end (inclusive)")
+    totalAmount: float = Field(description="Gross amount (KDV included)")
+    totalKdv: float = Field(description="Total KDV")
+    totalWithoutKdv: float = Field(description="Total net amount")
+    averageKdvRate: float = Field(description="Effective KDV rate on the net amount")
+    data: List[KDVRateSummaryItem] = Field(description="Totals per KDV rate")
+
+
 # Request Schemas
 class MonthlyReportRequest(BaseModel):
     """Request for monthly reports (pie/bar charts)"""
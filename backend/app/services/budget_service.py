@@ -3,26 +3,90 @@ Budget Management Service
 Handles budget creation, allocation, and management
 """
 
+import copy
 import logging
 from datetime import datetime, date
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
 from collections import defaultdict
 
+import numpy as np
+
+from app.core.config import settings
 from app.db.supabase_client import get_supabase_client
 from app.schemas.budget import (
     UserBudgetCreate, UserBudgetUpdate, UserBudgetResponse,
     BudgetCategoryCreate, BudgetCategoryUpdate, BudgetCategoryResponse,
     BudgetAllocationResponse, BudgetSummaryResponse
 )
+from app.utils.budget_allocator import allocate_by_history
+from app.utils.ttl_cache import TTLCache
 
 logger = logging.getLogger(__name__)
 
 
+BUDGET_WITH_CATEGORIES = "*, budget_categories(*, categories(name))"
+
+
+class BudgetSummaryCache:
+    """
+    (user_id, year, month) -> user_budgets row with its budget_categories
+
+    Shared by every BudgetService instance. Budget mutations (BudgetService
+    and api/budget.py) invalidate all months of the user.
+    """
+
+    def __init__(self, ttl_seconds: int = 30, max_entries: int = 10000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        # Entries are tagged with the user id so invalidate() drops every month
+        self._cache = TTLCache(ttl_seconds, max_entries, index=lambda key, _: key[0])
+
+    def get(self, user_id: Any, year: int, month: int) -> Optional[Dict[str, Any]]:
+        budget = self._cache.get((str(user_id), year, month))
+        return copy.deepcopy(budget) if budget is not None else None
+
+    def put(self, user_id: Any, year: int, month: int, budget: Dict[str, Any]):
+        self._cache.put((str(user_id), year, month), copy.deepcopy(budget))
+
+    def invalidate(self, user_id: Any):
+        self._cache.pop_tag(str(user_id))
+
+    def clear(self):
+        self._cache.clear()
+
+
+budget_summary_cache = BudgetSummaryCache(
+    ttl_seconds=settings.BUDGET_SUMMARY_CACHE_TTL,
+    max_entries=settings.BUDGET_SUMMARY_CACHE_SIZE
+)
+
+
+def resolve_year_month(year: Optional[int] = None, month: Optional[int] = None) -> Tuple[int, int]:
+    """Given year/month, defaulting to the current date"""
+    now = datetime.now()
+    return (year or now.year, month or now.month)
+
+
+def format_category_budget(item: Dict[str, Any]) -> Dict[str, Any]:
+    """budget_categories row with embedded categories(name) -> API shape"""
+    return {
+        "id": item["id"],
+        "user_budget_id": item["user_budget_id"],
+        "category_id": item["category_id"],
+        "category_name": item.get("categories", {}).get("name", "Unknown") if item.get("categories") else "Unknown",
+        "monthly_limit": item["monthly_limit"],
+        "is_active": item["is_active"],
+        "created_at": item["created_at"],
+        "updated_at": item["updated_at"]
+    }
+
+
 class BudgetService:
     """Service for budget management operations"""
     
-    def __init__(self):
-        self.supabase = get_supabase_client()
+    def __init__(self, supabase=None):
+        self.supabase = supabase or get_supabase_client()
+        self.summary_cache = budget_summary_cache
         
         # Optimal budget allocation percentages based on research
         self.optimal_allocations = {
@@ -70,6 +134,7 @@ class BudgetService:
             if not result.data:
                 return {"status": "error", "message": "Failed to create budget"}
             
+            self.summary_cache.invalidate(user_id)
             budget_id = result.data[0]["id"]
             
             # Auto-allocate budget to categories if requested
@@ -126,6 +191,8 @@ class BudgetService:
             if not result.data:
                 return {"status": "error", "message": "Failed to update budget"}
             
+            self.summary_cache.invalidate(user_id)
+            
             # Re-allocate budget if total amount changed and auto_allocate is enabled
             if "total_monthly_budget" in update_data:
                 budget_info = await self.get_user_budget(user_id, year, month)
@@ -182,6 +249,8 @@ class BudgetService:
             if not result.data:
                 return {"status": "error", "message": "Failed to save category budget"}
             
+            self.summary_cache.invalidate(user_id)
+            
             return {
                 "status": "success",
                 "category_budget": result.data[0],
@@ -192,38 +261,45 @@ class BudgetService:
             logger.error(f"Failed to create category budget: {str(e)}")
             return {"status": "error", "message": f"Failed to save category budget: {str(e)}"}
     
-    async def get_category_budgets(self, user_id: str) -> Dict[str, Any]:
-        """Get all category budgets for a user"""
+    def get_budget_with_categories(self, user_id: str, year: Optional[int] = None, month: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """
+        User's budget for year/month with its category budgets and their names
+        
+        One embedded select; results are cached per user in budget_summary_cache.
+        
+        Returns:
+            user_budgets row with a budget_categories list (active and inactive),
+            or None if the user has no budget for that month
+        """
+        year, month = resolve_year_month(year, month)
+        
+        budget = self.summary_cache.get(user_id, year, month)
+        if budget is not None:
+            return budget
+        
+        result = self.supabase.table("user_budgets").select(BUDGET_WITH_CATEGORIES).eq(
+            "user_id", user_id
+        ).eq("year", year).eq("month", month).execute()
+        if not result.data:
+            return None
+        
+        budget = result.data[0]
+        budget["budget_categories"] = budget.get("budget_categories") or []
+        self.summary_cache.put(user_id, year, month, budget)
+        return budget
+    
+    async def get_category_budgets(self, user_id: str, year: Optional[int] = None, month: Optional[int] = None) -> Dict[str, Any]:
+        """Get all active category budgets for a user (current month by default)"""
         try:
-            # Get current year and month
-            current_date = datetime.now()
-            current_year = current_date.year
-            current_month = current_date.month
+            year, month = resolve_year_month(year, month)
             
-            # First, get the user's budget to join with categories
-            user_budget_res = self.supabase.table("user_budgets").select("id").eq("user_id", user_id).eq("year", current_year).eq("month", current_month).execute()
-            if not user_budget_res.data:
-                return {"status": "not_found", "message": f"User budget not found for {current_year}-{current_month}"}
-            
-            user_budget_id = user_budget_res.data[0]["id"]
-            
-            # Now, get budget categories linked to this user_budget_id
-            result = self.supabase.table("budget_categories").select(
-                "*, categories(name)"
-            ).eq("user_budget_id", user_budget_id).eq("is_active", True).execute()
-            
-            category_budgets = []
-            for item in result.data or []:
-                category_budgets.append({
-                    "id": item["id"],
-                    "user_budget_id": item["user_budget_id"],
-                    "category_id": item["category_id"],
-                    "category_name": item.get("categories", {}).get("name", "Unknown") if item.get("categories") else "Unknown",
-                    "monthly_limit": item["monthly_limit"],
-                    "is_active": item["is_active"],
-                    "created_at": item["created_at"],
-                    "updated_at": item["updated_at"]
-                })
+            budget = self.get_budget_with_categories(user_id, year, month)
+            if budget is None:
+                return {"status": "not_found", "message": f"User budget not found for {year}-{month}"}
+            
+            category_budgets = [
+                format_category_budget(item) for item in budget["budget_categories"] if item.get("is_active")
+            ]
             
             return {
                 "status": "success",
@@ -234,21 +310,19 @@ class BudgetService:
             logger.error(f"Failed to get category budgets: {str(e)}")
             return {"status": "error", "message": f"Failed to get category budgets: {str(e)}"}
     
-    async def get_budget_summary(self, user_id: str) -> Dict[str, Any]:
-        """Get comprehensive budget summary"""
+    async def get_budget_summary(self, user_id: str, year: Optional[int] = None, month: Optional[int] = None) -> Dict[str, Any]:
+        """Get comprehensive budget summary (current month by default)"""
         try:
-            # Get user's overall budget
-            user_budget_result = await self.get_user_budget(user_id)
-            if user_budget_result["status"] != "success":
-                return user_budget_result
+            year, month = resolve_year_month(year, month)
             
-            # Get category budgets
-            category_budgets_result = await self.get_category_budgets(user_id)
-            if category_budgets_result["status"] != "success":
-                return category_budgets_result
+            budget = self.get_budget_with_categories(user_id, year, month)
+            if budget is None:
+                return {"status": "not_found", "message": "No budget found for user"}
             
-            user_budget = user_budget_result["budget"]
-            category_budgets = category_budgets_result["category_budgets"]
+            category_budgets = [
+                format_category_budget(item) for item in budget.pop("budget_categories") if item.get("is_active")
+            ]
+            user_budget = budget
             
             # Calculate totals
             total_allocated = sum(cb["monthly_limit"] for cb in category_budgets)
@@ -268,8 +342,21 @@ class BudgetService:
             logger.error(f"Failed to get budget summary: {str(e)}")
             return {"status": "error", "message": f"Failed to get budget summary: {str(e)}"}
     
-    async def allocate_budget_optimally(self, user_id: str, total_budget: float, categories: Optional[List[str]] = None) -> Dict[str, Any]:
-        """Allocate budget optimally across categories"""
+    async def allocate_budget_optimally(
+        self,
+        user_id: str,
+        total_budget: float,
+        categories: Optional[List[str]] = None,
+        method: str = "research"
+    ) -> Dict[str, Any]:
+        """
+        Allocate budget optimally across categories
+        
+        method="research" uses the fixed optimal_allocations percentages;
+        method="history" uses the user's own monthly spending (see
+        allocate_from_history) and falls back to "research" when there is
+        not enough history.
+        """
         try:
             # Get available categories
             available_categories = await self._get_available_categories(user_id)
@@ -281,6 +368,12 @@ class BudgetService:
             if categories:
                 available_categories = [cat for cat in available_categories if cat["id"] in categories]
             
+            if method == "history":
+                history_result = self.allocate_from_history(user_id, total_budget, available_categories, categories)
+                if history_result:
+                    return history_result
+                logger.info(f"Not enough spending history for user {user_id}, using research based allocation")
+            
             # Create allocation based on optimal percentages
             allocations = []
             total_allocated = 0
@@ -329,6 +422,139 @@ class BudgetService:
             logger.error(f"Failed to allocate budget: {str(e)}")
             return {"status": "error", "message": f"Failed to allocate budget: {str(e)}"}
     
+    def allocate_from_history(
+        self,
+        user_id: str,
+        total_budget: float,
+        available_categories: List[Dict[str, Any]],
+        requested: Optional[List[str]] = None,
+        today: Optional[date] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Allocate from the last BUDGET_HISTORY_MONTHS full months of spending
+        
+        Monthly per-category totals come from the budget_category_spend
+        rollup in one query. Categories the user spent on (plus requested
+        ones) get an equal overrun risk allocation with a floor of
+        BUDGET_ALLOCATION_MIN_FLOOR of the total each.
+        
+        Returns:
+            Allocation result, or None if the user has fewer than
+            BUDGET_HISTORY_MIN_MONTHS months of history
+        """
+        today = today or datetime.now().date()
+        window = settings.BUDGET_HISTORY_MONTHS
+        # Months are indexed as year * 12 + month - 1; the current month is partial and left out
+        end_index = today.year * 12 + today.month - 1
+        start_index = end_index - window
+        
+        rows = self.supabase.table("budget_category_spend").select(
+            "category_id, year, month, spent"
+        ).eq("user_id", user_id).gte("year", start_index // 12).lte("year", today.year).execute().data or []
+        
+        names = {category["id"]: category["name"] for category in available_categories}
+        category_ids = [category_id for category_id in requested or [] if category_id in names]
+        for row in rows:
+            if row["category_id"] in names and row["category_id"] not in category_ids:
+                category_ids.append(row["category_id"])
+        if not category_ids:
+            return None
+        
+        positions = {category_id: index for index, category_id in enumerate(category_ids)}
+        history = np.zeros((len(category_ids), window))
+        for row in rows:
+            month_index = row["year"] * 12 + row["month"] - 1 - start_index
+            if row["category_id"] in positions and 0 <= month_index < window:
+                history[positions[row["category_id"]], month_index] = float(row["spent"] or 0)
+        
+        # Months before the user's first recorded spending are not zero-spend months
+        active_months = np.flatnonzero(history.sum(axis=0))
+        if len(active_months) == 0 or window - active_months[0] < settings.BUDGET_HISTORY_MIN_MONTHS:
+            return None
+        history = history[:, active_months[0]:]
+        
+        floors = np.full(len(category_ids), total_budget * settings.BUDGET_ALLOCATION_MIN_FLOOR)
+        amounts, probabilities, statistics = allocate_by_history(history, total_budget, floors)
+        
+        allocations = []
+        for index, category_id in enumerate(category_ids):
+            share = amounts[index] / total_budget
+            allocations.append({
+                "category_id": category_id,
+                "category_name": names[category_id],
+                "allocated_amount": float(amounts[index]),
+                "percentage": round(float(share) * 100, 1),
+                "expected_spending": round(float(statistics["expected"][index]), 2),
+                "median_spending": round(float(statistics["median"][index]), 2),
+                "monthly_trend": round(float(statistics["trend"][index]), 2),
+                "volatility": round(float(statistics["volatility"][index]), 2),
+                "overrun_probability": round(float(probabilities[index]), 3),
+                "recommendation": self._get_allocation_recommendation(names[category_id], share)
+            })
+        
+        return {
+            "status": "success",
+            "total_budget": total_budget,
+            "allocations": allocations,
+            "allocation_method": "history_based",
+            "history_months": history.shape[1],
+            "generated_at": datetime.now()
+        }
+    
+    def apply_category_limits(
+        self,
+        user_budget_id: str,
+        amounts: Dict[str, float],
+        category_ids: List[str]
+    ) -> int:
+        """
+        Set the month's category limits to exactly amounts (category_id -> limit)
+        
+        Categories with a positive amount are updated or created; active budgets
+        of the other category_ids (the system categories the allocation covers)
+        are deactivated, so those limits add up to the allocated total. Custom
+        category budgets are left unchanged.
+        
+        Returns:
+            Number of category budgets written
+        """
+        applied = [category_id for category_id, amount in amounts.items() if amount > 0]
+        applied_count = 0
+        
+        for category_id in applied:
+            existing = self.supabase.table("budget_categories").select("id").eq("user_budget_id", user_budget_id).eq("category_id", category_id).execute()
+            
+            if existing.data:
+                update_data = {
+                    "monthly_limit": amounts[category_id],
+                    "is_active": True,
+                    "updated_at": datetime.now().isoformat()
+                }
+                result = self.supabase.table("budget_categories").update(update_data).eq("id", existing.data[0]["id"]).execute()
+            else:
+                budget_record = {
+                    "user_budget_id": user_budget_id,
+                    "category_id": category_id,
+                    "monthly_limit": amounts[category_id],
+                    "is_active": True,
+                    "created_at": datetime.now().isoformat(),
+                    "updated_at": datetime.now().isoformat()
+                }
+                result = self.supabase.table("budget_categories").insert(budget_record).execute()
+            
+            if result.data:
+                applied_count += 1
+        
+        # Limits left from an earlier allocation would push the total past the budget
+        stale = [category_id for category_id in category_ids if category_id not in applied]
+        if stale:
+            self.supabase.table("budget_categories").update({
+                "is_active": False,
+                "updated_at": datetime.now().isoformat()
+            }).eq("user_budget_id", user_budget_id).eq("is_active", True).in_("category_id", stale).execute()
+        
+        return applied_count
+    
     async def _auto_allocate_budget(self, user_id: str, total_budget: float):
         """Automatically allocate budget to categories"""
         try:
@@ -0,0 +1,156 @@
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+from app.core.config import settings
+from app.core.notifications import NotificationService, notification_service
+
+logger = logging.getLogger(__name__)
+
+EVENTS_TABLE = "budget_threshold_events"
+
+
+class BudgetThresholdService:
+    """
+    Bütçe eşiği (%50 / %80 / %100) bildirimlerinin arka plan gönderimi
+
+    Ay içi kategori harcaması expense_items / expenses trigger'ları ile
+    budget_category_spend'de tutulur; her yazım sadece kendi farkını ekler
+    ve monthly_limit ile karşılaştırır. Aşılan eşik budget_threshold_events'e
+    yazılır, unique anahtar sayesinde her eşik ayda bir kez oluşur. Bu servis
+    bekleyen olayları claim_budget_threshold_events ile batch halinde alıp
+    NotificationService.send_notifications ile gönderir; gönderilenler ve
+    cihazı olmayan kullanıcılarınkiler 'sent' olarak kapatılır. Gönderim hatası
+    alan olaylar 'processing' kalır ve lease süresi dolunca tekrar claim edilir,
+    max_attempts denemeden sonra gönderilemedi olarak kapatılır. İstek akışında
+    bildirim gönderilmez.
+    """
+
+    def __init__(
+        self,
+        notifier: Optional[NotificationService] = None,
+        supabase_factory: Optional[Callable[[], Any]] = None,
+        batch_size: int = 100,
+        poll_interval: float = 10.0,
+        lease_seconds: int = 300,
+        max_attempts: int = 5
+    ):
+        self.notifier = notifier or notification_service
+        self._supabase_factory = supabase_factory or (lambda: settings.supabase_admin)
+        self.batch_size = max(1, batch_size)
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max(1, max_attempts)
+        self._supabase = None
+        self._task: Optional[asyncio.Task] = None
+        self._wake: Optional[asyncio.Event] = None
+
+    @property
+    def supabase(self):
+        if self._supabase is None:
+            self._supabase = self._supabase_factory()
+        return self._supabase
+
+    def notify(self):
+        """Worker'ı poll aralığını beklemeden uyandır"""
+        if self._wake is not None:
+            self._wake.set()
+
+    async def start(self):
+        """Worker coroutine'ini başlat"""
+        if self._task:
+            return
+        if not self.notifier.fcm_server_key:
+            logger.warning("FCM server key not configured, budget threshold notifications disabled")
+            return
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._worker(), name="budget-thresholds")
+        logger.info("Budget threshold worker started")
+
+    async def stop(self):
+        """Worker'ı durdur; yarım kalan olaylar lease süresi dolunca tekrar claim edilir"""
+        task, self._task = self._task, None
+        if task:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    async def drain_once(self, limit: Optional[int] = None) -> int:
+        """
+        Bir batch bekleyen eşik olayını gönder
+
+        Returns:
+            İşlenen olay sayısı
+        """
+        client = self.supabase
+        events = client.rpc("claim_budget_threshold_events", {
+            "p_limit": limit or self.batch_size,
+            "p_lease_seconds": self.lease_seconds
+        }).execute().data or []
+        if not events:
+            return 0
+
+        # Cihazı olmayan kullanıcıya gönderim tekrar denense de başarılı olmaz
+        tokens = await self.notifier.get_user_fcm_tokens([event["user_id"] for event in events])
+        unreachable = [event for event in events if event["user_id"] in tokens and not tokens[event["user_id"]]]
+        sendable = [event for event in events if event not in unreachable]
+
+        delivered = await self.notifier.send_notifications([self._message(event) for event in sendable]) if sendable else []
+        failed = [event for event, ok in zip(sendable, delivered) if not ok]
+        exhausted = [event for event in failed if (event.get("attempts") or 0) >= self.max_attempts]
+        if len(failed) > len(exhausted):
+            logger.warning(
+                f"{len(failed) - len(exhausted)} budget threshold notifications failed, "
+                f"retrying after {self.lease_seconds}s"
+            )
+
+        self._complete(client, [event for event, ok in zip(sendable, delivered) if ok], True)
+        self._complete(client, unreachable + exhausted, False)
+        return len(events)
+
+    def _message(self, event: Dict[str, Any]) -> Dict:
+        message = self.notifier.budget_alert_message(
+            event["user_id"], event.get("category_name") or "Diğer", float(event["percentage"])
+        )
+        message["data"] = {**message["data"], "threshold": str(event["threshold"])}
+        return message
+
+    @staticmethod
+    def _complete(client, events: List[Dict[str, Any]], delivered: bool):
+        """Olayları 'sent' olarak kapat; kapatılan olay tekrar denenmez"""
+        if not events:
+            return
+        client.table(EVENTS_TABLE).update({
+            "status": "sent",
+            "delivered": delivered,
+            "locked_at": None,
+            "sent_at": datetime.now(timezone.utc).isoformat()
+        }).in_("id", [str(event["id"]) for event in events]).execute()
+
+    async def _worker(self):
+        while True:
+            try:
+                processed = await self.drain_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Budget threshold worker failed to drain: {e}")
+                processed = 0
+
+            if processed:
+                continue
+
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+
+# Global budget threshold service instance
+budget_threshold_service = BudgetThresholdService(
+    batch_size=settings.BUDGET_THRESHOLD_BATCH_SIZE,
+    poll_interval=settings.BUDGET_THRESHOLD_POLL_INTERVAL,
+    lease_seconds=settings.BUDGET_THRESHOLD_LEASE_SECONDS,
+    max_attempts=settings.BUDGET_THRESHOLD_MAX_ATTEMPTS
+)
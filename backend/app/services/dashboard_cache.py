@@ -0,0 +1,122 @@
+import hashlib
+import json
+import threading
+import time
+from dataclasses import dataclass
+from datetime import date
+from typing import Any, Dict, Mapping, Optional
+
+from fastapi.encoders import jsonable_encoder
+
+from app.core.config import settings
+from app.utils.ttl_cache import TTLCache
+
+
+@dataclass
+class DashboardPage:
+    """Serialized dashboard response plus its ETag"""
+    body: bytes
+    etag: str
+    day: date
+    version: int
+    cached_at: float
+
+    def cache_headers(self) -> Dict[str, str]:
+        """Clients keep the body but revalidate on every open"""
+        return {"ETag": self.etag, "Cache-Control": "private, no-cache"}
+
+    def is_not_modified(self, request_headers: Mapping[str, str]) -> bool:
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match is None:
+            return False
+        candidates = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in candidates or self.etag in candidates or f"W/{self.etag}" in candidates
+
+
+class DashboardCache:
+    """
+    user_id -> serialized /reports/dashboard response, versioned per user
+
+    Every write to a user's expenses, budgets or categories calls bump(),
+    which moves the user to a new version and drops the cached page. A page
+    is only served for the version (and day) it was built for; a page whose
+    build started before a bump is never stored. The ETag is a hash of the
+    dashboard content without generated_at, so a rebuilt but unchanged
+    dashboard keeps its ETag and still answers If-None-Match with 304.
+    """
+
+    def __init__(self, ttl_seconds: int = 60, max_entries: int = 10000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._users = TTLCache(max_entries=max_entries, on_evict=self._on_evict)
+        self._lock = threading.Lock()
+        self._counter = 0
+        # Version of users not in the cache; raised on eviction so a build
+        # that started before the eviction cannot store an old page
+        self._base_version = 0
+
+    def version(self, user_id: Any) -> int:
+        """Current version of the user's dashboard; read before building a page"""
+        with self._lock:
+            user = self._users.get(str(user_id))
+            return user["version"] if user else self._base_version
+
+    def bump(self, user_id: Any):
+        """The user's expenses, budgets or categories changed"""
+        user_id = str(user_id)
+        with self._lock:
+            self._counter += 1
+            self._users.put(user_id, {"version": self._counter, "page": None})
+
+    def get(self, user_id: Any, day: Optional[date] = None) -> Optional[DashboardPage]:
+        day = day or date.today()
+        with self._lock:
+            user = self._users.get(str(user_id))
+            page = user["page"] if user else None
+            if page is None:
+                return None
+            if page.day != day or time.monotonic() - page.cached_at > self.ttl_seconds:
+                user["page"] = None
+                return None
+            return page
+
+    def build_page(self, response: Dict[str, Any], version: int, day: Optional[date] = None) -> DashboardPage:
+        """Serialize a dashboard response; the ETag ignores generated_at"""
+        payload = jsonable_encoder(response)
+        content = {key: value for key, value in payload.items() if key != "generated_at"}
+        digest = hashlib.sha256(json.dumps(content, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+        return DashboardPage(
+            body=json.dumps(payload, separators=(",", ":")).encode(),
+            etag=f'"{digest[:32]}"',
+            day=day or date.today(),
+            version=version,
+            cached_at=time.monotonic()
+        )
+
+    def put(self, user_id: Any, page: DashboardPage) -> bool:
+        """Store the page unless the user's version moved on while it was built"""
+        if self.ttl_seconds <= 0:
+            return False
+        user_id = str(user_id)
+        with self._lock:
+            user = self._users.get(user_id)
+            current = user["version"] if user else self._base_version
+            if page.version != current:
+                return False
+            self._users.put(user_id, {"version": current, "page": page})
+            return True
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+            self._counter += 1
+            self._base_version = self._counter
+
+    def _on_evict(self, user_id: str, user: Dict[str, Any]):
+        self._base_version = self._counter
+
+
+dashboard_cache = DashboardCache(
+    ttl_seconds=settings.DASHBOARD_CACHE_TTL,
+    max_entries=settings.DASHBOARD_CACHE_SIZE
+)
@@ -5,12 +5,34 @@ Handles data formatting, validation, and standardization.
 
 import re
 import logging
-from typing import Dict, Any, List, Optional, Union
+from typing import Dict, Any, List, Optional, Union, Tuple, Iterable, Callable
 from datetime import datetime, date
 from decimal import Decimal, InvalidOperation
 
+from app.utils.date_parser import parse_datetimes, parse_datetime
+
 logger = logging.getLogger(__name__)
 
+# Patterns for cleaning text data (compiled once at import)
+TEXT_CLEANING_PATTERNS = {
+    'excessive_whitespace': re.compile(r'\s+'),
+    'special_chars': re.compile(r'[^\w\s\-\.ÇĞIİÖŞÜçğıiöşü]'),
+    'multiple_dots': re.compile(r'\.{2,}'),
+    'multiple_dashes': re.compile(r'\-{2,}'),
+    'leading_trailing_special': re.compile(r'^[\-\.\s]+|[\-\.\s]+$')
+}
+
+AMOUNT_STRIP_PATTERN = re.compile(r'[^\d.,\-]')
+PLAIN_DECIMAL_PATTERN = re.compile(r'^-?\d+(?:\.\d+)?$')
+NON_DIGIT_PATTERN = re.compile(r'\D')
+KDV_STRIP_PATTERN = re.compile(r'[^\d.]')
+CATEGORY_HINT_STRIP_PATTERN = re.compile(r'[^\w\s]')
+
+VALID_KDV_RATES = (1.0, 10.0, 20.0)
+
+# Memoized merchant names; cleared when full
+MERCHANT_CACHE_SIZE = 4096
+
 class DataCleaningError(Exception):
     """Custom exception for data cleaning errors"""
     pass
@@ -52,13 +74,19 @@ class DataCleaner:
         }
         
         # Patterns for cleaning text data
-        self.text_cleaning_patterns = {
-            'excessive_whitespace': r'\s+',
-            'special_chars': r'[^\w\s\-\.ÇĞIİÖŞÜçğıiöşü]',
-            'multiple_dots': r'\.{2,}',
-            'multiple_dashes': r'\-{2,}',
-            'leading_trailing_special': r'^[\-\.\s]+|[\-\.\s]+$'
+        self.text_cleaning_patterns = TEXT_CLEANING_PATTERNS
+        
+        # Reverse merchant index: variant -> canonical display name, plus one
+        # alternation (longest variant first) for names containing a variant
+        self.merchant_index = {
+            variation: standard_name.title()
+            for standard_name, variations in self.merchant_standardizations.items()
+            for variation in variations
         }
+        self.merchant_variant_pattern = re.compile('|'.join(
+            re.escape(variation) for variation in sorted(self.merchant_index, key=len, reverse=True)
+        ))
+        self._merchant_cache: Dict[str, str] = {}
 
     async def clean_receipt_data(self, receipt_data: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -203,37 +231,141 @@ class DataCleaner:
         Returns:
             List of cleaned expense data
         """
-        cleaned_expenses = []
+        cleaned_expenses, errors = self.clean_expenses_batch(expenses_list)
         
-        for i, expense in enumerate(expenses_list):
-            try:
-                cleaned_expense = await self.clean_expense_data(expense)
-                cleaned_expenses.append(cleaned_expense)
-            except DataCleaningError as e:
-                logger.warning(f"Failed to clean expense {i}: {str(e)}")
+        for i, error in errors.items():
+            logger.warning(f"Failed to clean expense {i}: {error}")
+        
+        return [expense for expense in cleaned_expenses if expense is not None]
+
+    def clean_expenses_batch(
+        self,
+        expenses_list: List[Dict[str, Any]]
+    ) -> Tuple[List[Optional[Dict[str, Any]]], Dict[int, str]]:
+        """
+        Clean expense records column by column
+        
+        Same rules as clean_expense_data, but every field is cleaned as one
+        column and each distinct value is cleaned only once, which is where
+        receipt batches spend most of their time (repeated descriptions,
+        dates, KDV rates).
+        
+        Args:
+            expenses_list: List of expense data dictionaries
+            
+        Returns:
+            (cleaned rows aligned with the input, None for rejected rows;
+             {row index: error message} for the rejected rows)
+        """
+        from app.utils.kdv_calculator import KDVCalculator
+        
+        rows = [expense.copy() for expense in expenses_list]
+        errors: Dict[int, str] = {}
+        
+        descriptions = self.clean_text_column(row.get('description') for row in rows)
+        amounts = self.clean_amount_column(row.get('amount') or 0 for row in rows)
+        quantities = self._clean_column((row.get('quantity') for row in rows), self._clean_quantity)
+        unit_prices = self.clean_amount_column(row.get('unit_price') or 0 for row in rows)
+        kdv_rates = self._clean_column((row.get('kdv_rate') for row in rows), self._clean_kdv_rate)
+        dates = parse_datetimes(row.get('expense_date') for row in rows)
+        notes = self.clean_text_column((row.get('notes') for row in rows), max_length=500)
+        category_hints = self._clean_column((row.get('category_hint') for row in rows), self._clean_category_hint)
+        suggested_kdv: Dict[str, float] = {}
+        
+        cleaned_rows: List[Optional[Dict[str, Any]]] = []
+        for i, row in enumerate(rows):
+            if not row.get('amount'):
+                errors[i] = "Amount is required"
+                cleaned_rows.append(None)
                 continue
-            except Exception as e:
-                logger.error(f"Unexpected error cleaning expense {i}: {str(e)}")
+            if amounts[i] <= 0:
+                errors[i] = "Amount must be positive"
+                cleaned_rows.append(None)
                 continue
+            
+            description = descriptions[i] if row.get('description') else 'Unknown Expense'
+            row['description'] = description
+            row['amount'] = amounts[i]
+            row['quantity'] = quantities[i] if row.get('quantity') else 1
+            
+            if row.get('unit_price'):
+                row['unit_price'] = unit_prices[i]
+            elif row['quantity'] > 0:
+                row['unit_price'] = round(row['amount'] / row['quantity'], 2)
+            
+            if row.get('kdv_rate'):
+                row['kdv_rate'] = kdv_rates[i]
+            else:
+                if description not in suggested_kdv:
+                    suggested_kdv[description] = KDVCalculator.suggest_kdv_rate_by_description(description)
+                row['kdv_rate'] = suggested_kdv[description]
+            
+            if row.get('expense_date'):
+                row['expense_date'] = (dates[i] or datetime.now()).isoformat()
+            else:
+                row['expense_date'] = datetime.now()
+            
+            if row.get('notes'):
+                row['notes'] = notes[i]
+            
+            if row.get('category_hint'):
+                row['category_hint'] = category_hints[i]
+            
+            cleaned_rows.append(row)
         
-        return cleaned_expenses
+        return cleaned_rows, errors
+
+    def clean_text_column(self, values: Iterable[Any], max_length: int = 200) -> List[str]:
+        """Clean a column of text values, each distinct value once"""
+        return self._clean_column(values, lambda value: self._clean_text(value, max_length=max_length))
+
+    def clean_amount_column(self, values: Iterable[Any]) -> List[float]:
+        """Clean a column of monetary amounts, each distinct value once"""
+        return self._clean_column(values, self._clean_amount)
+
+    def clean_merchant_column(self, values: Iterable[Any]) -> List[str]:
+        """Clean and standardize a column of merchant names"""
+        return self._clean_column(values, self._clean_merchant_name)
+
+    @staticmethod
+    def _clean_column(values: Iterable[Any], clean: Callable[[Any], Any]) -> List[Any]:
+        """Apply clean() to a column, reusing results for repeated values"""
+        cleaned: Dict[Any, Any] = {}
+        result = []
+        for value in values:
+            try:
+                result.append(cleaned[value])
+            except KeyError:
+                cleaned[value] = clean(value)
+                result.append(cleaned[value])
+            except TypeError:
+                # Unhashable value: clean it without memoizing
+                result.append(clean(value))
+        return result
 
     def _clean_merchant_name(self, merchant_name: str) -> str:
         """Clean and standardize merchant name"""
         if not merchant_name:
             return "Unknown Merchant"
         
+        cached = self._merchant_cache.get(merchant_name)
+        if cached is not None:
+            return cached
+        
         # Basic text cleaning
         cleaned = self._clean_text(merchant_name, max_length=100)
         cleaned_lower = cleaned.lower()
         
-        # Check for standardizations
-        for standard_name, variations in self.merchant_standardizations.items():
-            for variation in variations:
-                if variation in cleaned_lower:
-                    return standard_name.title()
+        # Check for standardizations: exact variant first, then any contained variant
+        standardized = self.merchant_index.get(cleaned_lower)
+        if standardized is None:
+            match = self.merchant_variant_pattern.search(cleaned_lower)
+            standardized = self.merchant_index[match.group(0)] if match else cleaned
         
-        return cleaned
+        if len(self._merchant_cache) >= MERCHANT_CACHE_SIZE:
+            self._merchant_cache.clear()
+        self._merchant_cache[merchant_name] = standardized
+        return standardized
 
     def _clean_amount(self, amount: Union[str, int, float, Decimal]) -> float:
         """Clean and validate monetary amount"""
@@ -247,8 +379,12 @@ class DataCleaner:
             return round(float(amount), 2)
         
         if isinstance(amount, str):
+            # Fast path: plain "123" / "-45.60"
+            if PLAIN_DECIMAL_PATTERN.match(amount):
+                return round(float(amount), 2)
+            
             # Remove currency symbols and clean
-            cleaned = re.sub(r'[^\d.,\-]', '', str(amount))
+            cleaned = AMOUNT_STRIP_PATTERN.sub('', amount)
             
             if not cleaned or cleaned in ['-', '.', ',']:
                 return 0.0
@@ -289,7 +425,7 @@ class DataCleaner:
         
         if isinstance(quantity, str):
             # Extract numeric part
-            numeric_part = re.sub(r'[^\d]', '', str(quantity))
+            numeric_part = NON_DIGIT_PATTERN.sub('', quantity)
             if numeric_part:
                 try:
                     qty = int(numeric_part)
@@ -319,55 +455,10 @@ class DataCleaner:
 
     def _clean_date(self, date_input: Union[str, datetime, date]) -> str:
         """Clean and validate date, return as ISO string for JSON serialization"""
-        if isinstance(date_input, datetime):
-            return date_input.isoformat()
-        
-        if isinstance(date_input, date):
-            return datetime.combine(date_input, datetime.min.time()).isoformat()
-        
-        if isinstance(date_input, str):
-            # If already ISO format, validate and return
-            if 'T' in date_input and ('Z' in date_input or '+' in date_input):
-                try:
-                    # Parse to validate, then return as ISO
-                    parsed = datetime.fromisoformat(date_input.replace('Z', '+00:00'))
-                    return parsed.isoformat()
-                except ValueError:
-                    pass
-            
-            # Try to parse various date formats
-            date_formats = [
-                '%Y-%m-%d %H:%M:%S',
-                '%Y-%m-%d %H:%M',
-                '%Y-%m-%d',
-                '%d/%m/%Y %H:%M:%S',
-                '%d/%m/%Y %H:%M',
-                '%d/%m/%Y',
-                '%d.%m.%Y %H:%M:%S',
-                '%d.%m.%Y %H:%M',
-                '%d.%m.%Y',
-                '%d-%m-%Y %H:%M:%S',
-                '%d-%m-%Y %H:%M',
-                '%d-%m-%Y'
-            ]
-            
-            for fmt in date_formats:
-                try:
-                    parsed_date = datetime.strptime(date_input.strip(), fmt)
-                    return parsed_date.isoformat()
-                except ValueError:
-                    continue
-            
-            # Try dateutil parser as fallback
-            try:
-                from dateutil import parser as date_parser
-                parsed_date = date_parser.parse(date_input, dayfirst=True)
-                return parsed_date.isoformat()
-            except Exception:
-                pass
+        parsed = parse_datetime(date_input)
         
         # Return current datetime as ISO string if parsing fails
-        return datetime.now().isoformat()
+        return (parsed or datetime.now()).isoformat()
 
     def _clean_tax_number(self, tax_number: str) -> Optional[str]:
         """Clean and validate tax number"""
@@ -375,7 +466,7 @@ class DataCleaner:
             return None
         
         # Extract only digits
-        digits_only = re.sub(r'\D', '', str(tax_number))
+        digits_only = NON_DIGIT_PATTERN.sub('', str(tax_number))
         
         # Turkish tax numbers are 10 or 11 digits
         if len(digits_only) in [10, 11]:
@@ -392,23 +483,23 @@ class DataCleaner:
         
         if not preserve_structure:
             # Remove excessive whitespace
-            text = re.sub(self.text_cleaning_patterns['excessive_whitespace'], ' ', text)
+            text = self.text_cleaning_patterns['excessive_whitespace'].sub(' ', text)
             
             # Remove unwanted special characters but preserve Turkish characters
-            text = re.sub(self.text_cleaning_patterns['special_chars'], '', text)
+            text = self.text_cleaning_patterns['special_chars'].sub('', text)
             
             # Clean up multiple dots and dashes
-            text = re.sub(self.text_cleaning_patterns['multiple_dots'], '.', text)
-            text = re.sub(self.text_cleaning_patterns['multiple_dashes'], '-', text)
+            text = self.text_cleaning_patterns['multiple_dots'].sub('.', text)
+            text = self.text_cleaning_patterns['multiple_dashes'].sub('-', text)
             
             # Remove leading/trailing special characters
-            text = re.sub(self.text_cleaning_patterns['leading_trailing_special'], '', text)
+            text = self.text_cleaning_patterns['leading_trailing_special'].sub('', text)
             
             # Capitalize properly
             text = ' '.join(word.capitalize() for word in text.split())
         else:
             # Minimal cleaning for structured data
-            text = re.sub(r'\s+', ' ', text)
+            text = self.text_cleaning_patterns['excessive_whitespace'].sub(' ', text)
         
         # Limit length
         if len(text) > max_length:
@@ -425,10 +516,10 @@ class DataCleaner:
         cleaned = category_hint.lower().strip()
         
         # Remove special characters
-        cleaned = re.sub(r'[^\w\s]', '', cleaned)
+        cleaned = CATEGORY_HINT_STRIP_PATTERN.sub('', cleaned)
         
         # Replace spaces with underscores
-        cleaned = re.sub(r'\s+', '_', cleaned)
+        cleaned = self.text_cleaning_patterns['excessive_whitespace'].sub('_', cleaned)
         
         return cleaned
 
@@ -547,11 +638,15 @@ class DataCleaner:
         if kdv_rate is None:
             return 20.0  # Default to most common rate
         
+        # Fast path: already a valid rate
+        if kdv_rate in VALID_KDV_RATES:
+            return float(kdv_rate)
+        
         if isinstance(kdv_rate, (int, float)):
             rate = float(kdv_rate)
         elif isinstance(kdv_rate, str):
             # Remove any non-numeric characters except decimal point
-            cleaned = re.sub(r'[^\d.]', '', str(kdv_rate))
+            cleaned = KDV_STRIP_PATTERN.sub('', kdv_rate)
             try:
                 rate = float(cleaned)
             except ValueError:
@@ -560,10 +655,8 @@ class DataCleaner:
             return 20.0
         
         # Validate against allowed KDV rates in Turkey
-        valid_rates = [1.0, 10.0, 20.0]
-        
         # Find closest valid rate
-        closest_rate = min(valid_rates, key=lambda x: abs(x - rate))
+        closest_rate = min(VALID_KDV_RATES, key=lambda x: abs(x - rate))
         
         # If the input rate is close enough to a valid rate, use it
         if abs(rate - closest_rate) <= 1.0:
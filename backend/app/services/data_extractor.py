@@ -9,6 +9,8 @@ from typing import Dict, Any, List, Optional, Tuple
 from datetime import datetime
 from decimal import Decimal, InvalidOperation
 
+from app.utils.receipt_lexer import LexedItem, receipt_lexer
+
 logger = logging.getLogger(__name__)
 
 class DataExtractionError(Exception):
@@ -19,18 +21,8 @@ class DataExtractor:
     """Service for extracting expense data from parsed receipt information"""
     
     def __init__(self):
-        # Common item patterns in Turkish receipts
-        self.item_patterns = {
-            'item_line': [
-                r'(\d+)\s*x?\s*([A-ZÇĞIİÖŞÜa-zçğıiöşü\s\-\.]+)\s+([0-9]+[.,][0-9]{2})',
-                r'([A-ZÇĞIİÖŞÜa-zçğıiöşü\s\-\.]+)\s+(\d+)\s*x\s*([0-9]+[.,][0-9]{2})',
-                r'([A-ZÇĞIİÖŞÜa-zçğıiöşü\s\-\.]+)\s+([0-9]+[.,][0-9]{2})'
-            ],
-            'price_patterns': [
-                r'([0-9]+[.,][0-9]{2})\s*(?:tl|try|₺)',
-                r'([0-9]+[.,][0-9]{2})'
-            ]
-        }
+        # Raw receipt text is tokenized line by line by the shared lexer
+        self.lexer = receipt_lexer
         
         # Common Turkish product categories for basic classification
         self.category_keywords = {
@@ -121,63 +113,27 @@ class DataExtractor:
         return expenses
 
     async def _extract_items_from_raw_data(self, receipt_data: Dict[str, Any]) -> List[Dict[str, Any]]:
-        """Extract items from raw QR data using pattern matching"""
+        """Extract items from raw QR data with the single-pass receipt lexer"""
         expenses = []
         raw_data = receipt_data.get('raw_qr_data', '')
         
         if not raw_data:
             return expenses
         
-        lines = raw_data.split('\n')
-        
-        for line in lines:
-            line = line.strip()
-            if not line or len(line) < 5:  # Skip very short lines
+        for item in self.lexer.extract_items(raw_data):
+            try:
+                expenses.append(self._create_expense_from_item(item, receipt_data))
+            except Exception as e:
+                logger.warning(f"Failed to create expense from line {item.line_number}: {str(e)}")
                 continue
-            
-            # Try different item patterns
-            for pattern in self.item_patterns['item_line']:
-                match = re.search(pattern, line, re.IGNORECASE)
-                if match:
-                    try:
-                        expense = self._create_expense_from_match(match, receipt_data)
-                        if expense:
-                            expenses.append(expense)
-                        break  # Use first matching pattern
-                    except Exception as e:
-                        logger.warning(f"Failed to create expense from line '{line}': {str(e)}")
-                        continue
         
         return expenses
 
-    def _create_expense_from_match(self, match: re.Match, receipt_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
-        """Create expense from regex match"""
-        groups = match.groups()
-        
-        if len(groups) == 3:
-            # Pattern: quantity x description price or description quantity x price
-            if groups[0].isdigit():
-                quantity = int(groups[0])
-                description = groups[1].strip()
-                amount = self._parse_amount(groups[2])
-            elif groups[1].isdigit():
-                description = groups[0].strip()
-                quantity = int(groups[1])
-                amount = self._parse_amount(groups[2])
-            else:
-                return None
-        elif len(groups) == 2:
-            # Pattern: description price
-            description = groups[0].strip()
-            amount = self._parse_amount(groups[1])
-            quantity = 1
-        else:
-            return None
-        
-        if not amount or amount <= 0:
-            return None
-        
-        description = self._clean_description(description)
+    def _create_expense_from_item(self, item: LexedItem, receipt_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Create expense from a lexed receipt line"""
+        description = self._clean_description(item.description)
+        quantity = item.quantity
+        amount = item.amount
         
         # Add KDV rate suggestion based on description
         from app.utils.kdv_calculator import KDVCalculator
@@ -3,10 +3,13 @@ Main data processing service that coordinates QR parsing, data extraction,
 cleaning, and AI categorization services.
 """
 
+import asyncio
 import logging
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, AsyncIterator, Set, Tuple
 from datetime import datetime
 
+from app.core.config import settings
+
 from .qr_parser import qr_parser, QRParsingError
 from .data_extractor import data_extractor, DataExtractionError
 from .data_cleaner import data_cleaner, DataCleaningError
@@ -14,6 +17,21 @@ from .ai_categorizer import ai_categorizer
 
 logger = logging.getLogger(__name__)
 
+# Bulk ingestion pipeline stages, in order
+BULK_STAGES = ('prepare', 'categorize', 'validate', 'write')
+
+# Default workers per bulk stage; CPU-only stages gain nothing from more
+# than one worker on a single event loop
+BULK_STAGE_WORKERS = {
+    'prepare': 1,
+    'categorize': settings.BULK_INGEST_CATEGORIZE_WORKERS,
+    'validate': 1,
+    'write': 1
+}
+
+# Tells a pipeline stage worker that its input is exhausted
+_STAGE_DONE = object()
+
 class DataProcessingError(Exception):
     """Custom exception for data processing errors"""
     pass
@@ -57,7 +75,7 @@ class DataProcessor:
             # Step 1: Parse QR code data
             try:
                 logger.info("Step 1: Parsing QR code data")
-                parsed_receipt = await self.qr_parser.parse_qr_data(qr_data)
+                parsed_receipt = self.qr_parser.parse(qr_data)
                 
                 # Check if this is an EcoTrack receipt URL
                 if parsed_receipt.get('is_ecotrack_receipt'):
@@ -417,6 +435,383 @@ class DataProcessor:
             logger.error(error_msg)
             raise DataProcessingError(error_msg)
 
+    async def process_receipts_bulk(
+        self,
+        receipts: List[Dict[str, Any]],
+        user_id: str,
+        supabase,
+        stage_workers: Optional[Dict[str, int]] = None,
+        queue_size: Optional[int] = None,
+        cpu_batch_size: int = 16,
+        write_batch_size: Optional[int] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Process many receipts through a bounded, staged pipeline
+        
+        prepare (parse/extract/clean) -> categorize -> validate -> write.
+        Stages are connected by bounded queues, so a slow database or a slow
+        consumer stalls the stages upstream instead of buffering the whole
+        request. CPU stages work on batches, identical item descriptions at
+        the same merchant are categorized once per call, and each write
+        batch is one multi-row insert per table.
+        
+        Args:
+            receipts: Entries with either 'qr_data' or structured receipt fields
+                (merchant_name, transaction_date, total_amount, currency, items)
+            user_id: User ID for the created records
+            supabase: Supabase client used for the writes
+            stage_workers: Per-stage worker count overrides (see BULK_STAGE_WORKERS);
+                counts below 1 run the stage with a single worker
+            queue_size: Capacity of each inter-stage queue
+            cpu_batch_size: Max entries a prepare/validate worker takes at once
+            write_batch_size: Max receipts coalesced into one insert
+            
+        Yields:
+            Per-receipt results in completion order, keyed by input 'index'
+        """
+        # Every stage needs at least one worker, and exactly as many done
+        # markers as workers, or the pipeline never finishes
+        workers = {
+            name: max(1, count) for name, count in {**BULK_STAGE_WORKERS, **(stage_workers or {})}.items()
+        }
+        queue_size = queue_size or settings.BULK_INGEST_QUEUE_SIZE
+        write_batch_size = write_batch_size or settings.BULK_INGEST_WRITE_BATCH_SIZE
+        
+        inboxes = {name: asyncio.Queue(maxsize=queue_size) for name in BULK_STAGES}
+        results: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        categorizations: Dict[Tuple[str, str], asyncio.Future] = {}
+        
+        categories_response = supabase.table("categories").select("id, name").execute()
+        category_ids = {row["name"]: row["id"] for row in categories_response.data or []}
+        
+        handlers = {
+            'prepare': (
+                lambda batch, forwarded: self._bulk_prepare(batch, forwarded, inboxes['categorize'], results),
+                cpu_batch_size
+            ),
+            'categorize': (
+                lambda batch, forwarded: self._bulk_categorize(batch, forwarded, categorizations, inboxes['validate']),
+                1
+            ),
+            'validate': (
+                lambda batch, forwarded: self._bulk_validate(batch, forwarded, inboxes['write'], results),
+                cpu_batch_size
+            ),
+            'write': (
+                lambda batch, forwarded: self._bulk_write(batch, forwarded, user_id, supabase, category_ids, results),
+                write_batch_size
+            ),
+        }
+        
+        async def feed():
+            for index, entry in enumerate(receipts):
+                await inboxes['prepare'].put({'index': index, 'entry': entry, 'warnings': []})
+            for _ in range(workers['prepare']):
+                await inboxes['prepare'].put(_STAGE_DONE)
+        
+        async def run_stage(name: str, next_inbox: asyncio.Queue, next_workers: int):
+            handler, batch_size = handlers[name]
+            await asyncio.gather(*(
+                self._bulk_stage_worker(inboxes[name], handler, batch_size, results)
+                for _ in range(workers[name])
+            ))
+            for _ in range(next_workers):
+                await next_inbox.put(_STAGE_DONE)
+        
+        tasks = [asyncio.create_task(feed())]
+        for position, name in enumerate(BULK_STAGES):
+            if position + 1 < len(BULK_STAGES):
+                next_stage = BULK_STAGES[position + 1]
+                tasks.append(asyncio.create_task(
+                    run_stage(name, inboxes[next_stage], workers[next_stage])
+                ))
+            else:
+                tasks.append(asyncio.create_task(run_stage(name, results, 1)))
+        
+        try:
+            while True:
+                result = await results.get()
+                if result is _STAGE_DONE:
+                    break
+                yield result
+        finally:
+            # Consumer went away early (e.g. client disconnect): stop all stages
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+            for pending in categorizations.values():
+                if not pending.done():
+                    pending.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    @staticmethod
+    async def _bulk_stage_worker(inbox: asyncio.Queue, handler, batch_size: int, results: asyncio.Queue):
+        """
+        Pull up to batch_size ready jobs at a time and hand them to the stage handler
+        
+        The handler adds the index of every job it passed on (to the next stage
+        or as a result) to forwarded; if it raises, only the other jobs of the
+        batch get an error result, so no index is reported twice.
+        """
+        done = False
+        while not done:
+            first = await inbox.get()
+            if first is _STAGE_DONE:
+                return
+            
+            batch = [first]
+            while len(batch) < batch_size:
+                try:
+                    queued = inbox.get_nowait()
+                except asyncio.QueueEmpty:
+                    break
+                if queued is _STAGE_DONE:
+                    done = True
+                    break
+                batch.append(queued)
+            
+            forwarded: Set[int] = set()
+            try:
+                await handler(batch, forwarded)
+            except Exception as e:
+                failed = [job for job in batch if job['index'] not in forwarded]
+                logger.error(f"Bulk pipeline stage failed for {len(failed)} receipts: {str(e)}")
+                for job in failed:
+                    await results.put(DataProcessor._bulk_result(job, errors=[str(e)]))
+
+    async def _bulk_prepare(
+        self,
+        batch: List[Dict[str, Any]],
+        forwarded: Set[int],
+        outbox: asyncio.Queue,
+        results: asyncio.Queue
+    ):
+        """CPU stage: parse/normalize, extract and clean a batch of receipts"""
+        ready = []
+        for job in batch:
+            try:
+                entry = job['entry']
+                if entry.get('qr_data'):
+                    parsed_receipt = self.qr_parser.parse(entry['qr_data'])
+                    if parsed_receipt.get('is_ecotrack_receipt'):
+                        raise DataProcessingError("EcoTrack receipt URLs must be claimed via /receipts/scan")
+                    source = 'qr_scan'
+                else:
+                    parsed_receipt = {
+                        'merchant_name': entry.get('merchant_name'),
+                        'transaction_date': entry.get('transaction_date') or datetime.now(),
+                        'total_amount': entry.get('total_amount'),
+                        'currency': entry.get('currency') or 'TRY',
+                        'items': [
+                            {**item, 'name': item.get('item_name') or item.get('name') or item.get('description')}
+                            for item in entry.get('items') or []
+                        ],
+                        'parsing_confidence': 100.0,
+                        'parsing_errors': []
+                    }
+                    source = 'bulk_upload'
+                
+                extracted_expenses = await self.data_extractor.extract_expenses_from_receipt(parsed_receipt)
+                
+                # Extraction suggests KDV rates; keep explicit ones from structured items
+                input_items = parsed_receipt.get('items') or []
+                if source == 'bulk_upload' and len(input_items) == len(extracted_expenses):
+                    for item, expense in zip(input_items, extracted_expenses):
+                        if item.get('kdv_rate'):
+                            expense['kdv_rate'] = item['kdv_rate']
+                
+                cleaned_receipt = await self.data_cleaner.clean_receipt_data({
+                    'raw_qr_data': entry.get('qr_data'),
+                    'merchant_name': parsed_receipt.get('merchant_name'),
+                    'transaction_date': parsed_receipt.get('transaction_date') or datetime.now(),
+                    'total_amount': parsed_receipt.get('total_amount'),
+                    'currency': parsed_receipt.get('currency', 'TRY'),
+                    'source': source
+                })
+                
+                job['warnings'].extend(parsed_receipt.get('parsing_errors') or [])
+                job['receipt'] = cleaned_receipt
+                job['items'] = extracted_expenses
+                job['confidence'] = parsed_receipt.get('parsing_confidence', 0.0)
+                ready.append(job)
+                
+            except Exception as e:
+                await results.put(self._bulk_result(job, errors=[str(e)]))
+                forwarded.add(job['index'])
+        
+        # Clean the items of the whole batch as one set of columns
+        cleaned_items, item_errors = self.data_cleaner.clean_expenses_batch(
+            [expense for job in ready for expense in job['items']]
+        )
+        offset = 0
+        for job in ready:
+            count = len(job['items'])
+            job['items'] = [item for item in cleaned_items[offset:offset + count] if item is not None]
+            for position in range(offset, offset + count):
+                if position in item_errors:
+                    job['warnings'].append(f"Failed to process expense item: {item_errors[position]}")
+            offset += count
+            
+            if not job['receipt'].get('total_amount'):
+                job['receipt']['total_amount'] = round(sum(item['amount'] for item in job['items']), 2)
+            
+            await outbox.put(job)
+            forwarded.add(job['index'])
+
+    async def _bulk_categorize(
+        self,
+        batch: List[Dict[str, Any]],
+        forwarded: Set[int],
+        categorizations: Dict[Tuple[str, str], asyncio.Future],
+        outbox: asyncio.Queue
+    ):
+        """I/O stage: categorize items, sharing one call per (description, merchant)"""
+        for job in batch:
+            merchant_name = job['receipt'].get('merchant_name')
+            
+            def categorize(item: Dict[str, Any]) -> asyncio.Future:
+                key = (item['description'].casefold(), (merchant_name or '').casefold())
+                pending = categorizations.get(key)
+                if pending is None:
+                    pending = asyncio.ensure_future(self.ai_categorizer.categorize_expense(
+                        description=item['description'],
+                        merchant_name=merchant_name,
+                        amount=item['amount']
+                    ))
+                    categorizations[key] = pending
+                return asyncio.shield(pending)
+            
+            outcomes = await asyncio.gather(
+                *(categorize(item) for item in job['items']),
+                return_exceptions=True
+            )
+            
+            for item, categorization in zip(job['items'], outcomes):
+                if isinstance(categorization, Exception):
+                    job['warnings'].append(f"Categorization failed for '{item['description']}': {categorization}")
+                    continue
+                item['category_hint'] = categorization.get('category')
+                item['category_name'] = categorization.get('category_name')
+                item['category_confidence'] = categorization.get('confidence')
+                item['categorization_method'] = categorization.get('method')
+            
+            await outbox.put(job)
+            forwarded.add(job['index'])
+
+    async def _bulk_validate(
+        self,
+        batch: List[Dict[str, Any]],
+        forwarded: Set[int],
+        outbox: asyncio.Queue,
+        results: asyncio.Queue
+    ):
+        """CPU stage: integrity checks; receipts without items stop here"""
+        ready = []
+        for job in batch:
+            validation_result = await self.data_cleaner.validate_data_integrity(job['receipt'], job['items'])
+            job['warnings'].extend(validation_result['warnings'])
+            
+            if not job['items']:
+                await results.put(self._bulk_result(
+                    job, errors=validation_result['errors'] or ["No expenses could be extracted from receipt"]
+                ))
+                forwarded.add(job['index'])
+                continue
+            
+            # Total mismatches are reported but not fatal, as in process_qr_receipt
+            job['warnings'].extend(validation_result['errors'])
+            ready.append(job)
+        
+        for job in ready:
+            await outbox.put(job)
+            forwarded.add(job['index'])
+
+    async def _bulk_write(
+        self,
+        batch: List[Dict[str, Any]],
+        forwarded: Set[int],
+        user_id: str,
+        supabase,
+        category_ids: Dict[str, str],
+        results: asyncio.Queue
+    ):
+        """DB stage: one multi-row insert per table for the whole batch"""
+        receipts_response = supabase.table("receipts").insert([
+            {
+                'user_id': user_id,
+                'merchant_name': job['receipt'].get('merchant_name'),
+                'transaction_date': job['receipt'].get('transaction_date'),
+                'total_amount': job['receipt'].get('total_amount'),
+                'currency': job['receipt'].get('currency', 'TRY'),
+                'source': job['receipt'].get('source'),
+                'raw_qr_data': job['receipt'].get('raw_qr_data')
+            }
+            for job in batch
+        ]).execute()
+        receipt_rows = receipts_response.data or []
+        if len(receipt_rows) != len(batch):
+            raise DataProcessingError("Failed to create receipts")
+        
+        try:
+            expenses_response = supabase.table("expenses").insert([
+                {
+                    'receipt_id': receipt_row['id'],
+                    'user_id': user_id,
+                    'total_amount': job['receipt'].get('total_amount'),
+                    'expense_date': job['receipt'].get('transaction_date'),
+                    'notes': f"Bulk import from {job['receipt'].get('merchant_name') or 'Unknown merchant'}"
+                }
+                for job, receipt_row in zip(batch, receipt_rows)
+            ]).execute()
+            expense_rows = expenses_response.data or []
+            if len(expense_rows) != len(batch):
+                raise DataProcessingError("Failed to create expenses")
+            
+            supabase.table("expense_items").insert([
+                {
+                    'expense_id': expense_row['id'],
+                    'user_id': user_id,
+                    'category_id': category_ids.get(item.get('category_name')),
+                    'description': item['description'],
+                    'amount': item['amount'],
+                    'quantity': item.get('quantity', 1),
+                    'unit_price': item.get('unit_price'),
+                    'kdv_rate': item.get('kdv_rate'),
+                    'notes': item.get('notes')
+                }
+                for job, expense_row in zip(batch, expense_rows)
+                for item in job['items']
+            ]).execute()
+        except Exception:
+            # Receipts cascade to expenses and items: leave no partial rows behind
+            supabase.table("receipts").delete().in_("id", [row['id'] for row in receipt_rows]).execute()
+            raise
+        
+        for job, receipt_row, expense_row in zip(batch, receipt_rows, expense_rows):
+            await results.put(self._bulk_result(job, receipt_id=receipt_row['id'], expense_id=expense_row['id']))
+            forwarded.add(job['index'])
+
+    @staticmethod
+    def _bulk_result(
+        job: Dict[str, Any],
+        errors: Optional[List[str]] = None,
+        receipt_id: Optional[str] = None,
+        expense_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+        receipt = job.get('receipt') or {}
+        return {
+            'index': job['index'],
+            'success': not errors,
+            'receipt_id': receipt_id,
+            'expense_id': expense_id,
+            'merchant_name': receipt.get('merchant_name'),
+            'total_amount': receipt.get('total_amount'),
+            'items_count': len(job.get('items') or []),
+            'processing_confidence': job.get('confidence', 0.0),
+            'warnings': job.get('warnings', []),
+            'errors': errors or []
+        }
+
     async def get_category_suggestions(self, description: str, merchant_name: str = None) -> List[Dict[str, Any]]:
         """
         Get category suggestions for an expense
@@ -499,7 +894,7 @@ class DataProcessor:
             Dictionary containing processing statistics
         """
         return {
-            'qr_parser_available': hasattr(self.qr_parser, 'parse_qr_data'),
+            'qr_parser_available': hasattr(self.qr_parser, 'parse'),
             'data_extractor_available': hasattr(self.data_extractor, 'extract_expenses_from_receipt'),
             'data_cleaner_available': hasattr(self.data_cleaner, 'clean_receipt_data'),
             'ai_categorizer_available': hasattr(self.ai_categorizer, '_model_available') and self.ai_categorizer._model_available,
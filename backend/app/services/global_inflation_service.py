@@ -7,26 +7,24 @@ from collections import defaultdict
 import re
 from datetime import datetime, date
 from unidecode import unidecode
-from dateutil.parser import isoparse
 
 from app.db.supabase_client import get_supabase_client
+from app.utils.date_parser import parse_datetime
 from app.core.config import settings
 
 logger = logging.getLogger(__name__)
 
 def _safe_parse_datetime(date_str: str) -> Optional[datetime]:
     """
-    Safely parse datetime string using dateutil.parser.isoparse for robustness.
+    Safely parse datetime string with the shared date parser.
     Returns None if parsing fails.
     """
     if not date_str or not isinstance(date_str, str):
         return None
-    try:
-        # isoparse is more flexible than fromisoformat
-        return isoparse(date_str)
-    except (ValueError, TypeError) as e:
-        logger.warning(f"Could not parse datetime string '{date_str}': {e}")
-        return None
+    parsed = parse_datetime(date_str, fallback=False)
+    if parsed is None:
+        logger.warning(f"Could not parse datetime string '{date_str}'")
+    return parsed
 
 def _normalize_product_name(description: str) -> str:
     """
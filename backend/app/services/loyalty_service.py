@@ -4,23 +4,61 @@ Handles loyalty points calculation, level management, and rewards
 """
 
 import logging
-from datetime import datetime
+from datetime import datetime, timezone
 from typing import Dict, Any, Optional, List
 from uuid import uuid4
 
+from app.core.config import settings
 from app.db.supabase_client import get_supabase_client, get_supabase_admin_client
+from app.utils.date_parser import parse_datetime
+from app.utils.ttl_cache import TTLCache
 from app.schemas.loyalty import (
     LoyaltyLevel, LoyaltyStatusResponse, PointsCalculationResult, LoyaltyTransaction
 )
 
 logger = logging.getLogger(__name__)
 
+
+class LoyaltyStatusCache:
+    """
+    user_id -> loyalty_status row
+
+    Shared by every LoyaltyService instance. Accruals invalidate the user's
+    entry and level recomputation clears the cache.
+    """
+
+    def __init__(self, ttl_seconds: int = 300, max_entries: int = 10000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._cache = TTLCache(ttl_seconds, max_entries)
+
+    def get(self, user_id: Any) -> Optional[Dict[str, Any]]:
+        status = self._cache.get(str(user_id))
+        return dict(status) if status is not None else None
+
+    def put(self, user_id: Any, status: Dict[str, Any]):
+        self._cache.put(str(user_id), dict(status))
+
+    def invalidate(self, user_id: Any):
+        self._cache.pop(str(user_id))
+
+    def clear(self):
+        self._cache.clear()
+
+
+loyalty_status_cache = LoyaltyStatusCache(
+    ttl_seconds=settings.LOYALTY_STATUS_CACHE_TTL,
+    max_entries=settings.LOYALTY_STATUS_CACHE_SIZE
+)
+
+
 class LoyaltyService:
     """Service for managing loyalty program functionality"""
     
     def __init__(self):
         self.supabase = get_supabase_client()
         self.service_supabase = get_supabase_admin_client()  # For admin operations
+        self.status_cache = loyalty_status_cache
         
         # Loyalty level thresholds (points required)
         self.level_thresholds = {
@@ -170,69 +208,76 @@ class LoyaltyService:
         Returns:
             Dictionary with award results
         """
-        try:
-            logger.info(f"Awarding points for expense {expense_id}, user {user_id}")
-            
-            # Calculate points
-            points_result = await self.calculate_points_for_expense(
-                user_id, amount, category, merchant_name
-            )
-            
-            # Get current loyalty status
-            current_status = await self.get_user_loyalty_status(user_id)
-            
-            # Calculate new totals
-            new_total_points = current_status.points + points_result.total_points
-            new_level = self._calculate_level(new_total_points)
-            level_changed = new_level != current_status.level
-            
-            # Update loyalty status
-            update_data = {
-                "points": new_total_points,
-                "level": new_level.value if new_level else None,
-                "last_updated": self._format_datetime_for_db()
-            }
-            
-            result = self.service_supabase.table("loyalty_status").update(update_data).eq("user_id", user_id).execute()
-            
-            if not result.data:
-                logger.error(f"Failed to update loyalty status for user {user_id}")
-                raise Exception("Failed to update loyalty status")
+        logger.info(f"Awarding points for expense {expense_id}, user {user_id}")
+        
+        results = await self.award_points_for_expenses([{
+            "user_id": user_id,
+            "expense_id": expense_id,
+            "amount": amount,
+            "category": category,
+            "merchant_name": merchant_name
+        }])
+        return results[0]
+
+    async def award_points_for_expenses(self, awards: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Award loyalty points for many expenses in one atomic database call
+        
+        The accrue_loyalty_points function locks each user's loyalty_status row,
+        applies the level bonus of the level at that moment, updates points and
+        level and records the loyalty transaction, so concurrent awards cannot
+        lose points.
+        
+        Args:
+            awards: Items with user_id, expense_id, amount and optional
+                category / merchant_name (same as award_points_for_expense)
             
-            # Create loyalty transaction record
-            transaction_data = {
-                "user_id": user_id,
-                "expense_id": expense_id,
-                "points_earned": points_result.total_points,
-                "transaction_amount": amount,
-                "merchant_name": merchant_name,
-                "category": category,
-                "calculation_details": points_result.calculation_details,
-                "transaction_type": "expense",
-                "created_at": self._format_datetime_for_db()
-            }
+        Returns:
+            Award results in input order, same shape as award_points_for_expense
+        """
+        if not awards:
+            return []
+        
+        try:
+            accruals = [
+                self._build_accrual(
+                    index, award["user_id"], award["expense_id"], award["amount"],
+                    award.get("category"), award.get("merchant_name")
+                )
+                for index, award in enumerate(awards)
+            ]
+            
+            result = self.service_supabase.rpc("accrue_loyalty_points", {
+                "p_accruals": accruals,
+                "p_levels": self._level_rules()
+            }).execute()
+            
+            # Invalidate before checking the result: the accrual may have been applied
+            for accrual in accruals:
+                self.status_cache.invalidate(accrual["user_id"])
+            
+            rows = result.data or []
+            if len(rows) != len(accruals):
+                raise Exception(f"Loyalty accrual returned {len(rows)} results for {len(accruals)} expenses")
+            
+            results = []
+            for row in sorted(rows, key=lambda r: r["idx"]):
+                previous_level = LoyaltyLevel(row["previous_level"]) if row.get("previous_level") else None
+                new_level = LoyaltyLevel(row["new_level"]) if row.get("new_level") else None
+                results.append({
+                    "success": True,
+                    "points_awarded": row["points_awarded"],
+                    "previous_total": row["previous_total"],
+                    "new_total": row["new_total"],
+                    "previous_level": previous_level,
+                    "new_level": new_level,
+                    "level_changed": new_level != previous_level,
+                    "calculation_details": row.get("calculation_details") or {},
+                    "transaction_id": row.get("transaction_id")
+                })
             
-            transaction_result = self.service_supabase.table("loyalty_transactions").insert(transaction_data).execute()
-            
-            if not transaction_result.data:
-                logger.warning(f"Failed to create loyalty transaction record for user {user_id}")
-                # Don't fail the entire operation, just log warning
-            else:
-                logger.info(f"Created loyalty transaction record: {transaction_result.data[0]['id']}")
-            
-            logger.info(f"Points awarded: {points_result.total_points}, New total: {new_total_points}, Level: {new_level}")
-            
-            return {
-                "success": True,
-                "points_awarded": points_result.total_points,
-                "previous_total": current_status.points,
-                "new_total": new_total_points,
-                "previous_level": current_status.level,
-                "new_level": new_level,
-                "level_changed": level_changed,
-                "calculation_details": points_result.calculation_details,
-                "transaction_id": transaction_result.data[0]["id"] if transaction_result.data else None
-            }
+            logger.info(f"Points awarded for {len(results)} expenses: {sum(r['points_awarded'] for r in results)} total")
+            return results
             
         except Exception as e:
             logger.error(f"Failed to award points: {str(e)}")
@@ -303,50 +348,13 @@ class LoyaltyService:
             datetime_str: Datetime string or object from database
             
         Returns:
-            datetime object
+            datetime object (naive database timestamps are taken as UTC)
         """
-        if isinstance(datetime_str, datetime):
-            return datetime_str
-        
-        if not isinstance(datetime_str, str):
-            logger.warning(f"Unexpected datetime type: {type(datetime_str)}, using current time")
-            return datetime.now()
-        
-        try:
-            # Handle Supabase datetime formats
-            working_str = datetime_str
-            
-            # Convert Z to timezone offset
-            if working_str.endswith('Z'):
-                working_str = working_str.replace('Z', '+00:00')
-            elif '+' not in working_str and 'T' in working_str:
-                working_str = working_str + '+00:00'
-            
-            # Fix microsecond precision issues
-            # Python fromisoformat expects max 6 digits for microseconds
-            if '.' in working_str and ('+' in working_str or '-' in working_str):
-                # Split by timezone part (+ or -)
-                if '+' in working_str:
-                    date_part, tz_part = working_str.rsplit('+', 1)
-                    tz_prefix = '+'
-                else:
-                    date_part, tz_part = working_str.rsplit('-', 1)
-                    tz_prefix = '-'
-                
-                if '.' in date_part:
-                    main_part, micro_part = date_part.rsplit('.', 1)
-                    # Ensure microseconds are exactly 6 digits
-                    if len(micro_part) > 6:
-                        micro_part = micro_part[:6]
-                    elif len(micro_part) < 6:
-                        micro_part = micro_part.ljust(6, '0')
-                    working_str = f"{main_part}.{micro_part}{tz_prefix}{tz_part}"
-            
-            return datetime.fromisoformat(working_str)
-            
-        except (ValueError, AttributeError) as e:
-            logger.warning(f"✗ Failed to parse datetime '{datetime_str}': {e}, using current time")
+        parsed = parse_datetime(datetime_str, assume_tz=timezone.utc, fallback=False)
+        if parsed is None:
+            logger.warning(f"✗ Failed to parse datetime '{datetime_str}', using current time")
             return datetime.now()
+        return parsed
     
     def _format_datetime_for_db(self) -> str:
         """
@@ -357,13 +365,38 @@ class LoyaltyService:
         """
         return datetime.now().replace(microsecond=0).isoformat() + 'Z'
 
+    async def recompute_levels(self, force: bool = False) -> int:
+        """
+        Recompute every user's level in one set-based update
+        
+        No-op in the database when the level rules are unchanged since the
+        last run (unless force). Clears the status cache when levels changed.
+        
+        Returns:
+            Number of users whose level changed
+        """
+        result = self.service_supabase.rpc("recompute_loyalty_levels", {
+            "p_levels": self._level_rules(),
+            "p_force": force
+        }).execute()
+        
+        updated = int(result.data or 0)
+        if updated:
+            self.status_cache.clear()
+        return updated
+
     async def _get_or_create_loyalty_status(self, user_id: str) -> Dict[str, Any]:
         """Get existing loyalty status or create new one using service role"""
+        cached = self.status_cache.get(user_id)
+        if cached is not None:
+            return cached
+        
         try:
             # Try to get existing status using service client (bypasses RLS)
             result = self.service_supabase.table("loyalty_status").select("*").eq("user_id", user_id).execute()
             
             if result.data:
+                self.status_cache.put(user_id, result.data[0])
                 return result.data[0]
             
             # Create new loyalty status using service client (bypasses RLS)
@@ -380,12 +413,59 @@ class LoyaltyService:
                 raise Exception("Failed to create loyalty status")
             
             logger.info(f"Created new loyalty status for user {user_id}")
+            self.status_cache.put(user_id, create_result.data[0])
             return create_result.data[0]
             
         except Exception as e:
             logger.error(f"Failed to get/create loyalty status: {str(e)}")
             raise
 
+    def _build_accrual(
+        self,
+        index: int,
+        user_id: str,
+        expense_id: str,
+        amount: float,
+        category: Optional[str],
+        merchant_name: Optional[str]
+    ) -> Dict[str, Any]:
+        """Level-independent part of the points calculation; the level bonus is added in the database"""
+        base_points = int(amount * self.base_points_per_lira)
+        
+        category_bonus = 0
+        if category and category.lower() in self.category_bonuses:
+            category_bonus = int(base_points * (self.category_bonuses[category.lower()] - 1.0))
+        
+        return {
+            "idx": index,
+            "user_id": str(user_id),
+            "expense_id": str(expense_id),
+            "amount": amount,
+            "base_points": base_points,
+            "category_bonus": category_bonus,
+            "category": category,
+            "merchant_name": merchant_name,
+            "calculation_details": {
+                "amount": amount,
+                "base_points_per_lira": self.base_points_per_lira,
+                "base_points": base_points,
+                "category": category,
+                "category_bonus": category_bonus,
+                "merchant_name": merchant_name
+            }
+        }
+
+    def _level_rules(self) -> List[Dict[str, Any]]:
+        """Level thresholds and multipliers for accrue_loyalty_points"""
+        return [
+            {
+                "level": level.value,
+                "min_points": self.level_thresholds[level],
+                "multiplier": self.level_multipliers.get(level, 1.0)
+            }
+            for level in self.level_thresholds
+        ]
+
     def _calculate_level(self, points: int) -> Optional[LoyaltyLevel]:
         """Calculate loyalty level based on points"""
         if points >= self.level_thresholds[LoyaltyLevel.PLATINUM]:
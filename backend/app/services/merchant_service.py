@@ -1,11 +1,15 @@
 import secrets
 import hashlib
+import hmac
 import logging
+from dataclasses import dataclass
 from typing import Optional, List, Dict, Any, Tuple
 from uuid import UUID
 from datetime import datetime, timedelta
 from supabase import Client
 
+from app.core.config import settings
+from app.utils.ttl_cache import TTLCache
 from app.schemas.merchant import (
     MerchantCreate,
     MerchantUpdate,
@@ -17,6 +21,123 @@ from app.schemas.merchant import (
 
 logger = logging.getLogger(__name__)
 
+# Values per in_() filter; keeps the PostgREST query string bounded
+MATCH_QUERY_CHUNK_SIZE = 200
+
+
+def _chunks(values: List[Any], size: int):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def hash_api_key(api_key: str) -> bytes:
+    return hashlib.sha256(api_key.encode()).digest()
+
+
+@dataclass(frozen=True)
+class MerchantCredential:
+    """Cached webhook credential: only the hash of the API key is kept in memory"""
+    merchant_id: str
+    key_hash: bytes
+    is_active: bool
+
+    def matches(self, api_key: str) -> bool:
+        """Constant-time API key check"""
+        return hmac.compare_digest(self.key_hash, hash_api_key(api_key or ""))
+
+
+class MerchantCredentialCache:
+    """
+    Merchant id -> API key hash + active flag
+
+    Webhook authentication reads this instead of the merchants row. Key
+    changes go through MerchantService, which invalidates the entry.
+    """
+
+    def __init__(self, ttl_seconds: int = 300, max_entries: int = 4096):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        # Entries are tagged with the key hash, for lookups by API key alone
+        self._cache = TTLCache(ttl_seconds, max_entries, index=lambda _, credential: credential.key_hash)
+
+    def get(self, merchant_id: Any) -> Optional[MerchantCredential]:
+        return self._cache.get(str(merchant_id))
+
+    def find_by_api_key(self, api_key: str) -> Optional[MerchantCredential]:
+        """Cached credential for an API key (entries are tagged by the key's hash, never the key)"""
+        for merchant_id in self._cache.keys_for(hash_api_key(api_key or "")):
+            credential = self.get(merchant_id)
+            if credential is not None and credential.matches(api_key):
+                return credential
+        return None
+
+    def put(self, merchant_id: Any, api_key: str, is_active: bool) -> MerchantCredential:
+        credential = MerchantCredential(
+            merchant_id=str(merchant_id),
+            key_hash=hash_api_key(api_key or ""),
+            is_active=bool(is_active)
+        )
+        self._cache.put(credential.merchant_id, credential)
+        return credential
+
+    def invalidate(self, merchant_id: Any):
+        """Drop a merchant's credential (call on key regeneration, update or deactivation)"""
+        self._cache.pop(str(merchant_id))
+
+    def clear(self):
+        self._cache.clear()
+
+
+# Shared across MerchantService instances (one is created per request)
+merchant_credential_cache = MerchantCredentialCache(
+    ttl_seconds=settings.MERCHANT_CREDENTIAL_CACHE_TTL,
+    max_entries=settings.MERCHANT_CREDENTIAL_CACHE_SIZE
+)
+
+
+# Lookup result for a key the cache has never seen (None is a cached "no such user")
+CACHE_MISS = object()
+
+
+class CustomerMatchCache:
+    """
+    (kind, value) -> user_id LRU for customer matching, kind is "email" or "card"
+
+    None is cached as well (negative caching) so repeated unknown customers do
+    not hit the database on every transaction; negative entries expire after
+    negative_ttl_seconds so a user who signs up is matched soon after.
+    """
+
+    def __init__(self, ttl_seconds: int = 300, negative_ttl_seconds: int = 60, max_entries: int = 10000):
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self.max_entries = max_entries
+        self._cache = TTLCache(ttl_seconds, max_entries)
+
+    def get(self, kind: str, value: str) -> Any:
+        """Cached user_id, None for a cached miss, CACHE_MISS if unknown or expired"""
+        return self._cache.get((kind, value), CACHE_MISS)
+
+    def put(self, kind: str, value: str, user_id: Optional[Any]):
+        if user_id is None:
+            self._cache.put((kind, value), None, ttl_seconds=self.negative_ttl_seconds)
+        else:
+            self._cache.put((kind, value), str(user_id))
+
+    def invalidate(self, kind: str, value: str):
+        self._cache.pop((kind, value))
+
+    def clear(self):
+        self._cache.clear()
+
+
+# Shared across CustomerMatchingService instances (one is created per WebhookService)
+customer_match_cache = CustomerMatchCache(
+    ttl_seconds=settings.CUSTOMER_MATCH_CACHE_TTL,
+    negative_ttl_seconds=settings.CUSTOMER_MATCH_NEGATIVE_TTL,
+    max_entries=settings.CUSTOMER_MATCH_CACHE_SIZE
+)
+
 
 class MerchantService:
     def __init__(self, supabase_client: Client):
@@ -84,6 +205,29 @@ class MerchantService:
             logger.error(f"Error fetching merchant {merchant_id}: {str(e)}")
             raise
 
+    async def get_merchant_credential(self, merchant_id: UUID) -> Optional[MerchantCredential]:
+        """
+        Webhook credential (API key hash + active flag) for a merchant
+
+        Served from merchant_credential_cache; only a miss reads the merchants row.
+        """
+        credential = merchant_credential_cache.get(merchant_id)
+        if credential is not None:
+            return credential
+
+        try:
+            result = self.supabase.table("merchants").select("api_key, is_active").eq("id", str(merchant_id)).execute()
+            
+            if not result.data:
+                return None
+            
+            row = result.data[0]
+            return merchant_credential_cache.put(merchant_id, row["api_key"], row["is_active"])
+            
+        except Exception as e:
+            logger.error(f"Error fetching credential for merchant {merchant_id}: {str(e)}")
+            raise
+
     async def get_merchant_by_api_key(self, api_key: str) -> Optional[MerchantResponse]:
         """Get merchant by API key"""
         try:
@@ -92,7 +236,9 @@ class MerchantService:
             if not result.data:
                 return None
             
-            return MerchantResponse(**result.data[0])
+            merchant = MerchantResponse(**result.data[0])
+            merchant_credential_cache.put(merchant.id, merchant.api_key, merchant.is_active)
+            return merchant
             
         except Exception as e:
             logger.error(f"Error fetching merchant by API key: {str(e)}")
@@ -154,6 +300,7 @@ class MerchantService:
             update_data["updated_at"] = datetime.now().isoformat()
             
             result = self.supabase.table("merchants").update(update_data).eq("id", str(merchant_id)).execute()
+            merchant_credential_cache.invalidate(merchant_id)
             
             if not result.data:
                 return None
@@ -172,6 +319,7 @@ class MerchantService:
                 "is_active": False,
                 "updated_at": datetime.now().isoformat()
             }).eq("id", str(merchant_id)).execute()
+            merchant_credential_cache.invalidate(merchant_id)
             
             success = bool(result.data)
             if success:
@@ -186,6 +334,10 @@ class MerchantService:
     async def validate_api_key(self, api_key: str) -> bool:
         """Validate merchant API key"""
         try:
+            credential = merchant_credential_cache.find_by_api_key(api_key)
+            if credential is not None:
+                return credential.is_active
+            
             merchant = await self.get_merchant_by_api_key(api_key)
             return merchant is not None and merchant.is_active
             
@@ -209,6 +361,8 @@ class MerchantService:
                 "api_key": new_api_key,
                 "updated_at": datetime.now().isoformat()
             }).eq("id", str(merchant_id)).execute()
+            # The old key must stop working immediately
+            merchant_credential_cache.invalidate(merchant_id)
             
             if not result.data:
                 return None
@@ -222,8 +376,9 @@ class MerchantService:
 
 
 class CustomerMatchingService:
-    def __init__(self, supabase_client: Client):
+    def __init__(self, supabase_client: Client, cache: Optional[CustomerMatchCache] = None):
         self.supabase = supabase_client
+        self.cache = cache or customer_match_cache
 
     def hash_card_number(self, card_number: str) -> str:
         """Hash card number for secure storage and matching"""
@@ -241,17 +396,25 @@ class CustomerMatchingService:
             
             # Try email matching first (highest confidence)
             if customer_info.email:
-                result = self.supabase.table("users").select("id").eq("email", customer_info.email).execute()
-                if result.data:
-                    matched_user_id = UUID(result.data[0]["id"])
+                user_id = self.cache.get("email", customer_info.email)
+                if user_id is CACHE_MISS:
+                    result = self.supabase.table("users").select("id").eq("email", customer_info.email).execute()
+                    user_id = result.data[0]["id"] if result.data else None
+                    self.cache.put("email", customer_info.email, user_id)
+                if user_id:
+                    matched_user_id = UUID(user_id)
                     match_method = "email"
                     confidence = 1.0
             
             # Try card hash matching if no email match
             if not matched_user_id and customer_info.card_hash:
-                result = self.supabase.table("user_payment_methods").select("user_id").eq("card_hash", customer_info.card_hash).eq("is_active", True).execute()
-                if result.data:
-                    matched_user_id = UUID(result.data[0]["user_id"])
+                user_id = self.cache.get("card", customer_info.card_hash)
+                if user_id is CACHE_MISS:
+                    result = self.supabase.table("user_payment_methods").select("user_id").eq("card_hash", customer_info.card_hash).eq("is_active", True).execute()
+                    user_id = result.data[0]["user_id"] if result.data else None
+                    self.cache.put("card", customer_info.card_hash, user_id)
+                if user_id:
+                    matched_user_id = UUID(user_id)
                     match_method = "card_hash"
                     confidence = 0.9
             
@@ -272,34 +435,116 @@ class CustomerMatchingService:
             logger.error(f"Error matching customer: {str(e)}")
             return CustomerMatchResult(matched=False, confidence=0.0)
 
+    async def match_customers_bulk(self, customer_infos: List[Optional[Any]]) -> List[CustomerMatchResult]:
+        """
+        Match many customers at once, same priority as match_customer
+
+        Identifiers found in the match cache are not queried; the rest are
+        resolved with one in_() query per identifier type (email, then card
+        hash for the still unmatched) and cached, misses included. None
+        entries are unmatched.
+        """
+        unmatched = CustomerMatchResult(matched=False, confidence=0.0)
+        try:
+            users_by_email = self._resolve_cached(
+                "email",
+                {info.email for info in customer_infos if info is not None and info.email},
+                lambda chunk: self.supabase.table("users").select("id, email").in_("email", chunk),
+                "email", "id"
+            )
+            users_by_card = self._resolve_cached(
+                "card",
+                {
+                    info.card_hash for info in customer_infos
+                    if info is not None and info.card_hash and users_by_email.get(info.email) is None
+                },
+                lambda chunk: self.supabase.table("user_payment_methods").select("user_id, card_hash").in_(
+                    "card_hash", chunk
+                ).eq("is_active", True),
+                "card_hash", "user_id"
+            )
+
+        except Exception as e:
+            logger.error(f"Error matching customers in bulk: {str(e)}")
+            return [unmatched for _ in customer_infos]
+
+        results = []
+        for info in customer_infos:
+            if info is None:
+                results.append(unmatched)
+            elif info.email and users_by_email.get(info.email):
+                results.append(CustomerMatchResult(
+                    matched=True, user_id=UUID(users_by_email[info.email]), match_method="email", confidence=1.0
+                ))
+            elif info.card_hash and users_by_card.get(info.card_hash):
+                results.append(CustomerMatchResult(
+                    matched=True, user_id=UUID(users_by_card[info.card_hash]), match_method="card_hash", confidence=0.9
+                ))
+            else:
+                results.append(unmatched)
+        return results
+
+    def _resolve_cached(self, kind: str, values, build_query, value_column: str, user_column: str) -> Dict[str, Optional[str]]:
+        """value -> user_id (None if no user) for every value, querying only cache misses"""
+        resolved: Dict[str, Optional[str]] = {}
+        missing = []
+        for value in sorted(values):
+            user_id = self.cache.get(kind, value)
+            if user_id is CACHE_MISS:
+                missing.append(value)
+            else:
+                resolved[value] = user_id
+
+        for chunk in _chunks(missing, MATCH_QUERY_CHUNK_SIZE):
+            found: Dict[str, str] = {}
+            for row in build_query(chunk).execute().data or []:
+                found.setdefault(row[value_column], row[user_column])
+            for value in chunk:
+                resolved[value] = found.get(value)
+                self.cache.put(kind, value, resolved[value])
+        return resolved
+
     async def store_payment_method(self, user_id: UUID, card_hash: str, card_last_four: str, card_type: Optional[str] = None) -> bool:
         """Store user payment method for future matching"""
-        try:
-            # Check if payment method already exists
-            existing = self.supabase.table("user_payment_methods").select("id").eq("user_id", str(user_id)).eq("card_hash", card_hash).execute()
-            
-            if existing.data:
-                # Payment method already exists
-                return True
-            
-            # Insert new payment method
-            insert_data = {
-                "user_id": str(user_id),
-                "card_hash": card_hash,
-                "card_last_four": card_last_four,
-                "card_type": card_type,
+        return await self.store_payment_methods([{
+            "user_id": user_id,
+            "card_hash": card_hash,
+            "card_last_four": card_last_four,
+            "card_type": card_type
+        }])
+
+    async def store_payment_methods(self, payment_methods: List[Dict[str, Any]]) -> bool:
+        """
+        Store many payment methods in one statement
+
+        Each item has user_id, card_hash, card_last_four and optionally
+        card_type. Existing (user_id, card_hash) pairs are left untouched.
+        """
+        rows = {}
+        for method in payment_methods:
+            key = (str(method["user_id"]), method["card_hash"])
+            rows[key] = {
+                "user_id": key[0],
+                "card_hash": key[1],
+                "card_last_four": method["card_last_four"],
+                "card_type": method.get("card_type"),
                 "is_primary": False,
                 "is_active": True
             }
-            
-            result = self.supabase.table("user_payment_methods").insert(insert_data).execute()
-            
-            success = bool(result.data)
-            if success:
-                logger.info(f"Stored payment method for user: {user_id}")
-            
-            return success
-            
+        if not rows:
+            return True
+
+        try:
+            self.supabase.table("user_payment_methods").upsert(
+                list(rows.values()), on_conflict="user_id,card_hash", ignore_duplicates=True
+            ).execute()
         except Exception as e:
-            logger.error(f"Error storing payment method for user {user_id}: {str(e)}")
-            return False 
\ No newline at end of file
+            logger.error(f"Error storing {len(rows)} payment methods: {str(e)}")
+            return False
+
+        for user_id, card_hash in rows:
+            # Keep an existing positive mapping, same first-match rule as the query
+            if self.cache.get("card", card_hash) in (CACHE_MISS, None):
+                self.cache.put("card", card_hash, user_id)
+        logger.info(f"Stored {len(rows)} payment methods")
+        return True
@@ -0,0 +1,181 @@
+import logging
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional
+from uuid import uuid4
+
+from app.core.config import settings
+from app.core.log_sink import utc_now_iso
+from app.core.notifications import NotificationService, notification_service
+
+logger = logging.getLogger(__name__)
+
+WEEKLY_SUMMARY_JOB = "weekly_summary"
+
+# Columns a run writes back to its notification_job_runs row
+CHECKPOINT_FIELDS = (
+    "status", "last_user_id", "users_processed", "notifications_sent",
+    "notifications_failed", "completed_at", "locked_until", "updated_at"
+)
+
+
+def _iso_week_key(day: date) -> str:
+    year, week, _ = day.isocalendar()
+    return f"{year}-W{week:02d}"
+
+
+class NotificationDigestService:
+    """
+    Haftalık özet bildirimlerinin toplu gönderimi
+
+    Aktif cihazı olan kullanıcılar user_id sırasıyla batch_size'lık sayfalar
+    halinde gezilir; her sayfanın toplamları tek bir RPC ile veritabanında
+    hesaplanır ve mesajlar NotificationService.send_notifications ile
+    gönderilir. Her sayfadan sonra notification_job_runs'a checkpoint yazılır,
+    yarıda kalan bir çalışma son işlenen kullanıcıdan devam eder. Sayfa
+    gönderilip checkpoint yazılamadan kesilirse o sayfa tekrar gönderilir.
+
+    Bir dönemi aynı anda tek çalışma gönderir: çalışma önce
+    acquire_notification_job_lease ile kilidi alır ve her checkpoint'te
+    lease_seconds kadar uzatır. Kilidi başka process'te olan dönem atlanır;
+    çöken çalışmanın kilidi süresi dolunca devralınır. Bütçe eşiği
+    uyarıları harcama anında BudgetThresholdService ile gider.
+    """
+
+    def __init__(
+        self,
+        notifier: Optional[NotificationService] = None,
+        supabase_factory: Optional[Callable[[], Any]] = None,
+        batch_size: Optional[int] = None,
+        lease_seconds: Optional[int] = None
+    ):
+        self.notifier = notifier or notification_service
+        self._supabase_factory = supabase_factory or (lambda: settings.supabase_admin)
+        self.batch_size = max(1, batch_size or settings.NOTIFICATION_DIGEST_BATCH_SIZE)
+        self.lease_seconds = lease_seconds or settings.NOTIFICATION_DIGEST_LEASE_SECONDS
+
+    async def send_weekly_summaries(self, today: Optional[date] = None) -> Dict[str, Any]:
+        """
+        Geçen haftanın (Pazartesi-Pazar) harcama özetini gönder
+
+        Hafta içinde harcaması olmayan kullanıcılara bildirim gönderilmez.
+        """
+        today = today or datetime.now(timezone.utc).date()
+        week_start = today - timedelta(days=today.weekday() + 7)
+        week_end = week_start + timedelta(days=7)
+
+        def fetch_page(supabase, after: Optional[str]) -> List[Dict[str, Any]]:
+            return supabase.rpc("get_weekly_spending_summaries", {
+                "p_start": week_start.isoformat(),
+                "p_end": week_end.isoformat(),
+                "p_after": after,
+                "p_limit": self.batch_size
+            }).execute().data or []
+
+        def build_messages(rows: List[Dict[str, Any]]) -> List[Dict]:
+            return [
+                self.notifier.weekly_summary_message(
+                    row["user_id"], float(row["total_spent"]), row.get("top_category") or "Diğer"
+                )
+                for row in rows if float(row.get("total_spent") or 0) > 0
+            ]
+
+        return await self._run(WEEKLY_SUMMARY_JOB, _iso_week_key(week_start), fetch_page, build_messages)
+
+    async def _run(
+        self,
+        job_name: str,
+        period_key: str,
+        fetch_page: Callable[[Any, Optional[str]], List[Dict[str, Any]]],
+        build_messages: Callable[[List[Dict[str, Any]]], List[Dict]]
+    ) -> Dict[str, Any]:
+        """
+        Checkpoint'ten devam ederek tüm sayfaları gönder
+        """
+        if not self.notifier.fcm_server_key:
+            logger.warning(f"FCM server key not configured, skipping {job_name} {period_key}")
+            return {"job": job_name, "period": period_key, "status": "skipped"}
+
+        supabase = self._supabase_factory()
+        checkpoint = self._load_checkpoint(supabase, job_name, period_key)
+        if checkpoint and checkpoint["status"] == "completed":
+            return self._summary(checkpoint, resumed=False)
+
+        owner = str(uuid4())
+        state = self._acquire_lease(supabase, job_name, period_key, owner)
+        if state is None:
+            logger.info(f"{job_name} {period_key} is being sent by another run, skipping")
+            return {"job": job_name, "period": period_key, "status": "locked"}
+
+        resumed = checkpoint is not None
+        if resumed:
+            logger.info(f"Resuming {job_name} {period_key} after user {state['last_user_id']}")
+
+        while True:
+            rows = fetch_page(supabase, state["last_user_id"])
+            if not rows:
+                break
+
+            delivered = await self.notifier.send_notifications(build_messages(rows))
+            state["last_user_id"] = str(rows[-1]["user_id"])
+            state["users_processed"] += len(rows)
+            state["notifications_sent"] += sum(delivered)
+            state["notifications_failed"] += len(delivered) - sum(delivered)
+            if not self._save_checkpoint(supabase, state, owner):
+                logger.warning(f"{job_name} {period_key} lease was taken over after user {state['last_user_id']}, stopping")
+                return {**self._summary(state, resumed=resumed), "status": "locked"}
+
+            if len(rows) < self.batch_size:
+                break
+
+        state["status"] = "completed"
+        state["completed_at"] = utc_now_iso()
+        self._save_checkpoint(supabase, state, owner)
+
+        logger.info(
+            f"{job_name} {period_key} completed: {state['users_processed']} users, "
+            f"{state['notifications_sent']} sent, {state['notifications_failed']} failed"
+        )
+        return self._summary(state, resumed=resumed)
+
+    @staticmethod
+    def _load_checkpoint(supabase, job_name: str, period_key: str) -> Optional[Dict[str, Any]]:
+        result = supabase.table("notification_job_runs").select("*").eq("job_name", job_name).eq("period_key", period_key).execute()
+        return result.data[0] if result.data else None
+
+    def _acquire_lease(self, supabase, job_name: str, period_key: str, owner: str) -> Optional[Dict[str, Any]]:
+        """Dönemin kilidini al; checkpoint satırını döner, kilit başkasındaysa None"""
+        result = supabase.rpc("acquire_notification_job_lease", {
+            "p_job_name": job_name,
+            "p_period_key": period_key,
+            "p_owner": owner,
+            "p_lease_seconds": self.lease_seconds
+        }).execute()
+        return result.data[0] if result.data else None
+
+    def _save_checkpoint(self, supabase, state: Dict[str, Any], owner: str) -> bool:
+        """Checkpoint'i yaz ve kilidi uzat; kilit başka çalışmaya geçtiyse False"""
+        state["updated_at"] = utc_now_iso()
+        if state["status"] == "completed":
+            state["locked_until"] = None
+        else:
+            state["locked_until"] = (datetime.now(timezone.utc) + timedelta(seconds=self.lease_seconds)).isoformat()
+        result = supabase.table("notification_job_runs").update(
+            {field: state.get(field) for field in CHECKPOINT_FIELDS}
+        ).eq("job_name", state["job_name"]).eq("period_key", state["period_key"]).eq("locked_by", owner).execute()
+        return bool(result.data)
+
+    @staticmethod
+    def _summary(state: Dict[str, Any], resumed: bool) -> Dict[str, Any]:
+        return {
+            "job": state["job_name"],
+            "period": state["period_key"],
+            "status": state["status"],
+            "resumed": resumed,
+            "users_processed": state["users_processed"],
+            "notifications_sent": state["notifications_sent"],
+            "notifications_failed": state["notifications_failed"]
+        }
+
+
+# Global notification digest service instance
+notification_digest_service = NotificationDigestService()
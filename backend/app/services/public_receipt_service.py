@@ -0,0 +1,246 @@
+import hashlib
+import logging
+import os
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Any, Dict, List, Mapping, Optional
+
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+
+from app.core.config import settings
+from app.utils.kdv_calculator import KDVCalculator
+from app.utils.ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+TEMPLATES_DIR = os.path.join(os.path.dirname(__file__), '..', 'templates')
+
+# Templates are compiled once on first load and never re-checked on disk
+template_env = Environment(
+    loader=FileSystemLoader(TEMPLATES_DIR),
+    autoescape=select_autoescape(["html"]),
+    auto_reload=False,
+    cache_size=-1
+)
+
+# Single round trip: receipt + expense + items
+PUBLIC_RECEIPT_SELECT = (
+    "id, merchant_name, transaction_date, total_amount, currency, is_public, expires_at, updated_at, "
+    "expenses(id, expense_items(description, amount, quantity, unit_price, kdv_rate))"
+)
+
+
+@dataclass
+class PublicReceiptPage:
+    """Rendered public receipt page plus the metadata needed for HTTP caching"""
+    status_code: int
+    body: bytes
+    etag: Optional[str] = None
+    last_modified: Optional[datetime] = None
+    expires_at: Optional[datetime] = None
+
+    @property
+    def cacheable(self) -> bool:
+        return self.status_code == 200 and self.etag is not None
+
+    def cache_headers(self) -> Dict[str, str]:
+        """ETag / Last-Modified / Cache-Control, bounded by the receipt's expires_at"""
+        if not self.cacheable:
+            return {"Cache-Control": "no-store"}
+
+        max_age = settings.PUBLIC_RECEIPT_MAX_AGE
+        if self.expires_at is not None:
+            remaining = int((self.expires_at - datetime.now(timezone.utc)).total_seconds())
+            max_age = max(0, min(max_age, remaining))
+
+        headers = {
+            "ETag": self.etag,
+            "Cache-Control": f"public, max-age={max_age}",
+        }
+        if self.last_modified is not None:
+            headers["Last-Modified"] = format_datetime(self.last_modified, usegmt=True)
+        return headers
+
+    def is_not_modified(self, request_headers: Mapping[str, str]) -> bool:
+        """Conditional GET check (If-None-Match takes precedence over If-Modified-Since)"""
+        if not self.cacheable:
+            return False
+
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match is not None:
+            candidates = [tag.strip() for tag in if_none_match.split(",")]
+            return "*" in candidates or self.etag in candidates or f"W/{self.etag}" in candidates
+
+        if_modified_since = request_headers.get("if-modified-since")
+        if if_modified_since and self.last_modified is not None:
+            try:
+                since = parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError):
+                return False
+            if since.tzinfo is None:
+                since = since.replace(tzinfo=timezone.utc)
+            return self.last_modified.replace(microsecond=0) <= since
+
+        return False
+
+
+class PublicReceiptService:
+    """
+    Public receipt web page rendering
+
+    Pages of unclaimed receipts are kept in a short-TTL in-process cache so a
+    burst of QR scans costs one Supabase lookup; claiming a receipt must call
+    invalidate() so the page disappears immediately.
+    """
+
+    def __init__(self, ttl_seconds: int = 30, max_entries: int = 1024):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._cache = TTLCache(ttl_seconds, max_entries)
+
+        # Precompile templates at startup
+        self.receipt_template = template_env.get_template("receipt.html")
+        self.not_found_template = template_env.get_template("receipt_not_found.html")
+        self.expired_template = template_env.get_template("receipt_expired.html")
+        self.error_template = template_env.get_template("receipt_error.html")
+
+    def get_page(self, receipt_id: str, supabase=None) -> PublicReceiptPage:
+        """
+        Get the rendered page for a public receipt, from cache when possible
+
+        The Supabase client is only created on a cache miss.
+        """
+        cached = self._cache_get(receipt_id)
+        if cached is not None:
+            return cached
+
+        try:
+            client = supabase or settings.supabase_admin
+            response = client.table("receipts").select(PUBLIC_RECEIPT_SELECT).eq(
+                "id", receipt_id
+            ).eq("is_public", True).execute()
+
+            if not response.data:
+                return self._render_status_page(self.not_found_template, 404)
+
+            receipt = response.data[0]
+
+            expires_at = _parse_timestamp(receipt.get("expires_at"))
+            if expires_at is not None and expires_at < datetime.now(timezone.utc):
+                return self._render_status_page(self.expired_template, 410)
+
+            page = self.render_receipt(receipt)
+            self._cache_put(receipt_id, page)
+            return page
+
+        except Exception as e:
+            logger.error(f"Error rendering public receipt {receipt_id}: {e}")
+            return self._render_status_page(self.error_template, 500, error=str(e))
+
+    def render_receipt(self, receipt: Dict[str, Any]) -> PublicReceiptPage:
+        """Render a receipt row (with embedded expenses/items) into a cacheable page"""
+        items = self._collect_items(receipt)
+        currency = receipt.get("currency") or "TRY"
+        total_amount = receipt.get("total_amount") or 87.5
+
+        template_vars = {
+            "merchant_name": receipt.get("merchant_name") or "Demo Coffee Shop",
+            "formatted_date": _format_transaction_date(receipt.get("transaction_date")),
+            "receipt_id": str(receipt["id"]),
+            "total_amount": total_amount,
+            "currency": currency,
+            "items": items,
+        }
+
+        if items:
+            kdv_summary = KDVCalculator.calculate_mixed_kdv_total(
+                [{"amount": item["amount"], "kdv_rate": item["kdv_rate"]} for item in items]
+            )
+            template_vars["total_kdv"] = kdv_summary["total_kdv"]
+            template_vars["total_without_kdv"] = kdv_summary["total_without_kdv"]
+        else:
+            # Default 20% KDV calculation from the receipt total
+            template_vars["total_kdv"] = total_amount * 0.20 / 1.20
+            template_vars["total_without_kdv"] = total_amount / 1.20
+
+        body = self.receipt_template.render(**template_vars).encode("utf-8")
+
+        return PublicReceiptPage(
+            status_code=200,
+            body=body,
+            etag=f'"{hashlib.sha256(body).hexdigest()[:32]}"',
+            last_modified=_parse_timestamp(receipt.get("updated_at")) or datetime.now(timezone.utc),
+            expires_at=_parse_timestamp(receipt.get("expires_at"))
+        )
+
+    def invalidate(self, receipt_id: str):
+        """Drop a receipt's cached page (call when the receipt is claimed or removed)"""
+        self._cache.pop(str(receipt_id))
+
+    def clear(self):
+        self._cache.clear()
+
+    @staticmethod
+    def _collect_items(receipt: Dict[str, Any]) -> List[Dict[str, Any]]:
+        expenses = receipt.get("expenses") or []
+        if isinstance(expenses, dict):
+            expenses = [expenses]
+        if not expenses:
+            return []
+
+        rows = expenses[0].get("expense_items") or []
+        breakdowns = KDVCalculator.get_kdv_breakdown_batch(
+            [item.get("amount") or 0 for item in rows],
+            [item.get("kdv_rate") or KDVCalculator.DEFAULT_KDV_RATE for item in rows]
+        )
+        return [
+            {
+                **item,
+                "amount": breakdown["total_amount"],
+                "kdv_rate": breakdown["kdv_rate"],
+                "kdv_amount": breakdown["kdv_amount"],
+            }
+            for item, breakdown in zip(rows, breakdowns)
+        ]
+
+    def _render_status_page(self, template, status_code: int, **context) -> PublicReceiptPage:
+        return PublicReceiptPage(
+            status_code=status_code,
+            body=template.render(**context).encode("utf-8")
+        )
+
+    def _cache_get(self, receipt_id: str) -> Optional[PublicReceiptPage]:
+        page = self._cache.get(receipt_id)
+        if page is not None and page.expires_at is not None and page.expires_at <= datetime.now(timezone.utc):
+            self._cache.pop(receipt_id)
+            return None
+        return page
+
+    def _cache_put(self, receipt_id: str, page: PublicReceiptPage):
+        if page.cacheable:
+            self._cache.put(receipt_id, page)
+
+
+def _parse_timestamp(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except (ValueError, TypeError, AttributeError):
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def _format_transaction_date(value: Optional[str]) -> str:
+    parsed = _parse_timestamp(value)
+    if parsed is None:
+        return value or ""
+    return parsed.strftime('%d.%m.%Y %H:%M')
+
+
+# Global public receipt service instance
+public_receipt_service = PublicReceiptService(
+    ttl_seconds=settings.PUBLIC_RECEIPT_CACHE_TTL,
+    max_entries=settings.PUBLIC_RECEIPT_CACHE_SIZE
+)
@@ -1,24 +1,180 @@
 import qrcode
+import asyncio
 import json
 from io import BytesIO
 import base64
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Dict, Any, Optional
+from enum import Enum
+from typing import Dict, Any, Optional, Tuple
 from app.core.config import settings
+from app.utils.ttl_cache import TTLCache
+
+
+class QRImageFormat(str, Enum):
+    """Supported QR image output formats"""
+    PNG = "png"
+    SVG = "svg"
+
+
+QR_MEDIA_TYPES = {
+    QRImageFormat.PNG: "image/png",
+    QRImageFormat.SVG: "image/svg+xml",
+}
+
+# Render options accepted from clients
+MIN_BOX_SIZE, MAX_BOX_SIZE = 1, 40
+MIN_BORDER, MAX_BORDER = 0, 10
+
+
+class QRRenderService:
+    """
+    Thread-safe QR image renderer
+
+    Every job builds its own qrcode.QRCode, so concurrent renders never share
+    encoder state. Async callers are served from a worker pool so encoding
+    stays off the event loop, and rendered images are kept in a bounded LRU
+    keyed by (data, format, box_size, border).
+    """
+
+    def __init__(self, max_workers: int = 2, cache_size: int = 512):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="qr-render")
+        self._cache = TTLCache(max_entries=cache_size)
+        # In-flight async renders, so a burst for the same URL encodes once
+        self._inflight: Dict[Tuple[str, QRImageFormat, int, int], asyncio.Future] = {}
+
+    def render(
+        self,
+        data: str,
+        fmt: QRImageFormat = QRImageFormat.PNG,
+        box_size: int = 10,
+        border: int = 4
+    ) -> bytes:
+        """Render QR image bytes synchronously (cached)"""
+        key = (data, QRImageFormat(fmt), box_size, border)
+        cached = self._cache.get(key)
+        if cached is not None:
+            return cached
+
+        image = self._encode(*key)
+        self._cache.put(key, image)
+        return image
+
+    async def render_async(
+        self,
+        data: str,
+        fmt: QRImageFormat = QRImageFormat.PNG,
+        box_size: int = 10,
+        border: int = 4
+    ) -> bytes:
+        """Render QR image bytes in the worker pool (cached)"""
+        key = (data, QRImageFormat(fmt), box_size, border)
+        cached = self._cache.get(key)
+        if cached is not None:
+            return cached
+
+        pending = self._inflight.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._executor, self._encode, *key)
+        self._inflight[key] = future
+        try:
+            image = await future
+        finally:
+            self._inflight.pop(key, None)
+
+        self._cache.put(key, image)
+        return image
+
+    @staticmethod
+    def to_data_uri(image: bytes, fmt: QRImageFormat = QRImageFormat.PNG) -> str:
+        """Encode rendered image bytes as a data URI"""
+        encoded = base64.b64encode(image).decode()
+        return f"data:{QR_MEDIA_TYPES[QRImageFormat(fmt)]};base64,{encoded}"
+
+    def cache_info(self) -> Dict[str, int]:
+        return {"size": len(self._cache), "max_size": self._cache.max_entries}
+
+    def clear_cache(self):
+        self._cache.clear()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+    @staticmethod
+    def _encode(data: str, fmt: QRImageFormat, box_size: int, border: int) -> bytes:
+        """Encode data with a fresh QRCode instance"""
+        qr = qrcode.QRCode(
+            version=None,
+            error_correction=qrcode.constants.ERROR_CORRECT_L,
+            box_size=box_size,
+            border=border,
+        )
+        qr.add_data(data)
+        qr.make(fit=True)
+
+        if fmt == QRImageFormat.SVG:
+            return QRRenderService._matrix_to_svg(qr.get_matrix(), box_size).encode()
+
+        qr_image = qr.make_image(fill_color="black", back_color="white")
+        buffer = BytesIO()
+        qr_image.save(buffer, format='PNG')
+        return buffer.getvalue()
+
+    @staticmethod
+    def _matrix_to_svg(matrix, box_size: int) -> str:
+        """
+        SVG fast path: one <path> built from horizontal runs of dark modules,
+        skipping PIL and qrcode's per-module SVG element tree
+        """
+        size = len(matrix)
+        segments = []
+        for y, row in enumerate(matrix):
+            x = 0
+            while x < size:
+                if row[x]:
+                    start = x
+                    while x < size and row[x]:
+                        x += 1
+                    run = x - start
+                    segments.append(f"M{start} {y}h{run}v1h-{run}z")
+                else:
+                    x += 1
+
+        pixels = size * box_size
+        return (
+            f'<svg xmlns="http://www.w3.org/2000/svg" width="{pixels}" height="{pixels}" '
+            f'viewBox="0 0 {size} {size}" shape-rendering="crispEdges">'
+            f'<rect width="{size}" height="{size}" fill="#fff"/>'
+            f'<path fill="#000" d="{"".join(segments)}"/></svg>'
+        )
+
+
+# Shared renderer: safe to use from any request or worker thread
+qr_render_service = QRRenderService(
+    max_workers=settings.QR_RENDER_WORKERS,
+    cache_size=settings.QR_RENDER_CACHE_SIZE
+)
+
 
 class QRGenerator:
     """QR Code generator for receipts"""
     
-    def __init__(self):
-        self.qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_L,
-            box_size=10,
-            border=4,
-        )
+    def __init__(self, renderer: Optional[QRRenderService] = None):
+        self.renderer = renderer or qr_render_service
         # Base URL for receipt viewing from config - updated to use public endpoint
         self.base_url = f"{settings.WEB_BASE_URL}/api/v1/receipts/public"
     
+    def get_receipt_url(self, receipt_id: str) -> str:
+        """Public URL encoded in a receipt's QR code"""
+        return f"{self.base_url}/{receipt_id}"
+    
+    def get_receipt_qr_image_url(self, receipt_id: str, fmt: QRImageFormat = QRImageFormat.SVG) -> str:
+        """URL where the QR image for a receipt is rendered on demand"""
+        return f"{self.base_url}/{receipt_id}/qr?format={QRImageFormat(fmt).value}"
+    
     def generate_receipt_qr(
         self,
         receipt_id: str,
@@ -35,10 +191,34 @@ class QRGenerator:
             transaction_date = datetime.now()
         
         # Create URL-based QR data for both app and web access
-        qr_url = f"{self.base_url}/{receipt_id}"
+        qr_url = self.get_receipt_url(receipt_id)
         
         return self._generate_qr_image(qr_url)
     
+    async def generate_receipt_qr_async(
+        self,
+        receipt_id: str,
+        fmt: QRImageFormat = QRImageFormat.PNG,
+        box_size: int = 10,
+        border: int = 4
+    ) -> str:
+        """
+        Generate QR code for a receipt without blocking the event loop
+        Returns QR code image as a data URI
+        """
+        image = await self.render_receipt_qr(receipt_id, fmt, box_size, border)
+        return self.renderer.to_data_uri(image, fmt)
+    
+    async def render_receipt_qr(
+        self,
+        receipt_id: str,
+        fmt: QRImageFormat = QRImageFormat.PNG,
+        box_size: int = 10,
+        border: int = 4
+    ) -> bytes:
+        """Render raw QR image bytes for a receipt in the worker pool"""
+        return await self.renderer.render_async(self.get_receipt_url(receipt_id), fmt, box_size, border)
+    
     def _create_turkish_receipt_format(
         self,
         receipt_id: str,
@@ -51,28 +231,12 @@ class QRGenerator:
         Create URL format for receipt access
         This method is kept for backward compatibility but now returns URL
         """
-        return f"{self.base_url}/{receipt_id}"
+        return self.get_receipt_url(receipt_id)
     
     def _generate_qr_image(self, data: str) -> str:
         """Generate QR code image and return as base64 string"""
-        
-        # Clear previous data
-        self.qr.clear()
-        
-        # Add new data
-        self.qr.add_data(data)
-        self.qr.make(fit=True)
-        
-        # Create QR code image
-        qr_image = self.qr.make_image(fill_color="black", back_color="white")
-        
-        # Convert to base64
-        buffer = BytesIO()
-        qr_image.save(buffer, format='PNG')
-        buffer.seek(0)
-        
-        qr_base64 = base64.b64encode(buffer.getvalue()).decode()
-        return f"data:image/png;base64,{qr_base64}"
+        image = self.renderer.render(data, QRImageFormat.PNG)
+        return self.renderer.to_data_uri(image, QRImageFormat.PNG)
     
     def parse_receipt_qr(self, qr_data: str) -> Optional[str]:
         """
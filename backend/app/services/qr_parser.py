@@ -6,13 +6,76 @@ Handles various QR code formats commonly used in Turkey and internationally.
 import re
 import json
 import logging
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Tuple
 from datetime import datetime
-from dateutil import parser as date_parser
+from urllib.parse import urlparse, parse_qs
 from app.core.config import settings
+from app.utils.date_parser import parse_datetime
 
 logger = logging.getLogger(__name__)
 
+# Common patterns for Turkish receipt QR codes (compiled once at import)
+TURKISH_PATTERNS = {
+    'efatura': re.compile(r'https?://earsivportal\.efatura\.gov\.tr/earsiv-services/download\?token=([^&]+)', re.IGNORECASE),
+    'ereceipt': re.compile(r'https?://ereceipt\.gov\.tr/fiş/([^/?]+)', re.IGNORECASE),
+    'gib_qr': re.compile(r'https?://verify\.gib\.gov\.tr/([^/?]+)', re.IGNORECASE),
+    'merchant_qr': re.compile(r'https?://(?:www\.)?([^/]+)/receipt/([^/?]+)', re.IGNORECASE)
+}
+
+# Patterns for extracting data from QR content
+_DATA_FLAGS = re.IGNORECASE | re.MULTILINE
+DATA_PATTERNS = {
+    'amount': [
+        re.compile(r'(?:toplam|total|amount|tutar)[:\s]*([0-9]+[.,][0-9]{2})', _DATA_FLAGS),
+        re.compile(r'([0-9]+[.,][0-9]{2})\s*(?:tl|try|usd|eur|₺|\$|€)', _DATA_FLAGS),
+        re.compile(r'(?:sum|miktar)[:\s]*([0-9]+[.,][0-9]{2})', _DATA_FLAGS)
+    ],
+    'date': [
+        re.compile(r'(?:tarih|date|time)[:\s]*([0-9]{1,2}[./\-][0-9]{1,2}[./\-][0-9]{2,4})', _DATA_FLAGS),
+        re.compile(r'([0-9]{1,2}[./\-][0-9]{1,2}[./\-][0-9]{2,4})\s*[0-9]{1,2}:[0-9]{2}', _DATA_FLAGS),
+        re.compile(r'([0-9]{4}[./\-][0-9]{1,2}[./\-][0-9]{1,2})', _DATA_FLAGS)
+    ],
+    'merchant': [
+        re.compile(r'(?:mağaza|store|merchant|firma)[:\s]*([^\n\r]+)', _DATA_FLAGS),
+        re.compile(r'(?:company|şirket)[:\s]*([^\n\r]+)', _DATA_FLAGS),
+        re.compile(r'^([A-ZÇĞIİÖŞÜa-zçğıiöşü\s]+?)(?:\n|\r|$)', _DATA_FLAGS),
+        re.compile(r'^([A-ZÇĞIİÖŞÜa-zçğıiöşü\s]{3,})', _DATA_FLAGS),
+    ],
+    'tax_number': [
+        re.compile(r'(?:vergi\s*no|tax\s*no|vkn)[:\s]*([0-9]{10,11})', _DATA_FLAGS),
+        re.compile(r'vn[:\s]*([0-9]{10,11})', _DATA_FLAGS)
+    ],
+    'receipt_id': [
+        re.compile(r'(?:receipt\s*id|fiş\s*id|receipt\s*no|fiş\s*no)[:\s]*([a-zA-Z0-9\-]+)', _DATA_FLAGS),
+        re.compile(r'(?:id)[:\s]*([a-fA-F0-9\-]{8,})', _DATA_FLAGS)
+    ]
+}
+
+# Structured text key -> field lookup, checked in this order
+STRUCTURED_KEY_FIELDS = (
+    ('merchant_name', ('merchant', 'store', 'magaza', 'firma')),
+    ('total_amount', ('total', 'amount', 'toplam', 'tutar')),
+    ('transaction_date', ('date', 'time', 'tarih')),
+    ('tax_number', ('tax', 'vkn', 'vergi')),
+)
+
+# JSON payload key -> field lookup
+JSON_FIELD_KEYS = {
+    'merchant_name': ('merchant', 'store', 'company', 'magaza', 'firma'),
+    'total_amount': ('total', 'amount', 'toplam', 'tutar', 'sum'),
+    'transaction_date': ('date', 'time', 'tarih', 'zaman'),
+    'tax_number': ('tax_no', 'vkn', 'vergi_no'),
+    'currency': ('currency', 'para_birimi', 'curr')
+}
+
+ECOTRACK_URL_MARKERS = ('ecotrack.com/receipt/', '/receipts/receipt/')
+
+MERCHANT_LINE_PATTERN = re.compile(r'^[A-ZÇĞIİÖŞÜa-zçğıiöşü\s&\-\.]{3,}$')
+AMOUNT_STRIP_PATTERN = re.compile(r'[^\d.,]')
+WHITESPACE_PATTERN = re.compile(r'\s+')
+MERCHANT_STRIP_PATTERN = re.compile(r'[^\w\s\-\.&]')
+NON_DIGIT_PATTERN = re.compile(r'\D')
+
 class QRParsingError(Exception):
     """Custom exception for QR parsing errors"""
     pass
@@ -21,43 +84,18 @@ class QRParser:
     """Service for parsing QR code data and extracting receipt information"""
     
     def __init__(self):
-        # Common patterns for Turkish receipt QR codes
-        self.turkish_patterns = {
-            'efatura': r'https?://earsivportal\.efatura\.gov\.tr/earsiv-services/download\?token=([^&]+)',
-            'ereceipt': r'https?://ereceipt\.gov\.tr/fiş/([^/?]+)',
-            'gib_qr': r'https?://verify\.gib\.gov\.tr/([^/?]+)',
-            'merchant_qr': r'https?://(?:www\.)?([^/]+)/receipt/([^/?]+)'
-        }
-        
-        # Patterns for extracting data from QR content
-        self.data_patterns = {
-            'amount': [
-                r'(?:toplam|total|amount|tutar)[:\s]*([0-9]+[.,][0-9]{2})',
-                r'([0-9]+[.,][0-9]{2})\s*(?:tl|try|usd|eur|₺|\$|€)',
-                r'(?:sum|miktar)[:\s]*([0-9]+[.,][0-9]{2})'
-            ],
-            'date': [
-                r'(?:tarih|date|time)[:\s]*([0-9]{1,2}[./\-][0-9]{1,2}[./\-][0-9]{2,4})',
-                r'([0-9]{1,2}[./\-][0-9]{1,2}[./\-][0-9]{2,4})\s*[0-9]{1,2}:[0-9]{2}',
-                r'([0-9]{4}[./\-][0-9]{1,2}[./\-][0-9]{1,2})'
-            ],
-            'merchant': [
-                r'(?:mağaza|store|merchant|firma)[:\s]*([^\n\r]+)',
-                r'(?:company|şirket)[:\s]*([^\n\r]+)',
-                r'^([A-ZÇĞIİÖŞÜa-zçğıiöşü\s]+?)(?:\n|\r|$)',
-                r'^([A-ZÇĞIİÖŞÜa-zçğıiöşü\s]{3,})',
-            ],
-            'tax_number': [
-                r'(?:vergi\s*no|tax\s*no|vkn)[:\s]*([0-9]{10,11})',
-                r'vn[:\s]*([0-9]{10,11})'
-            ],
-            'receipt_id': [
-                r'(?:receipt\s*id|fiş\s*id|receipt\s*no|fiş\s*no)[:\s]*([a-zA-Z0-9\-]+)',
-                r'(?:id)[:\s]*([a-fA-F0-9\-]{8,})'
-            ]
-        }
+        self.turkish_patterns = TURKISH_PATTERNS
+        self.data_patterns = DATA_PATTERNS
 
     async def parse_qr_data(self, qr_data: str) -> Dict[str, Any]:
+        """
+        Async wrapper around parse() for existing callers
+
+        Parsing is pure CPU work with no I/O, so it runs inline.
+        """
+        return self.parse(qr_data)
+
+    def parse(self, qr_data: str) -> Dict[str, Any]:
         """
         Parse QR code data and extract receipt information
         
@@ -71,12 +109,14 @@ class QRParser:
             QRParsingError: If parsing fails
         """
         try:
-            logger.info(f"Starting QR parsing for data: {qr_data[:100]}...")
+            logger.debug(f"Starting QR parsing for data: {qr_data[:100]}...")
+            
+            qr_type, json_data = self._classify(qr_data)
             
             # Initialize result structure
             parsed_data = {
                 'raw_qr_data': qr_data,
-                'qr_type': self._identify_qr_type(qr_data),
+                'qr_type': qr_type,
                 'merchant_name': None,
                 'transaction_date': None,
                 'total_amount': None,
@@ -89,22 +129,22 @@ class QRParser:
             }
             
             # Parse based on QR type
-            if parsed_data['qr_type'] == 'url':
-                await self._parse_url_qr(qr_data, parsed_data)
-            elif parsed_data['qr_type'] == 'json':
-                await self._parse_json_qr(qr_data, parsed_data)
-            elif parsed_data['qr_type'] == 'structured_text':
-                await self._parse_structured_text_qr(qr_data, parsed_data)
+            if qr_type == 'url':
+                self._parse_url_qr(qr_data, parsed_data)
+            elif qr_type == 'json':
+                self._parse_json_qr(json_data, parsed_data)
+            elif qr_type == 'structured_text':
+                self._parse_structured_text_qr(qr_data, parsed_data)
             else:
-                await self._parse_plain_text_qr(qr_data, parsed_data)
+                self._parse_plain_text_qr(qr_data, parsed_data)
             
             # Calculate parsing confidence
             parsed_data['parsing_confidence'] = self._calculate_confidence(parsed_data)
             
             # Validate and clean extracted data
-            await self._validate_and_clean_data(parsed_data)
+            self._validate_and_clean_data(parsed_data)
             
-            logger.info(f"QR parsing completed with confidence: {parsed_data['parsing_confidence']}")
+            logger.debug(f"QR parsing completed with confidence: {parsed_data['parsing_confidence']}")
             return parsed_data
             
         except Exception as e:
@@ -113,35 +153,53 @@ class QRParser:
 
     def _identify_qr_type(self, qr_data: str) -> str:
         """Identify the type of QR code based on its content"""
-        qr_data_lower = qr_data.lower().strip()
+        return self._classify(qr_data)[0]
+
+    def _classify(self, qr_data: str) -> Tuple[str, Any]:
+        """
+        Single-pass QR type detection
+
+        Looks at the first non-space character before doing any heavier work:
+        only payloads opening with '{' or '[' are handed to json.loads, and
+        only 'h'/'H' payloads are checked for a URL scheme.
+
+        Returns:
+            (qr_type, decoded JSON for 'json' payloads otherwise None)
+        """
+        stripped = qr_data.strip()
+        if not stripped:
+            return 'plain_text', None
         
-        # Check if it's a URL
-        if qr_data_lower.startswith(('http://', 'https://')):
-            return 'url'
+        first = stripped[0]
         
-        # Check if it's an EcoTrack receipt URL (without protocol)
-        if 'ecotrack.com/receipt/' in qr_data_lower or '/receipts/receipt/' in qr_data_lower:
-            return 'url'
+        # JSON object/array
+        if first in '{[':
+            try:
+                return 'json', json.loads(stripped)
+            except (json.JSONDecodeError, ValueError):
+                pass
         
-        # Check if it's JSON
-        try:
-            json.loads(qr_data)
-            return 'json'
-        except (json.JSONDecodeError, ValueError):
-            pass
+        # URL with scheme
+        if first in 'hH' and stripped[:8].lower().startswith(('http://', 'https://')):
+            return 'url', None
         
-        # Check if it's structured text (contains key-value pairs)
-        if ':' in qr_data and ('=' in qr_data or '\n' in qr_data):
-            return 'structured_text'
+        # EcoTrack receipt URL without protocol
+        lowered = stripped.lower()
+        if any(marker in lowered for marker in ECOTRACK_URL_MARKERS):
+            return 'url', None
         
-        return 'plain_text'
+        # Structured text (key-value pairs)
+        if ':' in stripped and ('=' in stripped or '\n' in stripped):
+            return 'structured_text', None
+        
+        return 'plain_text', None
 
-    async def _parse_url_qr(self, qr_data: str, parsed_data: Dict[str, Any]):
+    def _parse_url_qr(self, qr_data: str, parsed_data: Dict[str, Any]):
         """Parse URL-based QR codes (e-receipt, e-invoice, etc.)"""
         try:
             # Check for EcoTrack receipt URLs first
             qr_data_lower = qr_data.lower()
-            if 'ecotrack.com/receipt/' in qr_data_lower or '/receipts/receipt/' in qr_data_lower:
+            if any(marker in qr_data_lower for marker in ECOTRACK_URL_MARKERS):
                 parsed_data['qr_subtype'] = 'ecotrack_receipt'
                 parsed_data['source_system'] = 'EcoTrack'
                 
@@ -166,7 +224,7 @@ class QRParser:
             
             # Check for Turkish government receipt systems
             for pattern_name, pattern in self.turkish_patterns.items():
-                match = re.search(pattern, qr_data, re.IGNORECASE)
+                match = pattern.search(qr_data)
                 if match:
                     parsed_data['qr_subtype'] = pattern_name
                     parsed_data['receipt_id'] = match.group(1) if match.groups() else None
@@ -186,24 +244,25 @@ class QRParser:
         except Exception as e:
             parsed_data['parsing_errors'].append(f"URL parsing error: {str(e)}")
 
-    async def _parse_json_qr(self, qr_data: str, parsed_data: Dict[str, Any]):
-        """Parse JSON-formatted QR codes"""
+    def _parse_json_qr(self, json_data: Any, parsed_data: Dict[str, Any]):
+        """Parse JSON-formatted QR codes (already decoded by _classify)"""
         try:
-            json_data = json.loads(qr_data)
+            if not isinstance(json_data, dict):
+                parsed_data['parsing_errors'].append("JSON parsing error: expected an object")
+                return
             
             # Map common JSON fields to our structure
-            field_mappings = {
-                'merchant_name': ['merchant', 'store', 'company', 'magaza', 'firma'],
-                'total_amount': ['total', 'amount', 'toplam', 'tutar', 'sum'],
-                'transaction_date': ['date', 'time', 'tarih', 'zaman'],
-                'tax_number': ['tax_no', 'vkn', 'vergi_no'],
-                'currency': ['currency', 'para_birimi', 'curr']
-            }
-            
-            for target_field, possible_keys in field_mappings.items():
+            for target_field, possible_keys in JSON_FIELD_KEYS.items():
                 for key in possible_keys:
                     if key in json_data:
-                        parsed_data[target_field] = json_data[key]
+                        value = json_data[key]
+                        # POS payloads often carry "89,90" / "15.01.2024" as strings
+                        if isinstance(value, str):
+                            if target_field == 'total_amount':
+                                value = self._extract_amount(value)
+                            elif target_field == 'transaction_date':
+                                value = self._parse_date(value)
+                        parsed_data[target_field] = value
                         break
             
             # Extract items if available
@@ -215,7 +274,7 @@ class QRParser:
         except Exception as e:
             parsed_data['parsing_errors'].append(f"JSON parsing error: {str(e)}")
 
-    async def _parse_structured_text_qr(self, qr_data: str, parsed_data: Dict[str, Any]):
+    def _parse_structured_text_qr(self, qr_data: str, parsed_data: Dict[str, Any]):
         """Parse structured text QR codes (key:value pairs)"""
         try:
             lines = qr_data.split('\n')
@@ -225,7 +284,7 @@ class QRParser:
                 first_line = lines[0].strip()
                 if first_line and not any(sep in first_line for sep in [':', '=', '|']):
                     # Check if first line looks like a merchant name (contains letters and spaces)
-                    if re.match(r'^[A-ZÇĞIİÖŞÜa-zçğıiöşü\s&\-\.]{3,}$', first_line):
+                    if MERCHANT_LINE_PATTERN.match(first_line):
                         parsed_data['merchant_name'] = first_line
             
             for line in lines:
@@ -242,20 +301,20 @@ class QRParser:
                             value = parts[1].strip()
                             
                             # Map keys to our fields
-                            if any(k in key for k in ['merchant', 'store', 'magaza', 'firma']):
-                                parsed_data['merchant_name'] = value
-                            elif any(k in key for k in ['total', 'amount', 'toplam', 'tutar']):
-                                parsed_data['total_amount'] = self._extract_amount(value)
-                            elif any(k in key for k in ['date', 'time', 'tarih']):
-                                parsed_data['transaction_date'] = self._parse_date(value)
-                            elif any(k in key for k in ['tax', 'vkn', 'vergi']):
-                                parsed_data['tax_number'] = value
+                            for field, keywords in STRUCTURED_KEY_FIELDS:
+                                if any(k in key for k in keywords):
+                                    if field == 'total_amount':
+                                        value = self._extract_amount(value)
+                                    elif field == 'transaction_date':
+                                        value = self._parse_date(value)
+                                    parsed_data[field] = value
+                                    break
                         break
                         
         except Exception as e:
             parsed_data['parsing_errors'].append(f"Structured text parsing error: {str(e)}")
 
-    async def _parse_plain_text_qr(self, qr_data: str, parsed_data: Dict[str, Any]):
+    def _parse_plain_text_qr(self, qr_data: str, parsed_data: Dict[str, Any]):
         """Parse plain text QR codes using regex patterns"""
         try:
             # For simple test QR codes, create default data
@@ -270,7 +329,7 @@ class QRParser:
             # Extract data using regex patterns
             for field, patterns in self.data_patterns.items():
                 for pattern in patterns:
-                    match = re.search(pattern, qr_data, re.IGNORECASE | re.MULTILINE)
+                    match = pattern.search(qr_data)
                     if match:
                         value = match.group(1).strip()
                         
@@ -291,8 +350,6 @@ class QRParser:
     def _extract_from_url_params(self, url: str, parsed_data: Dict[str, Any]):
         """Extract data from URL parameters"""
         try:
-            from urllib.parse import urlparse, parse_qs
-            
             parsed_url = urlparse(url)
             params = parse_qs(parsed_url.query)
             
@@ -324,7 +381,7 @@ class QRParser:
         """Extract numeric amount from string"""
         try:
             # Remove currency symbols and clean the string
-            cleaned = re.sub(r'[^\d.,]', '', amount_str)
+            cleaned = AMOUNT_STRIP_PATTERN.sub('', amount_str)
             
             # Handle different decimal separators
             if ',' in cleaned and '.' in cleaned:
@@ -340,34 +397,7 @@ class QRParser:
 
     def _parse_date(self, date_str: str) -> Optional[datetime]:
         """Parse date string to datetime object"""
-        try:
-            # Try different date formats
-            date_formats = [
-                '%d/%m/%Y %H:%M:%S',
-                '%d/%m/%Y %H:%M',
-                '%d/%m/%Y',
-                '%d.%m.%Y %H:%M:%S',
-                '%d.%m.%Y %H:%M',
-                '%d.%m.%Y',
-                '%d-%m-%Y %H:%M:%S',
-                '%d-%m-%Y %H:%M',
-                '%d-%m-%Y',
-                '%Y-%m-%d %H:%M:%S',
-                '%Y-%m-%d %H:%M',
-                '%Y-%m-%d'
-            ]
-            
-            for fmt in date_formats:
-                try:
-                    return datetime.strptime(date_str.strip(), fmt)
-                except ValueError:
-                    continue
-            
-            # Try using dateutil parser as fallback
-            return date_parser.parse(date_str, dayfirst=True)
-            
-        except Exception:
-            return None
+        return parse_datetime(date_str)
 
     def _calculate_confidence(self, parsed_data: Dict[str, Any]) -> float:
         """Calculate parsing confidence score based on extracted data"""
@@ -392,15 +422,15 @@ class QRParser:
         
         return min(confidence, max_score)
 
-    async def _validate_and_clean_data(self, parsed_data: Dict[str, Any]):
+    def _validate_and_clean_data(self, parsed_data: Dict[str, Any]):
         """Validate and clean the extracted data"""
         try:
             # Clean merchant name
             if parsed_data.get('merchant_name'):
                 merchant = parsed_data['merchant_name'].strip()
                 # Remove excessive whitespace and special characters
-                merchant = re.sub(r'\s+', ' ', merchant)
-                merchant = re.sub(r'[^\w\s\-\.&]', '', merchant)
+                merchant = WHITESPACE_PATTERN.sub(' ', merchant)
+                merchant = MERCHANT_STRIP_PATTERN.sub('', merchant)
                 parsed_data['merchant_name'] = merchant[:100]  # Limit length
             
             # Validate amount
@@ -424,7 +454,7 @@ class QRParser:
             
             # Validate tax number (Turkish tax numbers are 10-11 digits)
             if parsed_data.get('tax_number'):
-                tax_no = re.sub(r'\D', '', parsed_data['tax_number'])
+                tax_no = NON_DIGIT_PATTERN.sub('', str(parsed_data['tax_number']))
                 if len(tax_no) not in [10, 11]:
                     parsed_data['tax_number'] = None
                 else:
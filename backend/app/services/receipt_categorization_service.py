@@ -0,0 +1,220 @@
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from datetime import datetime
+from enum import Enum
+from typing import Any, Dict, List, Optional
+from uuid import uuid4
+
+from app.core.config import settings
+from app.services.ai_categorizer import ai_categorizer
+from app.services.dashboard_cache import dashboard_cache
+from app.services.loyalty_service import LoyaltyService
+
+logger = logging.getLogger(__name__)
+
+# Same threshold the synchronous claim flow used
+CATEGORY_CONFIDENCE_THRESHOLD = 0.3
+
+
+class CategorizationJobStatus(str, Enum):
+    PENDING = "pending"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+
+
+class ReceiptCategorizationService:
+    """
+    Claimed receipt'lerin kategorize edilmemiş kalemlerini arka planda işleyen servis
+
+    Claim işlemi yanıtı beklemeden döner; kategorizasyon ve loyalty puanı
+    bir arka plan job'ında çalışır, client job durumunu poll eder.
+    Job durumu process içinde tutulur ve job_ttl_seconds sonra silinir.
+    """
+
+    def __init__(
+        self,
+        max_concurrent_jobs: int = 4,
+        job_ttl_seconds: int = 3600,
+        loyalty_service: Optional[LoyaltyService] = None
+    ):
+        self.max_concurrent_jobs = max_concurrent_jobs
+        self.job_ttl_seconds = job_ttl_seconds
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._tasks: set = set()
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loyalty_service = loyalty_service
+
+    @property
+    def loyalty_service(self) -> LoyaltyService:
+        if self._loyalty_service is None:
+            self._loyalty_service = LoyaltyService()
+        return self._loyalty_service
+
+    def submit(
+        self,
+        user_id: str,
+        receipt_id: str,
+        expense_ids: List[str],
+        merchant_name: Optional[str],
+        total_amount: Optional[float]
+    ) -> str:
+        """
+        Yeni bir kategorizasyon job'ı başlat ve job id'sini döndür
+        """
+        self._prune_finished_jobs()
+
+        job_id = str(uuid4())
+        self._jobs[job_id] = {
+            "job_id": job_id,
+            "user_id": user_id,
+            "receipt_id": receipt_id,
+            "status": CategorizationJobStatus.PENDING,
+            "items_total": 0,
+            "items_categorized": 0,
+            "loyalty_points_awarded": None,
+            "error": None,
+            "created_at": datetime.now(),
+            "finished_at": None,
+            "_finished_monotonic": None,
+        }
+
+        task = asyncio.create_task(
+            self._run_job(job_id, user_id, expense_ids, merchant_name, total_amount)
+        )
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+        return job_id
+
+    def get_job(self, job_id: str, user_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Job durumunu döndür (user_id verilirse sadece sahibine)
+        """
+        job = self._jobs.get(job_id)
+        if job is None or (user_id is not None and job["user_id"] != user_id):
+            return None
+        return {key: value for key, value in job.items() if not key.startswith("_")}
+
+    async def _run_job(
+        self,
+        job_id: str,
+        user_id: str,
+        expense_ids: List[str],
+        merchant_name: Optional[str],
+        total_amount: Optional[float]
+    ):
+        job = self._jobs[job_id]
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent_jobs)
+
+        async with self._semaphore:
+            job["status"] = CategorizationJobStatus.RUNNING
+            try:
+                supabase = settings.supabase_admin
+                primary_category = None
+
+                if expense_ids:
+                    primary_category = await self._categorize_items(
+                        supabase, job, expense_ids, merchant_name
+                    )
+                    # Category distribution on the dashboard changed
+                    dashboard_cache.bump(user_id)
+
+                    # Award loyalty points once categories are known
+                    loyalty_result = await self.loyalty_service.award_points_for_expense(
+                        user_id=user_id,
+                        expense_id=expense_ids[0],
+                        amount=total_amount,
+                        category=primary_category,
+                        merchant_name=merchant_name
+                    )
+                    if loyalty_result.get("success"):
+                        job["loyalty_points_awarded"] = loyalty_result.get("points_awarded")
+
+                job["status"] = CategorizationJobStatus.COMPLETED
+            except Exception as e:
+                logger.error(f"Categorization job {job_id} failed: {e}")
+                job["status"] = CategorizationJobStatus.FAILED
+                job["error"] = str(e)
+            finally:
+                job["finished_at"] = datetime.now()
+                job["_finished_monotonic"] = time.monotonic()
+
+    async def _categorize_items(
+        self,
+        supabase,
+        job: Dict[str, Any],
+        expense_ids: List[str],
+        merchant_name: Optional[str]
+    ) -> Optional[str]:
+        """
+        Kategorisiz kalemleri kategorize et, kategori başına tek update yap
+
+        Returns:
+            Loyalty hesabı için birincil kategori adı (en yüksek tutarlı kategorize kalem)
+        """
+        items_response = supabase.table("expense_items").select(
+            "id, description, amount, category_id, categories(name)"
+        ).in_("expense_id", expense_ids).execute()
+        items = items_response.data or []
+
+        uncategorized = [item for item in items if not item.get("category_id")]
+        job["items_total"] = len(uncategorized)
+
+        categories_response = supabase.table("categories").select("id, name").execute()
+        category_ids = {row["name"]: row["id"] for row in categories_response.data or []}
+
+        # Primary category candidates: already-categorized items count too
+        categorized_amounts = [
+            (item.get("amount") or 0, item["categories"]["name"])
+            for item in items
+            if item.get("category_id") and item.get("categories")
+        ]
+
+        item_ids_by_category: Dict[str, List[str]] = defaultdict(list)
+        for item in uncategorized:
+            try:
+                result = await ai_categorizer.categorize_expense(
+                    description=item.get("description", ""),
+                    merchant_name=merchant_name,
+                    amount=item.get("amount")
+                )
+            except Exception as e:
+                logger.warning(f"AI categorization failed for item {item.get('id')}: {e}")
+                continue
+
+            if result.get("confidence", 0) <= CATEGORY_CONFIDENCE_THRESHOLD:
+                continue
+
+            category_name = result.get("category_name")
+            category_id = category_ids.get(category_name)
+            if category_id:
+                item_ids_by_category[category_id].append(item["id"])
+                categorized_amounts.append((item.get("amount") or 0, category_name))
+
+        for category_id, item_ids in item_ids_by_category.items():
+            supabase.table("expense_items").update({
+                "category_id": category_id
+            }).in_("id", item_ids).execute()
+            job["items_categorized"] += len(item_ids)
+
+        if not categorized_amounts:
+            return None
+        return max(categorized_amounts, key=lambda pair: pair[0])[1]
+
+    def _prune_finished_jobs(self):
+        cutoff = time.monotonic() - self.job_ttl_seconds
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job["_finished_monotonic"] is not None and job["_finished_monotonic"] < cutoff
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+
+# Global receipt categorization service instance
+receipt_categorization_service = ReceiptCategorizationService()
@@ -19,40 +19,18 @@ from app.schemas.recommendation_schemas import (
     LLMPatternResponse
 )
 from app.db.supabase_client import get_supabase_client, get_authenticated_supabase_client
+from app.utils.date_parser import parse_date
 from collections import defaultdict
 
 logger = logging.getLogger(__name__)
 
 def parse_date_safely(date_str: Any) -> date:
     """Safely parse date string from Supabase"""
-    try:
-        if isinstance(date_str, (datetime, date)):
-            return date_str.date() if isinstance(date_str, datetime) else date_str
-        if isinstance(date_str, str):
-            # Handle Z suffix
-            if date_str.endswith('Z'):
-                date_str = date_str.replace('Z', '+00:00')
-            
-            # Handle microseconds with more than 6 digits (Supabase issue)
-            if '+' in date_str and '.' in date_str:
-                # Split at timezone
-                date_part, tz_part = date_str.rsplit('+', 1)
-                if '.' in date_part:
-                    # Limit microseconds to 6 digits
-                    main_part, microsec_part = date_part.rsplit('.', 1)
-                    microsec_part = microsec_part[:6].ljust(6, '0')  # Ensure exactly 6 digits
-                    date_str = f"{main_part}.{microsec_part}+{tz_part}"
-            
-            return datetime.fromisoformat(date_str).date()
-    except (ValueError, TypeError) as e:
-        logger.debug(f"First parse attempt failed for '{date_str}': {e}")
-        try:
-            # Fallback: try simple date format
-            return datetime.strptime(str(date_str), '%Y-%m-%d').date()
-        except (ValueError, TypeError, AttributeError) as e2:
-            logger.warning(f"Could not parse date: {date_str}. Error: {e2}. Returning today's date.")
-            return date.today()
-    return date.today()
+    parsed = parse_date(date_str)
+    if parsed is None:
+        logger.warning(f"Could not parse date: {date_str}. Returning today's date.")
+        return date.today()
+    return parsed
 
 class RecommendationService:
     """Service for AI-powered financial recommendations and insights"""
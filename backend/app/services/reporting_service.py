@@ -15,9 +15,14 @@ from app.schemas.reporting import (
     BarChartResponse, BarChartDataset,
     LineChartResponse, LineChartDataset, LineChartDataPoint,
     DashboardResponse, DashboardSummary,
+    KDVSummaryResponse, KDVRateSummaryItem,
     ChartType, PeriodType
 )
 from app.services.budget_service import BudgetService
+from app.utils.kdv_calculator import KDVCalculator
+
+# Rows per KDV summary request; at or below PostgREST's max-rows so no page is truncated
+KDV_SUMMARY_PAGE_SIZE = 1000
 
 
 class ReportingService:
@@ -64,41 +69,7 @@ class ReportingService:
             
             result = query.execute()
             
-            if not result.data:
-                return self._empty_pie_chart_response(year, month, chart_type)
-            
-            # Process data by category
-            category_totals = defaultdict(float)
-            total_amount = 0.0
-            
-            for expense in result.data:
-                expense_items = expense.get("expense_items", [])
-                for item in expense_items:
-                    category_name = "Other"
-                    if item.get("categories"):
-                        category_name = item["categories"].get("name", "Other")
-                    
-                    amount = float(item.get("amount", 0))
-                    category_totals[category_name] += amount
-                    total_amount += amount
-            
-            # Create chart data
-            chart_data = []
-            for i, (category, amount) in enumerate(sorted(category_totals.items(), key=lambda x: x[1], reverse=True)):
-                percentage = (amount / total_amount * 100) if total_amount > 0 else 0
-                chart_data.append(PieChartDataItem(
-                    label=category,
-                    value=round(amount, 2),
-                    percentage=round(percentage, 1),
-                    color=self.category_colors[i % len(self.category_colors)]
-                ))
-            
-            return PieChartResponse(
-                reportTitle=f"{self.month_names[month]} {year} Category Distribution",
-                totalAmount=round(total_amount, 2),
-                chartType=chart_type.value,
-                data=chart_data
-            ).dict()
+            return self._build_category_distribution(result.data or [], year, month, chart_type)
             
         except Exception as e:
             return {"error": f"Failed to generate category distribution: {str(e)}"}
@@ -114,7 +85,7 @@ class ReportingService:
         """
         try:
             # Get user's category budgets
-            budget_result = await self.budget_service.get_category_budgets(user_id)
+            budget_result = await self.budget_service.get_category_budgets(user_id, year, month)
             if budget_result["status"] != "success":
                 if budget_result["status"] == "not_found":
                     return {"error": f"Bütçe bulunamadı. Lütfen önce {self.month_names[month]} {year} için bir bütçe oluşturun."}
@@ -226,34 +197,91 @@ class ReportingService:
         except Exception as e:
             return {"error": f"Failed to generate spending trends: {str(e)}"}
     
-    async def get_dashboard_summary(self, user_id: str) -> Dict[str, Any]:
+    async def get_kdv_summary(
+        self,
+        user_id: str,
+        start_date: date,
+        end_date: date,
+        supabase=None
+    ) -> Dict[str, Any]:
+        """
+        D. KDV Summary - expense items of a date range grouped by KDV rate
+        
+        expense_date is a timestamp, so end_date is included up to its last
+        moment via < end_date + 1 day. Only amount and kdv_rate are fetched,
+        paged by id with range() so PostgREST's max-rows never truncates a
+        long range; the totals come from one
+        KDVCalculator.summarize_kdv_by_rate call over all pages.
+        """
+        client = supabase or self.supabase
+        items: List[Dict[str, Any]] = []
+        while True:
+            result = client.table("expense_items").select(
+                "amount, kdv_rate, expenses!inner(expense_date)"
+            ).eq("user_id", user_id).gte(
+                "expenses.expense_date", start_date.isoformat()
+            ).lt("expenses.expense_date", (end_date + timedelta(days=1)).isoformat()).order("id").range(
+                len(items), len(items) + KDV_SUMMARY_PAGE_SIZE - 1
+            ).execute()
+            
+            page = result.data or []
+            items.extend(page)
+            if len(page) < KDV_SUMMARY_PAGE_SIZE:
+                break
+        
+        return self.build_kdv_summary(items, start_date, end_date)
+    
+    def build_kdv_summary(self, items: List[Dict[str, Any]], start_date: date, end_date: date) -> Dict[str, Any]:
+        """Build the KDV summary response from expense item rows (amount, kdv_rate)"""
+        summary = KDVCalculator.summarize_kdv_by_rate(
+            [item.get("amount") or 0 for item in items],
+            [item.get("kdv_rate") or KDVCalculator.DEFAULT_KDV_RATE for item in items]
+        )
+        
+        return KDVSummaryResponse(
+            reportTitle=f"KDV Summary {start_date.isoformat()} - {end_date.isoformat()}",
+            startDate=start_date,
+            endDate=end_date,
+            totalAmount=summary["total_amount"],
+            totalKdv=summary["total_kdv"],
+            totalWithoutKdv=summary["total_without_kdv"],
+            averageKdvRate=summary["average_kdv_rate"],
+            data=[
+                KDVRateSummaryItem(
+                    kdvRate=rate,
+                    totalAmount=group["total_amount"],
+                    kdvAmount=group["kdv_amount"],
+                    amountWithoutKdv=group["amount_without_kdv"],
+                    itemCount=group["item_count"]
+                )
+                for rate, group in summary["kdv_by_rate"].items()
+            ]
+        ).dict()
+    
+    async def get_dashboard_summary(self, user_id: str, supabase=None) -> Dict[str, Any]:
         """
         Dashboard summary data
+        
+        Three queries: this month's expenses with their items (totals, top
+        category and the category chart all come from it), last month's
+        totals and the recent transactions.
         """
         try:
+            client = supabase or self.supabase
+            
             # Get current and previous month data
             today = date.today()
             current_month_start = today.replace(day=1)
             previous_month_end = current_month_start - timedelta(days=1)
             previous_month_start = previous_month_end.replace(day=1)
             
-            # Parallel queries for efficiency
-            current_month_query = self.supabase.table("expenses").select(
-                "total_amount, expense_date"
-            ).eq("user_id", user_id).gte("expense_date", current_month_start.isoformat()).lte("expense_date", today.isoformat())
+            current_result = client.table("expenses").select(
+                "total_amount, expense_date, expense_items(amount, category_id, categories(name))"
+            ).eq("user_id", user_id).gte("expense_date", current_month_start.isoformat()).lt("expense_date", (today + timedelta(days=1)).isoformat()).execute()
             
-            previous_month_query = self.supabase.table("expenses").select(
+            previous_result = client.table("expenses").select(
                 "total_amount"
-            ).eq("user_id", user_id).gte("expense_date", previous_month_start.isoformat()).lte("expense_date", previous_month_end.isoformat())
-            
-            category_query = self.supabase.table("expenses").select(
-                "expense_items(amount, categories(name))"
-            ).eq("user_id", user_id).gte("expense_date", current_month_start.isoformat())
-            
-            # Execute queries
-            current_result = current_month_query.execute()
-            previous_result = previous_month_query.execute()
-            category_result = category_query.execute()
+            ).eq("user_id", user_id).gte("expense_date", previous_month_start.isoformat()).lt("expense_date", current_month_start.isoformat()).execute()
             
             # Calculate current month metrics
             current_expenses = current_result.data or []
@@ -268,38 +296,27 @@ class ReportingService:
             # Calculate month-over-month change
             mom_change = ((current_total - previous_total) / previous_total * 100) if previous_total > 0 else 0
             
-            # Calculate top category
-            category_totals = defaultdict(float)
-            for expense in category_result.data or []:
-                expense_items = expense.get("expense_items", [])
-                for item in expense_items:
-                    category_name = "Other"
-                    if item.get("categories"):
-                        category_name = item["categories"].get("name", "Other")
-                    category_totals[category_name] += float(item.get("amount", 0))
-            
-            top_category = max(category_totals.items(), key=lambda x: x[1]) if category_totals else ("No Data", 0)
+            # Category distribution is sorted by amount; its first slice is the top category
+            distribution = self._build_category_distribution(current_expenses, today.year, today.month, ChartType.PIE)
+            top_slice = distribution["data"][0] if distribution["data"] else None
             
             # Create summary
             summary = DashboardSummary(
                 current_month_spending=round(current_total, 2),
                 previous_month_spending=round(previous_total, 2),
                 month_over_month_change=round(mom_change, 2),
-                top_category=top_category[0],
-                top_category_amount=round(top_category[1], 2),
+                top_category=top_slice["label"] if top_slice else "No Data",
+                top_category_amount=top_slice["value"] if top_slice else 0,
                 transaction_count=current_count,
                 average_transaction=round(current_average, 2)
             )
             
-            # Generate quick charts data
-            quick_charts = await self._generate_quick_charts(user_id, current_month_start, today)
-            
             # Get recent transactions
-            recent_transactions = await self._get_recent_transactions(user_id, limit=5)
+            recent_transactions = await self._get_recent_transactions(user_id, limit=5, supabase=client)
             
             return DashboardResponse(
                 summary=summary,
-                quick_charts=quick_charts,
+                quick_charts={"category_distribution": distribution["data"]},
                 recent_transactions=recent_transactions,
                 generated_at=datetime.now()
             ).dict()
@@ -308,6 +325,50 @@ class ReportingService:
             return {"error": f"Failed to generate dashboard: {str(e)}"}
     
     # Helper methods
+    def _build_category_distribution(
+        self,
+        expenses: List[Dict[str, Any]],
+        year: int,
+        month: int,
+        chart_type: ChartType = ChartType.PIE
+    ) -> Dict[str, Any]:
+        """Pie chart response from expenses rows with expense_items(amount, categories(name))"""
+        if not expenses:
+            return self._empty_pie_chart_response(year, month, chart_type)
+        
+        # Process data by category
+        category_totals = defaultdict(float)
+        total_amount = 0.0
+        
+        for expense in expenses:
+            expense_items = expense.get("expense_items", [])
+            for item in expense_items:
+                category_name = "Other"
+                if item.get("categories"):
+                    category_name = item["categories"].get("name", "Other")
+                
+                amount = float(item.get("amount", 0))
+                category_totals[category_name] += amount
+                total_amount += amount
+        
+        # Create chart data
+        chart_data = []
+        for i, (category, amount) in enumerate(sorted(category_totals.items(), key=lambda x: x[1], reverse=True)):
+            percentage = (amount / total_amount * 100) if total_amount > 0 else 0
+            chart_data.append(PieChartDataItem(
+                label=category,
+                value=round(amount, 2),
+                percentage=round(percentage, 1),
+                color=self.category_colors[i % len(self.category_colors)]
+            ))
+        
+        return PieChartResponse(
+            reportTitle=f"{self.month_names[month]} {year} Category Distribution",
+            totalAmount=round(total_amount, 2),
+            chartType=chart_type.value,
+            data=chart_data
+        ).dict()
+    
     async def _process_daily_trend(self, expense_data: List[Dict], title: str, start_date: date, end_date: date) -> Dict[str, Any]:
         """Process daily trend data for current month"""
         daily_totals = defaultdict(float)
@@ -386,24 +447,10 @@ class ReportingService:
             datasets=[dataset]
         ).dict()
     
-    async def _generate_quick_charts(self, user_id: str, start_date: date, end_date: date) -> Dict[str, Any]:
-        """Generate quick chart data for dashboard"""
-        try:
-            # Get category distribution for current month
-            distribution = await self.get_monthly_category_distribution(
-                user_id, start_date.year, start_date.month, ChartType.PIE
-            )
-            
-            return {
-                "category_distribution": distribution.get("data", [])
-            }
-        except Exception:
-            return {"category_distribution": []}
-    
-    async def _get_recent_transactions(self, user_id: str, limit: int = 5) -> List[Dict[str, Any]]:
+    async def _get_recent_transactions(self, user_id: str, limit: int = 5, supabase=None) -> List[Dict[str, Any]]:
         """Get recent transactions for dashboard"""
         try:
-            query = self.supabase.table("expenses").select(
+            query = (supabase or self.supabase).table("expenses").select(
                 "total_amount, expense_date, receipts(merchant_name)"
             ).eq("user_id", user_id).order("expense_date", desc=True).limit(limit)
             
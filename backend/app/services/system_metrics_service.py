@@ -0,0 +1,119 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class SystemMetricsService:
+    """
+    /health/metrics için periyodik olarak yenilenen metrik snapshot'ı
+
+    Toplam satır sayıları planner tahminlerinden (count="estimated") okunur,
+    sadece son 24 saatlik pencereler created_at index'i üzerinden exact sayılır.
+    """
+
+    # Tahmini toplamı alınan tablolar (response key -> tablo adı)
+    TOTAL_TABLES = {
+        "users": "users",
+        "expenses": "expenses",
+        "receipts": "receipts",
+        "merchants": "merchants",
+    }
+
+    # Exact sayılan 24 saatlik pencereler (response key -> tablo adı)
+    RECENT_TABLES = {
+        "new_expenses": "expenses",
+        "new_receipts": "receipts",
+    }
+
+    def __init__(self):
+        self._snapshot: Optional[Dict[str, Any]] = None
+        self._refreshed_at: Optional[float] = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def refresh_interval_seconds(self) -> int:
+        return max(1, settings.METRICS_REFRESH_INTERVAL_MINUTES) * 60
+
+    def snapshot_age_seconds(self) -> Optional[float]:
+        """
+        Mevcut snapshot'ın yaşı (saniye), snapshot yoksa None
+        """
+        if self._refreshed_at is None:
+            return None
+        return time.monotonic() - self._refreshed_at
+
+    def is_stale(self) -> bool:
+        """
+        Snapshot hiç alınmamışsa veya scheduler aralığının iki katından eskiyse
+        (ör. scheduler kapalı) bayat kabul edilir
+        """
+        age = self.snapshot_age_seconds()
+        return age is None or age > 2 * self.refresh_interval_seconds
+
+    async def refresh(self) -> Dict[str, Any]:
+        """
+        Metrik snapshot'ını yeniden hesapla
+
+        Eşzamanlı çağrılar tek bir yenilemede birleştirilir.
+        """
+        started_at = time.monotonic()
+        async with self._lock:
+            # Biz lock'u beklerken başka bir çağrı yenilediyse onu kullan
+            if self._refreshed_at is not None and self._refreshed_at >= started_at:
+                return self._snapshot  # type: ignore[return-value]
+
+            supabase = settings.supabase_admin
+            yesterday = datetime.utcnow() - timedelta(days=1)
+
+            totals: Dict[str, int] = {}
+            for key, table in self.TOTAL_TABLES.items():
+                totals[key] = self._count(
+                    supabase.table(table).select("id", count="estimated").limit(1)  # type: ignore
+                )
+
+            last_24h: Dict[str, int] = {}
+            for key, table in self.RECENT_TABLES.items():
+                last_24h[key] = self._count(
+                    supabase.table(table).select("id", count="exact")  # type: ignore
+                    .gte("created_at", yesterday.isoformat())
+                    .limit(1)
+                )
+
+            self._snapshot = {
+                "generated_at": datetime.utcnow().isoformat(),
+                "totals": totals,
+                "totals_are_estimates": True,
+                "last_24h": last_24h,
+            }
+            self._refreshed_at = time.monotonic()
+
+            logger.info(f"System metrics snapshot refreshed in {(self._refreshed_at - started_at) * 1000:.1f} ms")
+            return self._snapshot
+
+    async def get_snapshot(self) -> Dict[str, Any]:
+        """
+        Snapshot'ı döndür, yoksa veya bayatsa önce yenile
+        """
+        if self._snapshot is None or self.is_stale():
+            await self.refresh()
+
+        return {
+            **self._snapshot,  # type: ignore[dict-item]
+            "snapshot_age_seconds": round(self.snapshot_age_seconds() or 0.0, 1),
+            "refresh_interval_seconds": self.refresh_interval_seconds,
+        }
+
+    @staticmethod
+    def _count(query) -> int:
+        result = query.execute()
+        return result.count if getattr(result, "count", None) is not None else 0
+
+
+# Global system metrics service instance
+system_metrics_service = SystemMetricsService()
@@ -0,0 +1,403 @@
+import asyncio
+import json
+import logging
+import random
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from enum import Enum
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from uuid import UUID
+
+from app.core.config import settings
+from app.schemas.merchant import WebhookProcessingResult, WebhookTransactionData
+from app.services.webhook_service import WebhookService
+
+logger = logging.getLogger(__name__)
+
+QUEUE_TABLE = "webhook_queue"
+QUEUE_CONFLICT_KEY = "merchant_id,transaction_id"
+DEAD_LETTER_VIEW = "webhook_dead_letters"
+
+
+class WebhookQueueStatus(str, Enum):
+    QUEUED = "queued"
+    PROCESSING = "processing"
+    DONE = "done"
+    FAILED = "failed"
+
+
+# Statuses whose stored result is final; a 'queued' row may still hold the result of a failed attempt
+FINAL_STATUSES = {WebhookQueueStatus.DONE.value, WebhookQueueStatus.FAILED.value}
+
+
+class WebhookQueueService:
+    """
+    Merchant webhook'ları için kalıcı kuyruk (webhook_queue tablosu)
+
+    Kabul anında sadece payload yazılır; (merchant_id, transaction_id) unique
+    olduğu için POS'un tekrar gönderdiği işlem yeni kayıt oluşturmaz, mevcut
+    kaydın durumu/sonucu döner. Worker coroutine'leri claim_webhook_queue_batch
+    ile batch halinde kayıt alıp normal WebhookService akışını çalıştırır;
+    eşzamanlılık worker sayısı ile sınırlıdır.
+
+    Başarısız işlemler retry_attempts kez, üstel backoff + jitter ile
+    (next_attempt_at) tekrar kuyruğa alınır; denemeleri biten kayıt 'failed'
+    kalır ve webhook_dead_letters view'ında görünür. Retry claim'leri
+    retry_rate_limit / retry_rate_period ile sınırlıdır ve yeni işlemlerden
+    sonra gelir. WebhookService receipt'i (merchant_id, transaction_id) ile
+    upsert ettiği için yarıda kalmış bir denemenin retry'ı ikinci receipt
+    oluşturmaz.
+    """
+
+    def __init__(
+        self,
+        workers: int = 4,
+        batch_size: int = 10,
+        poll_interval: float = 5.0,
+        lease_seconds: int = 300,
+        retry_attempts: int = 0,
+        retry_delay: float = 60.0,
+        retry_max_delay: float = 3600.0,
+        retry_rate_limit: int = 60,
+        retry_rate_period: float = 60.0,
+        supabase_factory: Optional[Callable[[], Any]] = None,
+        processor_factory: Optional[Callable[[Any], Any]] = None
+    ):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.retry_attempts = retry_attempts
+        self.retry_delay = retry_delay
+        self.retry_max_delay = retry_max_delay
+        self.retry_rate_limit = retry_rate_limit
+        self.retry_rate_period = retry_rate_period
+        self._retry_claims: deque = deque()
+        self._supabase_factory = supabase_factory or (lambda: settings.supabase_admin)
+        self._processor_factory = processor_factory
+        self._supabase = None
+        self._tasks: List[asyncio.Task] = []
+        self._wake: Optional[asyncio.Event] = None
+
+    @property
+    def supabase(self):
+        if self._supabase is None:
+            self._supabase = self._supabase_factory()
+        return self._supabase
+
+    def enqueue(
+        self,
+        merchant_id: UUID,
+        transaction_data: WebhookTransactionData,
+        status: WebhookQueueStatus = WebhookQueueStatus.QUEUED,
+        supabase=None
+    ) -> Tuple[Dict[str, Any], bool]:
+        """
+        İşlemi kuyruğa yaz (idempotent)
+
+        Returns:
+            (queue row, duplicate) - duplicate ise row aynı transaction_id'nin mevcut kaydıdır
+        """
+        client = supabase or self.supabase
+        row = self._queue_row(merchant_id, transaction_data, status)
+
+        result = client.table(QUEUE_TABLE).upsert(
+            row, on_conflict=QUEUE_CONFLICT_KEY, ignore_duplicates=True
+        ).execute()
+
+        if result.data:
+            if status == WebhookQueueStatus.QUEUED:
+                self.notify()
+            return result.data[0], False
+
+        existing = self.get_entry(merchant_id, transaction_data.transaction_id, supabase=client)
+        if existing is None:
+            raise RuntimeError(f"Webhook queue insert for {transaction_data.transaction_id} returned no row")
+        return existing, True
+
+    def enqueue_many(
+        self,
+        merchant_id: UUID,
+        transactions: List[WebhookTransactionData],
+        status: WebhookQueueStatus = WebhookQueueStatus.QUEUED,
+        supabase=None
+    ) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, Dict[str, Any]]]:
+        """
+        Birden çok işlemi tek upsert ile kuyruğa yaz (idempotent)
+
+        Aynı istekte tekrar eden transaction_id'ler bir kez yazılır; daha önce
+        alınmış olanlar tek in_() sorgusuyla okunur.
+
+        Returns:
+            ({transaction_id: yeni kayıt}, {transaction_id: mevcut kayıt})
+        """
+        client = supabase or self.supabase
+        rows: Dict[str, Dict[str, Any]] = {}
+        for transaction_data in transactions:
+            if transaction_data.transaction_id not in rows:
+                rows[transaction_data.transaction_id] = self._queue_row(merchant_id, transaction_data, status)
+        if not rows:
+            return {}, {}
+
+        result = client.table(QUEUE_TABLE).upsert(
+            list(rows.values()), on_conflict=QUEUE_CONFLICT_KEY, ignore_duplicates=True
+        ).execute()
+        created = {row["transaction_id"]: row for row in result.data or []}
+
+        existing: Dict[str, Dict[str, Any]] = {}
+        missing = [transaction_id for transaction_id in rows if transaction_id not in created]
+        if missing:
+            existing_result = client.table(QUEUE_TABLE).select("*").eq(
+                "merchant_id", str(merchant_id)
+            ).in_("transaction_id", missing).execute()
+            existing = {row["transaction_id"]: row for row in existing_result.data or []}
+            lost = [transaction_id for transaction_id in missing if transaction_id not in existing]
+            if lost:
+                raise RuntimeError(f"Webhook queue insert returned no row for {len(lost)} transactions")
+
+        if created and status == WebhookQueueStatus.QUEUED:
+            self.notify()
+        return created, existing
+
+    def get_entry(self, merchant_id: UUID, transaction_id: str, supabase=None) -> Optional[Dict[str, Any]]:
+        """Bir merchant işleminin kuyruk kaydı"""
+        client = supabase or self.supabase
+        result = client.table(QUEUE_TABLE).select("*").eq(
+            "merchant_id", str(merchant_id)
+        ).eq("transaction_id", transaction_id).limit(1).execute()
+        return result.data[0] if result.data else None
+
+    def notify(self):
+        """Worker'ları poll aralığını beklemeden uyandır"""
+        if self._wake is not None:
+            self._wake.set()
+
+    async def start(self):
+        """Worker coroutine'lerini başlat"""
+        if self._tasks:
+            return
+        self._wake = asyncio.Event()
+        self._tasks = [
+            asyncio.create_task(self._worker(index), name=f"webhook-queue-{index}")
+            for index in range(max(1, self.workers))
+        ]
+        logger.info(f"Webhook queue started with {len(self._tasks)} workers")
+
+    async def stop(self):
+        """Worker'ları durdur; yarım kalan kayıtlar lease süresi dolunca tekrar claim edilir"""
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def drain_once(self, limit: Optional[int] = None) -> int:
+        """
+        Bir batch claim edip işle
+
+        Returns:
+            İşlenen kayıt sayısı
+        """
+        client = self.supabase
+        entries = client.rpc("claim_webhook_queue_batch", {
+            "p_limit": limit or self.batch_size,
+            "p_lease_seconds": self.lease_seconds,
+            "p_retry_limit": self._retry_allowance(),
+        }).execute().data or []
+        if not entries:
+            return 0
+
+        now = time.monotonic()
+        for entry in entries:
+            if (entry.get("attempts") or 0) > 1:
+                self._retry_claims.append(now)
+
+        processor = self._processor(client)
+        for entry in entries:
+            await self._process_entry(client, processor, entry)
+        return len(entries)
+
+    async def _worker(self, index: int):
+        while True:
+            try:
+                processed = await self.drain_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Webhook queue worker {index} failed to drain: {e}")
+                processed = 0
+
+            if processed:
+                continue
+
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _process_entry(self, client, processor, entry: Dict[str, Any]):
+        try:
+            transaction_data = WebhookTransactionData(**entry["payload"])
+            result = await processor.process_merchant_transaction(
+                UUID(entry["merchant_id"]), transaction_data, test_mode=False
+            )
+        except Exception as e:
+            logger.error(f"Webhook queue entry {entry.get('id')} failed: {e}")
+            result = WebhookProcessingResult(
+                success=False,
+                message=f"Error processing queued webhook: {str(e)}",
+                transaction_id=entry.get("transaction_id"),
+                processing_time_ms=0,
+                errors=[str(e)]
+            )
+        self.complete(entry, result, supabase=client)
+
+    def complete(self, entry: Dict[str, Any], result: WebhookProcessingResult, supabase=None) -> Dict[str, Any]:
+        """
+        Kaydı işlem sonucuyla kapat (done / failed) ya da retry için tekrar kuyruğa al
+
+        Returns:
+            Kayda yazılan alanlar; status 'queued' ise retry bekleniyor
+        """
+        client = supabase or self.supabase
+        completion = self._completion(entry, result)
+        client.table(QUEUE_TABLE).update(completion).eq("id", str(entry["id"])).execute()
+        return completion
+
+    def complete_many(
+        self,
+        completed: List[Tuple[Dict[str, Any], WebhookProcessingResult]],
+        supabase=None
+    ):
+        """Birden çok kaydı tek upsert ile kapat; (kuyruk kaydı, sonuç) çiftleri"""
+        if not completed:
+            return
+        client = supabase or self.supabase
+        client.table(QUEUE_TABLE).upsert(
+            [{**entry, **self._completion(entry, result)} for entry, result in completed],
+            on_conflict="id"
+        ).execute()
+
+    @staticmethod
+    def _queue_row(
+        merchant_id: UUID,
+        transaction_data: WebhookTransactionData,
+        status: WebhookQueueStatus
+    ) -> Dict[str, Any]:
+        row = {
+            "merchant_id": str(merchant_id),
+            "transaction_id": transaction_data.transaction_id,
+            "payload": json.loads(transaction_data.model_dump_json()),
+            "status": WebhookQueueStatus(status).value,
+        }
+        if status == WebhookQueueStatus.PROCESSING:
+            # Caller processes it right away (sync mode); workers must not pick it up
+            row["attempts"] = 1
+            row["locked_at"] = _now_iso()
+        return row
+
+    def retry_backoff(self, attempts: int) -> float:
+        """
+        Retry gecikmesi (saniye): retry_delay * 2^(attempts-1), retry_max_delay ile sınırlı
+
+        Gecikmenin yarısı sabit, yarısı rastgeledir; aynı anda düşen işlemlerin
+        retry'ları aynı ana yığılmaz.
+        """
+        delay = min(self.retry_max_delay, self.retry_delay * (2 ** max(0, attempts - 1)))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def _completion(self, entry: Dict[str, Any], result: WebhookProcessingResult) -> Dict[str, Any]:
+        attempts = entry.get("attempts") or 1
+        completion = {
+            "result": json.loads(result.model_dump_json()),
+            "error_message": None if result.success else result.message,
+            "locked_at": None,
+            "updated_at": _now_iso(),
+        }
+        if result.success:
+            completion.update(status=WebhookQueueStatus.DONE.value, processed_at=_now_iso())
+        elif attempts <= self.retry_attempts:
+            next_attempt_at = datetime.now(timezone.utc) + timedelta(seconds=self.retry_backoff(attempts))
+            completion.update(status=WebhookQueueStatus.QUEUED.value, next_attempt_at=next_attempt_at.isoformat())
+            logger.info(
+                f"Webhook transaction {entry.get('transaction_id')} failed on attempt {attempts}, "
+                f"retrying at {completion['next_attempt_at']}"
+            )
+        else:
+            completion.update(status=WebhookQueueStatus.FAILED.value, processed_at=_now_iso())
+            if self.retry_attempts:
+                logger.warning(
+                    f"Webhook transaction {entry.get('transaction_id')} moved to dead letters after {attempts} attempts"
+                )
+        return completion
+
+    def _retry_allowance(self) -> int:
+        """Bu claim'de alınabilecek retry sayısı (kayan pencere rate limit)"""
+        if not self.retry_attempts:
+            return 0
+        window_start = time.monotonic() - self.retry_rate_period
+        while self._retry_claims and self._retry_claims[0] <= window_start:
+            self._retry_claims.popleft()
+        return max(0, self.retry_rate_limit - len(self._retry_claims))
+
+    def list_dead_letters(
+        self,
+        merchant_id: Optional[UUID] = None,
+        page: int = 1,
+        size: int = 20,
+        supabase=None
+    ) -> Tuple[List[Dict[str, Any]], int]:
+        """Denemeleri tükenmiş işlemler (webhook_dead_letters view'ı), en yeni önce"""
+        client = supabase or self.supabase
+        query = client.table(DEAD_LETTER_VIEW).select("*", count="exact")
+        if merchant_id is not None:
+            query = query.eq("merchant_id", str(merchant_id))
+        offset = (page - 1) * size
+        result = query.order("failed_at", desc=True).range(offset, offset + size - 1).execute()
+        return result.data or [], result.count or 0
+
+    def requeue(self, queue_id: UUID, supabase=None) -> bool:
+        """Dead-letter kaydını baştan (yeni deneme hakkıyla) kuyruğa al"""
+        client = supabase or self.supabase
+        result = client.table(QUEUE_TABLE).update({
+            "status": WebhookQueueStatus.QUEUED.value,
+            "attempts": 0,
+            "next_attempt_at": _now_iso(),
+            "locked_at": None,
+            "updated_at": _now_iso(),
+        }).eq("id", str(queue_id)).eq("status", WebhookQueueStatus.FAILED.value).execute()
+        if result.data:
+            self.notify()
+            return True
+        return False
+
+    def _processor(self, client):
+        if self._processor_factory is not None:
+            return self._processor_factory(client)
+        return WebhookService(client)
+
+
+def stored_result(entry: Dict[str, Any]) -> Optional[WebhookProcessingResult]:
+    """Kuyruk kaydındaki kesin işlem sonucu (henüz işlenmediyse ya da retry bekliyorsa None)"""
+    if entry.get("status") not in FINAL_STATUSES or not entry.get("result"):
+        return None
+    return WebhookProcessingResult(**entry["result"])
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+# Global webhook queue service instance
+webhook_queue_service = WebhookQueueService(
+    workers=settings.WEBHOOK_INGEST_WORKERS,
+    batch_size=settings.WEBHOOK_INGEST_BATCH_SIZE,
+    poll_interval=settings.WEBHOOK_INGEST_POLL_INTERVAL,
+    lease_seconds=settings.WEBHOOK_INGEST_LEASE_SECONDS,
+    retry_attempts=settings.WEBHOOK_RETRY_ATTEMPTS,
+    retry_delay=settings.WEBHOOK_RETRY_DELAY,
+    retry_max_delay=settings.WEBHOOK_RETRY_MAX_DELAY,
+    retry_rate_limit=settings.WEBHOOK_RETRY_RATE_LIMIT,
+    retry_rate_period=settings.WEBHOOK_RETRY_RATE_PERIOD
+)
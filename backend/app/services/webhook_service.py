@@ -6,10 +6,14 @@ from uuid import UUID, uuid4
 from datetime import datetime, timedelta
 from supabase import Client
 
+from app.core.config import settings
+from app.core.log_sink import log_sink, utc_now_iso
 from app.schemas.merchant import (
     WebhookTransactionData,
     WebhookProcessingResult,
     WebhookLogResponse,
+    WebhookStatsBucket,
+    WebhookStatsResponse,
     CustomerMatchResult,
     WebhookStatus
 )
@@ -17,9 +21,25 @@ from app.services.merchant_service import CustomerMatchingService
 from app.services.data_processor import DataProcessor
 from app.services.qr_generator import QRGenerator
 from app.services.loyalty_service import LoyaltyService
+from app.services.dashboard_cache import dashboard_cache
 
 logger = logging.getLogger(__name__)
 
+PUBLIC_RECEIPT_URL = "https://ecotrack.com/api/v1/receipts/public/{receipt_id}"
+PUBLIC_RECEIPT_TTL_HOURS = 48
+
+# Unique key of webhook receipts; retries of a transaction reuse its receipt
+RECEIPT_CONFLICT_KEY = "merchant_id,webhook_transaction_id"
+
+# AI category is only used above this confidence
+CATEGORY_CONFIDENCE_THRESHOLD = 0.3
+
+
+def _has_customer_info(transaction_data: WebhookTransactionData) -> bool:
+    """True if the transaction carries anything a customer can be matched on"""
+    customer_info = transaction_data.customer_info
+    return bool(customer_info and any([customer_info.phone, customer_info.email, customer_info.card_hash]))
+
 
 class WebhookService:
     def __init__(self, supabase_client: Client):
@@ -28,6 +48,7 @@ class WebhookService:
         self.data_processor = DataProcessor()
         self.qr_generator = QRGenerator()
         self.loyalty_service = LoyaltyService()
+        self.log_sink = log_sink
 
     async def process_merchant_transaction(
         self, 
@@ -51,14 +72,7 @@ class WebhookService:
             merchant_name = merchant_result.data[0]["name"] if merchant_result.data else "Unknown Merchant"
             
             # Check if customer information was provided to attempt a match
-            customer_info_provided = (
-                transaction_data.customer_info and
-                any([
-                    transaction_data.customer_info.phone,
-                    transaction_data.customer_info.email,
-                    transaction_data.customer_info.card_hash
-                ])
-            )
+            customer_info_provided = _has_customer_info(transaction_data)
             
             if customer_info_provided:
                 # SCENARIO A: Identified customer flow. Try to match the customer.
@@ -88,7 +102,7 @@ class WebhookService:
                     
                     # Update webhook log as successful for public receipt
                     processing_time = int((time.time() - start_time) * 1000)
-                    public_url = f"https://ecotrack.com/api/v1/receipts/public/{receipt_id}"
+                    public_url = PUBLIC_RECEIPT_URL.format(receipt_id=receipt_id)
                     
                     # Update receipt with the generated QR data (URL)
                     self.supabase.table("receipts").update({"raw_qr_data": public_url}).eq("id", str(receipt_id)).execute()
@@ -215,7 +229,7 @@ class WebhookService:
                 
                 # Update webhook log as successful for public receipt
                 processing_time = int((time.time() - start_time) * 1000)
-                public_url = f"https://ecotrack.com/api/v1/receipts/public/{receipt_id}"
+                public_url = PUBLIC_RECEIPT_URL.format(receipt_id=receipt_id)
                 
                 # Update receipt with the generated QR data (URL)
                 self.supabase.table("receipts").update({"raw_qr_data": public_url}).eq("id", str(receipt_id)).execute()
@@ -266,6 +280,373 @@ class WebhookService:
                 errors=[error_msg]
             )
 
+    async def process_merchant_transactions_batch(
+        self,
+        merchant_id: UUID,
+        transactions: List[WebhookTransactionData],
+        test_mode: bool = False,
+        write_batch_size: int = 100
+    ) -> List[WebhookProcessingResult]:
+        """
+        Process a batch of merchant transactions in one pass
+
+        Merchant adı bir kez okunur, müşteriler tek in_() sorgusuyla eşleştirilir,
+        aynı ürün açıklamaları bir kez kategorize edilir ve receipts (upsert) /
+        expenses / expense_items chunk başına çok satırlı yazımla yazılır. Bir chunk'ın
+        yazımı başarısız olursa o chunk'ın kayıtları geri silinir ve yalnızca o
+        chunk'taki işlemler başarısız döner.
+
+        Returns:
+            İşlem başına sonuç, gelen sırayla
+        """
+        start_time = time.time()
+        if not transactions:
+            return []
+
+        merchant_result = self.supabase.table("merchants").select("name").eq("id", str(merchant_id)).execute()
+        merchant_name = merchant_result.data[0]["name"] if merchant_result.data else "Unknown Merchant"
+
+        matches = await self.customer_matcher.match_customers_bulk([
+            transaction.customer_info if _has_customer_info(transaction) else None
+            for transaction in transactions
+        ])
+        item_categories, primary_categories = await self._categorize_batch_items(
+            transactions, matches, merchant_name
+        )
+
+        results: List[Optional[WebhookProcessingResult]] = [None] * len(transactions)
+        write_batch_size = max(1, write_batch_size)
+        for chunk_start in range(0, len(transactions), write_batch_size):
+            indexes = range(chunk_start, min(chunk_start + write_batch_size, len(transactions)))
+            try:
+                written = self._write_transaction_chunk(
+                    merchant_id, merchant_name, transactions, matches, item_categories, indexes, test_mode
+                )
+            except Exception as e:
+                error_msg = f"Error processing webhook: {str(e)}"
+                logger.error(f"Webhook batch chunk {chunk_start}-{indexes[-1]} for merchant {merchant_id} failed: {e}")
+                for index in indexes:
+                    results[index] = WebhookProcessingResult(
+                        success=False,
+                        message=error_msg,
+                        transaction_id=transactions[index].transaction_id,
+                        processing_time_ms=int((time.time() - start_time) * 1000),
+                        errors=[error_msg]
+                    )
+                continue
+
+            loyalty_results = await self._award_batch_loyalty(
+                transactions, matches, written, primary_categories, merchant_name
+            )
+            for index, (receipt_id, expense_id) in written.items():
+                results[index] = self._batch_result(
+                    transactions[index], matches[index], receipt_id, expense_id,
+                    loyalty_results.get(index), start_time
+                )
+
+        await self._log_webhook_batch(merchant_id, transactions, results)
+
+        succeeded = sum(1 for result in results if result.success)
+        logger.info(
+            f"Processed webhook batch for merchant {merchant_id}: {succeeded}/{len(results)} succeeded "
+            f"in {int((time.time() - start_time) * 1000)}ms"
+        )
+        return results
+
+    async def _categorize_batch_items(
+        self,
+        transactions: List[WebhookTransactionData],
+        matches: List[CustomerMatchResult],
+        merchant_name: str
+    ) -> Tuple[Dict[Tuple[int, int], str], Dict[int, str]]:
+        """
+        Categorize the items of matched transactions
+
+        Each distinct description is categorized once and the category ids are
+        fetched with a single query.
+
+        Returns:
+            ({(transaction index, item index): category_id}, {transaction index: primary category name})
+        """
+        names_by_description: Dict[str, Optional[str]] = {}
+        for transaction, match in zip(transactions, matches):
+            if not match.matched:
+                continue
+            for item in transaction.items:
+                key = item.description.strip().casefold()
+                if key in names_by_description:
+                    continue
+                names_by_description[key] = None
+                try:
+                    categorization_result = await self.data_processor.ai_categorizer.categorize_expense(
+                        description=item.description,
+                        merchant_name=merchant_name,
+                        amount=item.total_price
+                    )
+                    if categorization_result.get("confidence", 0) > CATEGORY_CONFIDENCE_THRESHOLD:
+                        names_by_description[key] = categorization_result.get("category_name")
+                except Exception as e:
+                    logger.warning(f"Failed to categorize item '{item.description}': {str(e)}")
+
+        category_names = sorted({name for name in names_by_description.values() if name})
+        if not category_names:
+            return {}, {}
+
+        try:
+            category_result = self.supabase.table("categories").select("id, name").in_("name", category_names).execute()
+        except Exception as e:
+            logger.warning(f"Failed to fetch categories for webhook batch: {str(e)}")
+            return {}, {}
+        category_ids = {row["name"]: row["id"] for row in category_result.data or []}
+
+        item_categories: Dict[Tuple[int, int], str] = {}
+        primary_categories: Dict[int, str] = {}
+        for index, (transaction, match) in enumerate(zip(transactions, matches)):
+            if not match.matched:
+                continue
+            for item_index, item in enumerate(transaction.items):
+                category_name = names_by_description.get(item.description.strip().casefold())
+                if category_name and category_name in category_ids:
+                    item_categories[(index, item_index)] = category_ids[category_name]
+                    # Primary category is the first categorized item, as in the single transaction flow
+                    primary_categories.setdefault(index, category_name)
+        return item_categories, primary_categories
+
+    def _write_transaction_chunk(
+        self,
+        merchant_id: UUID,
+        merchant_name: str,
+        transactions: List[WebhookTransactionData],
+        matches: List[CustomerMatchResult],
+        item_categories: Dict[Tuple[int, int], str],
+        indexes: range,
+        test_mode: bool
+    ) -> Dict[int, Tuple[UUID, UUID]]:
+        """
+        One multi-row write per table for a chunk of transactions
+
+        Ids are generated here so public receipts get their URL in the same
+        insert and expenses/items can reference rows without a read back.
+        Receipts are upserted on (merchant_id, webhook_transaction_id): a
+        transaction received before keeps its receipt id and its earlier
+        expenses are replaced, as in _upsert_receipt.
+
+        Returns:
+            {transaction index: (receipt_id, expense_id)}
+        """
+        receipt_rows: List[Dict[str, Any]] = []
+        expense_rows: List[Dict[str, Any]] = []
+        item_rows: List[Dict[str, Any]] = []
+        written: Dict[int, Tuple[UUID, UUID]] = {}
+
+        existing = self.supabase.table("receipts").select("id, webhook_transaction_id").eq(
+            "merchant_id", str(merchant_id)
+        ).in_("webhook_transaction_id", [transactions[index].transaction_id for index in indexes]).execute()
+        reused = {row["webhook_transaction_id"]: UUID(row["id"]) for row in existing.data or []}
+
+        for index in indexes:
+            transaction = transactions[index]
+            user_id = matches[index].user_id if matches[index].matched else None
+            user_value = str(user_id) if user_id else None
+            receipt_id, expense_id = reused.get(transaction.transaction_id) or uuid4(), uuid4()
+
+            receipt_row = self._receipt_row(merchant_id, merchant_name, transaction, test_mode, user_id=user_id)
+            receipt_row["id"] = str(receipt_id)
+            if user_id is None:
+                receipt_row["raw_qr_data"] = PUBLIC_RECEIPT_URL.format(receipt_id=receipt_id)
+            receipt_rows.append(receipt_row)
+
+            expense_rows.append({
+                "id": str(expense_id),
+                "receipt_id": str(receipt_id),
+                "user_id": user_value,
+                "total_amount": transaction.total_amount,
+                "expense_date": transaction.transaction_date.isoformat(),
+                "notes": (
+                    f"Auto-created from merchant webhook{'' if user_id else ' (public)'} - "
+                    f"Transaction ID: {transaction.transaction_id}"
+                )
+            })
+
+            for item_index, item in enumerate(transaction.items):
+                item_rows.append({
+                    "expense_id": str(expense_id),
+                    "user_id": user_value,
+                    "category_id": item_categories.get((index, item_index)),
+                    "description": item.description,
+                    "amount": item.total_price,
+                    "quantity": item.quantity,
+                    "unit_price": item.unit_price,
+                    "kdv_rate": 20.0,
+                    "notes": f"Category: {item.category}" if item.category else None
+                })
+
+            written[index] = (receipt_id, expense_id)
+
+        if reused:
+            self.supabase.table("expenses").delete().in_("receipt_id", [str(receipt_id) for receipt_id in reused.values()]).execute()
+        self.supabase.table("receipts").upsert(receipt_rows, on_conflict=RECEIPT_CONFLICT_KEY).execute()
+        try:
+            self.supabase.table("expenses").insert(expense_rows).execute()
+            self.supabase.table("expense_items").insert(item_rows).execute()
+        except Exception:
+            # Receipts cascade to expenses and items: leave no partial rows behind
+            self.supabase.table("receipts").delete().in_("id", [row["id"] for row in receipt_rows]).execute()
+            raise
+
+        for user_value in {row["user_id"] for row in expense_rows if row["user_id"]}:
+            dashboard_cache.bump(user_value)
+        return written
+
+    async def _award_batch_loyalty(
+        self,
+        transactions: List[WebhookTransactionData],
+        matches: List[CustomerMatchResult],
+        written: Dict[int, Tuple[UUID, UUID]],
+        primary_categories: Dict[int, Optional[str]],
+        merchant_name: str
+    ) -> Dict[int, Dict[str, Any]]:
+        """Loyalty points for the matched transactions of a written chunk, in one accrual call"""
+        indexes = [index for index in written if matches[index].matched]
+        if not indexes:
+            return {}
+        try:
+            loyalty_results = await self.loyalty_service.award_points_for_expenses([
+                {
+                    "user_id": str(matches[index].user_id),
+                    "expense_id": str(written[index][1]),
+                    "amount": transactions[index].total_amount,
+                    "category": primary_categories.get(index),
+                    "merchant_name": merchant_name
+                }
+                for index in indexes
+            ])
+        except Exception as loyalty_error:
+            # Don't fail the transactions if loyalty points fail
+            logger.error(f"Loyalty points error in webhook batch for {len(indexes)} expenses: {str(loyalty_error)}")
+            return {}
+        return dict(zip(indexes, loyalty_results))
+
+    def _batch_result(
+        self,
+        transaction_data: WebhookTransactionData,
+        match_result: CustomerMatchResult,
+        receipt_id: UUID,
+        expense_id: UUID,
+        loyalty_result: Optional[Dict[str, Any]],
+        start_time: float
+    ) -> WebhookProcessingResult:
+        """Per-transaction result of a written batch row"""
+        if not match_result.matched:
+            return WebhookProcessingResult(
+                success=True,
+                message=(
+                    "Customer not found, public receipt created successfully."
+                    if _has_customer_info(transaction_data) else "Public receipt created successfully."
+                ),
+                transaction_id=transaction_data.transaction_id,
+                created_receipt_id=receipt_id,
+                processing_time_ms=int((time.time() - start_time) * 1000),
+                is_public_receipt=True,
+                public_url=PUBLIC_RECEIPT_URL.format(receipt_id=receipt_id)
+            )
+
+        loyalty_points_awarded = None
+        loyalty_transaction_id = None
+        if loyalty_result and loyalty_result.get("success"):
+            loyalty_points_awarded = loyalty_result.get("points_awarded")
+            if loyalty_result.get("transaction_id"):
+                try:
+                    loyalty_transaction_id = UUID(str(loyalty_result["transaction_id"]))
+                except (ValueError, TypeError):
+                    loyalty_transaction_id = None
+
+        return WebhookProcessingResult(
+            success=True,
+            message="Transaction processed successfully and receipt created for user.",
+            transaction_id=transaction_data.transaction_id,
+            matched_user_id=match_result.user_id,
+            created_receipt_id=receipt_id,
+            created_expense_id=expense_id,
+            processing_time_ms=int((time.time() - start_time) * 1000),
+            loyalty_points_awarded=loyalty_points_awarded,
+            loyalty_transaction_id=loyalty_transaction_id
+        )
+
+    async def _log_webhook_batch(
+        self,
+        merchant_id: UUID,
+        transactions: List[WebhookTransactionData],
+        results: List[WebhookProcessingResult]
+    ):
+        """Buffer the final webhook_logs rows of a batch; the sink writes them as multi-row upserts"""
+        try:
+            created_at = utc_now_iso()
+            for transaction, result in zip(transactions, results):
+                self.log_sink.add("webhook_logs", {
+                    "merchant_id": str(merchant_id),
+                    "transaction_id": transaction.transaction_id,
+                    "payload": json.loads(transaction.model_dump_json()),
+                    "status": (WebhookStatus.SUCCESS if result.success else WebhookStatus.FAILED).value,
+                    "error_message": None if result.success else result.message,
+                    "processing_time_ms": result.processing_time_ms,
+                    "retry_count": 0,
+                    "created_at": created_at
+                })
+        except Exception as e:
+            logger.error(f"Error logging webhook batch: {str(e)}")
+
+    @staticmethod
+    def _receipt_row(
+        merchant_id: UUID,
+        merchant_name: str,
+        transaction_data: WebhookTransactionData,
+        test_mode: bool = False,
+        user_id: Optional[UUID] = None
+    ) -> Dict[str, Any]:
+        """Receipt row for a webhook transaction; without user_id it is a public, claimable receipt"""
+        row = {
+            "user_id": str(user_id) if user_id else None,
+            "merchant_id": str(merchant_id),
+            "webhook_transaction_id": transaction_data.transaction_id,
+            "raw_qr_data": None,  # No QR data for webhook transactions
+            "merchant_name": merchant_name,
+            "transaction_date": transaction_data.transaction_date.isoformat(),
+            "total_amount": transaction_data.total_amount,
+            "currency": transaction_data.currency,
+            "source": "webhook" if not test_mode else "webhook_test",
+            "parsed_receipt_data": {
+                "merchant_transaction_id": transaction_data.merchant_transaction_id,
+                "receipt_number": transaction_data.receipt_number,
+                "cashier_id": transaction_data.cashier_id,
+                "store_location": transaction_data.store_location,
+                "payment_method": transaction_data.payment_method,
+                "items": [item.model_dump() for item in transaction_data.items],
+                "additional_data": transaction_data.additional_data
+            }
+        }
+        if user_id is None:
+            row["source"] += "_public"
+            row["is_public"] = True  # Mark as public receipt for web viewing
+            # Expiration time (48 hours from now) for cleanup
+            row["expires_at"] = (datetime.now() + timedelta(hours=PUBLIC_RECEIPT_TTL_HOURS)).isoformat()
+        return row
+
+    def _upsert_receipt(self, receipt_data: Dict[str, Any]) -> Optional[UUID]:
+        """
+        Write a webhook receipt keyed on (merchant_id, webhook_transaction_id)
+
+        A retried transaction gets the receipt of its failed attempt back; the
+        expenses that attempt left (items cascade) are deleted so the retry
+        writes them exactly once.
+        """
+        result = self.supabase.table("receipts").upsert(receipt_data, on_conflict=RECEIPT_CONFLICT_KEY).execute()
+        if not result.data:
+            return None
+        receipt_id = UUID(result.data[0]["id"])
+        self.supabase.table("expenses").delete().eq("receipt_id", str(receipt_id)).execute()
+        return receipt_id
+
     async def _create_receipt_from_webhook(
         self, 
         user_id: UUID, 
@@ -278,32 +659,9 @@ class WebhookService:
         try:
             
             # Prepare receipt data
-            receipt_data = {
-                "user_id": str(user_id),
-                "merchant_id": str(merchant_id),
-                "raw_qr_data": None,  # No QR data for webhook transactions
-                "merchant_name": merchant_name,
-                "transaction_date": transaction_data.transaction_date.isoformat(),
-                "total_amount": transaction_data.total_amount,
-                "currency": transaction_data.currency,
-                "source": "webhook" if not test_mode else "webhook_test",
-                "parsed_receipt_data": {
-                    "merchant_transaction_id": transaction_data.merchant_transaction_id,
-                    "receipt_number": transaction_data.receipt_number,
-                    "cashier_id": transaction_data.cashier_id,
-                    "store_location": transaction_data.store_location,
-                    "payment_method": transaction_data.payment_method,
-                    "items": [item.model_dump() for item in transaction_data.items],
-                    "additional_data": transaction_data.additional_data
-                }
-            }
-            
-            result = self.supabase.table("receipts").insert(receipt_data).execute()
+            receipt_data = self._receipt_row(merchant_id, merchant_name, transaction_data, test_mode, user_id=user_id)
             
-            if result.data:
-                return UUID(result.data[0]["id"])
-            
-            return None
+            return self._upsert_receipt(receipt_data)
             
         except Exception as e:
             logger.error(f"Error creating receipt from webhook: {str(e)}")
@@ -319,37 +677,12 @@ class WebhookService:
         """Create public receipt record for unregistered customers - viewable on web"""
         try:
             
-            # Calculate expiration time (48 hours from now)
-            expires_at = (datetime.now() + timedelta(hours=48)).isoformat()
-            
             # Prepare public receipt data (no user_id, no customer_info needed)
-            receipt_data = {
-                "user_id": None,  # Public receipt - no user assigned
-                "merchant_id": str(merchant_id),
-                "raw_qr_data": None,  # No QR data for webhook transactions
-                "merchant_name": merchant_name,
-                "transaction_date": transaction_data.transaction_date.isoformat(),
-                "total_amount": transaction_data.total_amount,
-                "currency": transaction_data.currency,
-                "source": "webhook_public" if not test_mode else "webhook_test_public",
-                "is_public": True,  # Mark as public receipt for web viewing
-                "expires_at": expires_at,  # Set expiration time for cleanup
-                "parsed_receipt_data": {
-                    "merchant_transaction_id": transaction_data.merchant_transaction_id,
-                    "receipt_number": transaction_data.receipt_number,
-                    "cashier_id": transaction_data.cashier_id,
-                    "store_location": transaction_data.store_location,
-                    "payment_method": transaction_data.payment_method,
-                    "items": [item.model_dump() for item in transaction_data.items],
-                    "additional_data": transaction_data.additional_data
-                }
-            }
+            receipt_data = self._receipt_row(merchant_id, merchant_name, transaction_data, test_mode)
             
-            result = self.supabase.table("receipts").insert(receipt_data).execute()
+            receipt_id = self._upsert_receipt(receipt_data)
             
-            if result.data:
-                receipt_id = UUID(result.data[0]["id"])
-                
+            if receipt_id:
                 # Create expense and expense items for public receipt (without user_id initially)
                 # This will be claimed later by a user
                 try:
@@ -436,8 +769,8 @@ class WebhookService:
                         amount=item.total_price
                     )
                     
-                    # Only assign category if confidence is above threshold (0.3)
-                    if categorization_result.get("confidence", 0) > 0.3:
+                    # Only assign category if confidence is above threshold
+                    if categorization_result.get("confidence", 0) > CATEGORY_CONFIDENCE_THRESHOLD:
                         # Get category_id from categories table using the category name
                         category_name = categorization_result.get("category_name")
                         if category_name:
@@ -465,6 +798,8 @@ class WebhookService:
                 
                 self.supabase.table("expense_items").insert(item_data).execute()
             
+            dashboard_cache.bump(user_id)
+            
             # Award loyalty points for the expense
             loyalty_result = None
             try:
@@ -507,16 +842,12 @@ class WebhookService:
                 "transaction_id": transaction_id,
                 "payload": serializable_payload,
                 "status": WebhookStatus.PENDING.value,
-                "retry_count": 0
+                "retry_count": 0,
+                "created_at": utc_now_iso()
             }
             
-            result = self.supabase.table("webhook_logs").insert(log_data).execute()
-            
-            if result.data:
-                return UUID(result.data[0]["id"])
-            
-            # Fallback to generate UUID if insert fails
-            return uuid4()
+            # Buffered: the attempt and its result are usually written as one row
+            return self.log_sink.add("webhook_logs", log_data)
             
         except Exception as e:
             logger.error(f"Error logging webhook attempt: {str(e)}")
@@ -543,7 +874,7 @@ class WebhookService:
             if processing_time_ms is not None:
                 update_data["processing_time_ms"] = processing_time_ms
             
-            self.supabase.table("webhook_logs").update(update_data).eq("id", str(log_id)).execute()
+            self.log_sink.update("webhook_logs", log_id, update_data)
             
         except Exception as e:
             logger.error(f"Error updating webhook log: {str(e)}")
@@ -577,9 +908,53 @@ class WebhookService:
             logger.error(f"Error fetching webhook logs: {str(e)}")
             return [], 0
 
+    async def get_webhook_stats(
+        self,
+        merchant_id: UUID,
+        start_time: datetime,
+        end_time: datetime
+    ) -> WebhookStatsResponse:
+        """
+        Webhook statistics for a merchant over [start_time, end_time)
+
+        Aggregated in the database by the get_webhook_stats function: whole
+        hours from the hourly rollup, the partial hours at the window edges
+        from webhook_logs.
+        """
+        result = self.supabase.rpc("get_webhook_stats", {
+            "p_merchant_id": str(merchant_id),
+            "p_start": start_time.isoformat(),
+            "p_end": end_time.isoformat()
+        }).execute()
+        stats = result.data or {}
+
+        total = stats.get("total") or 0
+        successful = stats.get("success") or 0
+        return WebhookStatsResponse(
+            merchant_id=merchant_id,
+            start_time=start_time,
+            end_time=end_time,
+            total_webhooks=total,
+            successful_webhooks=successful,
+            failed_webhooks=stats.get("failed") or 0,
+            retry_webhooks=stats.get("retry") or 0,
+            pending_webhooks=stats.get("pending") or 0,
+            success_rate_percentage=round(successful / total * 100, 2) if total > 0 else 0,
+            avg_processing_time_ms=stats.get("avg_processing_time_ms"),
+            max_processing_time_ms=stats.get("max_processing_time_ms"),
+            min_processing_time_ms=stats.get("min_processing_time_ms"),
+            p50_processing_time_ms=stats.get("p50_processing_time_ms"),
+            p95_processing_time_ms=stats.get("p95_processing_time_ms"),
+            p99_processing_time_ms=stats.get("p99_processing_time_ms"),
+            hourly=[WebhookStatsBucket(**bucket) for bucket in stats.get("hourly") or []]
+        )
+
     async def retry_failed_webhook(self, log_id: UUID) -> bool:
         """Retry a failed webhook processing"""
         try:
+            # Buffered status updates of this log must be written before it is read
+            await self.log_sink.flush()
+            
             # Get the webhook log
             log_result = self.supabase.table("webhook_logs").select("*").eq("id", str(log_id)).execute()
             
@@ -589,7 +964,7 @@ class WebhookService:
             log_data = log_result.data[0]
             
             # Check if it's eligible for retry (failed status and retry count < max)
-            if log_data["status"] != WebhookStatus.FAILED.value or log_data["retry_count"] >= 3:
+            if log_data["status"] != WebhookStatus.FAILED.value or log_data["retry_count"] >= settings.WEBHOOK_RETRY_ATTEMPTS:
                 return False
             
             # Update retry count and status
@@ -0,0 +1,189 @@
+"""
+Shared date/datetime parsing
+Supabase timestamps, ISO dates and Turkish day-first receipt dates
+"""
+
+import re
+from datetime import date, datetime, tzinfo
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from dateutil import parser as dateutil_parser
+
+# Fractional seconds of an ISO time; Supabase can return more than 6 digits
+ISO_FRACTION_PATTERN = re.compile(r'(\d{2}:\d{2}:\d{2})\.(\d+)')
+
+_TIME = r'(?:[ T]+(\d{1,2}):(\d{2})(?::(\d{2}))?)?'
+
+TURKISH_MONTHS = {
+    'ocak': 1, 'şubat': 2, 'subat': 2, 'mart': 3, 'nisan': 4, 'mayıs': 5, 'mayis': 5,
+    'haziran': 6, 'temmuz': 7, 'ağustos': 8, 'agustos': 8, 'eylül': 9, 'eylul': 9,
+    'ekim': 10, 'kasım': 11, 'kasim': 11, 'aralık': 12, 'aralik': 12,
+    'jan': 1, 'feb': 2, 'mar': 3, 'apr': 4, 'may': 5, 'jun': 6,
+    'jul': 7, 'aug': 8, 'sep': 9, 'oct': 10, 'nov': 11, 'dec': 12,
+}
+
+
+def _two_digit_year(year: str) -> int:
+    value = int(year)
+    return value + 2000 if value < 100 else value
+
+
+def _build_day_first(match: re.Match) -> datetime:
+    day, month, year, hour, minute, second = match.groups()
+    return datetime(_two_digit_year(year), int(month), int(day), int(hour or 0), int(minute or 0), int(second or 0))
+
+
+def _build_year_first(match: re.Match) -> datetime:
+    year, month, day, hour, minute, second = match.groups()
+    return datetime(int(year), int(month), int(day), int(hour or 0), int(minute or 0), int(second or 0))
+
+
+def _build_month_name(match: re.Match) -> datetime:
+    day, month_name, year, hour, minute, second = match.groups()
+    month = TURKISH_MONTHS.get(month_name.lower()) or TURKISH_MONTHS[month_name.lower()[:3]]
+    return datetime(_two_digit_year(year), month, int(day), int(hour or 0), int(minute or 0), int(second or 0))
+
+
+# Non-ISO formats, each a (name, compiled pattern, builder); matched without exceptions
+DATE_FORMATS: Tuple[Tuple[str, re.Pattern, Callable[[re.Match], datetime]], ...] = (
+    # 15.01.2024, 15/01/24 14:30, 15-01-2024 14:30:05
+    ('day_first', re.compile(r'^(\d{1,2})[./\-](\d{1,2})[./\-](\d{4}|\d{2})' + _TIME + r'$'), _build_day_first),
+    # 2024.01.15, 2024/1/5 09:00
+    ('year_first', re.compile(r'^(\d{4})[./\-](\d{1,2})[./\-](\d{1,2})' + _TIME + r'$'), _build_year_first),
+    # 15 Ocak 2024, 5 Mar 2024 10:30
+    ('month_name', re.compile(r'^(\d{1,2})\s+([^\W\d_]+)\.?\s+(\d{4}|\d{2})' + _TIME + r'$'), _build_month_name),
+)
+
+
+class DateParser:
+    """
+    Date parser shared by all services
+
+    Order of attempts: ISO fast path (datetime.fromisoformat after Z and
+    microsecond normalization), then the last format that succeeded, then
+    the remaining formats, and dateutil only as a last resort.
+    """
+
+    def __init__(self, formats=DATE_FORMATS):
+        self.formats = formats
+        self._last_format = 0
+        self.format_hits: Dict[str, int] = {name: 0 for name, _, _ in formats}
+        self.format_hits.update({'iso': 0, 'fallback': 0})
+
+    def parse_datetime(
+        self,
+        value: Any,
+        assume_tz: Optional[tzinfo] = None,
+        fallback: bool = True
+    ) -> Optional[datetime]:
+        """
+        Parse a datetime, date or string into a datetime
+
+        Args:
+            value: Value to parse
+            assume_tz: Timezone attached to naive results (e.g. timezone.utc for Supabase)
+            fallback: Try dateutil when no known format matches
+
+        Returns:
+            datetime, or None if the value cannot be parsed
+        """
+        parsed = self._parse(value, fallback)
+        if parsed is not None and assume_tz is not None and parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=assume_tz)
+        return parsed
+
+    def parse_date(self, value: Any, fallback: bool = True) -> Optional[date]:
+        """Parse a value into a date (the date part in the value's own offset)"""
+        if isinstance(value, date) and not isinstance(value, datetime):
+            return value
+        parsed = self._parse(value, fallback)
+        return parsed.date() if parsed is not None else None
+
+    def parse_datetimes(self, values: Iterable[Any], **kwargs) -> List[Optional[datetime]]:
+        """Batch parse; each distinct value in the batch is parsed once"""
+        parsed: Dict[Any, Optional[datetime]] = {}
+        results = []
+        for value in values:
+            try:
+                results.append(parsed[value])
+            except KeyError:
+                parsed[value] = self.parse_datetime(value, **kwargs)
+                results.append(parsed[value])
+            except TypeError:
+                results.append(self.parse_datetime(value, **kwargs))
+        return results
+
+    def parse_dates(self, values: Iterable[Any], fallback: bool = True) -> List[Optional[date]]:
+        """Batch parse into dates"""
+        return [
+            parsed.date() if isinstance(parsed, datetime) else parsed
+            for parsed in self.parse_datetimes(values, fallback=fallback)
+        ]
+
+    def _parse(self, value: Any, fallback: bool) -> Optional[datetime]:
+        if isinstance(value, datetime):
+            return value
+        if isinstance(value, date):
+            return datetime.combine(value, datetime.min.time())
+        if not isinstance(value, str):
+            return None
+
+        text = value.strip()
+        if not text:
+            return None
+
+        # ISO fast path: YYYY-MM-DD...
+        if len(text) >= 10 and text[4] == '-' and text[7] == '-':
+            parsed = self._parse_iso(text)
+            if parsed is not None:
+                self.format_hits['iso'] += 1
+                return parsed
+
+        # Last successful format first, then the rest
+        last = self._last_format
+        order = (last,) + tuple(i for i in range(len(self.formats)) if i != last)
+        for index in order:
+            name, pattern, build = self.formats[index]
+            match = pattern.match(text)
+            if match is None:
+                continue
+            try:
+                parsed = build(match)
+            except (ValueError, KeyError):
+                continue
+            self._last_format = index
+            self.format_hits[name] += 1
+            return parsed
+
+        if fallback:
+            try:
+                parsed = dateutil_parser.parse(text, dayfirst=True)
+            except (ValueError, OverflowError, TypeError):
+                return None
+            self.format_hits['fallback'] += 1
+            return parsed
+
+        return None
+
+    @staticmethod
+    def _parse_iso(text: str) -> Optional[datetime]:
+        if text[-1] in 'Zz':
+            text = text[:-1] + '+00:00'
+        if '.' in text:
+            # Exactly 6 fractional digits (Supabase sends up to 9, Python takes 6)
+            text = ISO_FRACTION_PATTERN.sub(
+                lambda match: f"{match.group(1)}.{match.group(2)[:6].ljust(6, '0')}", text, count=1
+            )
+        try:
+            return datetime.fromisoformat(text)
+        except ValueError:
+            return None
+
+
+# Shared parser instance
+default_date_parser = DateParser()
+
+parse_datetime = default_date_parser.parse_datetime
+parse_date = default_date_parser.parse_date
+parse_datetimes = default_date_parser.parse_datetimes
+parse_dates = default_date_parser.parse_dates
@@ -1,10 +1,67 @@
 """
 KDV (Turkish VAT) Calculator Utility
 Handles different VAT rates used in Turkey: 1%, 10%, 20%
+
+Money is handled as integer kuruş (1 TL = 100 kuruş). Amounts are converted
+once with to_kurus(), all KDV math is exact integer arithmetic with
+ROUND_HALF_UP, and results go back to TL with from_kurus().
 """
 
-from typing import Dict, List, Tuple
-from decimal import Decimal, ROUND_HALF_UP
+from typing import Any, Dict, Iterable, List, Sequence, Tuple, Union
+from decimal import Decimal, ROUND_HALF_UP, InvalidOperation
+
+Amount = Union[int, float, str, Decimal]
+
+KURUS_PER_TL = 100
+
+# Float TL amounts whose kuruş value is this close to .5 are rounded via Decimal
+_HALF_TOLERANCE = 1e-6
+
+
+def to_kurus(amount: Amount) -> int:
+    """
+    Convert a TL amount to integer kuruş (ROUND_HALF_UP on the decimal value)
+
+    Floats take an integer fast path; only values that land on a half kuruş
+    (e.g. 1.005) go through Decimal so the tie is decided on the decimal
+    string form, not on the binary float.
+    """
+    if isinstance(amount, bool):
+        raise ValueError(f"Invalid amount: {amount!r}")
+    if isinstance(amount, int):
+        return amount * KURUS_PER_TL
+    if isinstance(amount, float):
+        scaled = amount * KURUS_PER_TL
+        nearest = round(scaled)
+        if abs(abs(scaled - nearest) - 0.5) > _HALF_TOLERANCE:
+            return int(nearest)
+    try:
+        value = amount if isinstance(amount, Decimal) else Decimal(str(amount).strip())
+        return int((value * KURUS_PER_TL).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+    except (InvalidOperation, ValueError, OverflowError):
+        raise ValueError(f"Invalid amount: {amount!r}")
+
+
+def from_kurus(kurus: int) -> float:
+    """Convert integer kuruş back to a TL float"""
+    return kurus / KURUS_PER_TL
+
+
+def _div_half_up(numerator: int, denominator: int) -> int:
+    """Integer division rounded half away from zero (denominator > 0)"""
+    if numerator >= 0:
+        return (2 * numerator + denominator) // (2 * denominator)
+    return -((-2 * numerator + denominator) // (2 * denominator))
+
+
+def kdv_from_gross_kurus(gross_kurus: int, rate: int) -> int:
+    """KDV part of a KDV-included kuruş amount: gross * rate / (100 + rate)"""
+    return _div_half_up(gross_kurus * rate, 100 + rate)
+
+
+def gross_from_net_kurus(net_kurus: int, rate: int) -> int:
+    """KDV-included kuruş amount from a net kuruş amount: net * (100 + rate) / 100"""
+    return _div_half_up(net_kurus * (100 + rate), 100)
 
 
 class KDVCalculator:
@@ -49,43 +106,31 @@ class KDVCalculator:
         """Validate if KDV rate is valid"""
         return rate in cls.VALID_KDV_RATES
     
+    @classmethod
+    def _rate_percent(cls, kdv_rate: float) -> int:
+        """Validate a KDV rate and return it as an integer percent for the kuruş kernel"""
+        if not cls.validate_kdv_rate(kdv_rate):
+            raise ValueError(f"Invalid KDV rate: {kdv_rate}. Must be one of {cls.VALID_KDV_RATES}")
+        return int(kdv_rate)
+    
     @classmethod
     def calculate_kdv_amount(cls, total_amount: float, kdv_rate: float) -> float:
         """
         Calculate KDV amount from total amount (KDV included)
         Formula: KDV = (Total * KDV_Rate) / (100 + KDV_Rate)
         """
-        if not cls.validate_kdv_rate(kdv_rate):
-            raise ValueError(f"Invalid KDV rate: {kdv_rate}. Must be one of {cls.VALID_KDV_RATES}")
-        
-        if kdv_rate == 0.0:
-            return 0.0
-        
-        # Use Decimal for precise calculations
-        total = Decimal(str(total_amount))
-        rate = Decimal(str(kdv_rate))
-        
-        kdv_amount = (total * rate) / (100 + rate)
-        return float(kdv_amount.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP))
+        rate = cls._rate_percent(kdv_rate)
+        return from_kurus(kdv_from_gross_kurus(to_kurus(total_amount), rate))
     
     @classmethod
     def calculate_amount_without_kdv(cls, total_amount: float, kdv_rate: float) -> float:
         """
         Calculate amount without KDV from total amount (KDV included)
-        Formula: Amount_Without_KDV = Total / (1 + KDV_Rate/100)
+        Formula: Amount_Without_KDV = Total - KDV, so net + KDV always equals the total
         """
-        if not cls.validate_kdv_rate(kdv_rate):
-            raise ValueError(f"Invalid KDV rate: {kdv_rate}. Must be one of {cls.VALID_KDV_RATES}")
-        
-        if kdv_rate == 0.0:
-            return total_amount
-        
-        # Use Decimal for precise calculations
-        total = Decimal(str(total_amount))
-        rate = Decimal(str(kdv_rate))
-        
-        amount_without_kdv = total / (1 + rate / 100)
-        return float(amount_without_kdv.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP))
+        rate = cls._rate_percent(kdv_rate)
+        gross = to_kurus(total_amount)
+        return from_kurus(gross - kdv_from_gross_kurus(gross, rate))
     
     @classmethod
     def calculate_total_with_kdv(cls, amount_without_kdv: float, kdv_rate: float) -> float:
@@ -93,18 +138,8 @@ class KDVCalculator:
         Calculate total amount with KDV from amount without KDV
         Formula: Total = Amount_Without_KDV * (1 + KDV_Rate/100)
         """
-        if not cls.validate_kdv_rate(kdv_rate):
-            raise ValueError(f"Invalid KDV rate: {kdv_rate}. Must be one of {cls.VALID_KDV_RATES}")
-        
-        if kdv_rate == 0.0:
-            return amount_without_kdv
-        
-        # Use Decimal for precise calculations
-        amount = Decimal(str(amount_without_kdv))
-        rate = Decimal(str(kdv_rate))
-        
-        total = amount * (1 + rate / 100)
-        return float(total.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP))
+        rate = cls._rate_percent(kdv_rate)
+        return from_kurus(gross_from_net_kurus(to_kurus(amount_without_kdv), rate))
     
     @classmethod
     def get_kdv_breakdown(cls, total_amount: float, kdv_rate: float) -> Dict[str, float]:
@@ -117,16 +152,144 @@ class KDVCalculator:
             'amount_without_kdv': float
         }
         """
-        kdv_amount = cls.calculate_kdv_amount(total_amount, kdv_rate)
-        amount_without_kdv = cls.calculate_amount_without_kdv(total_amount, kdv_rate)
+        rate = cls._rate_percent(kdv_rate)
+        gross = to_kurus(total_amount)
+        kdv = kdv_from_gross_kurus(gross, rate)
         
         return {
             'total_amount': total_amount,
             'kdv_rate': kdv_rate,
-            'kdv_amount': kdv_amount,
-            'amount_without_kdv': amount_without_kdv
+            'kdv_amount': from_kurus(kdv),
+            'amount_without_kdv': from_kurus(gross - kdv)
         }
     
+    @classmethod
+    def breakdown_kurus_batch(
+        cls,
+        gross_kurus: Sequence[int],
+        rates: Sequence[int]
+    ) -> Tuple[List[int], List[int]]:
+        """
+        Column-wise KDV kernel on kuruş amounts
+        
+        Args:
+            gross_kurus: KDV-included amounts in kuruş
+            rates: Integer KDV percents, same length as gross_kurus
+            
+        Returns:
+            (kdv_kurus, net_kurus) columns; net + kdv == gross for every row
+        """
+        kdv = [kdv_from_gross_kurus(gross, rate) for gross, rate in zip(gross_kurus, rates)]
+        net = [gross - part for gross, part in zip(gross_kurus, kdv)]
+        return kdv, net
+    
+    @classmethod
+    def get_kdv_breakdown_batch(
+        cls,
+        amounts: Sequence[Amount],
+        kdv_rates: Union[float, Sequence[float]]
+    ) -> List[Dict[str, float]]:
+        """
+        get_kdv_breakdown for a whole column of amounts in one call
+        
+        Args:
+            amounts: KDV-included amounts (TL)
+            kdv_rates: One rate per amount, or a single rate for all of them
+            
+        Returns:
+            One breakdown dict per amount, same shape as get_kdv_breakdown
+        """
+        amounts, kdv_rates = cls._align_columns(amounts, kdv_rates)
+        gross = [to_kurus(amount) for amount in amounts]
+        kdv, net = cls.breakdown_kurus_batch(gross, cls._rate_column(kdv_rates))
+        
+        return [
+            {
+                'total_amount': amount,
+                'kdv_rate': kdv_rate,
+                'kdv_amount': from_kurus(kdv_part),
+                'amount_without_kdv': from_kurus(net_part)
+            }
+            for amount, kdv_rate, kdv_part, net_part in zip(amounts, kdv_rates, kdv, net)
+        ]
+    
+    @classmethod
+    def summarize_kdv_by_rate(
+        cls,
+        amounts: Sequence[Amount],
+        kdv_rates: Union[float, Sequence[float]]
+    ) -> Dict[str, Any]:
+        """
+        KDV summary of many amounts grouped by rate (a receipt, or a report range)
+        
+        Gross amounts are summed per rate in kuruş and KDV is computed once per
+        rate group, the way the KDV lines of a fiş are printed, so the group
+        totals are exact and net + KDV always equals gross.
+        
+        Returns:
+            Dict with total_amount, total_kdv, total_without_kdv,
+            kdv_by_rate ({rate: {total_amount, kdv_amount, amount_without_kdv, item_count}})
+            and average_kdv_rate
+        """
+        amounts, kdv_rates = cls._align_columns(amounts, kdv_rates)
+        rates = cls._rate_column(kdv_rates)
+        
+        gross_by_rate: Dict[int, int] = {}
+        count_by_rate: Dict[int, int] = {}
+        for amount, rate in zip(amounts, rates):
+            gross_by_rate[rate] = gross_by_rate.get(rate, 0) + to_kurus(amount)
+            count_by_rate[rate] = count_by_rate.get(rate, 0) + 1
+        
+        group_rates = sorted(gross_by_rate)
+        group_gross = [gross_by_rate[rate] for rate in group_rates]
+        group_kdv, group_net = cls.breakdown_kurus_batch(group_gross, group_rates)
+        
+        kdv_by_rate = {
+            float(rate): {
+                'total_amount': from_kurus(gross),
+                'kdv_amount': from_kurus(kdv),
+                'amount_without_kdv': from_kurus(net),
+                'item_count': count_by_rate[rate]
+            }
+            for rate, gross, kdv, net in zip(group_rates, group_gross, group_kdv, group_net)
+        }
+        
+        total_kdv = sum(group_kdv)
+        total_net = sum(group_net)
+        
+        return {
+            'total_amount': from_kurus(sum(group_gross)),
+            'total_kdv': from_kurus(total_kdv),
+            'total_without_kdv': from_kurus(total_net),
+            'kdv_by_rate': kdv_by_rate,
+            'average_kdv_rate': round(total_kdv / total_net * 100, 2) if total_net > 0 else 0
+        }
+    
+    @classmethod
+    def _rate_column(cls, kdv_rates: Iterable[float]) -> List[int]:
+        """Validate a column of rates; each distinct rate is checked once"""
+        percents: Dict[float, int] = {}
+        column = []
+        for kdv_rate in kdv_rates:
+            percent = percents.get(kdv_rate)
+            if percent is None:
+                percent = percents[kdv_rate] = cls._rate_percent(kdv_rate)
+            column.append(percent)
+        return column
+    
+    @staticmethod
+    def _align_columns(
+        amounts: Sequence[Amount],
+        kdv_rates: Union[float, Sequence[float]]
+    ) -> Tuple[List[Amount], List[float]]:
+        amounts = list(amounts)
+        if isinstance(kdv_rates, (int, float)):
+            return amounts, [kdv_rates] * len(amounts)
+        kdv_rates = list(kdv_rates)
+        if len(kdv_rates) != len(amounts):
+            raise ValueError(f"Got {len(amounts)} amounts but {len(kdv_rates)} KDV rates")
+        return amounts, kdv_rates
+    
     @classmethod
     def suggest_kdv_rate_by_category(cls, category: str) -> float:
         """
@@ -159,7 +322,7 @@ class KDVCalculator:
         return cls.DEFAULT_KDV_RATE
     
     @classmethod
-    def calculate_mixed_kdv_total(cls, items: List[Dict]) -> Dict[str, float]:
+    def calculate_mixed_kdv_total(cls, items: List[Dict]) -> Dict[str, Any]:
         """
         Calculate total KDV for multiple items with different KDV rates
         
@@ -167,41 +330,9 @@ class KDVCalculator:
             items: List of dicts with 'amount' and 'kdv_rate' keys
             
         Returns:
-            Dict with total amounts, KDV breakdown by rate, etc.
+            Dict with total amounts, KDV breakdown by rate, etc. (see summarize_kdv_by_rate)
         """
-        total_amount = 0.0
-        total_kdv = 0.0
-        total_without_kdv = 0.0
-        kdv_by_rate = {}
-        
-        for item in items:
-            amount = item.get('amount', 0.0)
-            kdv_rate = item.get('kdv_rate', cls.DEFAULT_KDV_RATE)
-            
-            breakdown = cls.get_kdv_breakdown(amount, kdv_rate)
-            
-            total_amount += breakdown['total_amount']
-            total_kdv += breakdown['kdv_amount']
-            total_without_kdv += breakdown['amount_without_kdv']
-            
-            # Group by KDV rate
-            if kdv_rate not in kdv_by_rate:
-                kdv_by_rate[kdv_rate] = {
-                    'total_amount': 0.0,
-                    'kdv_amount': 0.0,
-                    'amount_without_kdv': 0.0,
-                    'item_count': 0
-                }
-            
-            kdv_by_rate[kdv_rate]['total_amount'] += breakdown['total_amount']
-            kdv_by_rate[kdv_rate]['kdv_amount'] += breakdown['kdv_amount']
-            kdv_by_rate[kdv_rate]['amount_without_kdv'] += breakdown['amount_without_kdv']
-            kdv_by_rate[kdv_rate]['item_count'] += 1
-        
-        return {
-            'total_amount': round(total_amount, 2),
-            'total_kdv': round(total_kdv, 2),
-            'total_without_kdv': round(total_without_kdv, 2),
-            'kdv_by_rate': kdv_by_rate,
-            'average_kdv_rate': round((total_kdv / total_without_kdv * 100) if total_without_kdv > 0 else 0, 2)
-        } 
\ No newline at end of file
+        return cls.summarize_kdv_by_rate(
+            [item.get('amount', 0.0) for item in items],
+            [item.get('kdv_rate', cls.DEFAULT_KDV_RATE) for item in items]
+        )
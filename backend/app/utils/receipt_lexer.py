@@ -0,0 +1,176 @@
+"""
+Receipt text lexer
+Single-pass, line-oriented tokenizer for raw Turkish receipt text
+"""
+
+import logging
+import re
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Work caps per receipt: text beyond these is not scanned
+MAX_RECEIPT_CHARS = 64 * 1024
+MAX_RECEIPT_LINES = 1000
+MAX_LINE_LENGTH = 512
+MAX_RECEIPT_ITEMS = 500
+
+# Lines shorter than this are never items ("5,00", "KDV")
+MIN_ITEM_LINE_LENGTH = 5
+
+# Token kinds
+PRICE = 'price'
+QUANTITY = 'quantity'
+QUANTITY_AFTER = 'quantity_after'
+UNIT = 'unit'
+NUMBER = 'number'
+CURRENCY = 'currency'
+PERCENT = 'percent'
+WORD = 'word'
+
+# One alternation, scanned left to right with finditer: every alternative is a
+# flat run with no nested quantifiers, so a line is tokenized in linear time.
+# Order matters: price before unit/number, quantity before unit ("2X" is not a size).
+TOKEN_PATTERN = re.compile(
+    r'(?P<price>\d+(?:[.,]\d{3})*[.,]\d{2})(?!\d|[.,]\d)'
+    r'|(?P<quantity>\d+)\s*[x×*](?![^\W\d_])'
+    r'|(?<![^\W\d_])[x×](?P<quantity_after>\d+)(?![\d.,])'
+    r'|(?P<unit>\d+(?:[.,]\d+)?(?:kg|gr|g|lt|l|ml|cl|cm|mm|m|adet|ad|lu|lü|li|lı)(?![^\W\d_]))'
+    r'|(?P<number>\d+)'
+    r'|(?P<currency>tl|try|₺)(?![^\W\d_])'
+    r'|(?P<percent>%\s*\d+)'
+    r'|(?P<word>[^\W\d_]+(?:[-.][^\W\d_]+)*\.?)',
+    re.IGNORECASE
+)
+
+# Receipt footer / summary lines that carry a price but are not items
+SUMMARY_KEYWORDS = frozenset({
+    'toplam', 'topkdv', 'ara', 'aratoplam', 'genel', 'kdv', 'nakit', 'kredi',
+    'kart', 'para', 'indirim', 'tutar', 'total', 'subtotal', 'tax', 'vat', 'cash', 'change',
+})
+
+Token = Tuple[str, str]
+
+
+@dataclass
+class LexedItem:
+    """Item assembled from one receipt line"""
+    description: str
+    amount: float
+    quantity: int = 1
+    currency: Optional[str] = None
+    line_number: int = 0
+
+
+class ReceiptLexer:
+    """
+    Line-oriented receipt lexer
+
+    Each line is tokenized exactly once (price, quantity, unit, number,
+    currency, percent and word tokens) and an item is assembled from the
+    tokens: the last price on the line is the amount, an explicit "2 x" / "x2" or
+    a leading number is the quantity, and the words before the price are the
+    description. Work per receipt is capped by characters, lines, line length
+    and item count.
+    """
+
+    def __init__(
+        self,
+        max_chars: int = MAX_RECEIPT_CHARS,
+        max_lines: int = MAX_RECEIPT_LINES,
+        max_line_length: int = MAX_LINE_LENGTH,
+        max_items: int = MAX_RECEIPT_ITEMS
+    ):
+        self.max_chars = max_chars
+        self.max_lines = max_lines
+        self.max_line_length = max_line_length
+        self.max_items = max_items
+
+    @staticmethod
+    def tokenize(line: str) -> List[Token]:
+        """Tokenize a line into (kind, text) pairs; punctuation and whitespace are dropped"""
+        return [(match.lastgroup, match.group(match.lastgroup)) for match in TOKEN_PATTERN.finditer(line)]
+
+    def extract_items(self, text: str) -> List[LexedItem]:
+        """Extract items from raw receipt text within the work caps"""
+        if not text:
+            return []
+
+        if len(text) > self.max_chars:
+            logger.warning(f"Receipt text truncated from {len(text)} to {self.max_chars} characters")
+            text = text[:self.max_chars]
+
+        items: List[LexedItem] = []
+        for line_number, line in enumerate(text.split('\n')):
+            if line_number >= self.max_lines:
+                logger.warning(f"Receipt text truncated at {self.max_lines} lines")
+                break
+
+            line = line.strip()
+            if len(line) < MIN_ITEM_LINE_LENGTH:
+                continue
+
+            item = self.parse_line(line[:self.max_line_length], line_number)
+            if item is None:
+                continue
+
+            items.append(item)
+            if len(items) >= self.max_items:
+                logger.warning(f"Receipt item limit ({self.max_items}) reached")
+                break
+
+        return items
+
+    def parse_line(self, line: str, line_number: int = 0) -> Optional[LexedItem]:
+        """Assemble an item from a single line's tokens, or None if the line is not an item"""
+        tokens = self.tokenize(line)
+
+        price_index = None
+        for index in range(len(tokens) - 1, -1, -1):
+            if tokens[index][0] == PRICE:
+                price_index = index
+                break
+        if price_index is None:
+            return None
+
+        quantity = None
+        name_parts: List[str] = []
+        for index, (kind, text) in enumerate(tokens[:price_index]):
+            if kind in (QUANTITY, QUANTITY_AFTER):
+                if quantity is None:
+                    quantity = int(text)
+            elif kind == NUMBER and index == 0:
+                quantity = int(text)
+            elif kind in (WORD, UNIT, NUMBER):
+                name_parts.append(text)
+
+        # Needs at least one word; footer lines (TOPLAM, KDV, NAKİT...) are skipped
+        first_word = next((text for kind, text in tokens[:price_index] if kind == WORD), None)
+        if first_word is None or _fold(first_word) in SUMMARY_KEYWORDS:
+            return None
+
+        amount_kurus = int(''.join(char for char in tokens[price_index][1] if char.isdigit()))
+        if amount_kurus <= 0:
+            return None
+
+        currency = None
+        if price_index + 1 < len(tokens) and tokens[price_index + 1][0] == CURRENCY:
+            currency = 'TRY'
+
+        return LexedItem(
+            description=' '.join(name_parts),
+            amount=amount_kurus / 100,
+            quantity=quantity if quantity is not None else 1,
+            currency=currency,
+            line_number=line_number
+        )
+
+
+def _fold(word: str) -> str:
+    """Case-fold a word, mapping Turkish dotted/dotless i to plain i"""
+    return word.replace('İ', 'i').replace('I', 'i').casefold().replace('ı', 'i').rstrip('.')
+
+
+# Shared lexer instance
+receipt_lexer = ReceiptLexer()
@@ -0,0 +1,106 @@
+"""
+Shared in-process TTL + LRU cache
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Set
+
+# put() without an explicit ttl_seconds uses the cache's own TTL
+_DEFAULT_TTL = object()
+
+
+class TTLCache:
+    """
+    Thread-safe LRU whose entries expire ttl_seconds after put (None: never)
+
+    index(key, value) optionally tags entries for keys_for()/pop_tag() lookups;
+    on_evict(key, value) runs for entries dropped by expiry or the size bound.
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: Optional[float] = None,
+        max_entries: int = 1024,
+        index: Optional[Callable[[Any, Any], Optional[Hashable]]] = None,
+        on_evict: Optional[Callable[[Any, Any], None]] = None
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Any, tuple[Optional[float], Any]]" = OrderedDict()
+        self._index = index
+        self._tags: Dict[Hashable, Set[Any]] = {}
+        self._on_evict = on_evict
+        self._lock = threading.Lock()
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+
+            expires_at, value = entry
+            if expires_at is not None and time.monotonic() > expires_at:
+                self._remove(key)
+                if self._on_evict is not None:
+                    self._on_evict(key, value)
+                return default
+
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: Any, value: Any, ttl_seconds: Any = _DEFAULT_TTL) -> bool:
+        ttl = self.ttl_seconds if ttl_seconds is _DEFAULT_TTL else ttl_seconds
+        if self.max_entries <= 0 or (ttl is not None and ttl <= 0):
+            return False
+
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (time.monotonic() + ttl if ttl is not None else None, value)
+            tag = self._index(key, value) if self._index is not None else None
+            if tag is not None:
+                self._tags.setdefault(tag, set()).add(key)
+
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                evicted = self._remove(oldest)
+                if self._on_evict is not None:
+                    self._on_evict(oldest, evicted)
+        return True
+
+    def pop(self, key: Any):
+        with self._lock:
+            self._remove(key)
+
+    def keys_for(self, tag: Hashable) -> List[Any]:
+        with self._lock:
+            return list(self._tags.get(tag, ()))
+
+    def pop_tag(self, tag: Hashable):
+        with self._lock:
+            for key in list(self._tags.get(tag, ())):
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def _remove(self, key: Any) -> Any:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return None
+
+        value = entry[1]
+        tag = self._index(key, value) if self._index is not None else None
+        keys = self._tags.get(tag) if tag is not None else None
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._tags[tag]
+        return value
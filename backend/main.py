@@ -17,6 +17,11 @@ from app.core.security import (
     RequestLoggingMiddleware
 )
 from app.core.scheduler import scheduler
+from app.core.log_sink import log_sink
+from app.core.notifications import notification_service
+from app.services.qr_generator import qr_render_service
+from app.services.webhook_queue_service import webhook_queue_service
+from app.services.budget_threshold_service import budget_threshold_service
 from app.api.v1.api import api_router
 from app.api.v1.health import router as health_router
 
@@ -57,6 +62,15 @@ async def lifespan(app: FastAPI):
         scheduler_task = asyncio.create_task(scheduler.start())
         logger.info("⏰ Scheduler started")
     
+    # Audit log tamponunu başlat
+    await log_sink.start()
+    
+    # Webhook kuyruğu worker'larını başlat
+    await webhook_queue_service.start()
+    
+    # Bütçe eşiği bildirim worker'ını başlat
+    await budget_threshold_service.start()
+    
     logger.info("✅ EcoTrack API started successfully")
     
     yield
@@ -68,6 +82,15 @@ async def lifespan(app: FastAPI):
         await scheduler.stop()
         logger.info("Scheduler stopped")
     
+    await webhook_queue_service.stop()
+    await budget_threshold_service.stop()
+    qr_render_service.shutdown()
+    await notification_service.aclose()
+    
+    # Kalan log kayıtlarını yaz
+    await log_sink.stop()
+    logger.info(f"Log sink flushed: {log_sink.get_metrics()}")
+    
     logger.info("EcoTrack API shutdown complete")
 
 # Initialize FastAPI app
@@ -0,0 +1,26 @@
+"""
+Messy expense item rows
+DataCleaner batch/satır satır karşılaştırma testleri ve benchmark'ı için ham kalemler
+"""
+
+from typing import Any, Dict, List
+
+
+def messy_expense_rows(count: int) -> List[Dict[str, Any]]:
+    """count rows cycling through Turkish descriptions, mixed amount/quantity/KDV formats and dates"""
+    descriptions = ['Ekmek', 'Süt 1L', '  domates   kg ', 'Çay -- 500g', 'Deterjan!!', 'Benzin']
+    amounts = [12.5, '15,90', '7.25', '₺ 99,99', 3, '0']
+    quantities = [1, 2, '3 adet', None]
+    kdv_rates = [None, 20, '10', '%1', 8]
+    dates = ['15.01.2024', '2024-02-03 10:00']
+    return [
+        {
+            'description': descriptions[i % len(descriptions)] if i % 7 else f'Ürün {i % 500}',
+            'amount': amounts[i % len(amounts)],
+            'quantity': quantities[i % len(quantities)],
+            'kdv_rate': kdv_rates[i % len(kdv_rates)],
+            'expense_date': dates[i % len(dates)],
+            'notes': 'not  var' if i % 3 == 0 else None
+        }
+        for i in range(count)
+    ]
@@ -0,0 +1,67 @@
+"""
+Fake FCM server
+Legacy FCM HTTP API (/fcm/send) taklidi; NotificationService'e httpx transport olarak verilir
+"""
+
+import asyncio
+import json
+from typing import Dict, Iterable, List
+
+import httpx
+
+
+class FakeFCMServer:
+    """
+    In-process FCM endpoint
+
+    Gelen istekleri kaydeder, invalid_tokens içindeki token'lar için
+    NotRegistered döner ve latency ile yavaş bir FCM'i taklit eder.
+    max_in_flight aynı anda işlenen en fazla istek sayısıdır.
+    """
+
+    def __init__(self, server_key: str = "test-server-key", invalid_tokens: Iterable[str] = (), latency: float = 0.0):
+        self.server_key = server_key
+        self.invalid_tokens = set(invalid_tokens)
+        self.latency = latency
+        self.requests: List[Dict] = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    @property
+    def transport(self) -> httpx.MockTransport:
+        return httpx.MockTransport(self.handle)
+
+    @property
+    def delivered_tokens(self) -> List[str]:
+        return [token for request in self.requests for token in self._tokens(request)]
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            if request.headers.get("Authorization") != f"key={self.server_key}":
+                return httpx.Response(401, text="Unauthorized")
+
+            payload = json.loads(request.content)
+            self.requests.append(payload)
+            results = [
+                {"error": "NotRegistered"} if token in self.invalid_tokens
+                else {"message_id": f"0:{len(self.requests)}:{index}"}
+                for index, token in enumerate(self._tokens(payload))
+            ]
+            failure = sum(1 for result in results if "error" in result)
+            return httpx.Response(200, json={
+                "multicast_id": len(self.requests),
+                "success": len(results) - failure,
+                "failure": failure,
+                "canonical_ids": 0,
+                "results": results
+            })
+        finally:
+            self.in_flight -= 1
+
+    @staticmethod
+    def _tokens(payload: Dict) -> List[str]:
+        return payload.get("registration_ids") or [payload["to"]]
@@ -0,0 +1,51 @@
+"""
+Turkish receipt QR payload corpus
+QRParser sınıflandırma testleri ve parse/saniye benchmark'ı için örnek QR içerikleri
+"""
+
+# (payload, expected qr_type)
+TURKISH_RECEIPT_QR_PAYLOADS = [
+    # e-Arşiv / GİB URL'leri
+    (
+        "https://earsivportal.efatura.gov.tr/earsiv-services/download?token=7f3a9c1e2b4d6f8a0c1e3b5d7f9a1c3e&v=1",
+        "url",
+    ),
+    ("https://verify.gib.gov.tr/GIB2024000012345", "url"),
+    ("HTTPS://VERIFY.GIB.GOV.TR/ABC2024000067890", "url"),
+    (
+        "https://www.migros.com.tr/receipt/MGR-2024-0001523?amount=245,90&date=15.01.2024&vkn=6130029871",
+        "url",
+    ),
+    ("https://ecotrack.com/receipt/3f1c2a7e-5b8d-4c9e-a1f2-6d3b7e9c0a41", "url"),
+    ("localhost:8000/api/v1/receipts/receipt/3f1c2a7e-5b8d-4c9e-a1f2-6d3b7e9c0a41", "url"),
+    # JSON payload'lar (POS / ÖKC çıktıları)
+    (
+        '{"firma": "BİM Birleşik Mağazalar A.Ş.", "toplam": 187.45, "tarih": "15.01.2024 14:32", '
+        '"vkn": "1750051846", "para_birimi": "TRY"}',
+        "json",
+    ),
+    (
+        '{"merchant": "A101 Yeni Mağazacılık", "total": "89,90", "date": "2024-02-03T09:15:00", '
+        '"tax_no": "0680085325", "items": [{"name": "Süt 1L", "price": 32.5}, {"name": "Ekmek", "price": 10.0}]}',
+        "json",
+    ),
+    (
+        '  {"magaza": "ŞOK Marketler", "tutar": 54.75, "zaman": "03/02/2024", "urunler": []}',
+        "json",
+    ),
+    # Yapılandırılmış metin (anahtar:değer)
+    (
+        "MİGROS TİCARET A.Ş.\nVKN: 6130029871\nTarih: 15.01.2024 14:32\nToplam: 245,90 TL",
+        "structured_text",
+    ),
+    (
+        "Firma: CarrefourSA\nTarih: 2024-03-10 18:05\nTutar: 1.234,56\nVergi No: 2040038271",
+        "structured_text",
+    ),
+    ("magaza=File Market|tarih:21-04-2024|toplam=76.40", "structured_text"),
+    # Düz metin (ÖKC fiş altı satırları)
+    ("ŞOK MARKET KADIKÖY TOPLAM 123,45 TL TARİH 05.05.2024", "plain_text"),
+    ("Metro Grossmarket 15.01.2024 10:45 499,99 TRY VN 6200038122", "plain_text"),
+    ("FİŞ NO 0042 Z NO 0157 TOPLAM:64,20", "plain_text"),
+    ("", "plain_text"),
+]
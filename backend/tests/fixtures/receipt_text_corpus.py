@@ -0,0 +1,87 @@
+"""
+Turkish receipt text corpus
+ReceiptLexer testleri, fuzz ve benchmark için ham fiş metinleri
+"""
+
+import random
+
+# (raw receipt text, expected items as (description, amount, quantity))
+RECEIPT_TEXT_SAMPLES = [
+    (
+        "BİM BİRLEŞİK MAĞAZALAR A.Ş.\n"
+        "TARİH: 15.01.2024 SAAT: 14:32\n"
+        "EKMEK %01 *10,00\n"
+        "2 x SÜT 1L %01 *65,00\n"
+        "YUMURTA 10LU 2 x 47,50\n"
+        "DETERJAN 3KG %20 *189,90\n"
+        "TOPKDV *33,12\n"
+        "TOPLAM *312,40\n"
+        "NAKİT *320,00\n",
+        [
+            ("EKMEK", 10.0, 1),
+            ("SÜT 1L", 65.0, 2),
+            ("YUMURTA 10LU", 47.5, 2),
+            ("DETERJAN 3KG", 189.9, 1),
+        ],
+    ),
+    (
+        "Migros Ticaret A.Ş.\n"
+        "3 Portakal Suyu 89,85 TL\n"
+        "Coca-Cola 330 ml 25,00₺\n"
+        "Televizyon 12.499,00 TL\n"
+        "ARA TOPLAM 12.613,85\n"
+        "KDV %20 2.102,31\n",
+        [
+            ("Portakal Suyu", 89.85, 3),
+            ("Coca-Cola 330 ml", 25.0, 1),
+            ("Televizyon", 12499.0, 1),
+        ],
+    ),
+    (
+        "Kahve Dünyası\n"
+        "Türk Kahvesi x2 90,00\n"
+        "Su 0,5L 15,00\n"
+        "Kredi Kartı 105,00\n",
+        [
+            ("Türk Kahvesi", 90.0, 2),
+            ("Su 0,5L", 15.0, 1),
+        ],
+    ),
+]
+
+# Lines the old alternative regexes backtracked on; each must lex in linear time
+ADVERSARIAL_LINES = [
+    "a " * 20000,
+    "ş-" * 20000 + "1",
+    "Ekmek " * 5000 + "10,0",
+    "1," * 20000,
+    "x" * 40000 + " 1",
+    " " * 40000 + "a 1,5",
+]
+
+_WORDS = [
+    "EKMEK", "SÜT", "PEYNİR", "ÇAY", "KAHVE", "DETERJAN", "ŞAMPUAN", "YOĞURT",
+    "Domates", "Salatalık", "Elma", "Muz", "Makarna", "Pirinç", "Zeytinyağı",
+]
+_UNITS = ["", " 1L", " 500G", " 1KG", " 330ML", " 10LU"]
+_NOISE = "*%#/:;()[]{}|\\\"'!?@&=+<>~`^$"
+
+
+def random_receipt_text(seed: int, lines: int = 40) -> str:
+    """Random receipt-like text: item lines, footer lines and noise"""
+    rng = random.Random(seed)
+    out = []
+    for _ in range(lines):
+        roll = rng.random()
+        if roll < 0.6:
+            quantity = f"{rng.randint(1, 9)} x " if rng.random() < 0.3 else ""
+            amount = f"{rng.randint(0, 9999)},{rng.randint(0, 99):02d}"
+            currency = rng.choice(["", " TL", "₺", " TRY"])
+            out.append(f"{quantity}{rng.choice(_WORDS)}{rng.choice(_UNITS)} %0{rng.choice([1, 10, 20])} *{amount}{currency}")
+        elif roll < 0.7:
+            out.append(f"TOPLAM *{rng.randint(1, 9999)},{rng.randint(0, 99):02d}")
+        else:
+            length = rng.randint(0, 120)
+            alphabet = "abcçdefgğhıijklmnoöprsştuüvyz0123456789 .,-x" + _NOISE
+            out.append("".join(rng.choice(alphabet) for _ in range(length)))
+    return "\n".join(out)
@@ -333,6 +333,93 @@ class TestWebhookEndpoints:
         # Clean up
         app.dependency_overrides.clear()
     
+    def test_sync_webhook_failure_with_pending_retry_returns_202(self):
+        """Test a sync transaction that raises is released for retry and answered 202, also for duplicates"""
+        from app.db.supabase_client import get_supabase_admin_client
+        
+        app.dependency_overrides[validate_merchant_api_key] = lambda: self.merchant_id
+        app.dependency_overrides[get_supabase_admin_client] = lambda: Mock()
+        
+        transaction_data = self.create_sample_transaction_data()
+        entry = {
+            "id": str(uuid4()),
+            "transaction_id": transaction_data["transaction_id"],
+            "status": "processing",
+            "attempts": 1,
+            "result": None
+        }
+        failed_result = {
+            "success": False,
+            "message": "Failed to process transaction: db down",
+            "transaction_id": transaction_data["transaction_id"],
+            "processing_time_ms": 0
+        }
+        queue = Mock()
+        queue.enqueue.return_value = (entry, False)
+        queue.complete.return_value = {"status": "queued", "result": failed_result, "locked_at": None}
+        failing_service = Mock(process_merchant_transaction=AsyncMock(side_effect=Exception("db down")))
+        
+        with patch("app.api.v1.webhooks.webhook_queue_service", queue), \
+             patch("app.api.v1.webhooks.WebhookService", return_value=failing_service):
+            response = self.client.post(
+                f"/api/v1/webhooks/merchant/{self.merchant_id}/transaction?async_processing=false",
+                json=transaction_data,
+                headers=self.webhook_headers
+            )
+            
+            assert response.status_code == 202
+            assert response.json()["status"] == "queued"
+            assert response.json()["result"] is None
+            # The row is closed (requeued) instead of staying 'processing' until its lease expires
+            completed_entry, completed_result = queue.complete.call_args.args
+            assert completed_entry is entry and completed_result.success is False
+            
+            # Duplicate while the retry is pending: the failed attempt's result is not final
+            queue.enqueue.return_value = ({**entry, "status": "queued", "result": failed_result}, True)
+            duplicate = self.client.post(
+                f"/api/v1/webhooks/merchant/{self.merchant_id}/transaction?async_processing=false",
+                json=transaction_data,
+                headers=self.webhook_headers
+            )
+        
+        assert duplicate.status_code == 202
+        assert duplicate.json()["duplicate"] is True and duplicate.json()["result"] is None
+        assert failing_service.process_merchant_transaction.await_count == 1
+        
+        # Clean up
+        app.dependency_overrides.clear()
+    
+    def test_batch_webhook_failure_closes_queue_rows(self):
+        """Test a batch whose processing raises records a failed result for its claimed queue rows"""
+        from app.db.supabase_client import get_supabase_admin_client
+        
+        app.dependency_overrides[validate_merchant_api_key] = lambda: self.merchant_id
+        app.dependency_overrides[get_supabase_admin_client] = lambda: Mock()
+        
+        transactions = [
+            {**self.create_sample_transaction_data(), "transaction_id": transaction_id}
+            for transaction_id in ("TXN-1", "TXN-2")
+        ]
+        queue = Mock()
+        queue.enqueue_many.return_value = ({t["transaction_id"]: {"id": f"queue-{t['transaction_id']}"} for t in transactions}, {})
+        failing_service = Mock(process_merchant_transactions_batch=AsyncMock(side_effect=Exception("db down")))
+        
+        with patch("app.api.v1.webhooks.webhook_queue_service", queue), \
+             patch("app.api.v1.webhooks.WebhookService", return_value=failing_service):
+            response = self.client.post(
+                f"/api/v1/webhooks/merchant/{self.merchant_id}/transactions/batch",
+                json={"transactions": transactions},
+                headers=self.webhook_headers
+            )
+        
+        assert response.status_code == 500
+        completed = queue.complete_many.call_args.args[0]
+        assert [entry["id"] for entry, _ in completed] == ["queue-TXN-1", "queue-TXN-2"]
+        assert all(not result.success and "db down" in result.message for _, result in completed)
+        
+        # Clean up
+        app.dependency_overrides.clear()
+    
     def test_test_transaction_endpoint(self):
         """Test the test transaction endpoint"""
         app.dependency_overrides[require_admin] = lambda: self.admin_user
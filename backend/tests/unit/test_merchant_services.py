@@ -7,8 +7,9 @@ import hashlib
 import secrets
 
 # Import the services we're testing
-from app.services.merchant_service import MerchantService, CustomerMatchingService
+from app.services.merchant_service import MerchantService, CustomerMatchingService, CustomerMatchCache, CACHE_MISS, customer_match_cache
 from app.services.webhook_service import WebhookService
+from app.core.log_sink import BufferedLogSink
 from app.schemas.merchant import (
     MerchantCreate,
     MerchantUpdate,
@@ -22,6 +23,14 @@ from app.schemas.merchant import (
 )
 
 
+@pytest.fixture(autouse=True)
+def clear_customer_match_cache():
+    """The match cache is shared across matcher instances; keep tests independent"""
+    customer_match_cache.clear()
+    yield
+    customer_match_cache.clear()
+
+
 class TestMerchantService:
     """Test MerchantService functionality"""
     
@@ -642,6 +651,795 @@ class TestMerchantWebhookIntegration:
         assert hasattr(webhook_service, 'get_webhook_logs')
 
 
+class TestWebhookQueueService:
+    """Test durable webhook queue, idempotency and bounded workers"""
+    
+    @staticmethod
+    def create_transaction(transaction_id="TXN-Q-1"):
+        return WebhookTransactionData(
+            transaction_id=transaction_id,
+            total_amount=50.0,
+            currency="TRY",
+            transaction_date=datetime(2024, 1, 15, 12, 0, tzinfo=timezone.utc),
+            customer_info=CustomerInfo(email="test@example.com"),
+            items=[TransactionItem(description="Coffee", quantity=2, unit_price=25.0, total_price=50.0)]
+        )
+    
+    @staticmethod
+    def fake_queue_supabase():
+        """In-memory webhook_queue table with the unique (merchant_id, transaction_id) key"""
+        rows = {}
+        
+        def upsert(row, on_conflict, ignore_duplicates):
+            key = (row["merchant_id"], row["transaction_id"])
+            if any((r["merchant_id"], r["transaction_id"]) == key for r in rows.values()):
+                return Mock(execute=Mock(return_value=Mock(data=[])))
+            new_row = {"id": str(uuid4()), "attempts": 0, "result": None, **row}
+            rows[new_row["id"]] = new_row
+            return Mock(execute=Mock(return_value=Mock(data=[dict(new_row)])))
+        
+        def select(*_):
+            filters = {}
+            query = Mock()
+            
+            def eq(column, value):
+                filters[column] = value
+                return query
+            
+            query.eq.side_effect = eq
+            query.limit.return_value.execute.side_effect = lambda: Mock(data=[
+                dict(r) for r in rows.values() if all(r.get(c) == v for c, v in filters.items())
+            ])
+            return query
+        
+        def update(data):
+            query = Mock()
+            query.eq.side_effect = lambda column, value: Mock(execute=lambda: rows[value].update(data))
+            return query
+        
+        def rpc(name, params):
+            claimed = [r for r in rows.values() if r["status"] == "queued"][:params["p_limit"]]
+            for r in claimed:
+                r.update(status="processing", attempts=r["attempts"] + 1)
+            return Mock(execute=Mock(return_value=Mock(data=[dict(r) for r in claimed])))
+        
+        table = Mock(upsert=Mock(side_effect=upsert), select=Mock(side_effect=select), update=Mock(side_effect=update))
+        supabase = Mock()
+        supabase.table.return_value = table
+        supabase.rpc.side_effect = rpc
+        return supabase, rows
+    
+    @staticmethod
+    def processing_result(transaction_data, success=True):
+        from app.schemas.merchant import WebhookProcessingResult
+        return WebhookProcessingResult(
+            success=success,
+            message="ok" if success else "failed",
+            transaction_id=transaction_data.transaction_id,
+            processing_time_ms=5
+        )
+    
+    def test_enqueue_is_idempotent_per_transaction_id(self):
+        """Test a retried transaction returns the existing queue row"""
+        from app.services.webhook_queue_service import WebhookQueueService
+        
+        supabase, rows = self.fake_queue_supabase()
+        queue = WebhookQueueService(supabase_factory=lambda: supabase)
+        merchant_id = uuid4()
+        
+        first, first_duplicate = queue.enqueue(merchant_id, self.create_transaction())
+        second, second_duplicate = queue.enqueue(merchant_id, self.create_transaction())
+        
+        assert (first_duplicate, second_duplicate) == (False, True)
+        assert first["id"] == second["id"]
+        assert len(rows) == 1
+        
+        # Same transaction_id from another merchant is a different transaction
+        queue.enqueue(uuid4(), self.create_transaction())
+        assert len(rows) == 2
+    
+    @pytest.mark.asyncio
+    async def test_drain_once_records_results(self):
+        """Test claimed rows are processed and closed as done / failed"""
+        from app.services.webhook_queue_service import WebhookQueueService, stored_result
+        
+        supabase, rows = self.fake_queue_supabase()
+        processor = Mock()
+        processor.process_merchant_transaction = AsyncMock(
+            side_effect=lambda merchant_id, data, test_mode: self.processing_result(data, data.transaction_id != "TXN-BAD")
+        )
+        queue = WebhookQueueService(supabase_factory=lambda: supabase, processor_factory=lambda client: processor)
+        merchant_id = uuid4()
+        
+        queue.enqueue(merchant_id, self.create_transaction("TXN-OK"))
+        queue.enqueue(merchant_id, self.create_transaction("TXN-BAD"))
+        
+        assert await queue.drain_once() == 2
+        assert await queue.drain_once() == 0
+        
+        statuses = {r["transaction_id"]: r["status"] for r in rows.values()}
+        assert statuses == {"TXN-OK": "done", "TXN-BAD": "failed"}
+        assert stored_result(queue.get_entry(merchant_id, "TXN-OK")).success is True
+        assert processor.process_merchant_transaction.await_count == 2
+    
+    @pytest.mark.asyncio
+    async def test_workers_bound_concurrency(self):
+        """Test worker coroutines drain the queue with at most N in flight"""
+        from app.services.webhook_queue_service import WebhookQueueService
+        
+        supabase, rows = self.fake_queue_supabase()
+        in_flight = {"now": 0, "max": 0}
+        
+        async def process(merchant_id, data, test_mode):
+            in_flight["now"] += 1
+            in_flight["max"] = max(in_flight["max"], in_flight["now"])
+            await asyncio.sleep(0.01)
+            in_flight["now"] -= 1
+            return self.processing_result(data)
+        
+        processor = Mock(process_merchant_transaction=process)
+        queue = WebhookQueueService(
+            workers=2, batch_size=1, poll_interval=0.01,
+            supabase_factory=lambda: supabase, processor_factory=lambda client: processor
+        )
+        
+        await queue.start()
+        try:
+            for index in range(8):
+                queue.enqueue(uuid4(), self.create_transaction(f"TXN-{index}"))
+            for _ in range(200):
+                if all(r["status"] == "done" for r in rows.values()):
+                    break
+                await asyncio.sleep(0.01)
+        finally:
+            await queue.stop()
+        
+        assert all(r["status"] == "done" for r in rows.values())
+        assert in_flight["max"] == 2
+    
+    def test_sync_mode_duplicate_replays_stored_result(self):
+        """Test a transaction claimed for inline processing is skipped by workers and replayed on retry"""
+        from app.services.webhook_queue_service import WebhookQueueService, WebhookQueueStatus, stored_result
+        
+        supabase, rows = self.fake_queue_supabase()
+        queue = WebhookQueueService(supabase_factory=lambda: supabase)
+        merchant_id = uuid4()
+        transaction = self.create_transaction()
+        
+        entry, duplicate = queue.enqueue(merchant_id, transaction, status=WebhookQueueStatus.PROCESSING)
+        assert duplicate is False
+        assert entry["status"] == "processing" and entry["locked_at"]
+        
+        # Retry while still processing: no stored result yet (endpoint answers 202)
+        retry_entry, duplicate = queue.enqueue(merchant_id, transaction, status=WebhookQueueStatus.PROCESSING)
+        assert duplicate is True and stored_result(retry_entry) is None
+        
+        queue.complete(entry, self.processing_result(transaction))
+        retry_entry, duplicate = queue.enqueue(merchant_id, transaction, status=WebhookQueueStatus.PROCESSING)
+        
+        assert duplicate is True
+        assert stored_result(retry_entry).transaction_id == transaction.transaction_id
+        assert len(rows) == 1
+    
+    def test_stored_result_is_only_returned_once_final(self):
+        """Test a failed attempt waiting for retry has no stored result until the last attempt fails"""
+        from app.services.webhook_queue_service import WebhookQueueService, WebhookQueueStatus, stored_result
+        
+        supabase, rows = self.fake_queue_supabase()
+        queue = WebhookQueueService(retry_attempts=1, supabase_factory=lambda: supabase)
+        merchant_id = uuid4()
+        transaction = self.create_transaction()
+        
+        entry, _ = queue.enqueue(merchant_id, transaction, status=WebhookQueueStatus.PROCESSING)
+        completion = queue.complete(entry, self.processing_result(transaction, success=False))
+        
+        assert completion["status"] == "queued"
+        assert rows[entry["id"]]["result"] is not None
+        assert stored_result(queue.get_entry(merchant_id, transaction.transaction_id)) is None
+        
+        rows[entry["id"]]["attempts"] = 2
+        assert queue.complete(rows[entry["id"]], self.processing_result(transaction, success=False))["status"] == "failed"
+        assert stored_result(queue.get_entry(merchant_id, transaction.transaction_id)).success is False
+    
+    @pytest.mark.asyncio
+    async def test_failed_entry_is_retried_with_backoff_then_dead_lettered(self):
+        """Test failures are rescheduled with growing next_attempt_at until attempts run out"""
+        from app.services.webhook_queue_service import WebhookQueueService
+        
+        supabase, rows = self.fake_queue_supabase()
+        processor = Mock()
+        processor.process_merchant_transaction = AsyncMock(
+            side_effect=lambda merchant_id, data, test_mode: self.processing_result(data, success=False)
+        )
+        queue = WebhookQueueService(
+            retry_attempts=2, retry_delay=10, retry_max_delay=15,
+            supabase_factory=lambda: supabase, processor_factory=lambda client: processor
+        )
+        queue.enqueue(uuid4(), self.create_transaction())
+        row = next(iter(rows.values()))
+        
+        delays = []
+        for _ in range(2):
+            before = datetime.now(timezone.utc)
+            assert await queue.drain_once() == 1
+            assert row["status"] == "queued"
+            delays.append((datetime.fromisoformat(row["next_attempt_at"]) - before).total_seconds())
+        
+        assert 5 <= delays[0] <= 10.5
+        assert 7.5 <= delays[1] <= 15.5
+        
+        assert await queue.drain_once() == 1
+        assert row["status"] == "failed" and row["attempts"] == 3
+        assert processor.process_merchant_transaction.await_count == 3
+    
+    def test_retry_backoff_is_exponential_with_jitter(self):
+        """Test retry delays double per attempt, stay within [delay/2, delay] and respect the cap"""
+        from app.services.webhook_queue_service import WebhookQueueService
+        
+        queue = WebhookQueueService(retry_attempts=10, retry_delay=60, retry_max_delay=3600)
+        for attempts in range(1, 11):
+            delay = min(3600, 60 * 2 ** (attempts - 1))
+            samples = [queue.retry_backoff(attempts) for _ in range(50)]
+            assert all(delay / 2 <= sample <= delay for sample in samples)
+        assert len({queue.retry_backoff(1) for _ in range(20)}) > 1
+    
+    @pytest.mark.asyncio
+    async def test_retry_claims_are_rate_limited(self):
+        """Test the claim asks for fewer retries once the rate limit window is used up"""
+        from app.services.webhook_queue_service import WebhookQueueService
+        
+        supabase, rows = self.fake_queue_supabase()
+        processor = Mock()
+        processor.process_merchant_transaction = AsyncMock(
+            side_effect=lambda merchant_id, data, test_mode: self.processing_result(data)
+        )
+        queue = WebhookQueueService(
+            retry_attempts=3, retry_rate_limit=2, retry_rate_period=60,
+            supabase_factory=lambda: supabase, processor_factory=lambda client: processor
+        )
+        for index in range(3):
+            queue.enqueue(uuid4(), self.create_transaction(f"TXN-R{index}"))
+        for row in rows.values():
+            row["attempts"] = 1  # each already failed once
+        
+        await queue.drain_once()
+        await queue.drain_once()
+        
+        retry_limits = [call.args[1]["p_retry_limit"] for call in supabase.rpc.call_args_list]
+        assert retry_limits == [2, 0]
+        
+        # Retries disabled: claims never ask for retries
+        assert WebhookQueueService(supabase_factory=lambda: supabase)._retry_allowance() == 0
+
+
+class TestWebhookBatchProcessing:
+    """Test batch webhook processing: bulk matching, multi-row writes, per-transaction results"""
+    
+    @staticmethod
+    def fake_supabase(tables=None, fail=None):
+        """In-memory tables; records every executed (table, action, payload). fail(table, action, payload) -> raise"""
+        store = {name: [dict(row) for row in rows] for name, rows in (tables or {}).items()}
+        calls = []
+        
+        def table(name):
+            rows = store.setdefault(name, [])
+            
+            def query(action, payload=None, on_conflict=None, ignore_duplicates=False):
+                filters = []
+                q = Mock()
+                
+                def eq(column, value):
+                    filters.append((column, lambda v: v == value))
+                    return q
+                
+                def in_(column, values):
+                    filters.append((column, lambda v: v in values))
+                    return q
+                
+                def execute():
+                    calls.append((name, action, payload))
+                    if fail and fail(name, action, payload):
+                        raise Exception(f"{name} {action} failed")
+                    matched = [r for r in rows if all(test(r.get(column)) for column, test in filters)]
+                    if action == "select":
+                        return Mock(data=[dict(r) for r in matched])
+                    if action == "delete":
+                        for r in matched:
+                            rows.remove(r)
+                        return Mock(data=matched)
+                    if action == "update":
+                        for r in matched:
+                            r.update(payload)
+                        return Mock(data=[dict(r) for r in matched])
+                    created = []
+                    for row in payload if isinstance(payload, list) else [payload]:
+                        conflict = (on_conflict or "merchant_id,transaction_id").split(",")
+                        if ignore_duplicates and any(
+                            all(r.get(column) == row.get(column) for column in conflict) for r in rows
+                        ):
+                            continue
+                        if action == "upsert" and not ignore_duplicates and on_conflict:
+                            existing = next((
+                                r for r in rows if all(r.get(column) == row.get(column) for column in conflict)
+                            ), None)
+                        else:
+                            existing = next((r for r in rows if "id" in row and r["id"] == row["id"]), None)
+                        if existing is not None:
+                            existing.update(row)
+                            if action == "upsert":
+                                created.append(dict(existing))
+                            continue
+                        new_row = {"id": str(uuid4()), **row}
+                        rows.append(new_row)
+                        created.append(dict(new_row))
+                    return Mock(data=created)
+                
+                q.eq.side_effect = eq
+                q.in_.side_effect = in_
+                q.execute.side_effect = execute
+                return q
+            
+            return Mock(
+                select=lambda *args, **kwargs: query("select"),
+                insert=lambda payload: query("insert", payload),
+                upsert=lambda payload, on_conflict=None, ignore_duplicates=False: query("upsert", payload, on_conflict, ignore_duplicates),
+                update=lambda payload: query("update", payload),
+                delete=lambda: query("delete")
+            )
+        
+        supabase = Mock()
+        supabase.table.side_effect = table
+        return supabase, store, calls
+    
+    @staticmethod
+    def create_transaction(transaction_id, customer_info=None, descriptions=("Coffee",)):
+        return WebhookTransactionData(
+            transaction_id=transaction_id,
+            total_amount=25.0 * len(descriptions),
+            currency="TRY",
+            transaction_date=datetime(2024, 1, 15, 12, 0, tzinfo=timezone.utc),
+            customer_info=customer_info or CustomerInfo(),
+            items=[
+                TransactionItem(description=description, quantity=1, unit_price=25.0, total_price=25.0)
+                for description in descriptions
+            ]
+        )
+    
+    def create_webhook_service(self, supabase):
+        service = WebhookService.__new__(WebhookService)
+        service.supabase = supabase
+        service.customer_matcher = CustomerMatchingService(supabase)
+        service.data_processor = Mock()
+        service.data_processor.ai_categorizer.categorize_expense = AsyncMock(
+            return_value={"category_name": "Food", "confidence": 0.9}
+        )
+        service.loyalty_service = Mock()
+        service.loyalty_service.award_points_for_expense = AsyncMock(
+            return_value={"success": True, "points_awarded": 5, "transaction_id": str(uuid4())}
+        )
+        service.loyalty_service.award_points_for_expenses = AsyncMock(side_effect=lambda awards: [
+            {"success": True, "points_awarded": 5, "transaction_id": str(uuid4())} for _ in awards
+        ])
+        service.log_sink = BufferedLogSink(supabase_factory=lambda: supabase)
+        return service
+    
+    @staticmethod
+    def count(calls, table, action):
+        return sum(1 for name, call_action, _ in calls if (name, call_action) == (table, action))
+    
+    @pytest.mark.asyncio
+    async def test_match_customers_bulk_one_query_per_identifier(self):
+        """Test emails and card hashes are matched with one in_() query each"""
+        email_user, card_user = str(uuid4()), str(uuid4())
+        supabase, _, calls = self.fake_supabase({
+            "users": [{"id": email_user, "email": "known@example.com"}],
+            "user_payment_methods": [
+                {"user_id": card_user, "card_hash": "hash-active", "is_active": True},
+                {"user_id": str(uuid4()), "card_hash": "hash-inactive", "is_active": False}
+            ]
+        })
+        matcher = CustomerMatchingService(supabase)
+        
+        results = await matcher.match_customers_bulk([
+            CustomerInfo(email="known@example.com", card_hash="hash-active"),
+            CustomerInfo(email="unknown@example.com", card_hash="hash-active"),
+            CustomerInfo(card_hash="hash-inactive"),
+            None
+        ])
+        
+        assert [(r.matched, r.match_method) for r in results] == [
+            (True, "email"), (True, "card_hash"), (False, None), (False, None)
+        ]
+        assert results[0].user_id == UUID(email_user)
+        assert results[1].user_id == UUID(card_user)
+        assert self.count(calls, "users", "select") == 1
+        assert self.count(calls, "user_payment_methods", "select") == 1
+    
+    @pytest.mark.asyncio
+    async def test_batch_uses_multi_row_inserts(self):
+        """Test a batch is written with one multi-row write per table and returns per-transaction results"""
+        user_id = str(uuid4())
+        merchant_id = uuid4()
+        supabase, store, calls = self.fake_supabase({
+            "merchants": [{"id": str(merchant_id), "name": "Test Cafe"}],
+            "users": [{"id": user_id, "email": "known@example.com"}],
+            "categories": [{"id": "cat-food", "name": "Food"}]
+        })
+        service = self.create_webhook_service(supabase)
+        
+        await service.log_sink.start()
+        results = await service.process_merchant_transactions_batch(merchant_id, [
+            self.create_transaction("TXN-1", CustomerInfo(email="known@example.com"), ("Coffee", "Cake")),
+            self.create_transaction("TXN-2", CustomerInfo(email="known@example.com"), ("coffee",)),
+            self.create_transaction("TXN-3", CustomerInfo(email="stranger@example.com")),
+            self.create_transaction("TXN-4")
+        ])
+        await service.log_sink.stop()
+        
+        assert [r.success for r in results] == [True, True, True, True]
+        assert [r.matched_user_id for r in results] == [UUID(user_id), UUID(user_id), None, None]
+        assert results[0].loyalty_points_awarded == 5
+        # Both matched transactions accrue points in one call
+        assert service.loyalty_service.award_points_for_expenses.await_count == 1
+        assert len(service.loyalty_service.award_points_for_expenses.await_args.args[0]) == 2
+        assert results[2].message.startswith("Customer not found")
+        assert results[3].is_public_receipt and results[3].created_expense_id is None
+        
+        assert self.count(calls, "receipts", "upsert") == 1
+        for table in ("expenses", "expense_items"):
+            assert self.count(calls, table, "insert") == 1
+        assert self.count(calls, "webhook_logs", "upsert") == 1
+        assert self.count(calls, "users", "select") == 1
+        assert self.count(calls, "categories", "select") == 1
+        # "Coffee" and "coffee" are categorized once
+        assert service.data_processor.ai_categorizer.categorize_expense.await_count == 2
+        
+        assert len(store["expense_items"]) == 5
+        assert {i["category_id"] for i in store["expense_items"] if i["user_id"] == user_id} == {"cat-food"}
+        public_receipt = next(r for r in store["receipts"] if r["id"] == str(results[3].created_receipt_id))
+        assert public_receipt["raw_qr_data"] == results[3].public_url
+        assert public_receipt["is_public"] is True
+        assert {log["status"] for log in store["webhook_logs"]} == {"success"}
+    
+    @pytest.mark.asyncio
+    async def test_failed_chunk_is_rolled_back_alone(self):
+        """Test a failing write chunk deletes its receipts and fails only its transactions"""
+        merchant_id = uuid4()
+        supabase, store, calls = self.fake_supabase(
+            fail=lambda table, action, payload: table == "expense_items" and action == "insert"
+            and any(item["description"] == "Broken" for item in payload)
+        )
+        service = self.create_webhook_service(supabase)
+        
+        results = await service.process_merchant_transactions_batch(merchant_id, [
+            self.create_transaction("TXN-1"),
+            self.create_transaction("TXN-2"),
+            self.create_transaction("TXN-3", descriptions=("Broken",)),
+        ], write_batch_size=2)
+        
+        assert [r.success for r in results] == [True, True, False]
+        assert self.count(calls, "receipts", "upsert") == 2
+        assert {r["id"] for r in store["receipts"]} == {str(results[0].created_receipt_id), str(results[1].created_receipt_id)}
+        assert [log["status"] for log in store["webhook_logs"]] == ["success", "success", "failed"]
+    
+    @pytest.mark.asyncio
+    async def test_batch_reuses_receipt_of_received_transaction(self):
+        """Test a transaction received before does not fail its chunk and keeps one receipt"""
+        merchant_id = uuid4()
+        receipt_id, old_expense_id = str(uuid4()), str(uuid4())
+        supabase, store, _ = self.fake_supabase({
+            "merchants": [{"id": str(merchant_id), "name": "Test Cafe"}],
+            "receipts": [{"id": receipt_id, "merchant_id": str(merchant_id), "webhook_transaction_id": "TXN-1"}],
+            "expenses": [{"id": old_expense_id, "receipt_id": receipt_id}]
+        })
+        service = self.create_webhook_service(supabase)
+        
+        results = await service.process_merchant_transactions_batch(merchant_id, [
+            self.create_transaction("TXN-1"),
+            self.create_transaction("TXN-2")
+        ])
+        
+        assert [r.success for r in results] == [True, True]
+        assert results[0].created_receipt_id == UUID(receipt_id)
+        assert sorted(r["webhook_transaction_id"] for r in store["receipts"]) == ["TXN-1", "TXN-2"]
+        assert old_expense_id not in {e["id"] for e in store["expenses"]}
+        assert [e["receipt_id"] for e in store["expenses"]].count(receipt_id) == 1
+    
+    @pytest.mark.asyncio
+    async def test_retry_after_partial_write_reuses_receipt(self):
+        """Test an expense write failing after the receipt insert leaves one receipt after retries"""
+        from app.services.webhook_queue_service import WebhookQueueService
+        
+        user_id = str(uuid4())
+        merchant_id = uuid4()
+        expense_inserts = []
+        
+        def fail(table, action, payload):
+            if (table, action) != ("expenses", "insert"):
+                return False
+            expense_inserts.append(payload)
+            return len(expense_inserts) == 1
+        
+        supabase, store, calls = self.fake_supabase({
+            "merchants": [{"id": str(merchant_id), "name": "Test Cafe"}],
+            "users": [{"id": user_id, "email": "known@example.com"}],
+            "categories": [{"id": "cat-food", "name": "Food"}]
+        }, fail=fail)
+        service = self.create_webhook_service(supabase)
+        queue = WebhookQueueService(supabase_factory=lambda: supabase, retry_attempts=3)
+        transaction = self.create_transaction("TXN-1", CustomerInfo(email="known@example.com"))
+        
+        first = await service.process_merchant_transaction(merchant_id, transaction)
+        assert not first.success
+        assert queue._completion({"attempts": 1, "transaction_id": "TXN-1"}, first)["status"] == "queued"
+        
+        second = await service.process_merchant_transaction(merchant_id, transaction)
+        third = await service.process_merchant_transaction(merchant_id, transaction)
+        
+        assert second.success and third.success
+        assert len(store["receipts"]) == 1
+        assert second.created_receipt_id == third.created_receipt_id == first.created_receipt_id
+        # Each attempt replaced the expense of the one before it
+        assert [e["id"] for e in store["expenses"]] == [str(third.created_expense_id)]
+        # The database cascades items of deleted expenses; the fake store does not
+        assert sum(1 for i in store["expense_items"] if i["expense_id"] == str(third.created_expense_id)) == 1
+        assert store["receipts"][0]["webhook_transaction_id"] == "TXN-1"
+    
+    @pytest.mark.asyncio
+    async def test_retry_reads_buffered_failure(self):
+        """Test a failed status still in the log sink buffer is flushed before the retry reads the log"""
+        merchant_id = uuid4()
+        transaction = self.create_transaction("TXN-1")
+        supabase, store, _ = self.fake_supabase({"merchants": [{"id": str(merchant_id), "name": "Test Cafe"}]})
+        service = self.create_webhook_service(supabase)
+        service.process_merchant_transaction = AsyncMock(return_value=Mock(success=True))
+        
+        log_id = service.log_sink.add("webhook_logs", {
+            "merchant_id": str(merchant_id), "transaction_id": "TXN-1", "status": "pending", "retry_count": 0,
+            "payload": transaction.model_dump(mode="json")
+        })
+        await service.log_sink.start()
+        service.log_sink.update("webhook_logs", log_id, {"status": "failed"})
+        
+        assert await service.retry_failed_webhook(log_id) is True
+        await service.log_sink.stop()
+        
+        assert store["webhook_logs"][0]["status"] == "retry"
+        service.process_merchant_transaction.assert_awaited_once()
+    
+    def test_enqueue_many_dedupes_and_reports_existing(self):
+        """Test a batch enqueue writes each new transaction_id once and returns earlier ones as existing"""
+        from app.services.webhook_queue_service import WebhookQueueService, WebhookQueueStatus
+        
+        supabase, store, calls = self.fake_supabase()
+        queue = WebhookQueueService(supabase_factory=lambda: supabase)
+        merchant_id = uuid4()
+        
+        queue.enqueue(merchant_id, self.create_transaction("TXN-OLD"))
+        created, existing = queue.enqueue_many(merchant_id, [
+            self.create_transaction("TXN-NEW"),
+            self.create_transaction("TXN-OLD"),
+            self.create_transaction("TXN-NEW"),
+        ], status=WebhookQueueStatus.PROCESSING)
+        
+        assert set(created) == {"TXN-NEW"}
+        assert set(existing) == {"TXN-OLD"}
+        assert len(store["webhook_queue"]) == 2
+        assert created["TXN-NEW"]["status"] == "processing"
+        assert self.count(calls, "webhook_queue", "upsert") == 2
+
+
+class TestWebhookStats:
+    """Test webhook statistics are read from the database-side rollup"""
+    
+    @pytest.mark.asyncio
+    async def test_stats_come_from_rollup_function(self):
+        """Test stats use one get_webhook_stats RPC and never select raw webhook_logs"""
+        merchant_id = uuid4()
+        supabase = Mock()
+        supabase.rpc.return_value.execute.return_value = Mock(data={
+            "total": 4, "success": 3, "failed": 1, "retry": 0, "pending": 0,
+            "avg_processing_time_ms": 120.5, "min_processing_time_ms": 40, "max_processing_time_ms": 260,
+            "p50_processing_time_ms": 100, "p95_processing_time_ms": 260, "p99_processing_time_ms": 260,
+            "hourly": [
+                {"bucket_start": "2024-01-15T10:00:00+00:00", "total": 3, "success": 3, "failed": 0,
+                 "retry": 0, "pending": 0, "avg_processing_time_ms": 80.0},
+                {"bucket_start": "2024-01-15T11:00:00+00:00", "total": 1, "success": 0, "failed": 1,
+                 "retry": 0, "pending": 0, "avg_processing_time_ms": 260.0}
+            ]
+        })
+        service = WebhookService.__new__(WebhookService)
+        service.supabase = supabase
+        start = datetime(2024, 1, 15, 0, 0, tzinfo=timezone.utc)
+        end = datetime(2024, 1, 16, 0, 0, tzinfo=timezone.utc)
+        
+        stats = await service.get_webhook_stats(merchant_id, start, end)
+        
+        supabase.rpc.assert_called_once_with("get_webhook_stats", {
+            "p_merchant_id": str(merchant_id),
+            "p_start": start.isoformat(),
+            "p_end": end.isoformat()
+        })
+        supabase.table.assert_not_called()
+        assert (stats.total_webhooks, stats.successful_webhooks, stats.failed_webhooks) == (4, 3, 1)
+        assert stats.success_rate_percentage == 75.0
+        assert (stats.p50_processing_time_ms, stats.p95_processing_time_ms) == (100, 260)
+        assert [bucket.total for bucket in stats.hourly] == [3, 1]
+    
+    @pytest.mark.asyncio
+    async def test_empty_window(self):
+        """Test a window without webhooks returns zero counts and no percentiles"""
+        supabase = Mock()
+        supabase.rpc.return_value.execute.return_value = Mock(data={
+            "total": 0, "success": 0, "failed": 0, "retry": 0, "pending": 0, "hourly": []
+        })
+        service = WebhookService.__new__(WebhookService)
+        service.supabase = supabase
+        
+        stats = await service.get_webhook_stats(uuid4(), datetime(2024, 1, 1, tzinfo=timezone.utc), datetime(2024, 1, 2, tzinfo=timezone.utc))
+        
+        assert stats.total_webhooks == 0 and stats.success_rate_percentage == 0
+        assert stats.p99_processing_time_ms is None and stats.hourly == []
+
+
+class TestMerchantCredentialCache:
+    """Test cached, hashed merchant credentials for webhook authentication"""
+    
+    @pytest.fixture(autouse=True)
+    def clear_cache(self):
+        from app.services.merchant_service import merchant_credential_cache
+        merchant_credential_cache.clear()
+        yield
+        merchant_credential_cache.clear()
+    
+    @staticmethod
+    def merchant_supabase(merchant_id, api_key="mk_secret", is_active=True):
+        supabase = Mock()
+        row = {
+            "id": str(merchant_id), "name": "Test Cafe", "business_type": None, "api_key": api_key,
+            "webhook_url": None, "is_active": is_active, "contact_email": None, "contact_phone": None,
+            "address": None, "tax_number": None, "settings": {},
+            "created_at": "2024-01-15T12:00:00+00:00", "updated_at": "2024-01-15T12:00:00+00:00"
+        }
+        supabase.table.return_value.select.return_value.eq.return_value.execute.return_value = Mock(data=[row])
+        supabase.table.return_value.select.return_value.eq.return_value.eq.return_value.execute.return_value = Mock(data=[row])
+        supabase.table.return_value.update.return_value.eq.return_value.execute.return_value = Mock(data=[row])
+        return supabase
+    
+    @pytest.mark.asyncio
+    async def test_steady_state_needs_no_db_call(self):
+        """Test the merchants row is read once and the key is only kept as a hash"""
+        merchant_id = uuid4()
+        supabase = self.merchant_supabase(merchant_id)
+        service = MerchantService(supabase)
+        
+        first = await service.get_merchant_credential(merchant_id)
+        for _ in range(5):
+            credential = await service.get_merchant_credential(merchant_id)
+        
+        assert supabase.table.call_count == 1
+        assert credential is first
+        assert credential.matches("mk_secret") and not credential.matches("mk_wrong")
+        assert not credential.matches(None)
+        assert b"mk_secret" not in credential.key_hash
+    
+    @pytest.mark.asyncio
+    async def test_key_changes_invalidate_the_cache(self):
+        """Test regenerate, update and deactivate drop the cached credential"""
+        merchant_id = uuid4()
+        supabase = self.merchant_supabase(merchant_id)
+        service = MerchantService(supabase)
+        
+        for change in (
+            lambda: service.regenerate_api_key(merchant_id),
+            lambda: service.update_merchant(merchant_id, MerchantUpdate(is_active=False)),
+            lambda: service.deactivate_merchant(merchant_id),
+        ):
+            await service.get_merchant_credential(merchant_id)
+            await change()
+            calls_before = supabase.table.call_count
+            await service.get_merchant_credential(merchant_id)
+            assert supabase.table.call_count == calls_before + 1
+    
+    @pytest.mark.asyncio
+    async def test_ttl_expiry(self):
+        """Test an expired entry is reloaded from the database"""
+        from app.services.merchant_service import MerchantCredentialCache
+        
+        cache = MerchantCredentialCache(ttl_seconds=60)
+        merchant_id = uuid4()
+        with patch("app.utils.ttl_cache.time.monotonic", return_value=1000.0):
+            cache.put(merchant_id, "mk_secret", True)
+        with patch("app.utils.ttl_cache.time.monotonic", return_value=1059.0):
+            assert cache.get(merchant_id) is not None
+        with patch("app.utils.ttl_cache.time.monotonic", return_value=1061.0):
+            assert cache.get(merchant_id) is None
+            assert cache.find_by_api_key("mk_secret") is None
+    
+    @pytest.mark.asyncio
+    async def test_validate_api_key_uses_cache(self):
+        """Test validate_api_key answers from the key-hash index after the first lookup"""
+        merchant_id = uuid4()
+        supabase = self.merchant_supabase(merchant_id)
+        service = MerchantService(supabase)
+        
+        assert await service.validate_api_key("mk_secret") is True
+        calls_after_first = supabase.table.call_count
+        assert await service.validate_api_key("mk_secret") is True
+        assert supabase.table.call_count == calls_after_first
+
+
+
+class TestCustomerMatchCache:
+    """Test cached customer matching and single-statement payment method storage"""
+    
+    fake_supabase = staticmethod(TestWebhookBatchProcessing.fake_supabase)
+    count = staticmethod(TestWebhookBatchProcessing.count)
+    
+    @pytest.mark.asyncio
+    async def test_bulk_match_queries_only_cache_misses(self):
+        """Test matches and misses are cached and not queried again"""
+        user_id = str(uuid4())
+        supabase, _, calls = self.fake_supabase({"users": [{"id": user_id, "email": "known@example.com"}]})
+        matcher = CustomerMatchingService(supabase)
+        infos = [CustomerInfo(email="known@example.com"), CustomerInfo(email="stranger@example.com", card_hash="hash-x")]
+        
+        first = await matcher.match_customers_bulk(infos)
+        second = await matcher.match_customers_bulk(infos)
+        
+        assert [r.matched for r in first] == [r.matched for r in second] == [True, False]
+        assert second[0].user_id == UUID(user_id)
+        assert self.count(calls, "users", "select") == 1
+        assert self.count(calls, "user_payment_methods", "select") == 1
+    
+    @pytest.mark.asyncio
+    async def test_single_match_uses_cache(self):
+        """Test match_customer shares the cache with the bulk matcher"""
+        user_id = str(uuid4())
+        supabase, _, calls = self.fake_supabase({"users": [{"id": user_id, "email": "known@example.com"}]})
+        matcher = CustomerMatchingService(supabase)
+        
+        await matcher.match_customers_bulk([CustomerInfo(email="known@example.com")])
+        result = await matcher.match_customer(CustomerInfo(email="known@example.com"))
+        
+        assert result.matched is True and result.user_id == UUID(user_id)
+        assert self.count(calls, "users", "select") == 1
+    
+    def test_negative_entries_expire_sooner(self):
+        """Test cached misses use the negative TTL and the LRU bound is kept"""
+        cache = CustomerMatchCache(ttl_seconds=300, negative_ttl_seconds=60, max_entries=2)
+        
+        with patch("app.utils.ttl_cache.time.monotonic", return_value=1000.0):
+            cache.put("email", "known@example.com", "user-1")
+            cache.put("email", "stranger@example.com", None)
+        with patch("app.utils.ttl_cache.time.monotonic", return_value=1100.0):
+            assert cache.get("email", "known@example.com") == "user-1"
+            assert cache.get("email", "stranger@example.com") is CACHE_MISS
+            cache.put("card", "hash-1", "user-2")
+            cache.put("card", "hash-2", "user-3")
+            assert cache.get("email", "known@example.com") is CACHE_MISS
+    
+    @pytest.mark.asyncio
+    async def test_store_payment_methods_single_upsert(self):
+        """Test payment methods are stored with one upsert and become matchable without a query"""
+        user_id = uuid4()
+        supabase, store, calls = self.fake_supabase({
+            "user_payment_methods": [{"user_id": str(user_id), "card_hash": "hash-old", "is_active": True}]
+        })
+        matcher = CustomerMatchingService(supabase)
+        
+        stored = await matcher.store_payment_methods([
+            {"user_id": user_id, "card_hash": "hash-old", "card_last_four": "1111"},
+            {"user_id": user_id, "card_hash": "hash-new", "card_last_four": "2222", "card_type": "visa"}
+        ])
+        result = await matcher.match_customer(CustomerInfo(card_hash="hash-new"))
+        
+        assert stored is True
+        assert self.count(calls, "user_payment_methods", "upsert") == 1
+        assert self.count(calls, "user_payment_methods", "select") == 0
+        assert len(store["user_payment_methods"]) == 2
+        assert result.match_method == "card_hash" and result.user_id == user_id
+
 if __name__ == "__main__":
     # Run tests if script is executed directly
     pytest.main([__file__, "-v"]) 
\ No newline at end of file
@@ -91,7 +91,7 @@ class TestDataProcessor:
         processor = DataProcessor()
         
         # Mock dependencies
-        with patch.object(processor.qr_parser, 'parse_qr_data') as mock_parse, \
+        with patch.object(processor.qr_parser, 'parse') as mock_parse, \
              patch.object(processor.data_extractor, 'extract_expenses_from_receipt') as mock_extract, \
              patch.object(processor.data_cleaner, 'clean_receipt_data') as mock_clean_receipt, \
              patch.object(processor.data_cleaner, 'clean_expense_data') as mock_clean_expense, \
@@ -232,7 +232,6 @@ Tarih: 15.01.2024 10:30
 Toplam: 45.75 TRY
 EcoTrack Dijital Fiş
 Receipt ID: {receipt_id}"""
-        
         # Parse it
         parsed_id = generator.parse_receipt_qr(qr_text_data)
         
@@ -250,6 +249,47 @@ Receipt ID: {receipt_id}"""
         
         # Should return None for invalid data
         assert parsed_id is None
+    
+    def test_render_svg_and_png(self):
+        """Test SVG fast path and PNG rendering"""
+        from app.services.qr_generator import QRRenderService, QRImageFormat
+        
+        renderer = QRRenderService(max_workers=1, cache_size=4)
+        
+        svg = renderer.render("https://ecotrack.com/r/1", QRImageFormat.SVG, box_size=5)
+        png = renderer.render("https://ecotrack.com/r/1", QRImageFormat.PNG, box_size=5)
+        
+        assert svg.startswith(b"<svg")
+        assert png.startswith(b"\x89PNG")
+        assert renderer.to_data_uri(png).startswith("data:image/png;base64,")
+    
+    def test_render_cache_is_bounded_lru(self):
+        """Test rendered images are cached and evicted in LRU order"""
+        from app.services.qr_generator import QRRenderService, QRImageFormat
+        
+        renderer = QRRenderService(max_workers=1, cache_size=2)
+        
+        first = renderer.render("a", QRImageFormat.SVG)
+        renderer.render("b", QRImageFormat.SVG)
+        assert renderer.render("a", QRImageFormat.SVG) is first
+        
+        renderer.render("c", QRImageFormat.SVG)  # evicts "b"
+        assert renderer.cache_info()["size"] == 2
+        assert renderer.render("a", QRImageFormat.SVG) is first
+    
+    @pytest.mark.asyncio
+    async def test_render_async_concurrent(self):
+        """Test concurrent async renders produce independent, correct images"""
+        import asyncio
+        from app.services.qr_generator import QRRenderService, QRImageFormat
+        
+        renderer = QRRenderService(max_workers=4, cache_size=0)
+        urls = [f"https://ecotrack.com/r/{i}" for i in range(20)]
+        
+        images = await asyncio.gather(*(renderer.render_async(url, QRImageFormat.SVG) for url in urls))
+        
+        for url, image in zip(urls, images):
+            assert image == renderer.render(url, QRImageFormat.SVG)
 
 class TestAICategorizer:
     """Test AI Categorizer service"""
@@ -547,5 +587,1773 @@ class TestServiceIntegration:
             assert result['expense_data']['total_amount'] == 21.25
             assert result['receipt_data']['merchant_name'] == 'Test Market'
 
+class TestPublicReceiptService:
+    """Test public receipt page rendering and caching"""
+    
+    def _receipt(self):
+        return {
+            'id': str(uuid4()),
+            'merchant_name': '<b>Test Market</b>',
+            'transaction_date': '2025-01-15T10:30:00+00:00',
+            'total_amount': 30.0,
+            'currency': 'TRY',
+            'is_public': True,
+            'expires_at': '2099-01-01T00:00:00+00:00',
+            'updated_at': '2025-01-15T10:30:00+00:00',
+            'expenses': [{
+                'id': str(uuid4()),
+                'expense_items': [
+                    {'description': 'Milk', 'amount': 30.0, 'quantity': 1, 'unit_price': 30.0, 'kdv_rate': 1.0}
+                ]
+            }]
+        }
+    
+    def test_render_receipt_escapes_and_sets_validators(self):
+        """Test template output is escaped and carries ETag/Last-Modified"""
+        from app.services.public_receipt_service import PublicReceiptService
+        
+        service = PublicReceiptService()
+        page = service.render_receipt(self._receipt())
+        body = page.body.decode()
+        
+        assert page.status_code == 200
+        assert '&lt;b&gt;Test Market&lt;/b&gt;' in body
+        assert '{{' not in body and '{%' not in body
+        
+        headers = page.cache_headers()
+        assert headers['ETag'] == page.etag
+        assert headers['Last-Modified'] == 'Wed, 15 Jan 2025 10:30:00 GMT'
+        assert page.is_not_modified({'if-none-match': page.etag})
+        assert page.is_not_modified({'if-modified-since': headers['Last-Modified']})
+        assert not page.is_not_modified({'if-none-match': '"other"'})
+    
+    def test_get_page_cached_until_invalidated(self):
+        """Test pages are served from cache and dropped on claim"""
+        from app.services.public_receipt_service import PublicReceiptService
+        
+        service = PublicReceiptService(ttl_seconds=60)
+        receipt = self._receipt()
+        mock_supabase = Mock()
+        mock_supabase.table.return_value.select.return_value.eq.return_value.eq.return_value.execute.return_value = Mock(data=[receipt])
+        
+        first = service.get_page(receipt['id'], mock_supabase)
+        second = service.get_page(receipt['id'], mock_supabase)
+        
+        assert second is first
+        assert mock_supabase.table.call_count == 1
+        
+        service.invalidate(receipt['id'])
+        mock_supabase.table.return_value.select.return_value.eq.return_value.eq.return_value.execute.return_value = Mock(data=[])
+        
+        assert service.get_page(receipt['id'], mock_supabase).status_code == 404
+
+class TestReceiptCategorizationService:
+    """Test background categorization after a receipt claim"""
+    
+    @pytest.mark.asyncio
+    async def test_job_categorizes_items_and_reports_status(self):
+        """Test job groups category updates and completes"""
+        import asyncio
+        from unittest.mock import AsyncMock
+        from app.services.receipt_categorization_service import (
+            ReceiptCategorizationService,
+            CategorizationJobStatus
+        )
+        
+        mock_loyalty = Mock()
+        mock_loyalty.award_points_for_expense = AsyncMock(return_value={'success': True, 'points_awarded': 35})
+        service = ReceiptCategorizationService(loyalty_service=mock_loyalty)
+        user_id, receipt_id, expense_id = str(uuid4()), str(uuid4()), str(uuid4())
+        
+        mock_supabase = Mock()
+        items = [
+            {'id': 'i1', 'description': 'Ekmek', 'amount': 10.0, 'category_id': None, 'categories': None},
+            {'id': 'i2', 'description': 'Süt', 'amount': 25.0, 'category_id': None, 'categories': None},
+        ]
+        mock_supabase.table.return_value.select.return_value.in_.return_value.execute.return_value = Mock(data=items)
+        mock_supabase.table.return_value.select.return_value.execute.return_value = Mock(data=[{'id': 'cat-food', 'name': 'Food'}])
+        
+        with patch('app.services.receipt_categorization_service.settings') as mock_settings, \
+             patch('app.services.receipt_categorization_service.ai_categorizer') as mock_ai:
+            mock_settings.supabase_admin = mock_supabase
+            mock_ai.categorize_expense = AsyncMock(return_value={'category_name': 'Food', 'confidence': 0.9})
+            
+            job_id = service.submit(user_id, receipt_id, [expense_id], 'Test Market', 35.0)
+            assert service.get_job(job_id, user_id)['status'] == CategorizationJobStatus.PENDING
+            
+            await asyncio.gather(*service._tasks)
+        
+        job = service.get_job(job_id, user_id)
+        assert job['status'] == CategorizationJobStatus.COMPLETED
+        assert job['items_total'] == 2
+        assert job['items_categorized'] == 2
+        assert job['loyalty_points_awarded'] == 35
+        mock_supabase.table.return_value.update.return_value.in_.assert_called_once_with('id', ['i1', 'i2'])
+        
+        # Other users cannot see the job
+        assert service.get_job(job_id, str(uuid4())) is None
+
+class TestQRParserFastPath:
+    """Test QRParser precompiled patterns, classifier and throughput"""
+    
+    def test_classifier_matches_corpus(self):
+        """Test single-pass type detection over the Turkish receipt corpus"""
+        from app.services.qr_parser import QRParser
+        from tests.fixtures.qr_receipt_payloads import TURKISH_RECEIPT_QR_PAYLOADS
+        
+        parser = QRParser()
+        
+        for payload, expected_type in TURKISH_RECEIPT_QR_PAYLOADS:
+            assert parser._identify_qr_type(payload) == expected_type, payload
+    
+    def test_parse_is_synchronous(self):
+        """Test parse() returns data directly and decodes JSON string fields"""
+        from app.services.qr_parser import QRParser
+        
+        parser = QRParser()
+        
+        result = parser.parse('{"firma": "BİM", "toplam": "187,45", "tarih": "15.01.2024 14:32"}')
+        
+        assert result['qr_type'] == 'json'
+        assert result['total_amount'] == 187.45
+        assert result['transaction_date'] == datetime(2024, 1, 15, 14, 32)
+        assert result['parsing_errors'] == []
+    
+    def test_parse_date_fast_paths(self):
+        """Test day-first and ISO dates parse without the dateutil fallback"""
+        from app.services.qr_parser import QRParser
+        
+        parser = QRParser()
+        
+        with patch('app.utils.date_parser.dateutil_parser.parse') as mock_fallback:
+            assert parser._parse_date("15.01.2024 14:32:05") == datetime(2024, 1, 15, 14, 32, 5)
+            assert parser._parse_date("15/01/24") == datetime(2024, 1, 15)
+            assert parser._parse_date("2024-02-03T09:15:00") == datetime(2024, 2, 3, 9, 15)
+            mock_fallback.assert_not_called()
+
+class TestBulkReceiptPipeline:
+    """Test DataProcessor bulk ingestion pipeline"""
+    
+    @staticmethod
+    def _fake_supabase():
+        """Supabase mock that records multi-row inserts and returns rows with ids"""
+        inserts = {}
+        tables = {}
+        
+        def table(name):
+            if name not in tables:
+                query = MagicMock()
+                
+                def insert(rows):
+                    inserts.setdefault(name, []).append(rows)
+                    insert_query = MagicMock()
+                    insert_query.execute.return_value = Mock(
+                        data=[{**row, 'id': str(uuid4())} for row in rows]
+                    )
+                    return insert_query
+                
+                query.insert.side_effect = insert
+                query.select.return_value.execute.return_value = Mock(
+                    data=[{'id': 'cat-food', 'name': 'Food & Dining'}]
+                )
+                tables[name] = query
+            return tables[name]
+        
+        supabase = MagicMock()
+        supabase.table.side_effect = table
+        return supabase, inserts
+    
+    @pytest.mark.asyncio
+    async def test_bulk_pipeline_coalesces_writes_and_dedups_categorization(self):
+        """Test results for every entry, one insert per table and shared categorization"""
+        from app.services.data_processor import DataProcessor
+        
+        processor = DataProcessor()
+        supabase, inserts = self._fake_supabase()
+        receipts = [
+            {
+                'merchant_name': 'Migros',
+                'total_amount': 45.0,
+                'items': [{'item_name': 'Ekmek', 'amount': 15.0}, {'item_name': 'Süt', 'amount': 30.0, 'kdv_rate': 1.0}]
+            }
+            for _ in range(10)
+        ]
+        receipts.append({'qr_data': 'https://ecotrack.com/receipt/abc'})
+        
+        categorization = {
+            'category': 'food', 'category_name': 'Food & Dining', 'confidence': 0.9, 'method': 'rule_based'
+        }
+        with patch.object(processor.ai_categorizer, 'categorize_expense', return_value=categorization) as mock_categorize:
+            results = [
+                result async for result in processor.process_receipts_bulk(
+                    receipts, 'user-1', supabase, write_batch_size=100
+                )
+            ]
+        
+        assert sorted(result['index'] for result in results) == list(range(11))
+        failed = [result for result in results if not result['success']]
+        assert [result['index'] for result in failed] == [10]
+        
+        # Two distinct descriptions at one merchant -> two categorizer calls
+        assert mock_categorize.call_count == 2
+        
+        # Every write batch is one insert per table
+        stored = sum(len(rows) for rows in inserts['receipts'])
+        assert stored == 10
+        assert len(inserts['receipts']) == len(inserts['expenses']) == len(inserts['expense_items'])
+        items = [row for rows in inserts['expense_items'] for row in rows]
+        assert all(row['category_id'] == 'cat-food' for row in items)
+        assert {row['kdv_rate'] for row in items if row['description'] == 'Süt'} == {1.0}
+    
+    @pytest.mark.asyncio
+    async def test_bulk_pipeline_applies_back_pressure(self):
+        """Test a stalled consumer stops upstream stages from running ahead"""
+        import asyncio
+        from app.services.data_processor import DataProcessor
+        
+        processor = DataProcessor()
+        supabase, inserts = self._fake_supabase()
+        receipts = [{'merchant_name': 'BİM', 'total_amount': 10.0} for _ in range(200)]
+        
+        pipeline = processor.process_receipts_bulk(
+            receipts, 'user-1', supabase, queue_size=2, cpu_batch_size=2, write_batch_size=2
+        )
+        first = await pipeline.__anext__()
+        assert first['success']
+        
+        # Give the stages time to run; bounded queues must keep them blocked
+        await asyncio.sleep(0.05)
+        stored = sum(len(rows) for rows in inserts['receipts'])
+        assert stored < 20
+        
+        await pipeline.aclose()
+    
+    @pytest.mark.asyncio
+    async def test_bulk_pipeline_runs_stages_without_workers_on_one(self):
+        """Test a worker count of 0 falls back to one worker instead of hanging the pipeline"""
+        import asyncio
+        from app.services.data_processor import DataProcessor
+        
+        processor = DataProcessor()
+        supabase, inserts = self._fake_supabase()
+        receipts = [{'merchant_name': 'BİM', 'total_amount': 10.0} for _ in range(3)]
+        
+        async def collect():
+            return [
+                result async for result in processor.process_receipts_bulk(
+                    receipts, 'user-1', supabase,
+                    stage_workers={'prepare': 0, 'categorize': 0, 'validate': -1, 'write': 0}
+                )
+            ]
+        
+        results = await asyncio.wait_for(collect(), timeout=5)
+        
+        assert sorted(result['index'] for result in results) == [0, 1, 2]
+        assert sum(len(rows) for rows in inserts['receipts']) == 3
+    
+    @pytest.mark.asyncio
+    async def test_bulk_stage_failure_reports_each_receipt_once(self):
+        """Test a stage raising after passing some jobs on only fails the jobs it did not pass on"""
+        from app.services.data_processor import DataProcessor
+        
+        processor = DataProcessor()
+        supabase, inserts = self._fake_supabase()
+        receipts = [
+            {'qr_data': 'https://ecotrack.com/receipt/abc'},
+            {'merchant_name': 'BİM', 'total_amount': 10.0, 'items': [{'item_name': 'Ekmek', 'amount': 10.0}]},
+            {'merchant_name': 'BİM', 'items': [{'item_name': 'Süt', 'amount': 20.0}]},
+        ]
+        clean_expenses_batch = processor.data_cleaner.clean_expenses_batch
+        
+        def clean_with_broken_last_item(expenses):
+            # The last receipt has no total, so summing its broken item raises after the others moved on
+            cleaned, errors = clean_expenses_batch(expenses)
+            cleaned[-1]['amount'] = None
+            return cleaned, errors
+        
+        with patch.object(processor.data_cleaner, 'clean_expenses_batch', side_effect=clean_with_broken_last_item):
+            results = [
+                result async for result in processor.process_receipts_bulk(receipts, 'user-1', supabase, cpu_batch_size=3)
+            ]
+        
+        assert sorted(result['index'] for result in results) == [0, 1, 2]
+        assert {result['index']: result['success'] for result in results} == {0: False, 1: True, 2: False}
+        assert sum(len(rows) for rows in inserts['receipts']) == 1
+
+class TestDataCleanerBatch:
+    """Test DataCleaner column-wise batch cleaning"""
+    
+    @pytest.mark.asyncio
+    async def test_batch_matches_row_by_row_cleaning(self):
+        """Test clean_expenses_batch gives the same rows as clean_expense_data"""
+        from app.services.data_cleaner import DataCleaner, DataCleaningError
+        from tests.fixtures.expense_rows import messy_expense_rows
+        
+        cleaner = DataCleaner()
+        rows = messy_expense_rows(300)
+        
+        cleaned, errors = cleaner.clean_expenses_batch(rows)
+        
+        for i, row in enumerate(rows):
+            try:
+                expected = await cleaner.clean_expense_data(row)
+            except DataCleaningError:
+                assert cleaned[i] is None and i in errors
+                continue
+            assert cleaned[i] == expected
+    
+    def test_merchant_reverse_index(self):
+        """Test merchant variants resolve through the reverse index"""
+        from app.services.data_cleaner import DataCleaner
+        
+        cleaner = DataCleaner()
+        
+        assert cleaner.merchant_index['carrefour sa'] == 'Carrefour'
+        assert cleaner.clean_merchant_column(
+            ['CarrefourSA', 'Migros Kadıköy', 'Şok Market', 'Yerel Bakkal']
+        ) == ['Carrefour', 'Migros', 'Şok', 'Yerel Bakkal']
+
+class TestDateParser:
+    """Test shared date parser"""
+    
+    def test_supabase_timestamps(self):
+        """Test ISO fast path with Z suffix and nanosecond precision"""
+        from datetime import timezone
+        from app.utils.date_parser import DateParser
+        
+        parser = DateParser()
+        
+        parsed = parser.parse_datetime("2024-01-15T10:30:45.123456789Z")
+        
+        assert parsed == datetime(2024, 1, 15, 10, 30, 45, 123456, tzinfo=timezone.utc)
+        assert parser.parse_datetime("2024-01-15T10:30:45.5+03:00").microsecond == 500000
+        assert parser.format_hits['iso'] == 2
+    
+    def test_turkish_formats_and_format_cache(self):
+        """Test day-first / month-name formats and last-successful-format ordering"""
+        from app.utils.date_parser import DateParser
+        
+        parser = DateParser()
+        
+        assert parser.parse_datetime("15.01.2024 14:30") == datetime(2024, 1, 15, 14, 30)
+        assert parser.parse_datetime("15 Ocak 2024") == datetime(2024, 1, 15)
+        assert parser.formats[parser._last_format][0] == 'month_name'
+        assert parser.parse_datetime("3 Şubat 24") == datetime(2024, 2, 3)
+        assert parser.parse_datetime("not a date", fallback=False) is None
+    
+    def test_batch_parse(self):
+        """Test batch API parses each distinct value once"""
+        from datetime import date
+        from app.utils.date_parser import DateParser
+        
+        parser = DateParser()
+        values = ["2024-03-01", "01/03/2024", None, "2024-03-01"] * 250
+        
+        with patch.object(parser, 'parse_datetime', wraps=parser.parse_datetime) as mock_parse:
+            parsed = parser.parse_dates(values)
+        
+        assert mock_parse.call_count == 3
+        assert parsed[:4] == [date(2024, 3, 1), date(2024, 3, 1), None, date(2024, 3, 1)]
+    
+    def test_service_wrappers_use_shared_parser(self):
+        """Test service date helpers keep their return contracts"""
+        from datetime import timezone
+        from app.services.data_cleaner import DataCleaner
+        from app.services.loyalty_service import LoyaltyService
+        
+        assert DataCleaner()._clean_date("06.05.2024") == "2024-05-06T00:00:00"
+        
+        loyalty_service = LoyaltyService.__new__(LoyaltyService)
+        assert loyalty_service._safe_parse_datetime("2024-05-06T10:00:00").tzinfo == timezone.utc
+        assert loyalty_service._safe_parse_datetime("2024-05-06T23:10:00.1234567+00:00").microsecond == 123456
+
+
+class TestKDVCalculator:
+    """Test integer-kuruş KDV kernel and batch API"""
+    
+    def test_to_kurus_rounds_half_up_on_decimal_value(self):
+        """Test kuruş conversion decides ties on the decimal value, not the binary float"""
+        from decimal import Decimal
+        from app.utils.kdv_calculator import to_kurus, from_kurus
+        
+        assert to_kurus(1.005) == 101
+        assert to_kurus(0.125) == 13
+        assert to_kurus(-1.005) == -101
+        assert to_kurus(0.1 + 0.2) == 30
+        assert to_kurus("12.345") == 1235
+        assert to_kurus(Decimal("19.99")) == 1999
+        assert to_kurus(7) == 700
+        assert from_kurus(1999) == 19.99
+        
+        with pytest.raises(ValueError):
+            to_kurus("abc")
+    
+    def test_breakdown_is_exact(self):
+        """Test net + KDV always equals the gross amount"""
+        import random
+        from app.utils.kdv_calculator import KDVCalculator, to_kurus
+        
+        assert KDVCalculator.get_kdv_breakdown(100.0, 20.0) == {
+            'total_amount': 100.0, 'kdv_rate': 20.0, 'kdv_amount': 16.67, 'amount_without_kdv': 83.33
+        }
+        assert KDVCalculator.calculate_total_with_kdv(83.33, 20.0) == 100.0
+        
+        random.seed(7)
+        amounts = [round(random.uniform(0, 5000), 2) for _ in range(5000)]
+        rates = [random.choice(KDVCalculator.VALID_KDV_RATES) for _ in amounts]
+        
+        for breakdown in KDVCalculator.get_kdv_breakdown_batch(amounts, rates):
+            assert to_kurus(breakdown['kdv_amount']) + to_kurus(breakdown['amount_without_kdv']) == \
+                to_kurus(breakdown['total_amount'])
+        
+        with pytest.raises(ValueError):
+            KDVCalculator.calculate_kdv_amount(100.0, 18.0)
+    
+    def test_batch_matches_single_value_api(self):
+        """Test batch breakdowns equal per-item get_kdv_breakdown"""
+        from app.utils.kdv_calculator import KDVCalculator
+        
+        amounts = [10.0, 12.5, 0.01, 999.99, 49.95]
+        rates = [1.0, 10.0, 20.0, 20.0, 10.0]
+        
+        assert KDVCalculator.get_kdv_breakdown_batch(amounts, rates) == [
+            KDVCalculator.get_kdv_breakdown(amount, rate) for amount, rate in zip(amounts, rates)
+        ]
+        assert len(KDVCalculator.get_kdv_breakdown_batch(amounts, 20.0)) == 5
+        
+        with pytest.raises(ValueError):
+            KDVCalculator.get_kdv_breakdown_batch(amounts, rates[:2])
+    
+    def test_summary_groups_by_rate(self):
+        """Test KDV is computed once per rate group on the summed gross"""
+        from app.utils.kdv_calculator import KDVCalculator
+        
+        # 3 x 0.03 at 20%: per line 0.005 rounds up to 0.01 each, the 0.09 group gives 0.015 -> 0.02
+        summary = KDVCalculator.summarize_kdv_by_rate([0.03, 0.03, 0.03, 10.0], [20.0, 20.0, 20.0, 1.0])
+        
+        assert summary['kdv_by_rate'][20.0] == {
+            'total_amount': 0.09, 'kdv_amount': 0.02, 'amount_without_kdv': 0.07, 'item_count': 3
+        }
+        assert summary['kdv_by_rate'][1.0]['kdv_amount'] == 0.1
+        assert summary['total_amount'] == 10.09
+        assert summary['total_kdv'] == 0.12
+        assert summary['total_without_kdv'] == 9.97
+        
+        assert KDVCalculator.calculate_mixed_kdv_total(
+            [{'amount': 0.03, 'kdv_rate': 20.0}] * 3 + [{'amount': 10.0, 'kdv_rate': 1.0}]
+        ) == summary
+    
+    def test_reporting_kdv_summary(self):
+        """Test reporting KDV summary response built from expense item rows"""
+        from datetime import date
+        from app.services.reporting_service import ReportingService
+        
+        reporting_service = ReportingService.__new__(ReportingService)
+        items = [
+            {"amount": 450.0, "kdv_rate": 1.0},
+            {"amount": 500.0, "kdv_rate": 20.0},
+            {"amount": 300.0, "kdv_rate": None},
+        ]
+        
+        report = reporting_service.build_kdv_summary(items, date(2025, 1, 1), date(2025, 1, 31))
+        
+        assert report["totalAmount"] == 1250.0
+        assert report["totalKdv"] == 137.79
+        assert report["totalWithoutKdv"] == 1112.21
+        assert [row["kdvRate"] for row in report["data"]] == [1.0, 20.0]
+        assert report["data"][1] == {
+            "kdvRate": 20.0, "totalAmount": 800.0, "kdvAmount": 133.33, "amountWithoutKdv": 666.67, "itemCount": 2
+        }
+
+
+class TestReceiptLexer:
+    """Test single-pass receipt text lexer"""
+    
+    def test_corpus_items(self):
+        """Test items assembled from tokens match the corpus"""
+        from app.utils.receipt_lexer import ReceiptLexer
+        from tests.fixtures.receipt_text_corpus import RECEIPT_TEXT_SAMPLES
+        
+        lexer = ReceiptLexer()
+        
+        for text, expected in RECEIPT_TEXT_SAMPLES:
+            items = lexer.extract_items(text)
+            assert [(item.description, item.amount, item.quantity) for item in items] == expected
+    
+    def test_tokenize(self):
+        """Test each line is split into typed tokens once"""
+        from app.utils.receipt_lexer import ReceiptLexer
+        
+        assert ReceiptLexer.tokenize("2 x SÜT 1L %01 *1.234,50 TL") == [
+            ('quantity', '2'), ('word', 'SÜT'), ('unit', '1L'), ('percent', '%01'),
+            ('price', '1.234,50'), ('currency', 'TL')
+        ]
+        assert ReceiptLexer.tokenize("15.01.2024 14:32") == [
+            ('number', '15'), ('number', '01'), ('number', '2024'), ('number', '14'), ('number', '32')
+        ]
+    
+    def test_work_caps(self):
+        """Test per-receipt caps on lines and items"""
+        from app.utils.receipt_lexer import ReceiptLexer
+        
+        text = "\n".join(f"EKMEK {i},50" for i in range(1, 101))
+        
+        assert len(ReceiptLexer(max_items=10).extract_items(text)) == 10
+        assert len(ReceiptLexer(max_lines=25).extract_items(text)) == 25
+        assert len(ReceiptLexer(max_chars=24).extract_items(text)) == 2
+    
+    def test_adversarial_and_fuzz_input(self):
+        """Test pathological lines and random text lex quickly without errors"""
+        import time
+        from app.utils.receipt_lexer import ReceiptLexer
+        from tests.fixtures.receipt_text_corpus import ADVERSARIAL_LINES, random_receipt_text
+        
+        lexer = ReceiptLexer()
+        
+        started = time.perf_counter()
+        for line in ADVERSARIAL_LINES:
+            lexer.extract_items(line)
+        assert time.perf_counter() - started < 0.5
+        
+        for seed in range(200):
+            for item in lexer.extract_items(random_receipt_text(seed)):
+                assert item.amount > 0
+                assert item.quantity >= 0
+                assert item.description
+    
+    def test_lexer_throughput(self):
+        """Benchmark: receipts lexed per second on the fuzz corpus"""
+        import time
+        from app.utils.receipt_lexer import ReceiptLexer
+        from tests.fixtures.receipt_text_corpus import random_receipt_text
+        
+        lexer = ReceiptLexer()
+        receipts = [random_receipt_text(seed) for seed in range(300)]
+        
+        started = time.perf_counter()
+        for text in receipts:
+            lexer.extract_items(text)
+        elapsed = time.perf_counter() - started
+        
+        assert len(receipts) / elapsed > 100
+    
+    @pytest.mark.asyncio
+    async def test_data_extractor_uses_lexer(self):
+        """Test DataExtractor builds expenses from lexed raw QR text"""
+        from app.services.data_extractor import DataExtractor
+        
+        extractor = DataExtractor()
+        expenses = await extractor.extract_expenses_from_receipt({
+            'raw_qr_data': "2 x EKMEK 10,00\nTOPLAM 10,00",
+            'transaction_date': datetime(2024, 1, 15),
+        })
+        
+        assert len(expenses) == 1
+        assert expenses[0]['description'] == 'Ekmek'
+        assert expenses[0]['amount'] == 10.0
+        assert expenses[0]['quantity'] == 2
+        assert expenses[0]['unit_price'] == 5.0
+
+
+class TestBufferedLogSink:
+    """Test buffered audit log writer"""
+    
+    @staticmethod
+    def fake_supabase(fail=False, fail_updates=0):
+        """Records every upsert/update call per table; the first fail_updates updates raise"""
+        calls = []
+        update_failures = [fail_updates]
+        
+        def table(name):
+            def upsert(rows, on_conflict=None):
+                calls.append((name, "upsert", [dict(row) for row in rows]))
+                if fail:
+                    return Mock(execute=Mock(side_effect=Exception("database unavailable")))
+                return Mock(execute=Mock(return_value=Mock(data=rows)))
+            
+            def update(changes):
+                def execute(value):
+                    if update_failures[0] > 0:
+                        update_failures[0] -= 1
+                        raise Exception("database unavailable")
+                    calls.append((name, "update", (value, changes)))
+                
+                query = Mock()
+                query.eq.side_effect = lambda column, value: Mock(execute=lambda: execute(value))
+                return query
+            
+            return Mock(upsert=Mock(side_effect=upsert), update=Mock(side_effect=update))
+        
+        supabase = Mock()
+        supabase.table.side_effect = table
+        return supabase, calls
+    
+    def test_write_through_when_not_started(self):
+        """Test records are written immediately when the flush loop is not running"""
+        from app.core.log_sink import BufferedLogSink
+        
+        supabase, calls = self.fake_supabase()
+        sink = BufferedLogSink(supabase_factory=lambda: supabase)
+        
+        log_id = sink.add("webhook_logs", {"status": "pending"})
+        sink.update("webhook_logs", log_id, {"status": "success"})
+        
+        assert [(table, action) for table, action, _ in calls] == [("webhook_logs", "upsert"), ("webhook_logs", "update")]
+        assert calls[0][2][0]["id"] == str(log_id)
+        assert sink.depth == 0
+    
+    @pytest.mark.asyncio
+    async def test_attempt_and_result_coalesce_into_one_row(self):
+        """Test an update of a buffered record is merged and flushed with it on stop"""
+        from app.core.log_sink import BufferedLogSink
+        
+        supabase, calls = self.fake_supabase()
+        sink = BufferedLogSink(flush_interval=60, supabase_factory=lambda: supabase)
+        await sink.start()
+        
+        ids = [sink.add("webhook_logs", {"status": "pending", "transaction_id": f"TXN-{i}"}) for i in range(5)]
+        for log_id in ids:
+            sink.update("webhook_logs", log_id, {"status": "success", "processing_time_ms": 12})
+        sink.add("notification_logs", {"title": "Hi"})
+        assert calls == [] and sink.depth == 6
+        
+        await sink.stop()
+        
+        upserts = {table: rows for table, action, rows in calls if action == "upsert"}
+        assert len(calls) == 2
+        assert [row["status"] for row in upserts["webhook_logs"]] == ["success"] * 5
+        assert len(upserts["notification_logs"]) == 1
+        metrics = sink.get_metrics()
+        assert metrics["records_written"] == 6 and metrics["buffer_depth"] == 0
+        assert metrics["flushes"] == 1 and metrics["last_flush_ms"] is not None
+    
+    @pytest.mark.asyncio
+    async def test_size_threshold_triggers_flush(self):
+        """Test reaching max_batch wakes the flush loop before the interval"""
+        import asyncio
+        from app.core.log_sink import BufferedLogSink
+        
+        supabase, calls = self.fake_supabase()
+        sink = BufferedLogSink(max_batch=3, flush_interval=60, supabase_factory=lambda: supabase)
+        await sink.start()
+        try:
+            for i in range(3):
+                sink.add("notification_logs", {"title": f"T{i}"})
+            for _ in range(10):
+                if calls:
+                    break
+                await asyncio.sleep(0.01)
+            assert len(calls) == 1 and len(calls[0][2]) == 3
+        finally:
+            await sink.stop()
+    
+    @pytest.mark.asyncio
+    async def test_rows_grouped_by_columns(self):
+        """Test rows with different key sets are sent in separate upserts"""
+        from app.core.log_sink import BufferedLogSink
+        
+        supabase, calls = self.fake_supabase()
+        sink = BufferedLogSink(flush_interval=60, supabase_factory=lambda: supabase)
+        await sink.start()
+        sink.add("webhook_logs", {"status": "pending"})
+        sink.add("webhook_logs", {"status": "pending"})
+        sink.add("webhook_logs", {"status": "failed", "error_message": "boom"})
+        await sink.stop()
+        
+        assert sorted(len(rows) for _, _, rows in calls) == [1, 2]
+        for _, _, rows in calls:
+            assert len({tuple(sorted(row)) for row in rows}) == 1
+    
+    @pytest.mark.asyncio
+    async def test_full_buffer_and_failed_flush_drop_records(self):
+        """Test overflow and repeatedly failing flushes are counted as dropped"""
+        from app.core.log_sink import BufferedLogSink, MAX_FLUSH_ATTEMPTS
+        
+        supabase, calls = self.fake_supabase(fail=True)
+        sink = BufferedLogSink(max_buffer=2, flush_interval=60, supabase_factory=lambda: supabase)
+        await sink.start()
+        for i in range(3):
+            sink.add("notification_logs", {"title": f"T{i}"})
+        assert sink.get_metrics()["records_dropped"] == 1
+        
+        for _ in range(MAX_FLUSH_ATTEMPTS - 1):
+            sink.flush_now()
+            assert sink.depth == 2
+        sink.flush_now()
+        await sink.stop()
+        
+        metrics = sink.get_metrics()
+        assert metrics["buffer_depth"] == 0
+        assert metrics["records_dropped"] == 3
+        assert metrics["failed_flushes"] == MAX_FLUSH_ATTEMPTS
+    
+    @pytest.mark.asyncio
+    async def test_failed_late_update_is_retried_in_order(self):
+        """Test an update of a written record that fails to flush is retried before later updates"""
+        from app.core.log_sink import BufferedLogSink
+        
+        supabase, calls = self.fake_supabase(fail_updates=1)
+        sink = BufferedLogSink(flush_interval=60, supabase_factory=lambda: supabase)
+        await sink.start()
+        log_id = sink.add("webhook_logs", {"status": "pending"})
+        sink.flush_now()
+        
+        sink.update("webhook_logs", log_id, {"status": "failed"})
+        sink.flush_now()
+        assert sink.depth == 1
+        sink.update("webhook_logs", log_id, {"status": "retry"})
+        await sink.stop()
+        
+        updates = [payload[1] for _, action, payload in calls if action == "update"]
+        assert updates == [{"status": "failed"}, {"status": "retry"}]
+        assert sink.get_metrics()["records_dropped"] == 0
+
+
+
+class TestNotificationService:
+    """Test pooled, multicast FCM dispatch against the fake FCM server"""
+    
+    def setup_method(self):
+        """Setup test fixtures"""
+        from app.core.notifications import NotificationService, DeviceTokenCache
+        from tests.fixtures.fake_fcm import FakeFCMServer
+        
+        self.server = FakeFCMServer()
+        self.devices = []
+        self.supabase = Mock()
+        self.select = self.supabase.table.return_value.select.return_value.in_.return_value.eq.return_value.order.return_value
+        self.select.execute.side_effect = lambda: Mock(data=[d for d in self.devices if d["is_active"]])
+        self.service = NotificationService(
+            transport=self.server.transport,
+            supabase_factory=lambda: self.supabase,
+            token_cache=DeviceTokenCache(ttl_seconds=600)
+        )
+        self.service.fcm_server_key = self.server.server_key
+    
+    @pytest.mark.asyncio
+    async def test_bulk_notification_uses_bounded_multicast(self):
+        """Test fan-out is split into multicast requests with bounded concurrency on one client"""
+        from app.core.notifications import NotificationType
+        
+        self.server.latency = 0.01
+        user_ids = [f"user-{i}" for i in range(25)]
+        self.devices.extend({"user_id": user_id, "fcm_token": f"token-{user_id}", "is_active": True} for user_id in user_ids[:20])
+        self.service.multicast_size = 3
+        self.service.max_concurrency = 2
+        
+        with patch("app.core.notifications.log_sink") as sink:
+            results = await self.service.send_bulk_notification(user_ids, "Title", "Body", NotificationType.SAVINGS_TIP)
+            client = self.service.client
+            await self.service.send_notification(user_ids[0], "Title", "Body", NotificationType.SAVINGS_TIP)
+        
+        assert sum(results.values()) == 20 and not any(results[u] for u in user_ids[20:])
+        assert len(self.server.requests) == 8  # 7 multicast batches + 1 single send
+        assert all(len(r["registration_ids"]) <= 3 for r in self.server.requests[:7])
+        assert self.server.max_in_flight == 2
+        assert self.service.client is client
+        assert sink.add.call_count == 21
+        await self.service.aclose()
+    
+    @pytest.mark.asyncio
+    async def test_tokens_are_cached_and_invalid_tokens_pruned(self):
+        """Test device tokens are queried once and NotRegistered tokens are deactivated"""
+        from app.core.notifications import NotificationType, TOKEN_MISS
+        
+        self.devices.extend([
+            {"user_id": "user-1", "fcm_token": "token-good", "is_active": True},
+            {"user_id": "user-2", "fcm_token": "token-stale", "is_active": True}
+        ])
+        self.server.invalid_tokens = {"token-stale"}
+        
+        with patch("app.core.notifications.log_sink"):
+            first = await self.service.send_bulk_notification(["user-1", "user-2"], "Title", "Body", NotificationType.WEEKLY_SUMMARY)
+            second = await self.service.send_notification("user-1", "Title", "Body", NotificationType.WEEKLY_SUMMARY)
+        
+        assert first == {"user-1": True, "user-2": False} and second is True
+        assert self.select.execute.call_count == 1
+        self.supabase.table.return_value.update.assert_called_once_with({"is_active": False})
+        self.supabase.table.return_value.update.return_value.in_.assert_called_once_with("fcm_token", ["token-stale"])
+        assert self.service.token_cache.get("user-2") is TOKEN_MISS
+        assert self.service.token_cache.get("user-1") == "token-good"
+        await self.service.aclose()
+    
+    def test_device_token_cache_invalidation(self):
+        """Test device changes drop the cached token, including negative entries"""
+        from app.core.notifications import DeviceTokenCache, TOKEN_MISS
+        
+        cache = DeviceTokenCache(ttl_seconds=600, max_entries=2)
+        cache.put("user-1", "token-1")
+        cache.put("user-2", None)
+        
+        assert cache.get("user-2") is None
+        cache.invalidate("user-2")
+        assert cache.get("user-2") is TOKEN_MISS
+        
+        cache.put("user-3", "token-3")
+        cache.put("user-4", "token-4")
+        assert cache.get("user-1") is TOKEN_MISS
+
+
+
+class TestNotificationDigestService:
+    """Test paged, checkpointed weekly summary fan-out"""
+    
+    def setup_method(self):
+        """Setup test fixtures"""
+        self.rows = []
+        # notification_job_runs rows by (job_name, period_key)
+        self.runs = {}
+        self.saved = []
+        self.rpc_calls = []
+        self.fail_after_pages = None
+        self.supabase = Mock()
+        self.supabase.rpc.side_effect = self.rpc
+        self.supabase.table.return_value.select.side_effect = self.select
+        self.supabase.table.return_value.update.side_effect = self.update
+        self.notifier = self.create_notifier()
+        self.service = self.create_digest(self.notifier)
+    
+    def create_digest(self, notifier):
+        """Digest service on the shared fake; a second one models another process"""
+        from app.services.notification_digest_service import NotificationDigestService
+        return NotificationDigestService(notifier=notifier, supabase_factory=lambda: self.supabase, batch_size=2)
+    
+    @staticmethod
+    def create_notifier():
+        from unittest.mock import AsyncMock
+        
+        notifier = Mock()
+        notifier.fcm_server_key = "test-key"
+        notifier.send_notifications = AsyncMock(side_effect=lambda messages: [True for _ in messages])
+        notifier.weekly_summary_message.side_effect = lambda user_id, total, top: {"user_id": user_id, "total": total, "top": top}
+        return notifier
+    
+    def acquire(self, params):
+        key = (params["p_job_name"], params["p_period_key"])
+        run = self.runs.setdefault(key, {
+            "job_name": key[0], "period_key": key[1], "status": "running", "last_user_id": None,
+            "users_processed": 0, "notifications_sent": 0, "notifications_failed": 0
+        })
+        if run["status"] == "completed" or run.get("locked_by") not in (None, params["p_owner"]):
+            return []
+        run["locked_by"] = params["p_owner"]
+        return [dict(run)]
+    
+    def rpc(self, name, params):
+        if name == "acquire_notification_job_lease":
+            return Mock(execute=Mock(return_value=Mock(data=self.acquire(params))))
+        self.rpc_calls.append((name, params))
+        if self.fail_after_pages is not None and len(self.rpc_calls) > self.fail_after_pages:
+            raise Exception("connection lost")
+        after = params["p_after"]
+        page = [row for row in self.rows if after is None or row["user_id"] > after][:params["p_limit"]]
+        return Mock(execute=Mock(return_value=Mock(data=page)))
+    
+    def select(self, *_):
+        query = Mock()
+        query.eq.return_value.eq.side_effect = lambda column, period_key: Mock(execute=lambda: Mock(data=[
+            dict(run) for key, run in self.runs.items() if key[1] == period_key
+        ]))
+        return query
+    
+    def update(self, fields):
+        def execute(job_name, period_key, owner):
+            run = self.runs.get((job_name, period_key))
+            if run is None or run.get("locked_by") != owner:
+                return Mock(data=[])
+            run.update(fields)
+            self.saved.append(dict(run))
+            return Mock(data=[dict(run)])
+        
+        query = Mock()
+        query.eq.side_effect = lambda _, job_name: Mock(eq=Mock(side_effect=lambda _, period_key: Mock(
+            eq=Mock(side_effect=lambda _, owner: Mock(execute=lambda: execute(job_name, period_key, owner)))
+        )))
+        return query
+    
+    @pytest.mark.asyncio
+    async def test_weekly_summaries_are_paged_and_checkpointed(self):
+        """Test users are processed page by page with a checkpoint after each page"""
+        from datetime import date
+        
+        self.rows = [
+            {"user_id": "u1", "total_spent": "120.50", "top_category": "Food"},
+            {"user_id": "u2", "total_spent": "0", "top_category": None},
+            {"user_id": "u3", "total_spent": "40", "top_category": None}
+        ]
+        
+        result = await self.service.send_weekly_summaries(today=date(2024, 1, 17))
+        
+        assert result["status"] == "completed" and result["period"] == "2024-W02"
+        assert result["users_processed"] == 3 and result["notifications_sent"] == 2
+        assert self.rpc_calls[0][1]["p_start"] == "2024-01-08" and self.rpc_calls[0][1]["p_end"] == "2024-01-15"
+        assert [call[1]["p_after"] for call in self.rpc_calls] == [None, "u2"]
+        sent = [m for call in self.notifier.send_notifications.call_args_list for m in call.args[0]]
+        assert [(m["user_id"], m["top"]) for m in sent] == [("u1", "Food"), ("u3", "Diğer")]
+        assert [s["last_user_id"] for s in self.saved] == ["u2", "u3", "u3"]
+        assert self.saved[-1]["status"] == "completed"
+    
+    @pytest.mark.asyncio
+    async def test_interrupted_run_resumes_from_checkpoint(self):
+        """Test a failed run keeps its checkpoint and the next run continues after it"""
+        from datetime import date
+        
+        self.rows = [{"user_id": f"u{i}", "total_spent": "50", "top_category": "Food"} for i in range(1, 6)]
+        self.fail_after_pages = 1
+        
+        with pytest.raises(Exception):
+            await self.service.send_weekly_summaries(today=date(2024, 1, 17))
+        checkpoint = self.saved[-1]
+        assert checkpoint["status"] == "running" and checkpoint["last_user_id"] == "u2"
+        
+        # The crashed run's lease has expired and another process picks the period up
+        self.runs[("weekly_summary", "2024-W02")]["locked_by"] = None
+        self.fail_after_pages = None
+        self.rpc_calls.clear()
+        notifier = self.create_notifier()
+        result = await self.create_digest(notifier).send_weekly_summaries(today=date(2024, 1, 17))
+        
+        assert result["resumed"] is True and result["status"] == "completed"
+        assert self.rpc_calls[0][1]["p_after"] == "u2"
+        assert result["users_processed"] == 5 and result["notifications_sent"] == 5
+        sent = [m["user_id"] for call in notifier.send_notifications.call_args_list for m in call.args[0]]
+        assert sent == ["u3", "u4", "u5"]
+    
+    @pytest.mark.asyncio
+    async def test_period_leased_by_another_run_is_skipped(self):
+        """Test a second process does not send a period while the first holds its lease"""
+        from datetime import date
+        
+        self.rows = [{"user_id": f"u{i}", "total_spent": "50", "top_category": "Food"} for i in range(1, 4)]
+        second_notifier = self.create_notifier()
+        second = self.create_digest(second_notifier)
+        
+        async def send_while_other_runs(messages):
+            # The second process ticks while the first is sending its first page
+            assert (await second.send_weekly_summaries(today=date(2024, 1, 17)))["status"] == "locked"
+            return [True for _ in messages]
+        
+        self.notifier.send_notifications.side_effect = send_while_other_runs
+        result = await self.service.send_weekly_summaries(today=date(2024, 1, 17))
+        
+        assert result["status"] == "completed" and result["notifications_sent"] == 3
+        # Only the first process read pages
+        assert [call[1]["p_after"] for call in self.rpc_calls] == [None, "u2"]
+        assert second_notifier.send_notifications.call_count == 0
+        assert self.runs[("weekly_summary", "2024-W02")]["locked_until"] is None
+    
+    @pytest.mark.asyncio
+    async def test_completed_period_is_not_sent_again(self):
+        """Test a completed week is a no-op"""
+        from datetime import date
+        
+        checkpoint = {
+            "job_name": "weekly_summary", "period_key": "2024-W02", "status": "completed", "last_user_id": "u3",
+            "users_processed": 3, "notifications_sent": 2, "notifications_failed": 0
+        }
+        self.runs[("weekly_summary", "2024-W02")] = checkpoint
+        
+        result = await self.service.send_weekly_summaries(today=date(2024, 1, 17))
+        
+        assert result["status"] == "completed" and result["resumed"] is False
+        assert self.rpc_calls == [] and self.notifier.send_notifications.call_count == 0
+    
+    @pytest.mark.asyncio
+    async def test_send_notifications_personalized_bulk(self):
+        """Test personalized messages share one token lookup and report per-message results"""
+        from app.core.notifications import NotificationService, DeviceTokenCache
+        from tests.fixtures.fake_fcm import FakeFCMServer
+        
+        server = FakeFCMServer()
+        supabase = Mock()
+        select = supabase.table.return_value.select.return_value.in_.return_value.eq.return_value.order.return_value
+        select.execute.return_value = Mock(data=[{"user_id": "u1", "fcm_token": "token-1"}])
+        service = NotificationService(transport=server.transport, supabase_factory=lambda: supabase, token_cache=DeviceTokenCache())
+        service.fcm_server_key = server.server_key
+        
+        with patch("app.core.notifications.log_sink"):
+            results = await service.send_notifications([
+                service.weekly_summary_message("u1", 120.5, "Food"),
+                service.budget_alert_message("u1", "Food", 91.5),
+                service.budget_alert_message("u2", "Food", 85.0)
+            ])
+        
+        assert results == [True, True, False]
+        assert select.execute.call_count == 1
+        assert [r["data"]["type"] for r in server.requests] == ["weekly_summary", "budget_alert"]
+        await service.aclose()
+
+
+
+class TestLoyaltyAccrual:
+    """Test atomic loyalty accrual through the accrue_loyalty_points function"""
+    
+    def setup_method(self):
+        """Setup test fixtures"""
+        from app.services.loyalty_service import LoyaltyService
+        
+        self.admin = Mock()
+        self.admin.rpc.return_value.execute.return_value = Mock(data=[])
+        with patch("app.services.loyalty_service.get_supabase_client", return_value=Mock()), \
+             patch("app.services.loyalty_service.get_supabase_admin_client", return_value=self.admin):
+            self.service = LoyaltyService()
+    
+    @pytest.mark.asyncio
+    async def test_batch_accrual_is_one_rpc(self):
+        """Test many expenses accrue in one call and results come back in input order"""
+        from app.schemas.loyalty import LoyaltyLevel
+        
+        rows = [
+            {"idx": 1, "points_awarded": 26, "previous_total": 990, "new_total": 1016, "previous_level": "bronze",
+             "new_level": "silver", "calculation_details": {"level_bonus": 0}, "transaction_id": "tx-2"},
+            {"idx": 0, "points_awarded": 10, "previous_total": 980, "new_total": 990, "previous_level": "bronze",
+             "new_level": "bronze", "calculation_details": {"level_bonus": 0}, "transaction_id": "tx-1"}
+        ]
+        self.admin.rpc.return_value.execute.return_value = Mock(data=rows)
+        
+        results = await self.service.award_points_for_expenses([
+            {"user_id": "u1", "expense_id": "e1", "amount": 100.0},
+            {"user_id": "u1", "expense_id": "e2", "amount": 200.0, "category": "Grocery", "merchant_name": "Migros"}
+        ])
+        
+        self.admin.rpc.assert_called_once()
+        name, params = self.admin.rpc.call_args.args
+        assert name == "accrue_loyalty_points"
+        assert [(a["idx"], a["base_points"], a["category_bonus"]) for a in params["p_accruals"]] == [(0, 10, 0), (1, 20, 6)]
+        assert {rule["level"]: rule["min_points"] for rule in params["p_levels"]}["silver"] == 1000
+        assert [r["transaction_id"] for r in results] == ["tx-1", "tx-2"]
+        assert results[1]["new_level"] == LoyaltyLevel.SILVER and results[1]["level_changed"] is True
+        assert results[0]["level_changed"] is False
+        self.admin.table.assert_not_called()
+    
+    @pytest.mark.asyncio
+    async def test_single_award_uses_batch_function(self):
+        """Test award_points_for_expense keeps its result shape without reading status first"""
+        rows = [{"idx": 0, "points_awarded": 5, "previous_total": 0, "new_total": 5, "previous_level": "bronze",
+                 "new_level": "bronze", "calculation_details": {}, "transaction_id": "tx-1"}]
+        self.admin.rpc.return_value.execute.return_value = Mock(data=rows)
+        
+        result = await self.service.award_points_for_expense("u1", "e1", 50.0)
+        
+        assert result["success"] is True and result["points_awarded"] == 5 and result["new_total"] == 5
+        assert self.admin.rpc.call_count == 1
+        self.admin.table.assert_not_called()
+    
+    @pytest.mark.asyncio
+    async def test_incomplete_accrual_raises(self):
+        """Test a result count mismatch is reported as a failure"""
+        with pytest.raises(Exception):
+            await self.service.award_points_for_expense("u1", "e1", 50.0)
+
+
+
+class TestLoyaltyStatusCache:
+    """Test cached loyalty status and set-based level recomputation"""
+    
+    @pytest.fixture(autouse=True)
+    def clear_cache(self):
+        from app.services.loyalty_service import loyalty_status_cache
+        loyalty_status_cache.clear()
+        yield
+        loyalty_status_cache.clear()
+    
+    def setup_method(self):
+        """Setup test fixtures"""
+        from app.services.loyalty_service import LoyaltyService
+        
+        self.admin = Mock()
+        self.admin.table.return_value.select.return_value.eq.return_value.execute.return_value = Mock(data=[
+            {"user_id": "u1", "points": 1200, "level": "silver", "last_updated": "2024-01-15T12:00:00Z"}
+        ])
+        with patch("app.services.loyalty_service.get_supabase_client", return_value=Mock()), \
+             patch("app.services.loyalty_service.get_supabase_admin_client", return_value=self.admin):
+            self.service = LoyaltyService()
+    
+    @pytest.mark.asyncio
+    async def test_status_is_cached_until_accrual(self):
+        """Test repeated status reads hit the cache and an accrual invalidates it"""
+        from app.schemas.loyalty import LoyaltyLevel
+        
+        select = self.admin.table.return_value.select.return_value.eq.return_value
+        self.admin.rpc.return_value.execute.return_value = Mock(data=[
+            {"idx": 0, "points_awarded": 12, "previous_total": 1200, "new_total": 1212, "previous_level": "silver",
+             "new_level": "silver", "calculation_details": {}, "transaction_id": "tx-1"}
+        ])
+        
+        first = await self.service.get_user_loyalty_status("u1")
+        second = await self.service.get_user_loyalty_status("u1")
+        assert first.level == second.level == LoyaltyLevel.SILVER
+        assert select.execute.call_count == 1
+        
+        await self.service.award_points_for_expense("u1", "e1", 100.0)
+        await self.service.get_user_loyalty_status("u1")
+        assert select.execute.call_count == 2
+    
+    @pytest.mark.asyncio
+    async def test_recompute_levels_is_one_rpc(self):
+        """Test level recomputation is a single set-based call that clears the cache on change"""
+        await self.service.get_user_loyalty_status("u1")
+        self.admin.rpc.return_value.execute.return_value = Mock(data=0)
+        
+        assert await self.service.recompute_levels() == 0
+        assert self.service.status_cache.get("u1") is not None
+        
+        self.admin.rpc.return_value.execute.return_value = Mock(data=42)
+        assert await self.service.recompute_levels(force=True) == 42
+        assert self.service.status_cache.get("u1") is None
+        
+        name, params = self.admin.rpc.call_args.args
+        assert name == "recompute_loyalty_levels" and params["p_force"] is True
+        assert [rule["level"] for rule in params["p_levels"]] == ["bronze", "silver", "gold", "platinum"]
+
+
+
+class TestBudgetThresholdService:
+    """Test background delivery of budget threshold crossing events"""
+    
+    def setup_method(self):
+        """Setup test fixtures"""
+        from unittest.mock import AsyncMock
+        from app.core.notifications import NotificationService
+        from app.services.budget_threshold_service import BudgetThresholdService
+        
+        self.supabase = Mock()
+        self.supabase.rpc.return_value.execute.return_value = Mock(data=[])
+        
+        self.notifier = Mock()
+        self.notifier.fcm_server_key = "test-key"
+        self.notifier.budget_alert_message.side_effect = lambda *args: NotificationService.budget_alert_message(None, *args)
+        self.notifier.get_user_fcm_tokens = AsyncMock(side_effect=lambda user_ids: {
+            user_id: None if user_id == "user-2" else f"token-{user_id}" for user_id in user_ids
+        })
+        self.notifier.send_notifications = AsyncMock(side_effect=lambda messages: [message["user_id"] != "user-3" for message in messages])
+        
+        self.service = BudgetThresholdService(
+            notifier=self.notifier, supabase_factory=lambda: self.supabase, batch_size=50, max_attempts=3
+        )
+    
+    @pytest.mark.asyncio
+    async def test_drain_sends_claimed_events_and_closes_them(self):
+        """Test claimed events are sent in one batch and marked sent with their delivery result"""
+        events = [
+            {"id": "event-1", "user_id": "user-1", "category_name": "Market", "threshold": 80, "percentage": 83.5},
+            {"id": "event-2", "user_id": "user-2", "category_name": "Market", "threshold": 100, "percentage": 101},
+            {"id": "event-3", "user_id": "user-4", "category_name": None, "threshold": 50, "percentage": 50},
+        ]
+        self.supabase.rpc.return_value.execute.return_value = Mock(data=events)
+        
+        processed = await self.service.drain_once()
+        
+        assert processed == 3
+        self.supabase.rpc.assert_called_once_with(
+            "claim_budget_threshold_events", {"p_limit": 50, "p_lease_seconds": 300}
+        )
+        messages = self.notifier.send_notifications.await_args.args[0]
+        assert [message["user_id"] for message in messages] == ["user-1", "user-4"]
+        assert "Market" in messages[0]["body"] and "%84" in messages[0]["body"]
+        assert messages[0]["data"]["threshold"] == "80"
+        assert messages[1]["data"]["category"] == "Diğer"
+        
+        updates = self.supabase.table.return_value.update.call_args_list
+        closed = self.supabase.table.return_value.update.return_value.in_.call_args_list
+        assert [call.args[0]["delivered"] for call in updates] == [True, False]
+        assert all(call.args[0]["status"] == "sent" for call in updates)
+        assert [call.args for call in closed] == [("id", ["event-1", "event-3"]), ("id", ["event-2"])]
+    
+    @pytest.mark.asyncio
+    async def test_failed_send_is_left_for_retry(self):
+        """Test events whose send failed stay claimed for the lease retry until max_attempts"""
+        events = [
+            {"id": "event-1", "user_id": "user-3", "category_name": "Market", "threshold": 80, "percentage": 83.5, "attempts": 1},
+            {"id": "event-2", "user_id": "user-3", "category_name": "Market", "threshold": 100, "percentage": 101, "attempts": 3},
+        ]
+        self.supabase.rpc.return_value.execute.return_value = Mock(data=events)
+        
+        assert await self.service.drain_once() == 2
+        
+        updates = self.supabase.table.return_value.update.call_args_list
+        closed = self.supabase.table.return_value.update.return_value.in_.call_args_list
+        assert [call.args[0]["delivered"] for call in updates] == [False]
+        assert [call.args for call in closed] == [("id", ["event-2"])]
+    
+    @pytest.mark.asyncio
+    async def test_drain_without_events_sends_nothing(self):
+        """Test an empty claim neither sends notifications nor writes"""
+        assert await self.service.drain_once() == 0
+        self.notifier.send_notifications.assert_not_called()
+        self.supabase.table.assert_not_called()
+    
+    @pytest.mark.asyncio
+    async def test_worker_not_started_without_fcm_key(self):
+        """Test the worker stays off when notifications cannot be sent"""
+        self.notifier.fcm_server_key = None
+        
+        await self.service.start()
+        
+        assert self.service._task is None
+        await self.service.stop()
+
+
+
+class TestBudgetAllocator:
+    """Test history-based budget allocation statistics and solver"""
+    
+    def test_allocation_sums_to_budget_with_equal_risk(self):
+        """Test amounts add up to the budget, respect floors and share one overrun probability"""
+        import numpy as np
+        from app.utils.budget_allocator import allocate_by_history
+        
+        history = np.array([
+            [1000, 1100, 900, 1050, 980, 1020],
+            [300, 500, 200, 450, 250, 400],
+            [0, 0, 0, 0, 0, 10],
+        ], dtype=float)
+        floors = np.full(3, 100.0)
+        
+        amounts, probabilities, _ = allocate_by_history(history, 2000, floors)
+        
+        assert amounts.sum() == pytest.approx(2000, abs=1e-6)
+        assert np.all(amounts >= 100)
+        assert probabilities[0] == pytest.approx(probabilities[1], abs=1e-3)
+        assert amounts[0] > amounts[1] > amounts[2]
+    
+    def test_trend_moves_forecast(self):
+        """Test a rising category is forecast above its median and a flat one at it"""
+        import numpy as np
+        from app.utils.budget_allocator import spending_statistics
+        
+        statistics = spending_statistics(np.array([
+            [100, 200, 300, 400, 500, 600],
+            [500, 500, 500, 500, 500, 500],
+        ], dtype=float))
+        
+        assert statistics["trend"][0] == pytest.approx(100)
+        assert statistics["expected"][0] == pytest.approx(700)
+        assert statistics["expected"][1] == pytest.approx(500)
+        assert statistics["volatility"][1] == pytest.approx(25)
+    
+    def test_floors_above_budget_are_scaled(self):
+        """Test floors that exceed the budget are scaled down to fit it"""
+        import numpy as np
+        from app.utils.budget_allocator import allocate
+        
+        amounts = allocate(np.array([50.0, 50.0]), np.array([5.0, 5.0]), 100, np.array([100.0, 100.0]))
+        
+        assert amounts.tolist() == [50.0, 50.0]
+    
+    def test_rounding_takes_excess_from_largest_share(self):
+        """Test amounts above the budget are rounded back to it from the largest share"""
+        import numpy as np
+        from app.utils.budget_allocator import round_to_kurus
+        
+        assert round_to_kurus(np.array([10.004, 20.004, 69.996]), 100).tolist() == [10.0, 20.0, 70.0]
+        assert round_to_kurus(np.array([30.0, 70.02]), 100).tolist() == [30.0, 70.0]
+        assert round_to_kurus(np.array([30.0, 70.02]), 100).sum() == pytest.approx(100)
+
+
+class TestBudgetHistoryAllocation:
+    """Test BudgetService history allocation mode"""
+    
+    def setup_method(self):
+        """Setup test fixtures"""
+        from app.services.budget_service import BudgetService
+        
+        self.supabase = Mock()
+        self.history = self.supabase.table.return_value.select.return_value.eq.return_value.gte.return_value.lte.return_value
+        self.history.execute.return_value = Mock(data=[])
+        self.supabase.table.return_value.select.return_value.execute.return_value = Mock(data=[
+            {"id": "cat-food", "name": "Groceries"},
+            {"id": "cat-fun", "name": "Entertainment"},
+        ])
+        self.service = BudgetService(supabase=self.supabase)
+    
+    @pytest.mark.asyncio
+    async def test_history_mode_uses_spending_rollup(self):
+        """Test allocations follow past spending and carry overrun probabilities"""
+        rows = [
+            {"category_id": "cat-food", "year": 2024, "month": month, "spent": 3000 + 50 * month}
+            for month in range(1, 10)
+        ] + [
+            {"category_id": "cat-fun", "year": 2024, "month": month, "spent": 500}
+            for month in range(3, 10)
+        ]
+        self.history.execute.return_value = Mock(data=rows)
+        
+        with patch("app.services.budget_service.datetime") as mock_datetime:
+            from datetime import datetime
+            mock_datetime.now.return_value = datetime(2024, 10, 5)
+            result = await self.service.allocate_budget_optimally("user-1", 5000, method="history")
+        
+        assert result["allocation_method"] == "history_based"
+        assert result["history_months"] == 9
+        self.supabase.table.assert_any_call("budget_category_spend")
+        allocations = {allocation["category_id"]: allocation for allocation in result["allocations"]}
+        assert allocations["cat-food"]["allocated_amount"] > allocations["cat-fun"]["allocated_amount"]
+        assert sum(allocation["allocated_amount"] for allocation in result["allocations"]) == pytest.approx(5000)
+        assert 0 <= allocations["cat-food"]["overrun_probability"] <= 1
+    
+    @pytest.mark.asyncio
+    async def test_history_mode_falls_back_without_history(self):
+        """Test users with too little history get the research based allocation"""
+        self.history.execute.return_value = Mock(data=[
+            {"category_id": "cat-food", "year": 2024, "month": 9, "spent": 3000}
+        ])
+        
+        with patch("app.services.budget_service.datetime") as mock_datetime:
+            from datetime import datetime
+            mock_datetime.now.return_value = datetime(2024, 10, 5)
+            result = await self.service.allocate_budget_optimally("user-1", 5000, method="history")
+        
+        assert result["allocation_method"] == "optimal_research_based"
+    
+    def budget_categories(self, rows):
+        """Fake budget_categories table filtering and updating rows in place"""
+        def table(name):
+            filters = []
+            query = Mock()
+            action = {}
+            
+            def matching():
+                return [r for r in rows if all(test(r) for test in filters)]
+            
+            def execute():
+                if action.get("update") is not None:
+                    for row in matching():
+                        row.update(action["update"])
+                    return Mock(data=matching())
+                if action.get("insert") is not None:
+                    rows.append({"id": f"bc-{len(rows)}", **action["insert"]})
+                    return Mock(data=[rows[-1]])
+                return Mock(data=matching())
+            
+            query.select.side_effect = lambda *_: query
+            query.update.side_effect = lambda data: action.update(update=data) or query
+            query.insert.side_effect = lambda data: action.update(insert=data) or query
+            query.eq.side_effect = lambda column, value: filters.append(lambda r: r.get(column) == value) or query
+            query.in_.side_effect = lambda column, values: filters.append(lambda r: r.get(column) in values) or query
+            query.execute.side_effect = execute
+            return query
+        
+        supabase = Mock()
+        supabase.table.side_effect = table
+        return supabase
+    
+    def test_apply_limits_deactivates_categories_outside_allocation(self):
+        """Test applying an allocation leaves only its categories active"""
+        from app.services.budget_service import BudgetService
+        
+        rows = [
+            {"id": "bc-food", "user_budget_id": "budget-1", "category_id": "cat-food", "monthly_limit": 900, "is_active": True},
+            {"id": "bc-old", "user_budget_id": "budget-1", "category_id": "cat-old", "monthly_limit": 2000, "is_active": True},
+            {"id": "bc-zero", "user_budget_id": "budget-1", "category_id": "cat-fun", "monthly_limit": 300, "is_active": True},
+            {"id": "bc-other", "user_budget_id": "budget-2", "category_id": "cat-old", "monthly_limit": 100, "is_active": True},
+        ]
+        
+        applied = BudgetService(supabase=self.budget_categories(rows)).apply_category_limits(
+            "budget-1",
+            {"cat-food": 600.0, "cat-new": 400.0, "cat-fun": 0.0},
+            ["cat-food", "cat-new", "cat-fun", "cat-old"]
+        )
+        
+        active = {r["category_id"]: r["monthly_limit"] for r in rows if r["user_budget_id"] == "budget-1" and r["is_active"]}
+        assert applied == 2
+        assert active == {"cat-food": 600.0, "cat-new": 400.0}
+        assert sum(active.values()) == 1000
+        assert next(r for r in rows if r["id"] == "bc-other")["is_active"] is True
+    
+    def test_apply_limits_keeps_custom_category_budgets(self):
+        """Test custom category budgets stay active after an allocation"""
+        from app.services.budget_service import BudgetService
+        
+        rows = [
+            {"id": "bc-food", "user_budget_id": "budget-1", "category_id": "cat-food", "monthly_limit": 900, "is_active": True},
+            {"id": "bc-pet", "user_budget_id": "budget-1", "category_id": "cat-custom-pet", "monthly_limit": 250, "is_active": True},
+        ]
+        
+        BudgetService(supabase=self.budget_categories(rows)).apply_category_limits(
+            "budget-1", {"cat-fun": 500.0}, ["cat-food", "cat-fun"]
+        )
+        
+        active = {r["category_id"]: r["monthly_limit"] for r in rows if r["is_active"]}
+        assert active == {"cat-fun": 500.0, "cat-custom-pet": 250}
+
+
+
+class TestBudgetSummaryCache:
+    """Test single-query, cached budget summary"""
+    
+    @pytest.fixture(autouse=True)
+    def clear_cache(self):
+        from app.services.budget_service import budget_summary_cache
+        budget_summary_cache.clear()
+        yield
+        budget_summary_cache.clear()
+    
+    def setup_method(self):
+        """Setup test fixtures"""
+        from app.services.budget_service import BudgetService
+        
+        budget = {
+            "id": "budget-1",
+            "user_id": "user-1",
+            "total_monthly_budget": 1000,
+            "year": 2024,
+            "month": 3,
+            "budget_categories": [
+                {"id": "bc-1", "user_budget_id": "budget-1", "category_id": "cat-1", "categories": {"name": "Market"},
+                 "monthly_limit": 400, "is_active": True, "created_at": "2024-03-01", "updated_at": "2024-03-01"},
+                {"id": "bc-2", "user_budget_id": "budget-1", "category_id": "cat-2", "categories": None,
+                 "monthly_limit": 300, "is_active": False, "created_at": "2024-03-01", "updated_at": "2024-03-01"},
+            ]
+        }
+        self.supabase = Mock()
+        budget_query = self.supabase.table.return_value.select.return_value.eq.return_value.eq.return_value.eq.return_value
+        budget_query.execute.return_value = Mock(data=[budget])
+        self.service = BudgetService(supabase=self.supabase)
+    
+    @pytest.mark.asyncio
+    async def test_summary_uses_one_embedded_query_for_given_month(self):
+        """Test the summary reads budget, categories and names together for the requested month"""
+        result = await self.service.get_budget_summary("user-1", 2024, 3)
+        
+        assert result["status"] == "success"
+        assert result["total_allocated"] == 400
+        assert [cb["category_name"] for cb in result["category_budgets"]] == ["Market"]
+        self.supabase.table.assert_called_once_with("user_budgets")
+        self.supabase.table.return_value.select.assert_called_once_with("*, budget_categories(*, categories(name))")
+        eq_calls = [
+            self.supabase.table.return_value.select.return_value.eq.call_args,
+            self.supabase.table.return_value.select.return_value.eq.return_value.eq.call_args,
+            self.supabase.table.return_value.select.return_value.eq.return_value.eq.return_value.eq.call_args,
+        ]
+        assert [call.args for call in eq_calls] == [("user_id", "user-1"), ("year", 2024), ("month", 3)]
+    
+    @pytest.mark.asyncio
+    async def test_repeated_reads_are_cached_until_a_mutation(self):
+        """Test summary and category reads share the cache and a category write invalidates it"""
+        from app.schemas.budget import BudgetCategoryCreate
+        
+        
+        await self.service.get_budget_summary("user-1", 2024, 3)
+        categories = await self.service.get_category_budgets("user-1", 2024, 3)
+        assert len(categories["category_budgets"]) == 1
+        assert self.supabase.table.call_count == 1
+        
+        self.supabase.table.return_value.insert.return_value.execute.return_value = Mock(data=[{"id": "bc-3"}])
+        self.supabase.table.return_value.select.return_value.eq.return_value.eq.return_value.execute.return_value = Mock(data=[])
+        with patch.object(self.service, "get_user_budget", return_value={"status": "success", "budget": {"id": "budget-1"}}):
+            await self.service.create_category_budget("user-1", BudgetCategoryCreate(category_id="cat-3", monthly_limit=100))
+        
+        calls_before = self.supabase.table.call_count
+        await self.service.get_budget_summary("user-1", 2024, 3)
+        assert self.supabase.table.call_count == calls_before + 1
+
+
+class TestDashboardCache:
+    """Test per-user dashboard response cache"""
+    
+    @staticmethod
+    def response(total=100.0, generated_at="2024-03-10T12:00:00"):
+        return {"summary": {"current_month_spending": total}, "recent_transactions": [], "generated_at": generated_at}
+    
+    def test_bump_drops_page_and_rejects_stale_builds(self):
+        """Test a write drops the cached page and a build started before it is not stored"""
+        from app.services.dashboard_cache import DashboardCache
+        
+        cache = DashboardCache(ttl_seconds=60, max_entries=10)
+        page = cache.build_page(self.response(), cache.version("user-1"))
+        assert cache.put("user-1", page)
+        assert cache.get("user-1") is page
+        
+        stale = cache.build_page(self.response(), cache.version("user-1"))
+        cache.bump("user-1")
+        assert cache.get("user-1") is None
+        assert not cache.put("user-1", stale)
+        assert cache.put("user-1", cache.build_page(self.response(), cache.version("user-1")))
+    
+    def test_etag_ignores_generated_at_and_answers_if_none_match(self):
+        """Test an unchanged rebuild keeps its ETag and If-None-Match matches it"""
+        from app.services.dashboard_cache import DashboardCache
+        
+        cache = DashboardCache()
+        first = cache.build_page(self.response(), 0)
+        rebuilt = cache.build_page(self.response(generated_at="2024-03-10T12:05:00"), 1)
+        changed = cache.build_page(self.response(total=150.0), 1)
+        
+        assert first.etag == rebuilt.etag
+        assert first.etag != changed.etag
+        assert rebuilt.is_not_modified({"if-none-match": f'"other", {first.etag}'})
+        assert rebuilt.is_not_modified({"if-none-match": f"W/{first.etag}"})
+        assert not changed.is_not_modified({"if-none-match": first.etag})
+        assert not first.is_not_modified({})
+        assert first.cache_headers() == {"ETag": first.etag, "Cache-Control": "private, no-cache"}
+    
+    def test_page_expires_on_new_day(self):
+        """Test a page built yesterday is not served today"""
+        from datetime import date
+        from app.services.dashboard_cache import DashboardCache
+        
+        cache = DashboardCache()
+        cache.put("user-1", cache.build_page(self.response(), 0, day=date(2024, 3, 10)))
+        
+        assert cache.get("user-1", day=date(2024, 3, 10)) is not None
+        assert cache.get("user-1", day=date(2024, 3, 11)) is None
+    
+    @pytest.mark.asyncio
+    async def test_dashboard_summary_reads_items_with_current_month(self):
+        """Test the dashboard makes three queries, includes today's expenses and takes the top category from the items"""
+        from datetime import date, timedelta
+        from app.services.reporting_service import ReportingService
+        
+        today = date.today()
+        month_start = today.replace(day=1)
+        expenses = [
+            # expense_date is timestamptz: a bare date bound compares as midnight
+            {"total_amount": 60, "expense_date": f"{today.isoformat()}T15:30:00+00:00", "expense_items": [
+                {"amount": 40, "category_id": "cat-1", "categories": {"name": "Market"}},
+                {"amount": 20, "category_id": "cat-2", "categories": {"name": "Ulaşım"}},
+            ]},
+            {"total_amount": 30, "expense_date": f"{(month_start - timedelta(days=1)).isoformat()}T20:00:00+00:00",
+             "expense_items": []},
+        ]
+        
+        def table(name):
+            filters = []
+            query = Mock()
+            query.select.return_value = query
+            query.eq.return_value = query
+            query.order.return_value = query
+            query.limit.return_value = query
+            query.gte.side_effect = lambda column, value: filters.append(lambda v: v >= value) or query
+            query.lt.side_effect = lambda column, value: filters.append(lambda v: v < value) or query
+            query.lte.side_effect = lambda column, value: filters.append(lambda v: v <= value) or query
+            query.execute.side_effect = lambda: Mock(data=[
+                e for e in expenses if all(test(e["expense_date"]) for test in filters)
+            ])
+            return query
+        
+        supabase = Mock()
+        supabase.table.side_effect = table
+        
+        with patch("app.services.reporting_service.get_supabase_client"), \
+             patch("app.services.reporting_service.BudgetService"):
+            service = ReportingService()
+        
+        result = await service.get_dashboard_summary("user-1", supabase=supabase)
+        
+        assert "error" not in result
+        assert result["summary"]["current_month_spending"] == 60
+        assert result["summary"]["previous_month_spending"] == 30
+        assert result["summary"]["top_category"] == "Market"
+        assert result["summary"]["top_category_amount"] == 40
+        assert supabase.table.call_count == 3
+
+class TestKDVSummaryReport:
+    """Test paged KDV summary report"""
+    
+    def setup_method(self):
+        """Setup test fixtures"""
+        from app.services.reporting_service import ReportingService
+        
+        with patch("app.services.reporting_service.get_supabase_client"), \
+             patch("app.services.reporting_service.BudgetService"):
+            self.service = ReportingService()
+        self.ranges = []
+    
+    def expense_items(self, items):
+        """Fake expense_items table applying date filters and range() pages"""
+        filters = []
+        query = Mock()
+        
+        def page(start, end):
+            self.ranges.append((start, end))
+            matching = [item for item in items if all(test(item) for test in filters)]
+            return Mock(execute=Mock(return_value=Mock(data=matching[start:end + 1])))
+        
+        def compare(test):
+            return lambda column, value: filters.append(lambda item: test(item["expenses"]["expense_date"], value)) or query
+        
+        query.select.return_value = query
+        query.eq.return_value = query
+        query.order.return_value = query
+        query.gte.side_effect = compare(lambda left, right: left >= right)
+        query.gt.side_effect = compare(lambda left, right: left > right)
+        query.lte.side_effect = compare(lambda left, right: left <= right)
+        query.lt.side_effect = compare(lambda left, right: left < right)
+        query.range.side_effect = page
+        
+        supabase = Mock()
+        supabase.table.return_value = query
+        return supabase, query
+    
+    @pytest.mark.asyncio
+    async def test_kdv_summary_reads_every_page(self):
+        """Test items past the first max-rows page are included in the totals"""
+        from datetime import date
+        from app.services.reporting_service import KDV_SUMMARY_PAGE_SIZE
+        
+        items = [
+            {"amount": 12.0, "kdv_rate": 20.0 if i % 2 else 10.0, "expenses": {"expense_date": "2024-06-01T10:00:00+00:00"}}
+            for i in range(2 * KDV_SUMMARY_PAGE_SIZE + 5)
+        ]
+        supabase, query = self.expense_items(items)
+        
+        result = await self.service.get_kdv_summary("user-1", date(2024, 1, 1), date(2024, 12, 31), supabase=supabase)
+        
+        assert [start for start, _ in self.ranges] == [0, KDV_SUMMARY_PAGE_SIZE, 2 * KDV_SUMMARY_PAGE_SIZE]
+        query.order.assert_called_with("id")
+        assert sum(group["itemCount"] for group in result["data"]) == len(items)
+        assert result["totalAmount"] == pytest.approx(12.0 * len(items))
+    
+    @pytest.mark.asyncio
+    async def test_kdv_summary_includes_whole_end_date(self):
+        """Test items later than midnight on end_date are in the range and the next day is not"""
+        from datetime import date
+        
+        items = [
+            {"amount": 100.0, "kdv_rate": 20.0, "expenses": {"expense_date": "2024-01-01T00:00:00+00:00"}},
+            {"amount": 50.0, "kdv_rate": 20.0, "expenses": {"expense_date": "2024-01-31T15:30:00+00:00"}},
+            {"amount": 70.0, "kdv_rate": 20.0, "expenses": {"expense_date": "2024-02-01T00:00:00+00:00"}},
+        ]
+        supabase, _ = self.expense_items(items)
+        
+        result = await self.service.get_kdv_summary("user-1", date(2024, 1, 1), date(2024, 1, 31), supabase=supabase)
+        
+        assert result["totalAmount"] == pytest.approx(150.0)
+        assert result["data"][0]["itemCount"] == 2
+
+
+class TestTTLCache:
+    """Test shared TTL + LRU cache helper"""
+    
+    def test_entries_expire_and_lru_bound_calls_on_evict(self):
+        """Test expiry, per-entry TTL and the size bound, with on_evict for dropped entries"""
+        from app.utils.ttl_cache import TTLCache
+        
+        evicted = []
+        cache = TTLCache(ttl_seconds=60, max_entries=2, on_evict=lambda key, value: evicted.append(key))
+        
+        with patch("app.utils.ttl_cache.time.monotonic", return_value=1000.0):
+            cache.put("a", 1)
+            cache.put("b", None, ttl_seconds=10)
+            assert not cache.put("c", 3, ttl_seconds=0)
+        with patch("app.utils.ttl_cache.time.monotonic", return_value=1011.0):
+            assert cache.get("b", "miss") == "miss"
+            assert cache.get("a") == 1
+            cache.put("c", 3)
+            cache.put("d", 4)
+        
+        assert evicted == ["b", "a"]
+        assert len(cache) == 2
+    
+    def test_tags_follow_entries(self):
+        """Test keys_for/pop_tag track puts, replacements and removals"""
+        from app.utils.ttl_cache import TTLCache
+        
+        cache = TTLCache(max_entries=10, index=lambda key, value: key[0])
+        cache.put(("user-1", 1), "jan")
+        cache.put(("user-1", 2), "feb")
+        cache.put(("user-2", 1), "jan")
+        
+        assert sorted(cache.keys_for("user-1")) == [("user-1", 1), ("user-1", 2)]
+        cache.pop_tag("user-1")
+        assert cache.get(("user-1", 2)) is None
+        assert cache.keys_for("user-1") == []
+        assert cache.get(("user-2", 1)) == "jan"
+
+class TestSystemMetricsService:
+    """Test scheduler-refreshed /health/metrics snapshot"""
+    
+    def setup_method(self):
+        """Setup test fixtures"""
+        from app.services.system_metrics_service import SystemMetricsService
+        
+        self.counts = {"users": 10, "expenses": 250, "receipts": 40, "merchants": 3}
+        self.recent_counts = {"expenses": 12, "receipts": None}
+        self.queries = []
+        self.supabase = Mock()
+        self.supabase.table.side_effect = self.table
+        self.settings = Mock(METRICS_REFRESH_INTERVAL_MINUTES=5, supabase_admin=self.supabase)
+        self.service = SystemMetricsService()
+    
+    def table(self, name):
+        query = Mock()
+        query.select.side_effect = lambda *args, count=None: query.__setattr__("count_mode", count) or query
+        query.gte.return_value = query
+        query.limit.return_value = query
+        
+        def execute():
+            if isinstance(self.counts, Exception):
+                raise self.counts
+            counts = self.recent_counts if query.gte.called else self.counts
+            self.queries.append((name, query.count_mode, query.gte.called))
+            return Mock(count=counts[name])
+        
+        query.execute.side_effect = execute
+        return query
+    
+    @pytest.mark.asyncio
+    async def test_refresh_aggregates_estimated_totals_and_exact_recent_counts(self):
+        """Test totals use estimated counts, 24h windows use exact counts and a missing count reads as 0"""
+        with patch("app.services.system_metrics_service.settings", self.settings):
+            snapshot = await self.service.refresh()
+        
+        assert snapshot["totals"] == self.counts
+        assert snapshot["totals_are_estimates"] is True
+        assert snapshot["last_24h"] == {"new_expenses": 12, "new_receipts": 0}
+        assert sorted(self.queries) == sorted(
+            [(table, "estimated", False) for table in self.counts]
+            + [("expenses", "exact", True), ("receipts", "exact", True)]
+        )
+    
+    @pytest.mark.asyncio
+    async def test_get_snapshot_refreshes_only_when_missing_or_stale(self):
+        """Test a fresh snapshot is served as is and a stale one is rebuilt"""
+        with patch("app.services.system_metrics_service.settings", self.settings):
+            first = await self.service.get_snapshot()
+            assert len(self.queries) == 6
+            assert first["refresh_interval_seconds"] == 300
+            assert not self.service.is_stale()
+            
+            await self.service.get_snapshot()
+            assert len(self.queries) == 6
+            
+            self.service._refreshed_at -= 2 * 300 + 1
+            assert self.service.is_stale()
+            await self.service.get_snapshot()
+            assert len(self.queries) == 12
+    
+    @pytest.mark.asyncio
+    async def test_refresh_waiting_on_lock_reuses_newer_snapshot(self):
+        """Test a caller that waited on the lock reuses the snapshot built while it waited"""
+        import asyncio
+        import time
+        
+        with patch("app.services.system_metrics_service.settings", self.settings):
+            async with self.service._lock:
+                waiter = asyncio.create_task(self.service.refresh())
+                await asyncio.sleep(0)
+                newer = {"totals": {}}
+                self.service._snapshot = newer
+                self.service._refreshed_at = time.monotonic()
+            
+            assert await waiter is newer
+        
+        assert self.queries == []
+    
+    @pytest.mark.asyncio
+    async def test_failed_refresh_keeps_previous_snapshot(self):
+        """Test a database error propagates and leaves the last good snapshot in place"""
+        with patch("app.services.system_metrics_service.settings", self.settings):
+            previous = await self.service.refresh()
+            refreshed_at = self.service._refreshed_at
+            
+            self.counts = RuntimeError("database unavailable")
+            with pytest.raises(RuntimeError):
+                await self.service.refresh()
+        
+        assert self.service._snapshot is previous
+        assert self.service._refreshed_at == refreshed_at
+
 if __name__ == "__main__":
     pytest.main([__file__, "-v"]) 
\ No newline at end of file